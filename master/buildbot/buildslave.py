@@ -14,12 +14,14 @@
 # Portions Copyright Buildbot Team Members
 # Portions Copyright Canonical Ltd. 2009
 
+import math
 import time
+from collections import deque
 from email.Message import Message
 from email.Utils import formatdate
 from zope.interface import implements
 from twisted.python import log, failure
-from twisted.internet import defer, reactor
+from twisted.internet import defer, reactor, task
 from twisted.application import service
 from twisted.spread import pb
 from twisted.python.reflect import namedModule
@@ -31,7 +33,7 @@ from buildbot.interfaces import IBuildSlave, ILatentBuildSlave
 from buildbot.process.properties import Properties
 from buildbot.locks import LockAccess
 from buildbot.util import subscription
-from buildbot import config
+from buildbot import config, util
 
 class AbstractBuildSlave(config.ReconfigurableServiceMixin, pb.Avatar,
                         service.MultiService):
@@ -52,6 +54,10 @@ class AbstractBuildSlave(config.ReconfigurableServiceMixin, pb.Avatar,
     # reconfig slaves after builders
     reconfig_priority = 64
 
+    # the attributes that reconfigService takes from the new instance
+    reconfig_attrs = ('password', 'max_builds', 'access', 'notify_on_missing',
+                      'keepalive_interval', 'missing_timeout', 'properties')
+
     def __init__(self, name, password, max_builds=None,
                  notify_on_missing=[], missing_timeout=3600,
                  properties={}, locks=None, keepalive_interval=3600):
@@ -140,8 +146,9 @@ class AbstractBuildSlave(config.ReconfigurableServiceMixin, pb.Avatar,
         """
         if not self.locks:
             return True
+        # a slave does not wait in the locks' queues, so it only needs room
         for lock, access in self.locks:
-            if not lock.isAvailable(access):
+            if not lock.isAvailable(self, access, queue=False):
                 return False
         return True
 
@@ -158,7 +165,7 @@ class AbstractBuildSlave(config.ReconfigurableServiceMixin, pb.Avatar,
             return False
         # all locks are available, claim them all
         for lock, access in self.locks:
-            lock.claim(self, access)
+            lock.claim(self, access, queue=False)
         return True
 
     def releaseLocks(self):
@@ -235,6 +242,20 @@ class AbstractBuildSlave(config.ReconfigurableServiceMixin, pb.Avatar,
         self.stopMissingTimer()
         return service.MultiService.stopService(self)
 
+    def isReconfigNeeded(self, new, new_config):
+        """
+        Return true if reconfigService has anything to adopt from C{new},
+        this slave's instance in C{new_config}.  Changes to the builders
+        using this slave are not considered.
+        """
+        if (not self.registration or
+            new_config.slavePortnum != self.registered_port):
+            return True
+        for attr in self.reconfig_attrs:
+            if getattr(self, attr, None) != getattr(new, attr, None):
+                return True
+        return False
+
     def findNewSlaveInstance(self, new_config):
         # TODO: called multiple times per reconfig; use 1-element cache?
         for sl in new_config.slaves:
@@ -735,6 +756,215 @@ class BuildSlave(AbstractBuildSlave):
         # builders, then it's safe to disconnect
         self.maybeShutdown()
 
+class LatentSlavePool(util.ComparableMixin, object):
+    """
+    A group of interchangeable latent slaves, a few of which are kept
+    substantiated and idle as spares, so that builds do not have to wait for
+    an instance to boot.  Pass the same pool as the C{pool} argument of each
+    latent slave in the group.
+
+    The number of spares follows demand: it is the number of build requests
+    waiting for the pool's builders, plus the number expected to arrive
+    while an instance boots at the recent arrival rate, kept between
+    C{min_spares} and C{max_spares}.  At most C{max_parallel} instances are
+    started at the same time.
+
+    Pools compare equal when their arguments are.  On reconfig, slaves keep
+    the running pool if it is equal to the one in the new configuration;
+    otherwise the new pool takes over what the old one measured.
+
+    @ivar boot_time: the average time taken by an instance to substantiate,
+    initially the C{boot_time} argument and then measured
+    @ivar idle_time: the total time spent by instances substantiated, but
+    not building
+    """
+
+    # how often to reconsider the number of spares, in seconds
+    check_interval = 60
+    # how far back build requests count towards the arrival rate
+    arrival_window = 600
+    # weight of the latest boot in the average boot time
+    boot_time_weight = 0.3
+
+    compare_attrs = ['name', 'min_spares', 'max_spares', 'max_parallel',
+                     'initial_boot_time']
+
+    def __init__(self, name, min_spares=1, max_spares=None, max_parallel=4,
+                 boot_time=120):
+        errors = []
+        if max_spares is not None and max_spares < min_spares:
+            errors.append("latent slave pool %r: max_spares must be at "
+                          "least min_spares" % (name,))
+        if max_parallel < 1:
+            errors.append("latent slave pool %r: max_parallel must be at "
+                          "least 1" % (name,))
+        if errors:
+            raise config.ConfigErrors(errors)
+
+        self.name = name
+        self.min_spares = min_spares
+        self.max_spares = max_spares
+        self.max_parallel = max_parallel
+        self.initial_boot_time = boot_time
+        self.boot_time = boot_time
+        self.boot_time_measured = False
+        self.idle_time = 0
+        self.target = min_spares
+        self.slaves = []
+        self.arrivals = deque()
+        self.master = None
+        self.subscription = None
+        self.loop = None
+        self._checking = False
+        self._recheck = False
+        self._reactor = reactor # seam for tests
+
+    def __repr__(self):
+        return "<%s %r>" % (self.__class__.__name__, self.name)
+
+    def addSlave(self, slave):
+        """
+        Add a latent slave to the pool, once it is part of the configuration.
+        """
+        if slave in self.slaves:
+            return
+        self.slaves.append(slave)
+        if self.master is None:
+            self.master = slave.master
+            self.subscription = self.master.subscribeToBuildRequests(
+                    self.buildRequestAdded)
+            self.loop = task.LoopingCall(self.check)
+            self.loop.clock = self._reactor
+            self.loop.start(self.check_interval, now=True)
+        else:
+            self.check()
+
+    def takeOver(self, old):
+        """
+        Carry the measurements of C{old}, the pool of the same name in the
+        previous configuration, over to this one.
+        """
+        if old.name != self.name:
+            return
+        if old.boot_time_measured:
+            self.boot_time = old.boot_time
+            self.boot_time_measured = True
+        self.idle_time = old.idle_time
+        self.arrivals = deque(old.arrivals)
+
+    def removeSlave(self, slave):
+        if slave not in self.slaves:
+            return
+        self.slaves.remove(slave)
+        if not self.slaves:
+            self.subscription.unsubscribe()
+            self.subscription = None
+            self.loop.stop()
+            self.loop = None
+            self.master = None
+
+    def getBuilderNames(self):
+        names = set()
+        for sl in self.slaves:
+            names.update(sl.slavebuilders.keys())
+        return names
+
+    def buildRequestAdded(self, notif):
+        if notif['buildername'] not in self.getBuilderNames():
+            return
+        self.arrivals.append(util.now(self._reactor))
+        self.check()
+
+    def getArrivalRate(self):
+        """
+        Get the recent rate of build requests for the pool's builders, per
+        second.
+        """
+        horizon = util.now(self._reactor) - self.arrival_window
+        while self.arrivals and self.arrivals[0] < horizon:
+            self.arrivals.popleft()
+        return float(len(self.arrivals)) / self.arrival_window
+
+    def getTarget(self, pending):
+        """
+        Get the number of spares wanted when C{pending} build requests are
+        waiting.
+        """
+        expected = int(math.ceil(self.getArrivalRate() * self.boot_time))
+        target = max(self.min_spares, pending + expected)
+        if self.max_spares is not None:
+            target = min(target, self.max_spares)
+        return target
+
+    def getSpares(self):
+        return [ sl for sl in self.slaves if sl.isSpare() ]
+
+    def check(self):
+        """
+        Recompute the number of spares wanted, and start instances to get
+        there.
+        """
+        if self._checking:
+            self._recheck = True
+            return defer.succeed(None)
+        self._checking = True
+        d = self._check()
+        def done(res):
+            self._checking = False
+            return res
+        d.addBoth(done)
+        d.addErrback(log.err, "in %r" % (self,))
+        return d
+
+    @defer.deferredGenerator
+    def _check(self):
+        self._recheck = True
+        while self._recheck and self.master:
+            self._recheck = False
+            pending = 0
+            for name in self.getBuilderNames():
+                wfd = defer.waitForDeferred(
+                    self.master.db.buildrequests.getBuildRequests(
+                        buildername=name, claimed=False))
+                yield wfd
+                pending += len(wfd.getResult())
+            self.target = self.getTarget(pending)
+            self.startSpares()
+
+    def startSpares(self):
+        spares = self.getSpares()
+        metrics.MetricCountEvent.log("LatentSlavePool.%s.spares" % self.name,
+                                     len(spares), absolute=True)
+        starting = [ sl for sl in self.slaves
+                     if sl.substantiation_deferred is not None ]
+        cold = [ sl for sl in self.slaves if sl.isCold() ]
+        count = min(self.target - len(spares),
+                    self.max_parallel - len(starting), len(cold))
+        for sl in cold[:count]:
+            log.msg("%r: starting %s as a spare" % (self, sl.slavename))
+            d = sl.substantiate(None, None)
+            d.addErrback(log.err,
+                         "while starting spare slave %s" % (sl.slavename,))
+
+    def keepSpare(self, slave):
+        """
+        Decide whether an idle substantiated C{slave} should be kept as a
+        spare, rather than shut down.
+        """
+        return slave in self.slaves and len(self.getSpares()) <= self.target
+
+    def slaveBooted(self, slave, elapsed):
+        metrics.MetricTimeEvent.log("LatentSlavePool.%s.boot_time"
+                                    % self.name, elapsed)
+        w = self.boot_time_weight
+        self.boot_time = (1 - w) * self.boot_time + w * elapsed
+        self.boot_time_measured = True
+
+    def slaveIdled(self, slave, elapsed):
+        metrics.MetricCountEvent.log("LatentSlavePool.%s.idle_time"
+                                     % self.name, elapsed)
+        self.idle_time += elapsed
+
 class AbstractLatentBuildSlave(AbstractBuildSlave):
     """A build slave that will start up a slave instance when needed.
 
@@ -751,22 +981,29 @@ class AbstractLatentBuildSlave(AbstractBuildSlave):
     substantiation_build = None
     build_wait_timer = None
     _shutdown_callback_handle = None
+    substantiation_started = None
+    idle_since = None
+    _reactor = reactor # seam for tests
+
+    reconfig_attrs = AbstractBuildSlave.reconfig_attrs + ('pool',)
 
     def __init__(self, name, password, max_builds=None,
                  notify_on_missing=[], missing_timeout=60*20,
                  build_wait_timeout=60*10,
-                 properties={}, locks=None):
+                 properties={}, locks=None, pool=None):
         AbstractBuildSlave.__init__(
             self, name, password, max_builds, notify_on_missing,
             missing_timeout, properties, locks)
         self.building = set()
         self.build_wait_timeout = build_wait_timeout
+        self.pool = pool
 
     def start_instance(self, build):
         # responsible for starting instance that will try to connect with this
         # master.  Should return deferred with either True (instance started)
         # or False (instance not started, so don't run a build here).  Problems
-        # should use an errback.
+        # should use an errback.  The build is None when the instance is
+        # started as a spare by a LatentSlavePool.
         raise NotImplementedError
 
     def stop_instance(self, fast=False):
@@ -781,22 +1018,27 @@ class AbstractLatentBuildSlave(AbstractBuildSlave):
         if self.substantiation_deferred is None:
             if self.parent and not self.missing_timer:
                 # start timer.  if timer times out, fail deferred
-                self.missing_timer = reactor.callLater(
+                self.missing_timer = self._reactor.callLater(
                     self.missing_timeout,
                     self._substantiation_failed, defer.TimeoutError())
             self.substantiation_deferred = defer.Deferred()
             self.substantiation_build = build
+            self.substantiation_started = util.now(self._reactor)
             if self.slave is None:
                 d = self._substantiate(build) # start up instance
                 d.addErrback(log.err, "while substantiating")
             # else: we're waiting for an old one to detach.  the _substantiate
             # will be done in ``detached`` below.
+        elif self.substantiation_build is None:
+            # a build is waiting for a slave being started as a spare, so it
+            # is no longer spare
+            self.substantiation_build = build
         return self.substantiation_deferred
 
     def _substantiate(self, build):
         # register event trigger
         d = self.start_instance(build)
-        self._shutdown_callback_handle = reactor.addSystemEventTrigger(
+        self._shutdown_callback_handle = self._reactor.addSystemEventTrigger(
             'before', 'shutdown', self._soft_disconnect, fast=True)
         def start_instance_result(result):
             # If we don't report success, then preparation failed.
@@ -813,7 +1055,7 @@ class AbstractLatentBuildSlave(AbstractBuildSlave):
             if self._shutdown_callback_handle is not None:
                 handle = self._shutdown_callback_handle
                 del self._shutdown_callback_handle
-                reactor.removeSystemEventTrigger(handle)
+                self._reactor.removeSystemEventTrigger(handle)
             return failure
         d.addCallbacks(start_instance_result, clean_up)
         return d
@@ -864,6 +1106,7 @@ class AbstractLatentBuildSlave(AbstractBuildSlave):
     def buildStarted(self, sb):
         assert self.substantiated
         self._clearBuildWaitTimer()
+        self._stopIdling()
         self.building.add(sb.builder_name)
 
     def buildFinished(self, sb):
@@ -871,8 +1114,39 @@ class AbstractLatentBuildSlave(AbstractBuildSlave):
 
         self.building.remove(sb.builder_name)
         if not self.building:
+            self._startIdling()
             self._setBuildWaitTimer()
 
+    def isSpare(self):
+        """
+        Is this slave substantiated, or substantiating, without a build to
+        run?
+        """
+        if self.building:
+            return False
+        if self.substantiated:
+            return True
+        return (self.substantiation_deferred is not None and
+                self.substantiation_build is None)
+
+    def isCold(self):
+        """
+        Is this slave free to be substantiated?
+        """
+        return (not self.substantiated and
+                self.substantiation_deferred is None and self.slave is None)
+
+    def _startIdling(self):
+        if self.pool and self.idle_since is None:
+            self.idle_since = util.now(self._reactor)
+
+    def _stopIdling(self):
+        if self.idle_since is not None:
+            if self.pool:
+                self.pool.slaveIdled(self,
+                        util.now(self._reactor) - self.idle_since)
+            self.idle_since = None
+
     def _clearBuildWaitTimer(self):
         if self.build_wait_timer is not None:
             if self.build_wait_timer.active():
@@ -881,16 +1155,25 @@ class AbstractLatentBuildSlave(AbstractBuildSlave):
 
     def _setBuildWaitTimer(self):
         self._clearBuildWaitTimer()
-        self.build_wait_timer = reactor.callLater(
-            self.build_wait_timeout, self._soft_disconnect)
+        self.build_wait_timer = self._reactor.callLater(
+            self.build_wait_timeout, self._buildWaitTimeout)
+
+    def _buildWaitTimeout(self):
+        self.build_wait_timer = None
+        # the pool may want this slave kept as a spare
+        if self.pool and self.pool.keepSpare(self):
+            self._setBuildWaitTimer()
+            return
+        self._soft_disconnect()
 
     def insubstantiate(self, fast=False):
         self._clearBuildWaitTimer()
+        self._stopIdling()
         d = self.stop_instance(fast)
         if self._shutdown_callback_handle is not None:
             handle = self._shutdown_callback_handle
             del self._shutdown_callback_handle
-            reactor.removeSystemEventTrigger(handle)
+            self._reactor.removeSystemEventTrigger(handle)
         self.substantiated = False
         self.building.clear() # just to be sure
         return d
@@ -933,7 +1216,34 @@ class AbstractLatentBuildSlave(AbstractBuildSlave):
         # without a restart (or maybe a sighup)
         self.botmaster.slaveLost(self)
 
+    def reconfigService(self, new_config):
+        new = self.findNewSlaveInstance(new_config)
+        # keep the running pool if its configuration is unchanged
+        if self.pool != new.pool:
+            if self.pool:
+                if new.pool:
+                    new.pool.takeOver(self.pool)
+                self.pool.removeSlave(self)
+            # the new pool picks this slave up in updateSlave
+            self.pool = new.pool
+        return AbstractBuildSlave.reconfigService(self, new_config)
+
+    def _findRunningPool(self):
+        # a new slave joining a pool whose configuration is unchanged joins
+        # the pool its siblings kept, rather than the equal one built from
+        # the new configuration
+        if self.pool.slaves or not self.botmaster:
+            return self.pool
+        for sl in self.botmaster.slaves.itervalues():
+            pool = getattr(sl, 'pool', None)
+            if pool is not None and pool is not self.pool \
+                    and pool.slaves and pool == self.pool:
+                return pool
+        return self.pool
+
     def stopService(self):
+        if self.pool:
+            self.pool.removeSlave(self)
         res = defer.maybeDeferred(AbstractBuildSlave.stopService, self)
         if self.slave is not None:
             d = self._soft_disconnect()
@@ -950,6 +1260,9 @@ class AbstractLatentBuildSlave(AbstractBuildSlave):
         for b in self.botmaster.getBuildersForSlave(self.slavename):
             if b.name not in self.slavebuilders:
                 b.addLatentSlave(self)
+        if self.pool:
+            self.pool = self._findRunningPool()
+            self.pool.addSlave(self)
         return AbstractBuildSlave.updateSlave(self)
 
     def sendBuilderList(self):
@@ -984,20 +1297,26 @@ class AbstractLatentBuildSlave(AbstractBuildSlave):
             # TODO: maybe log?  send an email?
             return why
         d.addCallbacks(_sent, _set_failed)
-        def _substantiated(res):
-            log.msg("Slave %s substantiated \o/" % self.slavename)
-            self.substantiated = True
-            if not self.substantiation_deferred:
-                log.msg("No substantiation deferred for %s" % self.slavename)
-            if self.substantiation_deferred:
-                log.msg("Firing %s substantiation deferred with success" % self.slavename)
-                d = self.substantiation_deferred
-                self.substantiation_deferred = None
-                self.substantiation_build = None
-                d.callback(True)
-            # note that the missing_timer is already handled within
-            # ``attached``
-            if not self.building:
-                self._setBuildWaitTimer()
-        d.addCallback(_substantiated)
+        d.addCallback(lambda _ : self._substantiated())
         return d
+
+    def _substantiated(self):
+        log.msg("Slave %s substantiated \o/" % self.slavename)
+        self.substantiated = True
+        if self.pool and self.substantiation_started is not None:
+            self.pool.slaveBooted(self,
+                    util.now(self._reactor) - self.substantiation_started)
+        self.substantiation_started = None
+        if not self.substantiation_deferred:
+            log.msg("No substantiation deferred for %s" % self.slavename)
+        if self.substantiation_deferred:
+            log.msg("Firing %s substantiation deferred with success" % self.slavename)
+            d = self.substantiation_deferred
+            self.substantiation_deferred = None
+            self.substantiation_build = None
+            d.callback(True)
+        # note that the missing_timer is already handled within
+        # ``attached``
+        if not self.building:
+            self._startIdling()
+            self._setBuildWaitTimer()
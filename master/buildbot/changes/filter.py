@@ -15,7 +15,10 @@
 
 import re, types
 
+from twisted.python import failure, log
+
 from buildbot.util import ComparableMixin, NotABranch
+from buildbot.util import subscription
 
 class ChangeFilter(ComparableMixin):
 
@@ -115,3 +118,172 @@ class ChangeFilter(ComparableMixin):
             return ChangeFilter(**cfargs)
         else:
             return None
+
+
+# patterns that refer to their own groups can't be combined with others
+_groupReference = re.compile(r'\\[1-9]|\(\?P=|\(\?\(')
+# inline flags apply to the whole expression, so patterns using them are
+# matched on their own
+_inlineFlags = re.compile(r'\(\?[iLmsux]')
+
+class ChangeRouter(subscription.SubscriptionPoint):
+    """
+    A subscription point for changes that only delivers each change to the
+    subscribers whose L{ChangeFilter} might accept it, rather than asking
+    every subscriber in turn.
+
+    Each filter is routed on the first attribute for which it gives a list
+    of values, through a dictionary mapping each value to the subscriptions
+    that accept it.  Filters with only regular expressions are grouped by
+    attribute, with identical expressions matched once, and all of the
+    expressions for an attribute are combined into a single one that rules
+    out most changes in one pass.  Subscriptions without a filter, or whose
+    filter only uses functions, get every change.
+
+    Routing only narrows the candidates: a subscriber is handed every change
+    its filter may accept, and must still apply the filter itself.
+    """
+
+    def __init__(self, name):
+        subscription.SubscriptionPoint.__init__(self, name)
+        self.routes = {}        # subscription -> route
+        self.unrouted = set()
+        self.byValue = {}       # attr -> { value : set(subscriptions) }
+        self.byRegex = {}       # attr -> { key : (regex, set(subscriptions)) }
+        self.combined = {}      # attr -> (combined regex, uncombined keys)
+
+    def subscribe(self, callback, change_filter=None):
+        """Add C{callback} to the subscriptions, to be called with the
+        changes that C{change_filter} may accept, or with every change if it
+        is None; returns a L{subscription.Subscription} instance."""
+        sub = subscription.SubscriptionPoint.subscribe(self, callback)
+        route = self._getRoute(change_filter)
+        self.routes[sub] = route
+        if route is None:
+            self.unrouted.add(sub)
+        elif route[0] == 'value':
+            byValue = self.byValue.setdefault(route[1], {})
+            for value in route[2]:
+                byValue.setdefault(value, set()).add(sub)
+        else:
+            kind, attr, key, regex = route
+            byRegex = self.byRegex.setdefault(attr, {})
+            if key not in byRegex:
+                byRegex[key] = (regex, set())
+                self.combined.pop(attr, None)
+            byRegex[key][1].add(sub)
+        return sub
+
+    def _unsubscribe(self, sub):
+        subscription.SubscriptionPoint._unsubscribe(self, sub)
+        route = self.routes.pop(sub)
+        if route is None:
+            self.unrouted.discard(sub)
+        elif route[0] == 'value':
+            byValue = self.byValue[route[1]]
+            for value in route[2]:
+                subs = byValue.get(value)
+                if subs is not None:
+                    subs.discard(sub)
+                    if not subs:
+                        del byValue[value]
+            if not byValue:
+                del self.byValue[route[1]]
+        else:
+            kind, attr, key, regex = route
+            byRegex = self.byRegex[attr]
+            subs = byRegex[key][1]
+            subs.discard(sub)
+            if not subs:
+                del byRegex[key]
+                self.combined.pop(attr, None)
+            if not byRegex:
+                del self.byRegex[attr]
+
+    def _getRoute(self, change_filter):
+        checks = getattr(change_filter, 'checks', None)
+        if not checks:
+            return None
+        for filt_list, filt_re, filt_fn, attr in checks:
+            if filt_list is not None:
+                try:
+                    frozenset(filt_list)
+                except TypeError:
+                    continue # unhashable values can't be looked up
+                return ('value', attr, tuple(filt_list))
+        for filt_list, filt_re, filt_fn, attr in checks:
+            if filt_re is not None:
+                key = (filt_re.pattern, filt_re.flags)
+                return ('regex', attr, key, filt_re)
+        return None
+
+    def _getCombined(self, attr):
+        if attr in self.combined:
+            return self.combined[attr]
+        combinable = []
+        uncombined = []
+        flags = None
+        for key, (regex, subs) in self.byRegex[attr].iteritems():
+            pattern = regex.pattern
+            if (not isinstance(pattern, basestring)
+                    or _groupReference.search(pattern)
+                    or _inlineFlags.search(pattern)
+                    or (flags is not None and regex.flags != flags)):
+                uncombined.append(key)
+            else:
+                flags = regex.flags
+                combinable.append(key)
+        combined = None
+        if len(combinable) > 1:
+            try:
+                combined = re.compile('|'.join([ '(?:%s)' % key[0]
+                                                 for key in combinable ]),
+                                      flags)
+            except (re.error, AssertionError, OverflowError):
+                # e.g., too many groups, or a group name used twice
+                pass
+        if combined is None:
+            uncombined = uncombined + combinable
+            combinable = []
+        self.combined[attr] = (combined, combinable, uncombined)
+        return self.combined[attr]
+
+    def getCandidates(self, change):
+        """Return the set of subscriptions whose filters may accept
+        C{change}."""
+        candidates = set(self.unrouted)
+        for attr, byValue in self.byValue.iteritems():
+            value = getattr(change, attr, '')
+            try:
+                subs = byValue.get(value)
+            except TypeError:
+                continue
+            if subs:
+                candidates.update(subs)
+        for attr, byRegex in self.byRegex.iteritems():
+            value = getattr(change, attr, '')
+            if value is None:
+                continue
+            combined, combinable, uncombined = self._getCombined(attr)
+            keys = uncombined
+            if combined is not None and combined.match(value):
+                keys = keys + combinable
+            for key in keys:
+                regex, subs = byRegex[key]
+                if regex.match(value):
+                    candidates.update(subs)
+        return candidates
+
+    def deliver(self, change):
+        """
+        Deliver C{change} to the subscribers whose filters may accept it.
+        """
+        for sub in self.getCandidates(change):
+            # a subscriber may have unsubscribed another one
+            if sub not in self.subscriptions:
+                continue
+            try:
+                sub.callback(change)
+            except:
+                log.err(failure.Failure(),
+                        'while invoking callback %s to %s' % (sub.callback, self))
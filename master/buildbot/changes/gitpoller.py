@@ -23,11 +23,17 @@ from buildbot.util import deferredLocked
 from buildbot.changes import base
 from buildbot.util import epoch2datetime
 
+# the format used to get all of the information about a range of commits
+# from a single 'git log -z --name-only'.  Each commit starts with a \x01, and
+# its fields are separated by NULs; the list of files follows, also separated
+# by NULs.
+LOG_FORMAT = r'%x01%H%x00%ct%x00%aN <%aE>%x00%s%n%b%x00'
+
 class GitPoller(base.PollingChangeSource):
     """This source will poll a remote git repo for changes and submit
     them to the change master."""
     
-    compare_attrs = ["repourl", "branch", "workdir",
+    compare_attrs = ["repourl", "branch", "branches", "workdir",
                      "pollInterval", "gitbin", "usetimestamps",
                      "category", "project"]
                      
@@ -36,14 +42,23 @@ class GitPoller(base.PollingChangeSource):
                  gitbin='git', usetimestamps=True,
                  category=None, project=None,
                  pollinterval=-2, fetch_refspec=None,
-                 encoding='utf-8'):
+                 encoding='utf-8', branches=None):
         # for backward compatibility; the parameter used to be spelled with 'i'
         if pollinterval != -2:
             pollInterval = pollinterval
         if project is None: project = ''
 
+        # the first branch is the one checked out in the workdir; the others
+        # are tracked with local branch refs
+        if branches:
+            branches = list(branches)
+            branch = branches[0]
+        else:
+            branches = [ branch ]
+
         self.repourl = repourl
         self.branch = branch
+        self.branches = branches
         self.pollInterval = pollInterval
         self.fetch_refspec = fetch_refspec
         self.encoding = encoding
@@ -56,6 +71,7 @@ class GitPoller(base.PollingChangeSource):
         self.project = project
         self.changeCount = 0
         self.commitInfo  = {}
+        self._updateBranches = []
         self.initLock = defer.DeferredLock()
         
         if self.workdir == None:
@@ -152,8 +168,12 @@ class GitPoller(base.PollingChangeSource):
         status = ""
         if not self.master:
             status = "[STOPPED - check log]"
-        str = 'GitPoller watching the remote git repository %s, branch: %s %s' \
-                % (self.repourl, self.branch, status)
+        if len(self.branches) > 1:
+            branches = 'branches: %s' % ', '.join(self.branches)
+        else:
+            branches = 'branch: %s' % self.branch
+        str = 'GitPoller watching the remote git repository %s, %s %s' \
+                % (self.repourl, branches, status)
         return str
 
     @deferredLocked('initLock')
@@ -165,55 +185,6 @@ class GitPoller(base.PollingChangeSource):
         d.addErrback(self._catch_up_failure)
         return d
 
-    def _get_commit_comments(self, rev):
-        args = ['log', rev, '--no-walk', r'--format=%s%n%b']
-        d = utils.getProcessOutput(self.gitbin, args, path=self.workdir, env=os.environ, errortoo=False )
-        def process(git_output):
-            stripped_output = git_output.strip().decode(self.encoding)
-            if len(stripped_output) == 0:
-                raise EnvironmentError('could not get commit comment for rev')
-            return stripped_output
-        d.addCallback(process)
-        return d
-
-    def _get_commit_timestamp(self, rev):
-        # unix timestamp
-        args = ['log', rev, '--no-walk', r'--format=%ct']
-        d = utils.getProcessOutput(self.gitbin, args, path=self.workdir, env=os.environ, errortoo=False )
-        def process(git_output):
-            stripped_output = git_output.strip()
-            if self.usetimestamps:
-                try:
-                    stamp = float(stripped_output)
-                except Exception, e:
-                        log.msg('gitpoller: caught exception converting output \'%s\' to timestamp' % stripped_output)
-                        raise e
-                return stamp
-            else:
-                return None
-        d.addCallback(process)
-        return d
-
-    def _get_commit_files(self, rev):
-        args = ['log', rev, '--name-only', '--no-walk', r'--format=%n']
-        d = utils.getProcessOutput(self.gitbin, args, path=self.workdir, env=os.environ, errortoo=False )
-        def process(git_output):
-            fileList = git_output.split()
-            return fileList
-        d.addCallback(process)
-        return d
-            
-    def _get_commit_author(self, rev):
-        args = ['log', rev, '--no-walk', r'--format=%aN <%aE>']
-        d = utils.getProcessOutput(self.gitbin, args, path=self.workdir, env=os.environ, errortoo=False )
-        def process(git_output):
-            stripped_output = git_output.strip().decode(self.encoding)
-            if len(stripped_output) == 0:
-                raise EnvironmentError('could not get commit author for rev')
-            return stripped_output
-        d.addCallback(process)
-        return d
-
     def _get_changes(self):
         log.msg('gitpoller: polling git repo at %s' % self.repourl)
 
@@ -233,61 +204,133 @@ class GitPoller(base.PollingChangeSource):
 
         return d
 
+    def _get_refs(self):
+        # get the local and remote-tracking branch heads in one go
+        args = ['for-each-ref', r'--format=%(objectname) %(refname)',
+                'refs/heads', 'refs/remotes/origin']
+        d = utils.getProcessOutput(self.gitbin, args, path=self.workdir,
+                                   env=os.environ, errortoo=False )
+        def process(git_output):
+            refs = {}
+            for line in git_output.splitlines():
+                sha, ref = line.split(' ', 1)
+                refs[ref] = sha
+            return refs
+        d.addCallback(process)
+        return d
+
+    def _get_commits(self, branch):
+        # get everything about the new commits on this branch, oldest first,
+        # from a single git process
+        args = ['log', '--reverse', '--name-only', '-z',
+                '--format=' + LOG_FORMAT,
+                '%s..origin/%s' % (branch, branch)]
+        d = utils.getProcessOutput(self.gitbin, args, path=self.workdir,
+                                   env=os.environ, errortoo=False )
+        d.addCallback(lambda git_output : list(self._parse_log(git_output)))
+        return d
+
+    def _parse_log(self, git_output):
+        """
+        Parse the output of C{git log} with L{LOG_FORMAT}, yielding a tuple
+        (rev, timestamp, author, files, comments) for each commit.  The output
+        is scanned in place, rather than split up front, so that a large
+        range of commits does not need several copies in memory.
+        """
+        pos = git_output.find('\x01')
+        while pos != -1:
+            end = git_output.find('\x01', pos + 1)
+            if end == -1:
+                record = git_output[pos+1:]
+            else:
+                record = git_output[pos+1:end]
+            pos = end
+
+            fields = record.split('\0')
+            if len(fields) < 4:
+                raise EnvironmentError('could not parse git log output: %r'
+                                       % (record[:100],))
+            rev, timestamp, author, comments = fields[:4]
+
+            if self.usetimestamps:
+                try:
+                    timestamp = float(timestamp)
+                except Exception, e:
+                    log.msg('gitpoller: caught exception converting output '
+                            '\'%s\' to timestamp' % timestamp)
+                    raise e
+            else:
+                timestamp = None
+
+            author = author.strip().decode(self.encoding)
+            if not author:
+                raise EnvironmentError('could not get commit author for rev')
+            comments = comments.strip().decode(self.encoding)
+            if not comments:
+                raise EnvironmentError('could not get commit comment for rev')
+
+            # git separates the file list from the commit with a newline
+            files = [ f.lstrip('\n') for f in fields[4:] ]
+            files = [ f for f in files if f ]
+
+            yield rev, timestamp, author, files, comments
+
     @defer.deferredGenerator
     def _process_changes(self, unused_output):
-        # get the change list
-        revListArgs = ['log', '%s..origin/%s' % (self.branch, self.branch), r'--format=%H']
         self.changeCount = 0
-        d = utils.getProcessOutput(self.gitbin, revListArgs, path=self.workdir,
-                                   env=os.environ, errortoo=False )
-        wfd = defer.waitForDeferred(d)
+        self._updateBranches = []
+
+        wfd = defer.waitForDeferred(self._get_refs())
         yield wfd
-        results = wfd.getResult()
+        refs = wfd.getResult()
 
-        # process oldest change first
-        revList = results.split()
-        if not revList:
-            return
+        changes = []
+        for branch in self.branches:
+            local = refs.get('refs/heads/%s' % branch)
+            remote = refs.get('refs/remotes/origin/%s' % branch)
+            if remote is None:
+                log.msg('gitpoller: branch %s not found in %s'
+                        % (branch, self.repourl))
+                continue
+            if local == remote:
+                continue
+            self._updateBranches.append(branch)
+            if local is None:
+                # a newly-polled branch; start tracking it from here, rather
+                # than reporting its entire history
+                log.msg('gitpoller: starting to track branch %s at %s'
+                        % (branch, remote))
+                continue
 
-        revList.reverse()
-        self.changeCount = len(revList)
-            
-        log.msg('gitpoller: processing %d changes: %s in "%s"'
-                % (self.changeCount, revList, self.workdir) )
-
-        for rev in revList:
-            dl = defer.DeferredList([
-                self._get_commit_timestamp(rev),
-                self._get_commit_author(rev),
-                self._get_commit_files(rev),
-                self._get_commit_comments(rev),
-            ], consumeErrors=True)
-
-            wfd = defer.waitForDeferred(dl)
+            wfd = defer.waitForDeferred(self._get_commits(branch))
             yield wfd
-            results = wfd.getResult()
-
-            # check for failures
-            failures = [ r[1] for r in results if not r[0] ]
-            if failures:
-                # just fail on the first error; they're probably all related!
-                raise failures[0]
-
-            timestamp, author, files, comments = [ r[1] for r in results ]
-            d = self.master.addChange(
-                   author=author,
-                   revision=rev,
-                   files=files,
-                   comments=comments,
-                   when_timestamp=epoch2datetime(timestamp),
-                   branch=self.branch,
-                   category=self.category,
-                   project=self.project,
-                   repository=self.repourl,
-                   src='git')
-            wfd = defer.waitForDeferred(d)
-            yield wfd
-            results = wfd.getResult()
+            commits = wfd.getResult()
+
+            log.msg('gitpoller: processing %d changes on %s: %s in "%s"'
+                    % (len(commits), branch, [ c[0] for c in commits ],
+                       self.workdir) )
+
+            for rev, timestamp, author, files, comments in commits:
+                changes.append(dict(
+                       author=author,
+                       revision=rev,
+                       files=files,
+                       comments=comments,
+                       when_timestamp=epoch2datetime(timestamp),
+                       branch=branch,
+                       category=self.category,
+                       project=self.project,
+                       repository=self.repourl,
+                       src='git'))
+
+        self.changeCount = len(changes)
+        if not changes:
+            return
+
+        # add all of the changes in one database transaction
+        wfd = defer.waitForDeferred(self.master.addChanges(changes))
+        yield wfd
+        wfd.getResult()
 
     def _process_changes_failure(self, f):
         log.msg('gitpoller: repo poll failed')
@@ -296,13 +339,24 @@ class GitPoller(base.PollingChangeSource):
         return None
         
     def _catch_up(self, res):
-        if self.changeCount == 0:
+        if not self._updateBranches:
             log.msg('gitpoller: no changes, no catch_up')
             return
-        log.msg('gitpoller: catching up tracking branch')
-        args = ['reset', '--hard', 'origin/%s' % (self.branch,)]
-        d = utils.getProcessOutputAndValue(self.gitbin, args, path=self.workdir, env=os.environ)
-        d.addCallback(self._convert_nonzero_to_failure)
+        log.msg('gitpoller: catching up tracking branches')
+        dl = []
+        for branch in self._updateBranches:
+            if branch == self.branch:
+                # this is the branch checked out in the workdir
+                args = ['reset', '--hard', 'origin/%s' % (branch,)]
+            else:
+                args = ['update-ref', 'refs/heads/%s' % (branch,),
+                        'origin/%s' % (branch,)]
+            d = utils.getProcessOutputAndValue(self.gitbin, args,
+                        path=self.workdir, env=os.environ)
+            d.addCallback(self._convert_nonzero_to_failure)
+            dl.append(d)
+        d = defer.DeferredList(dl, fireOnOneErrback=True, consumeErrors=True)
+        d.addErrback(lambda f : f.value.subFailure)
         return d
 
     def _catch_up_failure(self, f):
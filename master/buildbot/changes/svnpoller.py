@@ -18,13 +18,14 @@
 # Changed to svn (using xml.dom.minidom) by Niklaus Giger
 # Hacked beyond recognition by Brian Warner
 
-from twisted.python import log
-from twisted.internet import defer, utils
+from twisted.python import log, failure
+from twisted.internet import defer, utils, reactor, protocol, error
 
 from buildbot import util
 from buildbot.changes import base
 
 import xml.dom.minidom
+import xml.parsers.expat
 import os, urllib
 
 # these split_file_* functions are available for use as values to the
@@ -44,6 +45,142 @@ def split_file_branches(path):
         return None
 
 
+class LogEntry(object):
+    """
+    One <logentry> from the output of C{svn log --xml --verbose}.
+
+    @ivar revision: the revision number, as an integer
+    @ivar author: the author, or C{<unknown>}
+    @ivar msg: the log message, or C{<unknown>}
+    @ivar paths: list of (action, path) tuples, or None if the entry had no
+    <paths> element
+    """
+
+    def __init__(self, revision):
+        self.revision = revision
+        self.author = u"<unknown>"
+        self.msg = u"<unknown>"
+        self.paths = None
+
+
+class LogParser(object):
+    """
+    An incremental parser for the output of C{svn log --xml --verbose}.
+    Feed it the output in arbitrary chunks with L{feed}, which returns the
+    L{LogEntry} instances completed by that chunk.  Only the entry being
+    parsed is kept in memory.
+    """
+
+    def __init__(self):
+        self._parser = xml.parsers.expat.ParserCreate()
+        self._parser.StartElementHandler = self._start
+        self._parser.EndElementHandler = self._end
+        self._parser.CharacterDataHandler = self._chars
+        self._entry = None
+        self._action = None
+        self._text = None
+        self._completed = []
+
+    def feed(self, data):
+        """
+        Parse another chunk of output.
+
+        @returns: list of L{LogEntry} instances
+        @raises xml.parsers.expat.ExpatError: on malformed XML
+        """
+        self._parser.Parse(data, False)
+        return self._takeCompleted()
+
+    def close(self):
+        """
+        Finish parsing.
+
+        @returns: list of L{LogEntry} instances
+        @raises xml.parsers.expat.ExpatError: if the XML was incomplete
+        """
+        self._parser.Parse('', True)
+        return self._takeCompleted()
+
+    def _takeCompleted(self):
+        completed, self._completed = self._completed, []
+        return completed
+
+    def _start(self, name, attrs):
+        if name == 'logentry':
+            self._entry = LogEntry(int(attrs['revision']))
+        elif self._entry is None:
+            return
+        elif name == 'paths':
+            self._entry.paths = []
+        elif name == 'path':
+            self._action = attrs.get('action')
+            self._text = []
+        elif name in ('author', 'msg'):
+            self._text = []
+
+    def _end(self, name):
+        if self._entry is None:
+            return
+        if name == 'logentry':
+            self._completed.append(self._entry)
+            self._entry = None
+        elif name == 'path':
+            self._entry.paths.append((self._action, u"".join(self._text)))
+            self._text = None
+        elif name in ('author', 'msg'):
+            setattr(self._entry, name, u"".join(self._text))
+            self._text = None
+
+    def _chars(self, data):
+        if self._text is not None:
+            self._text.append(data)
+
+
+class LogProcessProtocol(protocol.ProcessProtocol):
+    """
+    Feed the output of C{svn log --xml} to a L{LogParser} as it arrives,
+    calling C{entryReceived} for each completed L{LogEntry}.  The C{deferred}
+    attribute fires when the process has finished and all of its output has
+    been parsed, or errbacks if the process fails or its output is malformed.
+    """
+
+    def __init__(self, entryReceived):
+        self.entryReceived = entryReceived
+        self.parser = LogParser()
+        self.deferred = defer.Deferred()
+        self.stderr = []
+        self.failure = None
+
+    def outReceived(self, data):
+        if self.failure:
+            return
+        try:
+            for entry in self.parser.feed(data):
+                self.entryReceived(entry)
+        except:
+            self.failure = failure.Failure()
+            if self.transport:
+                self.transport.loseConnection()
+
+    def errReceived(self, data):
+        self.stderr.append(data)
+
+    def processEnded(self, reason):
+        if not self.failure and not reason.check(error.ProcessDone):
+            self.failure = failure.Failure(EnvironmentError(
+                "svn log failed: %s" % ("".join(self.stderr).strip(),)))
+        if not self.failure:
+            try:
+                for entry in self.parser.close():
+                    self.entryReceived(entry)
+            except:
+                self.failure = failure.Failure()
+        if self.failure:
+            self.deferred.errback(self.failure)
+        else:
+            self.deferred.callback(None)
+
+
 class SVNPoller(base.PollingChangeSource, util.ComparableMixin):
     """
     Poll a Subversion repository for changes and submit them to the change
@@ -59,6 +196,9 @@ class SVNPoller(base.PollingChangeSource, util.ComparableMixin):
     last_change = None
     loop = None
 
+    # the number of changes added to the master, and checkpointed, at a time
+    changeBatchSize = 100
+
     def __init__(self, svnurl, split_file=None,
                  svnuser=None, svnpasswd=None,
                  pollInterval=10*60, histmax=100,
@@ -152,10 +292,6 @@ class SVNPoller(base.PollingChangeSource, util.ComparableMixin):
             d.addCallback(set_prefix)
 
         d.addCallback(self.get_logs)
-        d.addCallback(self.parse_logs)
-        d.addCallback(self.get_new_logentries)
-        d.addCallback(self.create_changes)
-        d.addCallback(self.submit_changes)
         d.addCallback(self.finished_ok)
         d.addErrback(log.err, 'SVNPoller: Error in  while polling') # eat errors
         return d
@@ -165,6 +301,11 @@ class SVNPoller(base.PollingChangeSource, util.ComparableMixin):
         d = utils.getProcessOutput(self.svnbin, args, self.environ)
         return d
 
+    def spawnProcess(self, pp, args):
+        # this exists so we can override it during the unit tests
+        reactor.spawnProcess(pp, self.svnbin, [self.svnbin] + args,
+                             env=self.environ)
+
     def get_prefix(self):
         args = ["info", "--xml", "--non-interactive", self.svnurl]
         if self.svnuser:
@@ -201,67 +342,50 @@ class SVNPoller(base.PollingChangeSource, util.ComparableMixin):
         return d
 
     def get_logs(self, _):
+        """
+        Run C{svn log}, turning new log entries into changes as they are
+        parsed.  Changes are added to the master in batches of
+        C{changeBatchSize}, and C{last_change} is checkpointed after each
+        batch.
+
+        @returns: Deferred that fires when the log has been processed
+        """
         args = []
         args.extend(["log", "--xml", "--verbose", "--non-interactive"])
         if self.svnuser:
             args.extend(["--username=%s" % self.svnuser])
         if self.svnpasswd:
             args.extend(["--password=%s" % self.svnpasswd])
-        args.extend(["--limit=%d" % (self.histmax), self.svnurl])
-        d = self.getProcessOutput(args)
-        return d
+        if self.last_change is None:
+            # if this is the first time we've been run, ignore any changes
+            # that occurred before now. This prevents a build at every
+            # startup.
+            args.extend(["--limit=1", self.svnurl])
+        else:
+            # ask for the new revisions oldest first, so that changes can be
+            # submitted as they are parsed; if more than histmax revisions
+            # are waiting, the rest are picked up by the next poll
+            args.extend(["--revision=%d:HEAD" % self.last_change,
+                         "--limit=%d" % self.histmax, self.svnurl])
+
+        batch = _LogBatch(self)
+        pp = LogProcessProtocol(batch.entryReceived)
+        batch.pp = pp
+        self.spawnProcess(pp, args)
+        pp.deferred.addCallback(lambda _ : batch.flush())
+        return pp.deferred
 
     def parse_logs(self, output):
-        # parse the XML output, return a list of <logentry> nodes
+        """
+        Parse the complete output of C{svn log --xml}, returning a list of
+        L{LogEntry} instances in the order they appear.
+        """
+        parser = LogParser()
         try:
-            doc = xml.dom.minidom.parseString(output)
+            return parser.feed(output) + parser.close()
         except xml.parsers.expat.ExpatError:
             log.msg("SVNPoller: SVNPoller.parse_logs: ExpatError in '%s'" % output)
             raise
-        logentries = doc.getElementsByTagName("logentry")
-        return logentries
-
-
-    def get_new_logentries(self, logentries):
-        last_change = old_last_change = self.last_change
-
-        # given a list of logentries, calculate new_last_change, and
-        # new_logentries, where new_logentries contains only the ones after
-        # last_change
-
-        new_last_change = None
-        new_logentries = []
-        if logentries:
-            new_last_change = int(logentries[0].getAttribute("revision"))
-
-            if last_change is None:
-                # if this is the first time we've been run, ignore any changes
-                # that occurred before now. This prevents a build at every
-                # startup.
-                log.msg('SVNPoller: starting at change %s' % new_last_change)
-            elif last_change == new_last_change:
-                # an unmodified repository will hit this case
-                log.msg('SVNPoller: no changes')
-            else:
-                for el in logentries:
-                    if last_change == int(el.getAttribute("revision")):
-                        break
-                    new_logentries.append(el)
-                new_logentries.reverse() # return oldest first
-
-        self.last_change = new_last_change
-        log.msg('SVNPoller: _process_changes %s .. %s' %
-                (old_last_change, new_last_change))
-        return new_logentries
-
-
-    def _get_text(self, element, tag_name):
-        try:
-            child_nodes = element.getElementsByTagName(tag_name)[0].childNodes
-            text = "".join([t.data for t in child_nodes])
-        except:
-            text = "<unknown>"
-        return text
 
     def _transform_path(self, path):
         assert path.startswith(self._prefix), \
@@ -278,7 +402,7 @@ class SVNPoller(base.PollingChangeSource, util.ComparableMixin):
         changes = []
 
         for el in new_logentries:
-            revision = str(el.getAttribute("revision"))
+            revision = str(el.revision)
 
             revlink=''
 
@@ -287,23 +411,19 @@ class SVNPoller(base.PollingChangeSource, util.ComparableMixin):
                     revlink = self.revlinktmpl % urllib.quote_plus(revision)
 
             log.msg("Adding change revision %s" % (revision,))
-            author   = self._get_text(el, "author")
-            comments = self._get_text(el, "msg")
+            author   = el.author
+            comments = el.msg
             # there is a "date" field, but it provides localtime in the
             # repository's timezone, whereas we care about buildmaster's
             # localtime (since this will get used to position the boxes on
             # the Waterfall display, etc). So ignore the date field, and
             # addChange will fill in with the current time
             branches = {}
-            try:
-                pathlist = el.getElementsByTagName("paths")[0]
-            except IndexError: # weird, we got an empty revision
+            if el.paths is None: # weird, we got an empty revision
                 log.msg("ignoring commit with no paths")
                 continue
 
-            for p in pathlist.getElementsByTagName("path"):
-                action = p.getAttribute("action")
-                path = "".join([t.data for t in p.childNodes])
+            for action, path in el.paths:
                 # the rest of buildbot is certaily not yet ready to handle
                 # unicode filenames, because they get put in RemoteCommands
                 # which get sent via PB to the buildslave, and PB doesn't
@@ -346,19 +466,107 @@ class SVNPoller(base.PollingChangeSource, util.ComparableMixin):
 
         return changes
 
-    @defer.deferredGenerator
     def submit_changes(self, changes):
-        for chdict in changes:
-            wfd = defer.waitForDeferred(self.master.addChange(src='svn',
-                                                              **chdict))
-            yield wfd
-            wfd.getResult()
+        return self.master.addChanges([ dict(src='svn', **chdict)
+                                        for chdict in changes ])
 
-    def finished_ok(self, res):
+    def write_cache(self):
         if self.cachepath:
             f = open(self.cachepath, "w")
             f.write(str(self.last_change))
             f.close()
 
+    def finished_ok(self, res):
+        self.write_cache()
+
         log.msg("SVNPoller: finished polling %s" % res)
         return res
+
+
+class _LogBatch(object):
+    # Collects the changes for an SVNPoller as log entries are parsed, and
+    # submits them in batches, pausing the svn process while each batch is
+    # being added.
+
+    def __init__(self, poller):
+        self.poller = poller
+        self.pp = None
+        self.changes = []
+        self.last_revision = None
+        self.submitting = None
+        self.failure = None
+        self.first_run = poller.last_change is None
+        self.old_last_change = poller.last_change
+
+    def entryReceived(self, entry):
+        if self.first_run:
+            if self.last_revision is None:
+                log.msg('SVNPoller: starting at change %s' % entry.revision)
+                self.last_revision = entry.revision
+            return
+        # the range includes last_change itself
+        if entry.revision <= self.old_last_change:
+            return
+        self.changes.extend(self.poller.create_changes([entry]))
+        self.last_revision = entry.revision
+        if (len(self.changes) >= self.poller.changeBatchSize
+                and not self.submitting):
+            self.submit()
+
+    def submit(self):
+        changes, self.changes = self.changes, []
+        last_revision = self.last_revision
+
+        transport = self.pp and self.pp.transport
+        if transport:
+            transport.pauseProducing()
+
+        if changes:
+            d = self.poller.submit_changes(changes)
+        else:
+            d = defer.succeed(None)
+        self.submitting = d
+        def checkpoint(_):
+            self.poller.last_change = last_revision
+            self.poller.write_cache()
+        d.addCallback(checkpoint)
+        def done(res):
+            self.submitting = None
+            if transport:
+                transport.resumeProducing()
+            return res
+        d.addBoth(done)
+        # errors are reported when the batch is flushed
+        d.addErrback(self.submitFailed)
+        return d
+
+    def submitFailed(self, f):
+        self.failure = f
+        # stop reading the log, and make sure that it is this failure, rather
+        # than the svn process's death, that is reported
+        if self.pp and not self.pp.failure:
+            self.pp.failure = f
+            if self.pp.transport:
+                self.pp.transport.loseConnection()
+
+    @defer.deferredGenerator
+    def flush(self):
+        if self.submitting:
+            wfd = defer.waitForDeferred(self.submitting)
+            yield wfd
+            wfd.getResult()
+        if self.failure:
+            self.failure.raiseException()
+
+        if self.last_revision is None:
+            log.msg('SVNPoller: no changes')
+            return
+
+        wfd = defer.waitForDeferred(self.submit())
+        yield wfd
+        wfd.getResult()
+        if self.failure:
+            self.failure.raiseException()
+
+        log.msg('SVNPoller: _process_changes %s .. %s' %
+                (self.old_last_change, self.poller.last_change))
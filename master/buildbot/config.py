@@ -16,7 +16,7 @@
 import re
 import os
 import sys
-from buildbot.util import safeTranslate
+from buildbot.util import safeTranslate, ComparableMixin
 from buildbot.process import properties
 from buildbot import interfaces
 from buildbot import locks
@@ -579,7 +579,12 @@ class MasterConfig(object):
                     "debug client is configured, but no slavePortnum is set")
 
 
-class BuilderConfig:
+class BuilderConfig(ComparableMixin):
+
+    # used at reconfig to tell which builders have changed
+    compare_attrs = ('name', 'slavenames', 'builddir', 'slavebuilddir',
+            'factory', 'category', 'nextSlave', 'nextBuild', 'locks', 'env',
+            'properties', 'mergeRequests')
 
     def __init__(self, name=None, slavename=None, slavenames=None,
             builddir=None, slavebuilddir=None, factory=None, category=None,
@@ -697,7 +702,8 @@ class ReconfigurableServiceMixin:
         # get a list of child services to reconfigure
         reconfigurable_services = [ svc
                 for svc in self
-                if isinstance(svc, ReconfigurableServiceMixin) ]
+                if isinstance(svc, ReconfigurableServiceMixin)
+                and self.needsReconfig(svc, new_config) ]
 
         # sort by priority
         reconfigurable_services.sort(key=lambda svc : -svc.reconfig_priority)
@@ -707,3 +713,11 @@ class ReconfigurableServiceMixin:
             wfd = defer.waitForDeferred(d)
             yield wfd
             wfd.getResult()
+
+    def needsReconfig(self, svc, new_config):
+        """
+        Return false if the child service C{svc} is known to be unaffected
+        by C{new_config}, so that its C{reconfigService} need not be called.
+        """
+        return True
+
@@ -13,9 +13,11 @@
 #
 # Copyright Buildbot Team Members
 
+import sqlalchemy as sa
 from twisted.internet import reactor
 from buildbot.db import base
 from buildbot.util import epoch2datetime
+from buildbot.status.results import SUCCESS, WARNINGS
 
 class BuildsConnectorComponent(base.DBConnectorComponent):
     # Documentation is in developer/database.rst
@@ -41,6 +43,24 @@ class BuildsConnectorComponent(base.DBConnectorComponent):
             return [ self._bdictFromRow(row) for row in res.fetchall() ]
         return self.db.pool.do(thd)
 
+    def getRecentBuildDurations(self, buildername, count=5):
+        def thd(conn):
+            builds_tbl = self.db.model.builds
+            reqs_tbl = self.db.model.buildrequests
+            q = sa.select([ builds_tbl.c.start_time, builds_tbl.c.finish_time ],
+                    from_obj=[ builds_tbl.join(reqs_tbl,
+                            builds_tbl.c.brid == reqs_tbl.c.id) ],
+                    whereclause=((reqs_tbl.c.buildername == buildername)
+                               & (reqs_tbl.c.complete == 1)
+                               & (reqs_tbl.c.results.in_([SUCCESS, WARNINGS]))
+                               & (builds_tbl.c.finish_time != None)),
+                    order_by=[ sa.desc(builds_tbl.c.id) ],
+                    limit=count)
+            res = conn.execute(q)
+            return [ row.finish_time - row.start_time
+                     for row in res.fetchall() ]
+        return self.db.pool.do(thd)
+
     def addBuild(self, brid, number, _reactor=reactor):
         def thd(conn):
             start_time = _reactor.seconds()
@@ -21,6 +21,7 @@ from buildbot.util import json
 import sqlalchemy as sa
 from twisted.internet import defer, reactor
 from buildbot.db import base
+from buildbot.process import metrics
 from buildbot.util import epoch2datetime, datetime2epoch
 
 class ChDict(dict):
@@ -33,16 +34,12 @@ class ChangesConnectorComponent(base.DBConnectorComponent):
             revision=None, when_timestamp=None, branch=None,
             category=None, revlink='', properties={}, repository='',
             project='', uid=None, _reactor=reactor):
-        assert project is not None, "project must be a string, not None"
-        assert repository is not None, "repository must be a string, not None"
-
-        if when_timestamp is None:
-            when_timestamp = epoch2datetime(_reactor.seconds())
-
-        # verify that source is 'Change' for each property
-        for pv in properties.values():
-            assert pv[1] == 'Change', ("properties must be qualified with"
-                                       "source 'Change'")
+        chdict = dict(author=author, files=files, comments=comments,
+                is_dir=is_dir, revision=revision,
+                when_timestamp=when_timestamp, branch=branch,
+                category=category, revlink=revlink, properties=properties,
+                repository=repository, project=project, uid=uid)
+        self._checkChange(chdict, _reactor)
 
         def thd(conn):
             # note that in a read-uncommitted database like SQLite this
@@ -52,44 +49,92 @@ class ChangesConnectorComponent(base.DBConnectorComponent):
             # all in the database, but beware.
 
             transaction = conn.begin()
-
-            ins = self.db.model.changes.insert()
-            r = conn.execute(ins, dict(
-                author=author,
-                comments=comments,
-                is_dir=is_dir,
-                branch=branch,
-                revision=revision,
-                revlink=revlink,
-                when_timestamp=datetime2epoch(when_timestamp),
-                category=category,
-                repository=repository,
-                project=project))
-            changeid = r.inserted_primary_key[0]
-            if files:
-                ins = self.db.model.change_files.insert()
-                conn.execute(ins, [
-                    dict(changeid=changeid, filename=f)
-                        for f in files
-                    ])
-            if properties:
-                ins = self.db.model.change_properties.insert()
-                conn.execute(ins, [
-                    dict(changeid=changeid,
-                        property_name=k,
-                        property_value=json.dumps(v))
-                    for k,v in properties.iteritems()
-                ])
-            if uid:
-                ins = self.db.model.change_users.insert()
-                conn.execute(ins, dict(changeid=changeid, uid=uid))
-
+            changeid = self._addChange_thd(conn, **chdict)
             transaction.commit()
 
             return changeid
         d = self.db.pool.do(thd)
         return d
 
+    def addChanges(self, changes, _reactor=reactor):
+        # each element of changes is a dictionary of addChange's keyword
+        # arguments; missing keys take addChange's defaults
+        chdicts = []
+        for kwargs in changes:
+            chdict = dict(author=None, files=None, comments=None, is_dir=0,
+                    revision=None, when_timestamp=None, branch=None,
+                    category=None, revlink='', properties={}, repository='',
+                    project='', uid=None)
+            chdict.update(kwargs)
+            self._checkChange(chdict, _reactor)
+            chdicts.append(chdict)
+
+        if not chdicts:
+            return defer.succeed([])
+
+        def thd(conn):
+            # all of the changes go in in a single transaction, which saves a
+            # commit (and, on most databases, an fsync) per change
+            transaction = conn.begin()
+            changeids = [ self._addChange_thd(conn, **chdict)
+                          for chdict in chdicts ]
+            transaction.commit()
+            return changeids
+        d = self.db.pool.do(thd)
+        return d
+
+    def _checkChange(self, chdict, _reactor):
+        assert chdict['project'] is not None, \
+                "project must be a string, not None"
+        assert chdict['repository'] is not None, \
+                "repository must be a string, not None"
+
+        if chdict['when_timestamp'] is None:
+            chdict['when_timestamp'] = epoch2datetime(_reactor.seconds())
+
+        # verify that source is 'Change' for each property
+        for pv in chdict['properties'].values():
+            assert pv[1] == 'Change', ("properties must be qualified with"
+                                       "source 'Change'")
+
+    def _addChange_thd(self, conn, author, files, comments, is_dir, revision,
+            when_timestamp, branch, category, revlink, properties,
+            repository, project, uid):
+        # This method must be run in a db.pool thread, inside a transaction,
+        # and returns the new changeid
+        ins = self.db.model.changes.insert()
+        r = conn.execute(ins, dict(
+            author=author,
+            comments=comments,
+            is_dir=is_dir,
+            branch=branch,
+            revision=revision,
+            revlink=revlink,
+            when_timestamp=datetime2epoch(when_timestamp),
+            category=category,
+            repository=repository,
+            project=project))
+        changeid = r.inserted_primary_key[0]
+        if files:
+            ins = self.db.model.change_files.insert()
+            conn.execute(ins, [
+                dict(changeid=changeid, filename=f)
+                    for f in files
+                ])
+        if properties:
+            ins = self.db.model.change_properties.insert()
+            conn.execute(ins, [
+                dict(changeid=changeid,
+                    property_name=k,
+                    property_value=json.dumps(v))
+                for k,v in properties.iteritems()
+            ])
+        if uid:
+            ins = self.db.model.change_users.insert()
+            conn.execute(ins, dict(changeid=changeid, uid=uid))
+
+        return changeid
+
     @base.cached("chdicts")
     def getChange(self, changeid):
         assert changeid >= 0
@@ -150,36 +195,76 @@ class ChangesConnectorComponent(base.DBConnectorComponent):
 
     # utility methods
 
+    # the number of changes deleted in each transaction by pruneChanges
+    pruneBatchSize = 500
+
+    @defer.deferredGenerator
     def pruneChanges(self, changeHorizon):
         """
         Called periodically by DBConnector, this method deletes changes older
-        than C{changeHorizon}.
+        than C{changeHorizon}.  The changes are deleted a batch at a time,
+        lowest changeid first, each batch in its own transaction, so that the
+        tables are not locked for long.
         """
 
         if not changeHorizon:
-            return defer.succeed(None)
-        def thd(conn):
-            changes_tbl = self.db.model.changes
+            return
 
-            # First, get the list of changes to delete.  This could be written
-            # as a subquery but then that subquery would be run for every
-            # table, which is very inefficient; also, MySQL's subquery support
-            # leaves much to be desired, and doesn't support this particular
-            # form.
+        # find the newest change to delete, and how many there are
+        def thd_horizon(conn):
+            changes_tbl = self.db.model.changes
             q = sa.select([changes_tbl.c.changeid],
                           order_by=[sa.desc(changes_tbl.c.changeid)],
-                          offset=changeHorizon)
-            res = conn.execute(q)
-            ids_to_delete = [ r.changeid for r in res ]
-
-            # and delete from all relevant tables, in dependency order
-            for table_name in ('scheduler_changes', 'sourcestamp_changes',
-                               'change_files', 'change_properties', 'changes',
-                               'change_users'):
-                table = self.db.model.metadata.tables[table_name]
-                conn.execute(
-                    table.delete(table.c.changeid.in_(ids_to_delete)))
-        return self.db.pool.do(thd)
+                          offset=changeHorizon, limit=1)
+            row = conn.execute(q).fetchone()
+            if not row:
+                return None, 0
+            q = sa.select([sa.func.count(changes_tbl.c.changeid)],
+                    whereclause=(changes_tbl.c.changeid <= row.changeid))
+            return row.changeid, conn.execute(q).scalar()
+        wfd = defer.waitForDeferred(self.db.pool.do(thd_horizon))
+        yield wfd
+        last_changeid, backlog = wfd.getResult()
+
+        # then delete the changes up to it, from the lowest surviving one;
+        # the reactor runs while each batch is in the db thread
+        def thd_batch(conn):
+            changes_tbl = self.db.model.changes
+            q = sa.select([changes_tbl.c.changeid],
+                    whereclause=(changes_tbl.c.changeid <= last_changeid),
+                    order_by=[changes_tbl.c.changeid],
+                    limit=self.pruneBatchSize)
+            ids_to_delete = [ r.changeid for r in conn.execute(q) ]
+            if not ids_to_delete:
+                return 0
+
+            # delete from all relevant tables, in dependency order
+            transaction = conn.begin()
+            try:
+                for table_name in ('scheduler_changes', 'sourcestamp_changes',
+                                   'change_files', 'change_properties',
+                                   'changes', 'change_users'):
+                    table = self.db.model.metadata.tables[table_name]
+                    conn.execute(
+                        table.delete(table.c.changeid.in_(ids_to_delete)))
+            except:
+                transaction.rollback()
+                raise
+            transaction.commit()
+            return len(ids_to_delete)
+
+        while backlog > 0:
+            metrics.MetricCountEvent.log("changes.prune_backlog", backlog,
+                                         absolute=True)
+            wfd = defer.waitForDeferred(self.db.pool.do(thd_batch))
+            yield wfd
+            deleted = wfd.getResult()
+            if not deleted:
+                break
+            metrics.MetricCountEvent.log("changes.pruned", deleted)
+            backlog -= deleted
+        metrics.MetricCountEvent.log("changes.prune_backlog", 0,
+                                     absolute=True)
 
     def _chdict_from_change_row_thd(self, conn, ch_row):
         # This method must be run in a db.pool thread, and returns a chdict
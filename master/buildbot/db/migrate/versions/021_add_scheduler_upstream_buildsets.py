@@ -0,0 +1,75 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import sqlalchemy as sa
+from buildbot.util import json
+
+def upgrade(migrate_engine):
+    metadata = sa.MetaData()
+    metadata.bind = migrate_engine
+
+    sa.Table('objects', metadata, autoload=True)
+    buildsets = sa.Table('buildsets', metadata, autoload=True)
+    object_state = sa.Table('object_state', metadata, autoload=True)
+
+    # Dependent schedulers used to keep the buildsets they are waiting on as
+    # a JSON list in object_state; give them a table of their own
+    scheduler_upstream_buildsets = sa.Table('scheduler_upstream_buildsets',
+                                            metadata,
+        sa.Column('objectid', sa.Integer, sa.ForeignKey('objects.id'),
+            nullable=False),
+        sa.Column('buildsetid', sa.Integer, sa.ForeignKey('buildsets.id'),
+            nullable=False),
+    )
+    scheduler_upstream_buildsets.create()
+
+    sa.Index('scheduler_upstream_buildsets_unique',
+            scheduler_upstream_buildsets.c.objectid,
+            scheduler_upstream_buildsets.c.buildsetid, unique=True).create()
+    sa.Index('scheduler_upstream_buildsets_buildsetid',
+            scheduler_upstream_buildsets.c.buildsetid).create()
+
+    # move the existing state over
+    wc = (object_state.c.name == 'upstream_bsids')
+    q = sa.select([ object_state.c.objectid, object_state.c.value_json ],
+                  whereclause=wc)
+    upstream = []
+    for row in migrate_engine.execute(q).fetchall():
+        try:
+            bsids = json.loads(row.value_json)
+        except ValueError:
+            continue
+        upstream.append((row.objectid, set(bsids)))
+
+    # the state may name buildsets which have since been deleted; leave those
+    # out, as they would violate the foreign key
+    all_bsids = set()
+    for objectid, bsids in upstream:
+        all_bsids.update(bsids)
+    all_bsids = list(all_bsids)
+    existing = set()
+    while all_bsids:
+        batch, all_bsids = all_bsids[:100], all_bsids[100:]
+        q = sa.select([ buildsets.c.id ],
+                      whereclause=buildsets.c.id.in_(batch))
+        existing.update([ r.id for r in migrate_engine.execute(q).fetchall() ])
+
+    rows = []
+    for objectid, bsids in upstream:
+        for bsid in bsids & existing:
+            rows.append(dict(objectid=objectid, buildsetid=bsid))
+    if rows:
+        migrate_engine.execute(scheduler_upstream_buildsets.insert(), rows)
+    migrate_engine.execute(object_state.delete(whereclause=wc))
@@ -276,6 +276,17 @@ class Model(base.DBConnectorComponent):
         sa.Column('important', sa.Integer),
     )
 
+    # This table references the buildsets that a Dependent scheduler is
+    # waiting on, having been submitted by its upstream scheduler.  Rows are
+    # deleted once the buildset is complete and the scheduler has acted on it.
+    scheduler_upstream_buildsets = sa.Table('scheduler_upstream_buildsets',
+                                            metadata,
+        sa.Column('objectid', sa.Integer, sa.ForeignKey('objects.id'),
+            nullable=False),
+        sa.Column('buildsetid', sa.Integer, sa.ForeignKey('buildsets.id'),
+            nullable=False),
+    )
+
     # objects
 
     # This table uniquely identifies objects that need to maintain state across
@@ -355,6 +366,11 @@ class Model(base.DBConnectorComponent):
     sa.Index('scheduler_changes_changeid', scheduler_changes.c.changeid)
     sa.Index('scheduler_changes_unique', scheduler_changes.c.objectid,
                     scheduler_changes.c.changeid, unique=True)
+    sa.Index('scheduler_upstream_buildsets_unique',
+            scheduler_upstream_buildsets.c.objectid,
+            scheduler_upstream_buildsets.c.buildsetid, unique=True)
+    sa.Index('scheduler_upstream_buildsets_buildsetid',
+            scheduler_upstream_buildsets.c.buildsetid)
     sa.Index('sourcestamp_changes_sourcestampid', sourcestamp_changes.c.sourcestampid)
     sa.Index('sourcestamps_sourcestampsetid', sourcestamps.c.sourcestampsetid, unique=False)
     sa.Index('users_identifier', users.c.identifier, unique=True)
@@ -74,3 +74,53 @@ class SchedulersConnectorComponent(base.DBConnectorComponent):
             return dict([ (r.changeid, [False,True][r.important])
                           for r in conn.execute(q) ])
         return self.db.pool.do(thd)
+
+    def addUpstreamBuildset(self, objectid, bsid):
+        def thd(conn):
+            tbl = self.db.model.scheduler_upstream_buildsets
+            try:
+                conn.execute(tbl.insert(), objectid=objectid, buildsetid=bsid)
+            except (sqlalchemy.exc.ProgrammingError,
+                    sqlalchemy.exc.IntegrityError):
+                pass # already recorded
+        return self.db.pool.do(thd)
+
+    def removeUpstreamBuildsets(self, objectid, bsids):
+        def thd(conn):
+            tbl = self.db.model.scheduler_upstream_buildsets
+            q = tbl.delete(
+                    whereclause=((tbl.c.objectid == objectid)
+                            & (tbl.c.buildsetid == sa.bindparam('wc_bsid'))))
+            if bsids:
+                conn.execute(q, [ dict(wc_bsid=bsid) for bsid in bsids ])
+        return self.db.pool.do(thd)
+
+    def getUpstreamBuildsets(self, objectid):
+        def thd(conn):
+            tbl = self.db.model.scheduler_upstream_buildsets
+            bs_tbl = self.db.model.buildsets
+            q = sa.select(
+                [ tbl.c.buildsetid, bs_tbl.c.sourcestampsetid,
+                  bs_tbl.c.complete, bs_tbl.c.results ],
+                whereclause=(tbl.c.objectid == objectid),
+                from_obj=[ tbl.outerjoin(bs_tbl,
+                                    tbl.c.buildsetid == bs_tbl.c.id) ],
+                order_by=[ tbl.c.buildsetid ])
+            rv = []
+            missing = []
+            for row in conn.execute(q).fetchall():
+                if row.sourcestampsetid is None:
+                    missing.append(row.buildsetid)
+                    continue
+                rv.append((row.buildsetid, row.sourcestampsetid,
+                           bool(row.complete), row.results))
+
+            # forget about buildsets that no longer exist
+            if missing:
+                q = tbl.delete(
+                    whereclause=((tbl.c.objectid == objectid)
+                            & (tbl.c.buildsetid == sa.bindparam('wc_bsid'))))
+                conn.execute(q, [ dict(wc_bsid=bsid) for bsid in missing ])
+            return rv
+        return self.db.pool.do(thd)
+
@@ -100,43 +100,59 @@ class StateConnectorComponent(base.DBConnectorComponent):
 
     def setState(self, objectid, name, value):
         def thd(conn):
-            object_state_tbl = self.db.model.object_state
+            self._setStateJson(conn, objectid, name,
+                               self._encodeValue(value))
+        return self.db.pool.do(thd)
 
-            try:
-                value_json = json.dumps(value)
-            except:
-                raise TypeError("Error encoding JSON for %r" % (value,))
+    def setStates(self, states):
+        def thd(conn):
+            # encode everything first, so that nothing is written if one of
+            # the values cannot be
+            encoded = [ (objectid, name, self._encodeValue(value))
+                        for objectid, name, value in states ]
+            transaction = conn.begin()
+            for objectid, name, value_json in encoded:
+                self._setStateJson(conn, objectid, name, value_json)
+            transaction.commit()
+        return self.db.pool.do(thd)
 
-            def update():
-                q = object_state_tbl.update(
-                        whereclause=((object_state_tbl.c.objectid == objectid)
-                                & (object_state_tbl.c.name == name)))
-                res = conn.execute(q, value_json=value_json)
+    def _encodeValue(self, value):
+        try:
+            return json.dumps(value)
+        except:
+            raise TypeError("Error encoding JSON for %r" % (value,))
 
-                # check whether that worked
-                return res.rowcount > 0
+    def _setStateJson(self, conn, objectid, name, value_json):
+        object_state_tbl = self.db.model.object_state
 
-            def insert():
-                conn.execute(object_state_tbl.insert(),
-                                   objectid=objectid,
-                                   name=name,
-                                   value_json=value_json)
+        def update():
+            q = object_state_tbl.update(
+                    whereclause=((object_state_tbl.c.objectid == objectid)
+                            & (object_state_tbl.c.name == name)))
+            res = conn.execute(q, value_json=value_json)
 
-            # try updating; if that fails, try inserting; if that fails, then
-            # we raced with another instance to insert, so let that instance
-            # win.
+            # check whether that worked
+            return res.rowcount > 0
 
-            if update():
-                return
+        def insert():
+            conn.execute(object_state_tbl.insert(),
+                               objectid=objectid,
+                               name=name,
+                               value_json=value_json)
 
-            self._test_timing_hook(conn)
+        # try updating; if that fails, try inserting; if that fails, then
+        # we raced with another instance to insert, so let that instance
+        # win.
 
-            try:
-                insert()
-            except (sqlalchemy.exc.IntegrityError, sqlalchemy.exc.ProgrammingError):
-                pass # someone beat us to it - oh well
+        if update():
+            return
 
-        return self.db.pool.do(thd)
+        self._test_timing_hook(conn)
+
+        try:
+            insert()
+        except (sqlalchemy.exc.IntegrityError, sqlalchemy.exc.ProgrammingError):
+            pass # someone beat us to it - oh well
 
     def _test_timing_hook(self, conn):
         # called so tests can simulate another process inserting a database row
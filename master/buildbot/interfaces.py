@@ -291,6 +291,10 @@ class ISlaveStatus(Interface):
         """Return a timestamp (seconds since epoch) indicating when the most
         recent message was received from the buildslave."""
 
+    def getGeneration():
+        """Return an integer which increases whenever anything about this
+        slave changes."""
+
 class ISchedulerStatus(Interface):
     def getName():
         """Return the name of this Scheduler (a string)."""
@@ -320,6 +324,11 @@ class IBuilderStatus(Interface):
         """Return a list of ISlaveStatus objects for the buildslaves that are
         used by this builder."""
 
+    def getGeneration():
+        """Return an integer which increases whenever this builder's state,
+        current builds, or pending build requests change.  It starts over
+        when the master restarts."""
+
     def getPendingBuildRequestStatuses():
         """
         Get a L{IBuildRequestStatus} implementations for all unclaimed build
@@ -529,6 +538,11 @@ class IBuildStatus(Interface):
     def getSlavename():
         """Return the name of the buildslave which handled this build."""
 
+    def getGeneration():
+        """Return an integer which increases whenever anything about this
+        build, including its steps, changes.  It starts over when the build
+        is loaded from disk."""
+
     def getText():
         """Returns a list of strings to describe the build. These are
         intended to be displayed in a narrow column. If more space is
@@ -646,6 +660,10 @@ class IBuildStepStatus(Interface):
         expected to finish, or None if we can't make a guess. This guess will
         be refined over time."""
 
+    def getGeneration():
+        """Return an integer which increases whenever anything about this
+        step changes."""
+
     # Once you know the step has finished, the following methods are legal.
     # Before ths step has finished, they all return None.
 
@@ -772,7 +790,7 @@ class IStatusLog(Interface):
         to remove a receiver which was not previously registered is a no-op.
         """
 
-    def subscribeConsumer(consumer):
+    def subscribeConsumer(consumer, start=0, stop=None):
         """Register an L{IStatusLogConsumer} to receive all chunks of the
         logfile, including all the old entries and any that will arrive in
         the future. The consumer will first have their C{registerProducer}
@@ -785,8 +803,20 @@ class IStatusLog(Interface):
         a small amount of data could be written via C{writeChunk} even after
         C{pauseProducing} has been called.
 
+        To get only part of the log, give C{start} and C{stop} as file
+        offsets of chunks, from the log's L{getChunkIndex}.  The consumer
+        then gets the chunks from C{start} up to C{stop}, and is notified
+        with C{finish} at C{stop}, even if the log is not finished.
+
         To unsubscribe the consumer, use C{producer.stopProducing}."""
 
+    def getChunkIndex():
+        """Get an index of the positions of the chunks of this log, in its
+        file and in its text, for use with C{subscribeConsumer}.  The index
+        covers the whole log as it is when this is called.
+
+        @returns: L{buildbot.status.logfile.LogChunkIndex} via Deferred"""
+
     # once the log has finished, the following methods make sense. They can
     # be called earlier, but they will only return the contents of the log up
     # to the point at which they were called. You will lose items that are
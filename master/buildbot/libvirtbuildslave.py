@@ -133,9 +133,11 @@ class Connection(object):
 class LibVirtSlave(AbstractLatentBuildSlave):
 
     def __init__(self, name, password, connection, hd_image, base_image = None, xml=None, max_builds=None, notify_on_missing=[],
-                 missing_timeout=60*20, build_wait_timeout=60*10, properties={}, locks=None):
+                 missing_timeout=60*20, build_wait_timeout=60*10, properties={}, locks=None,
+                 pool=None):
         AbstractLatentBuildSlave.__init__(self, name, password, max_builds, notify_on_missing,
-                                          missing_timeout, build_wait_timeout, properties, locks)
+                                          missing_timeout, build_wait_timeout, properties, locks,
+                                          pool)
         self.name = name
         self.connection = connection
         self.image = hd_image
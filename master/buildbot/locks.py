@@ -14,6 +14,7 @@
 # Copyright Buildbot Team Members
 
 
+import heapq
 from twisted.python import log
 from twisted.internet import reactor, defer
 from buildbot import util
@@ -24,24 +25,91 @@ if False: # for debugging
 else:
     debuglog = lambda m: None
 
+def _logTime(timer, elapsed):
+    # imported here, as buildbot.process.metrics imports buildbot.config,
+    # which imports this module
+    from buildbot.process import metrics
+    metrics.MetricTimeEvent.log(timer, elapsed)
+
+def _logCount(counter, count, absolute=False):
+    from buildbot.process import metrics
+    metrics.MetricCountEvent.log(counter, count, absolute=absolute)
+
+class LockWaiter(object):
+    """
+    A ticket in a lock's wait queue.
+
+    @ivar ticket: the position of this waiter in the order of arrival
+    @ivar woken: true once the lock has room for this waiter, and is holding
+                 that room until it claims the lock
+    @ivar suspended: true while the owner waits on another of its locks; the
+                     waiter keeps its place, but no room is held for it
+    @ivar inQueue: true while the waiter has an entry in the lock's queue
+    """
+
+    def __init__(self, ticket, owner, access, d, queued_at):
+        self.ticket = ticket
+        self.owner = owner
+        self.access = access
+        self.d = d
+        self.queued_at = queued_at
+        self.woken = False
+        self.suspended = False
+        self.cancelled = False
+        self.inQueue = False
+
+    def __repr__(self):
+        return "<LockWaiter #%d %r %s>" % (self.ticket, self.owner,
+                                            self.access.mode)
+
 class BaseLock:
     """
     Class handling claiming and releasing of L{self}, and keeping track of
     current and waiting owners.
 
-    @note: Ideally, we'd like to maintain FIFO order. The place to do that
-           would be the L{isAvailable()} function. However, this function is
-           called by builds/steps both for the first time, and after waking
-           them up by L{self} from the L{self.waiting} queue. There is
-           currently no way of distinguishing between them.
+    Waiters are served in FIFO order: once anybody is waiting, a new
+    requester has to wait its turn, even if the lock has room for it.  When
+    the lock is released, the waiters at the head of the queue that now fit
+    are woken up, and the room is kept for them until they claim the lock or
+    stop waiting.  The number of exclusive and counting owners is kept up to
+    date, and the queue is a heap ordered by ticket, so that checking,
+    claiming and releasing the lock do not depend on the number of owners,
+    and take at most logarithmic time in the number of waiters.
+
+    Requesters that never wait in the queue, such as slaves checking the
+    locks they need before taking a build, only need room in the lock.
+
+    An owner that needs several locks must not hold room in one lock while
+    it waits for another, or two owners taking the same locks in different
+    orders would wait for each other forever.  Before it waits on a lock, it
+    calls L{suspendWaiting} on its other locks: it keeps its ticket, but it
+    leaves their queues and its room goes to the waiters behind it.  When it
+    waits on such a lock again, it goes back into the queue at its old
+    place.
     """
     description = "<BaseLock>"
 
-    def __init__(self, name, maxCount=1):
+    def __init__(self, name, maxCount=1, _reactor=reactor):
         self.name = name          # Name of the lock
-        self.waiting = []         # Current queue, tuples (LockAccess, deferred)
-        self.owners = []          # Current owners, tuples (owner, LockAccess)
         self.maxCount = maxCount  # maximal number of counting owners
+        self._reactor = _reactor
+
+        # current owners, mapping (owner, LockAccess) to the claim time
+        self.owners = {}
+        self.numExclusive = 0
+        self.numCounting = 0
+
+        # heap of (ticket, waiter) for the waiters that have not been woken
+        # yet; cancelled and suspended ones are dropped when they reach the
+        # head of the heap
+        self.waiting = []
+        # all current waiters, woken or not, by owner
+        self.waiters = {}
+        self.wokenExclusive = 0
+        self.wokenCounting = 0
+        self.nextTicket = 0
+
+        self.metricsName = "locks.%s" % (name,)
 
         # subscriptions to this lock being released
         self.release_subs = subscription.SubscriptionPoint("%r releases"
@@ -55,39 +123,85 @@ class BaseLock:
 
             @return: Tuple (number exclusive owners, number counting owners)
         """
-        num_excl, num_counting = 0, 0
-        for owner in self.owners:
-            if owner[1].mode == 'exclusive':
-                num_excl = num_excl + 1
-            else: # mode == 'counting'
-                num_counting = num_counting + 1
-
-        assert (num_excl == 1 and num_counting == 0) \
-                or (num_excl == 0 and num_counting <= self.maxCount)
-        return num_excl, num_counting
-
-
-    def isAvailable(self, access):
-        """ Return a boolean whether the lock is available for claiming """
-        debuglog("%s isAvailable(%s): self.owners=%r"
-                                            % (self, access, self.owners))
-        num_excl, num_counting = self._getOwnersCount()
+        assert (self.numExclusive == 1 and self.numCounting == 0) \
+                or (self.numExclusive == 0
+                    and self.numCounting <= self.maxCount)
+        return self.numExclusive, self.numCounting
+
+    def _hasRoom(self, access):
+        # owners and woken waiters both take up room
+        num_excl = self.numExclusive + self.wokenExclusive
+        num_counting = self.numCounting + self.wokenCounting
         if access.mode == 'counting':
-            # Wants counting access
             return num_excl == 0 and num_counting < self.maxCount
         else:
-            # Wants exclusive access
             return num_excl == 0 and num_counting == 0
 
-    def claim(self, owner, access):
+    def isAvailable(self, requester, access, queue=True):
+        """ Return a boolean whether the lock is available for claiming by
+        C{requester}
+
+        @param queue: false for requesters that never wait in the queue; they
+                      do not have to wait for their turn """
+        debuglog("%s isAvailable(%s, %s): self.owners=%r"
+                                % (self, requester, access, self.owners))
+        waiter = self.waiters.get(requester)
+        if waiter is not None:
+            if waiter.woken:
+                # room was kept for it when it was woken up
+                return True
+            # a waiter that was suspended may claim any room left over by the
+            # waiters ahead of it
+            return self._hasRoom(access) and not self._waitersAhead(waiter)
+        if queue and self._nextWaiter():
+            # wait your turn
+            return False
+        return self._hasRoom(access)
+
+    def _nextWaiter(self):
+        # return the first waiter in the queue that is waiting for this lock,
+        # dropping any that are not
+        while self.waiting:
+            waiter = self.waiting[0][1]
+            if not waiter.cancelled and not waiter.suspended:
+                return waiter
+            heapq.heappop(self.waiting)
+            waiter.inQueue = False
+        return None
+
+    def _waitersAhead(self, waiter):
+        # are there waiters ahead of this one that are waiting for this lock?
+        first = self._nextWaiter()
+        return first is not None and first.ticket < waiter.ticket
+
+    def _enqueue(self, waiter):
+        heapq.heappush(self.waiting, (waiter.ticket, waiter))
+        waiter.inQueue = True
+
+    def claim(self, owner, access, queue=True):
         """ Claim the lock (lock must be available) """
         debuglog("%s claim(%s, %s)" % (self, owner, access.mode))
         assert owner is not None
-        assert self.isAvailable(access), "ask for isAvailable() first"
+        assert self.isAvailable(owner, access, queue), \
+                "ask for isAvailable() first"
 
         assert isinstance(access, LockAccess)
         assert access.mode in ['counting', 'exclusive']
-        self.owners.append((owner, access))
+        entry = (owner, access)
+        assert entry not in self.owners
+
+        now = self._reactor.seconds()
+        waiter = self.waiters.pop(owner, None)
+        if waiter is not None:
+            self._unreserve(waiter)
+            _logTime("%s.wait" % self.metricsName, now - waiter.queued_at)
+            self._logQueueLength()
+
+        self.owners[entry] = now
+        if access.mode == 'exclusive':
+            self.numExclusive += 1
+        else:
+            self.numCounting += 1
         debuglog(" %s is claimed '%s'" % (self, access.mode))
 
     def subscribeToReleases(self, callback):
@@ -102,55 +216,127 @@ class BaseLock:
         debuglog("%s release(%s, %s)" % (self, owner, access.mode))
         entry = (owner, access)
         assert entry in self.owners
-        self.owners.remove(entry)
-        # who can we wake up?
-        # After an exclusive access, we may need to wake up several waiting.
-        # Break out of the loop when the first waiting client should not be awakened.
-        num_excl, num_counting = self._getOwnersCount()
-        while len(self.waiting) > 0:
-            access, d = self.waiting[0]
-            if access.mode == 'counting':
-                if num_excl > 0 or num_counting == self.maxCount:
-                    break
-                else:
-                    num_counting = num_counting + 1
-            else:
-                # access.mode == 'exclusive'
-                if num_excl > 0 or num_counting > 0:
-                    break
-                else:
-                    num_excl = num_excl + 1
+        claimed_at = self.owners.pop(entry)
+        if access.mode == 'exclusive':
+            self.numExclusive -= 1
+        else:
+            self.numCounting -= 1
+        _logTime("%s.hold" % self.metricsName,
+                 self._reactor.seconds() - claimed_at)
 
-            del self.waiting[0]
-            reactor.callLater(0, d.callback, self)
+        # who can we wake up?
+        self._wakeWaiters()
 
         # notify any listeners
         self.release_subs.deliver()
 
+    def _wakeWaiters(self):
+        # wake the waiters at the head of the queue, for as long as they fit.
+        # After an exclusive access, we may need to wake up several waiting.
+        # Break out of the loop when the first waiting client should not be
+        # awakened.
+        while True:
+            waiter = self._nextWaiter()
+            if waiter is None or not self._hasRoom(waiter.access):
+                break
+            heapq.heappop(self.waiting)
+            waiter.inQueue = False
+            waiter.woken = True
+            if waiter.access.mode == 'exclusive':
+                self.wokenExclusive += 1
+            else:
+                self.wokenCounting += 1
+            self._reactor.callLater(0, self._fire, waiter.d)
+
+    def _fire(self, d):
+        # the waiter may have been interrupted, and fired the deferred itself
+        if not d.called:
+            d.callback(self)
+
+    def _unreserve(self, waiter):
+        if waiter.woken:
+            if waiter.access.mode == 'exclusive':
+                self.wokenExclusive -= 1
+            else:
+                self.wokenCounting -= 1
+        else:
+            waiter.cancelled = True
+
+    def _logQueueLength(self):
+        _logCount("%s.queue" % self.metricsName, len(self.waiters),
+                  absolute=True)
+
     def waitUntilMaybeAvailable(self, owner, access):
         """Fire when the lock *might* be available. The caller will need to
         check with isAvailable() when the deferred fires. This loose form is
         used to avoid deadlocks. If we were interested in a stronger form,
         this would be named 'waitUntilAvailable', and the deferred would fire
         after the lock had been claimed.
+
+        The owner keeps its place in the queue until it claims the lock or
+        calls L{stopWaitingUntilAvailable}, even while it waits on other
+        locks.
         """
         debuglog("%s waitUntilAvailable(%s)" % (self, owner))
         assert isinstance(access, LockAccess)
-        if self.isAvailable(access):
+        if self.isAvailable(owner, access):
             return defer.succeed(self)
         d = defer.Deferred()
-        self.waiting.append((access, d))
+        waiter = self.waiters.get(owner)
+        if waiter is not None:
+            # it was suspended; back to its place in the queue
+            waiter.d = d
+            waiter.suspended = False
+            if not waiter.inQueue:
+                self._enqueue(waiter)
+            self._wakeWaiters()
+            return d
+        waiter = LockWaiter(self.nextTicket, owner, access, d,
+                            self._reactor.seconds())
+        self.nextTicket += 1
+        self._enqueue(waiter)
+        self.waiters[owner] = waiter
+        self._logQueueLength()
+        # the lock may have room that is kept for others ahead of us
+        self._wakeWaiters()
         return d
 
-    def stopWaitingUntilAvailable(self, owner, access, d):
+    def suspendWaiting(self, owner):
+        """Called when C{owner} is about to wait on another lock: it keeps its
+        ticket, if it has one, but it is passed over and any room kept for it
+        goes to the next waiters until it waits on this lock again."""
+        waiter = self.waiters.get(owner)
+        if waiter is None or waiter.suspended:
+            return
+        debuglog("%s suspendWaiting(%s)" % (self, owner))
+        waiter.suspended = True
+        if waiter.woken:
+            self._unreserve(waiter)
+            waiter.woken = False
+        self._wakeWaiters()
+
+    def stopWaitingUntilAvailable(self, owner, access, d=None):
+        """Give up the place of C{owner} in the queue, if it has one; any room
+        kept for it goes to the next waiters."""
         debuglog("%s stopWaitingUntilAvailable(%s)" % (self, owner))
         assert isinstance(access, LockAccess)
-        assert (access, d) in self.waiting
-        self.waiting.remove( (access, d) )
+        waiter = self.waiters.pop(owner, None)
+        if waiter is None:
+            return
+        assert d is None or waiter.d is d
+        self._unreserve(waiter)
+        self._logQueueLength()
+        self._wakeWaiters()
 
     def isOwner(self, owner, access):
         return (owner, access) in self.owners
 
+    def getWaiters(self):
+        """Return the current waiters, in FIFO order"""
+        waiters = [ w for w in self.waiters.itervalues() ]
+        waiters.sort(key=lambda w : w.ticket)
+        return waiters
+
 
 class RealMasterLock(BaseLock):
     def __init__(self, lockid):
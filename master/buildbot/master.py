@@ -27,7 +27,7 @@ import buildbot
 import buildbot.pbmanager
 from buildbot.util import subscription, epoch2datetime
 from buildbot.status.master import Status
-from buildbot.changes import changes
+from buildbot.changes import changes, filter
 from buildbot.changes.manager import ChangeManager
 from buildbot import interfaces
 from buildbot.process.builder import BuilderControl
@@ -91,13 +91,15 @@ class BuildMaster(config.ReconfigurableServiceMixin, service.MultiService):
 
         # subscription points
         self._change_subs = \
-                subscription.SubscriptionPoint("changes")
+                filter.ChangeRouter("changes")
         self._new_buildrequest_subs = \
                 subscription.SubscriptionPoint("buildrequest_additions")
         self._new_buildset_subs = \
                 subscription.SubscriptionPoint("buildset_additions")
         self._complete_buildset_subs = \
                 subscription.SubscriptionPoint("buildset_completion")
+        self._complete_buildset_subs_by_bsid = \
+                subscription.KeyedSubscriptionPoint("buildset_completion")
 
         # local cache for this master's object ID
         self._object_id = None
@@ -479,14 +481,76 @@ class BuildMaster(config.ReconfigurableServiceMixin, service.MultiService):
         d.addCallback(notify)
         return d
 
-    def subscribeToChanges(self, callback):
+    @defer.deferredGenerator
+    def addChanges(self, change_kwargs):
+        """
+        Add several changes to the buildmaster at once, and act on them.
+
+        Each element of C{change_kwargs} is a dictionary of keyword arguments to
+        L{addChange}, although the deprecated argument names are not
+        supported.  The changes are written to the database in a single
+        transaction, and subscribers are then notified of each change in
+        order.  Change sources which discover many changes in one poll
+        should prefer this method.
+
+        @returns: list of L{Change} instances via Deferred
+        """
+        if not change_kwargs:
+            yield []
+            return
+
+        metrics.MetricCountEvent.log("added_changes", len(change_kwargs))
+
+        db_changes = []
+        for kwargs in change_kwargs:
+            kwargs = kwargs.copy()
+            src = kwargs.pop('src', None)
+            # add a source to each property
+            kwargs['properties'] = dict([ (n, (v, 'Change')) for n, v
+                            in kwargs.get('properties', {}).iteritems() ])
+            if src:
+                wfd = defer.waitForDeferred(
+                    users.createUserObject(self, kwargs.get('author'), src))
+                yield wfd
+                kwargs['uid'] = wfd.getResult()
+            db_changes.append(kwargs)
+
+        wfd = defer.waitForDeferred(
+            self.db.changes.addChanges(db_changes))
+        yield wfd
+        changeids = wfd.getResult()
+
+        added = []
+        for changeid in changeids:
+            wfd = defer.waitForDeferred(
+                self.db.changes.getChange(changeid))
+            yield wfd
+            chdict = wfd.getResult()
+
+            wfd = defer.waitForDeferred(
+                changes.Change.fromChdict(self, chdict))
+            yield wfd
+            change = wfd.getResult()
+
+            msg = u"added change %s to database" % change
+            log.msg(msg.encode('utf-8', 'replace'))
+            # only deliver messages immediately if we're not polling
+            if not self.config.db['db_poll_interval']:
+                self._change_subs.deliver(change)
+            added.append(change)
+
+        yield added
+
+    def subscribeToChanges(self, callback, change_filter=None):
         """
         Request that C{callback} be called with each Change object added to the
-        cluster.
+        cluster.  If C{change_filter} is given, the callback is only called
+        with the changes that the filter may accept; it should still check
+        them with the filter.
 
         Note: this method will go away in 0.9.x
         """
-        return self._change_subs.subscribe(callback)
+        return self._change_subs.subscribe(callback, change_filter)
 
     def addBuildset(self, **kwargs):
         """
@@ -564,6 +628,7 @@ class BuildMaster(config.ReconfigurableServiceMixin, service.MultiService):
 
     def _buildsetComplete(self, bsid, results):
         self._complete_buildset_subs.deliver(bsid, results)
+        self._complete_buildset_subs_by_bsid.deliver(bsid, results)
 
     def subscribeToBuildsetCompletions(self, callback):
         """
@@ -574,6 +639,16 @@ class BuildMaster(config.ReconfigurableServiceMixin, service.MultiService):
         """
         return self._complete_buildset_subs.subscribe(callback)
 
+    def subscribeToBuildsetCompletion(self, bsid, callback):
+        """
+        Request that C{callback(bsid, result)} be called when the buildset
+        C{bsid} is complete.  Unlike L{subscribeToBuildsetCompletions}, the
+        callback is not invoked for other buildsets.
+
+        Note: this method will go away in 0.9.x
+        """
+        return self._complete_buildset_subs_by_bsid.subscribe(bsid, callback)
+
     def buildRequestAdded(self, bsid, brid, buildername):
         """
         Notifies the master that a build request is available to be claimed;
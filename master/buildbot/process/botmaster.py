@@ -61,6 +61,11 @@ class BotMaster(config.ReconfigurableServiceMixin, service.MultiService):
 
         self.lastSlavePortnum = None
 
+        # names of the slaves and builders that the configuration being
+        # applied adds or changes; the others are not reconfigured
+        self.reconfig_slaves = set()
+        self.reconfig_builders = set()
+
         # subscription to new build requests
         self.buildrequest_sub = None
 
@@ -169,11 +174,26 @@ class BotMaster(config.ReconfigurableServiceMixin, service.MultiService):
         yield wfd
         wfd.getResult()
 
-        # try to start a build for every builder; this is necessary at master
-        # startup, and a good idea in any other case
-        self.maybeStartBuildsForAllBuilders()
+        # try to start builds on the builders that were added or changed, or
+        # whose slaves were; at master startup, that is every builder
+        buildernames = set(self.reconfig_builders)
+        for slavename in self.reconfig_slaves:
+            buildernames.update([ b.name
+                for b in self.getBuildersForSlave(slavename) ])
+        if buildernames:
+            self.brd.maybeStartBuildsOn(sorted(buildernames))
 
-        timer.stop()
+        elapsed = timer.stop()
+        log.msg("reconfigured %d of %d builders and %d of %d slaves in %.3fs"
+                % (len(self.reconfig_builders), len(self.builders),
+                   len(self.reconfig_slaves), len(self.slaves), elapsed))
+
+    def needsReconfig(self, svc, new_config):
+        if isinstance(svc, Builder):
+            return svc.name in self.reconfig_builders
+        if interfaces.IBuildSlave.providedBy(svc):
+            return svc.slavename in self.reconfig_slaves
+        return True
 
 
     @defer.deferredGenerator
@@ -204,6 +224,16 @@ class BotMaster(config.ReconfigurableServiceMixin, service.MultiService):
                 removed_names.add(n)
                 added_names.add(n)
 
+        # only new slaves, and those with a changed configuration, need to
+        # be reconfigured; reconfigServiceBuilders adds those whose builders
+        # have changed
+        self.reconfig_slaves = set(added_names)
+        for n in (old_set & new_set) - added_names:
+            old = old_by_name[n]
+            if (not hasattr(old, 'isReconfigNeeded')
+                    or old.isReconfigNeeded(new_by_name[n], new_config)):
+                self.reconfig_slaves.add(n)
+
         if removed_names or added_names:
             log.msg("adding %d new slaves, removing %d" %
                     (len(added_names), len(removed_names)))
@@ -253,6 +283,21 @@ class BotMaster(config.ReconfigurableServiceMixin, service.MultiService):
         # calculate new builders, by name, and removed builders
         removed_names, added_names = util.diffSets(old_set, new_set)
 
+        # only new builders, and those with a changed configuration, need to
+        # be reconfigured
+        self.reconfig_builders = set(added_names)
+        for n in old_set & new_set:
+            if old_by_name[n].config != new_by_name[n]:
+                self.reconfig_builders.add(n)
+
+        # .. as do the slaves which gain or lose builders
+        for n in self.reconfig_builders | removed_names:
+            if n in old_by_name and old_by_name[n].config:
+                self.reconfig_slaves.update(old_by_name[n].config.slavenames)
+            if n in new_by_name:
+                self.reconfig_slaves.update(new_by_name[n].slavenames)
+        self.reconfig_slaves.intersection_update(self.slaves)
+
         if removed_names or added_names:
             log.msg("adding %d new builders, removing %d" %
                     (len(added_names), len(removed_names)))
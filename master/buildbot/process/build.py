@@ -267,8 +267,12 @@ class Build(properties.PropertiesMixin):
             return defer.succeed(None)
         log.msg("acquireLocks(build %s, locks %s)" % (self, self.locks))
         for lock, access in self.locks:
-            if not lock.isAvailable(access):
+            if not lock.isAvailable(self, access):
                 log.msg("Build %s waiting for lock %s" % (self, lock))
+                # don't hold room in the other locks while waiting
+                for other, _ in self.locks:
+                    if other is not lock:
+                        other.suspendWaiting(self)
                 d = lock.waitUntilMaybeAvailable(self, access)
                 d.addCallback(self.acquireLocks)
                 self._acquiringLock = (lock, access, d)
@@ -528,6 +532,8 @@ class Build(properties.PropertiesMixin):
             else:
                 # This should only happen if we've been interrupted
                 assert self.stopped
+                # give up our place in the lock's queue, if we had one
+                lock.stopWaitingUntilAvailable(self, access)
 
     # IBuildControl
 
@@ -27,7 +27,7 @@ from buildbot.status.builder import RETRY
 from buildbot.status.buildrequest import BuildRequestStatus
 from buildbot.process.properties import Properties
 from buildbot.process import buildrequest, slavebuilder
-from buildbot.process.slavebuilder import BUILDING
+from buildbot.process.slavebuilder import BUILDING, LATENT
 from buildbot.db import buildrequests
 
 class Builder(config.ReconfigurableServiceMixin,
@@ -424,6 +424,14 @@ class Builder(config.ReconfigurableServiceMixin,
         if sb.slave:
             sb.slave.releaseLocks()
 
+        # let a nextSlave that keeps track of builds know about this one
+        buildFinished = getattr(self.config.nextSlave, 'buildFinished', None)
+        if buildFinished:
+            try:
+                buildFinished(self, sb, build)
+            except:
+                log.err(failure.Failure(), 'while recording finished build:')
+
         self.updateBigStatus()
 
     @defer.deferredGenerator
@@ -497,31 +505,31 @@ class Builder(config.ReconfigurableServiceMixin,
 
         # match them up until we're out of options
         while available_slavebuilders and unclaimed_requests:
-            # first, choose a slave (using nextSlave)
+            # first, choose a request (using nextBuild)
             wfd = defer.waitForDeferred(
-                self._chooseSlave(available_slavebuilders))
+                self._chooseBuild(unclaimed_requests))
             yield wfd
-            slavebuilder = wfd.getResult()
+            brdict = wfd.getResult()
 
-            if not slavebuilder:
+            if not brdict:
                 break
 
-            if slavebuilder not in available_slavebuilders:
-                log.msg(("nextSlave chose a nonexistent slave for builder "
+            if brdict not in unclaimed_requests:
+                log.msg(("nextBuild chose a nonexistent request for builder "
                          "'%s'; cannot start build") % self.name)
                 break
 
-            # then choose a request (using nextBuild)
+            # then choose a slave for it (using nextSlave)
             wfd = defer.waitForDeferred(
-                self._chooseBuild(unclaimed_requests))
+                self._chooseSlave(available_slavebuilders, brdict))
             yield wfd
-            brdict = wfd.getResult()
+            slavebuilder = wfd.getResult()
 
-            if not brdict:
+            if not slavebuilder:
                 break
 
-            if brdict not in unclaimed_requests:
-                log.msg(("nextBuild chose a nonexistent request for builder "
+            if slavebuilder not in available_slavebuilders:
+                log.msg(("nextSlave chose a nonexistent slave for builder "
                          "'%s'; cannot start build") % self.name)
                 break
 
@@ -596,19 +604,34 @@ class Builder(config.ReconfigurableServiceMixin,
     # a few utility functions to make the maybeStartBuild a bit shorter and
     # easier to read
 
-    def _chooseSlave(self, available_slavebuilders):
+    def _chooseSlave(self, available_slavebuilders, brdict=None):
         """
         Choose the next slave, using the C{nextSlave} configuration if
-        available, and falling back to C{random.choice} otherwise.
+        available, and falling back to C{random.choice} otherwise.  The
+        fallback prefers slaves that are ready to build over latent slaves
+        that would have to be substantiated first.
+
+        If C{nextSlave} has a C{chooseSlaveForRequest} method, that is called
+        instead, with the build request dictionary as an extra argument.
 
         @param available_slavebuilders: list of slavebuilders to choose from
+        @param brdict: the build request the slave is chosen for, if known
         @returns: SlaveBuilder or None via Deferred
         """
-        if self.config.nextSlave:
+        nextSlave = self.config.nextSlave
+        if nextSlave:
+            chooseForRequest = getattr(nextSlave, 'chooseSlaveForRequest',
+                                       None)
+            if chooseForRequest:
+                return defer.maybeDeferred(chooseForRequest, self,
+                                           available_slavebuilders, brdict)
             return defer.maybeDeferred(lambda :
-                    self.config.nextSlave(self, available_slavebuilders))
+                    nextSlave(self, available_slavebuilders))
         else:
-            return defer.succeed(random.choice(available_slavebuilders))
+            ready = [ sb for sb in available_slavebuilders
+                      if sb.state != LATENT ]
+            return defer.succeed(random.choice(ready or
+                                               available_slavebuilders))
 
     def _chooseBuild(self, buildrequests):
         """
@@ -204,4 +204,8 @@ class BuildRequestControl:
 
     def cancel(self):
         d = self.original_request.cancelBuildRequest()
+        def bump(_):
+            # the builder's pending build requests have changed
+            self.original_builder.builder_status.bumpGeneration()
+        d.addCallback(bump)
         d.addErrback(log.err, 'while cancelling build request')
@@ -107,10 +107,13 @@ class Timer(object):
         self.started = util.now(self._reactor)
 
     def stop(self):
+        """Stop the timer and log the elapsed time, which is also
+        returned."""
         if self.started is not None:
             elapsed = util.now(self._reactor) - self.started
             MetricTimeEvent.log(timer=self.name, elapsed=elapsed)
             self.started = None
+            return elapsed
 
 def timeMethod(name, _reactor=None):
     def decorator(func):
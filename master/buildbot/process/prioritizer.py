@@ -0,0 +1,165 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+from twisted.internet import defer, reactor
+from buildbot import util
+from buildbot.process import metrics
+
+class DurationPrioritizer(util.ComparableMixin):
+    """
+    A C{prioritizeBuilders} function that runs the builders whose builds are
+    expected to be shortest first, so that quick builds do not wait behind
+    long ones for a shared slave.  Waiting requests age: a builder's score
+    is
+
+        weight * (duration + agingFactor * wait) / duration
+
+    where C{wait} is how long its oldest request has been waiting, so long
+    builds are not starved.  With equal durations, this is the default
+    oldest-request-first order.
+
+    Expected durations come from the builder's expectations, updated by each
+    successful build, or else from the durations of its last
+    C{historyBuilds} successful builds in the database.  Builders whose
+    durations are not known yet are assumed to take C{defaultDuration}, or
+    the median of the known durations if that is C{None}.
+
+    Each time the builders are sorted, the wait projected for each builder,
+    from the expected durations of the builders ahead of it that share its
+    slaves, is available from L{getProjectedWaits} and reported in the
+    C{DurationPrioritizer.<builder>.projected_wait} metrics.
+    """
+
+    compare_attrs = ('weights', 'agingFactor', 'defaultDuration',
+                     'historyBuilds', 'cacheTimeout')
+
+    def __init__(self, weights=None, agingFactor=1.0, defaultDuration=None,
+                 historyBuilds=5, cacheTimeout=300, _reactor=reactor):
+        """
+        @param weights: dictionary mapping builder names to weights, which
+            multiply their scores (default 1)
+        @param agingFactor: how quickly waiting requests gain priority
+        @param defaultDuration: duration, in seconds, assumed for builders
+            that have no recorded builds
+        @param historyBuilds: number of builds to average from the database
+        @param cacheTimeout: how long, in seconds, durations from the
+            database are reused
+        """
+        if weights is None:
+            weights = {}
+        self.weights = weights
+        self.agingFactor = agingFactor
+        self.defaultDuration = defaultDuration
+        self.historyBuilds = historyBuilds
+        self.cacheTimeout = cacheTimeout
+        self._reactor = _reactor
+
+        # buildername : (expiry time, duration or None)
+        self.durationCache = {}
+        # buildername : projected wait, from the last sort
+        self.projectedWaits = {}
+
+    def getProjectedWaits(self):
+        """Return a dictionary mapping the names of the builders sorted last
+        to the time, in seconds, their next build is expected to wait."""
+        return self.projectedWaits.copy()
+
+    @defer.deferredGenerator
+    def getExpectedDuration(self, master, bldr):
+        """Return the duration expected for the next build of C{bldr}, or
+        None if it is not known, via Deferred."""
+        if bldr.expectations:
+            duration = bldr.expectations.expectedBuildTime()
+            if duration is not None:
+                yield duration
+                return
+
+        now = self._reactor.seconds()
+        cached = self.durationCache.get(bldr.name)
+        if cached and cached[0] > now:
+            yield cached[1]
+            return
+
+        wfd = defer.waitForDeferred(
+            master.db.builds.getRecentBuildDurations(bldr.name,
+                                                     self.historyBuilds))
+        yield wfd
+        durations = wfd.getResult()
+
+        duration = None
+        if durations:
+            duration = float(sum(durations)) / len(durations)
+        self.durationCache[bldr.name] = (now + self.cacheTimeout, duration)
+        yield duration
+
+    def _getDefaultDuration(self, durations):
+        if self.defaultDuration is not None:
+            return self.defaultDuration
+        known = sorted([ d for d in durations if d is not None ])
+        if not known:
+            return 1
+        return known[len(known) // 2]
+
+    @defer.deferredGenerator
+    def __call__(self, master, builders):
+        def getInfo(bldr):
+            d = defer.gatherResults([
+                defer.maybeDeferred(bldr.getOldestRequestTime),
+                self.getExpectedDuration(master, bldr) ])
+            return d
+        wfd = defer.waitForDeferred(
+            defer.gatherResults([ getInfo(bldr) for bldr in builders ]))
+        yield wfd
+        infos = wfd.getResult()
+
+        now = self._reactor.seconds()
+        default = self._getDefaultDuration([ i[1] for i in infos ])
+
+        scored = []
+        for bldr, (oldest, duration) in zip(builders, infos):
+            if duration is None:
+                duration = default
+            duration = max(duration, 1)
+            if oldest is None:
+                # no requests; sort to the end
+                scored.append(((1, 0, 0), bldr, duration))
+                continue
+            submitted = util.datetime2epoch(oldest)
+            wait = max(now - submitted, 0)
+            score = (self.weights.get(bldr.name, 1) *
+                     (duration + self.agingFactor * wait) / duration)
+            scored.append(((0, -score, submitted), bldr, duration))
+        scored.sort(key=lambda s : s[0])
+
+        self.projectedWaits = {}
+        ahead = []
+        for key, bldr, duration in scored:
+            if key[0]:
+                continue
+            slavenames = self._getSlavenames(bldr)
+            waitFor = sum([ d for (s, d) in ahead if s & slavenames ])
+            wait = float(waitFor) / max(len(slavenames), 1)
+            self.projectedWaits[bldr.name] = wait
+            metrics.MetricCountEvent.log(
+                    "DurationPrioritizer.%s.projected_wait" % bldr.name,
+                    int(wait), absolute=True)
+            ahead.append((slavenames, duration))
+
+        yield [ s[1] for s in scored ]
+
+    def _getSlavenames(self, bldr):
+        if bldr.config:
+            return set(bldr.config.slavenames)
+        return set()
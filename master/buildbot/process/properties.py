@@ -20,6 +20,10 @@ from buildbot.interfaces import IRenderable, IProperties
 from twisted.python.components import registerAdapter
 from zope.interface import implements
 
+# values of these types render as themselves; recognizing them up front saves
+# adapting each of them to IRenderable
+_plainTypes = set([ str, unicode, int, long, float, bool, type(None) ])
+
 class Properties(util.ComparableMixin):
     """
     I represent a set of properties that can be interpolated into various
@@ -133,6 +137,8 @@ class Properties(util.ComparableMixin):
         return self.build
 
     def render(self, value):
+        if type(value) in _plainTypes:
+            return value
         renderable = IRenderable(value)
         return renderable.getRenderingFor(self)
 
@@ -186,62 +192,84 @@ class PropertyMap:
     colon_minus_re = re.compile(r"(.*):-(.*)")
     colon_tilde_re = re.compile(r"(.*):~(.*)")
     colon_plus_re = re.compile(r"(.*):\+(.*)")
+
+    # keys parsed by parseKey, shared by all instances since the keys come
+    # from a limited number of format strings
+    parsedKeys = {}
+    maxParsedKeys = 10000
+
     def __init__(self, properties):
         # use weakref here to avoid a reference loop
         self.properties = weakref.ref(properties)
         self.temp_vals = {}
 
+    def parseKey(cls, key):
+        """Split C{key} into an operator (C{'-'}, C{'~'}, C{'+'} or None),
+        the property name, and the replacement value."""
+        try:
+            return cls.parsedKeys[key]
+        except KeyError:
+            pass
+        for op, regexp in [
+            ( '-', cls.colon_minus_re ),
+            ( '~', cls.colon_tilde_re ),
+            ( '+', cls.colon_plus_re ),
+            ]:
+            mo = regexp.match(key)
+            if mo:
+                parsed = (op, mo.group(1), mo.group(2))
+                break
+        else:
+            parsed = (None, key, None)
+        if len(cls.parsedKeys) >= cls.maxParsedKeys:
+            cls.parsedKeys.clear()
+        cls.parsedKeys[key] = parsed
+        return parsed
+    parseKey = classmethod(parseKey)
+
     def __getitem__(self, key):
+        op, prop, repl = self.parseKey(key)
+        return self.lookup(op, prop, repl, self.temp_vals)
+
+    def lookup(self, op, prop, repl, temp_vals):
+        """Look up a key parsed by L{parseKey}, giving precedence to the
+        values in C{temp_vals}."""
         properties = self.properties()
         assert properties is not None
 
-        def colon_minus(mo):
+        if op is None:
+            # If explicitly passed as a kwarg, use that,
+            # otherwise, use the property value.
+            if prop in temp_vals:
+                rv = temp_vals[prop]
+            else:
+                rv = properties[prop]
+        elif op == '-':
             # %(prop:-repl)s
             # if prop exists, use it; otherwise, use repl
-            prop, repl = mo.group(1,2)
-            if prop in self.temp_vals:
-                return self.temp_vals[prop]
+            if prop in temp_vals:
+                rv = temp_vals[prop]
             elif properties.has_key(prop):
-                return properties[prop]
+                rv = properties[prop]
             else:
-                return repl
-
-        def colon_tilde(mo):
+                rv = repl
+        elif op == '~':
             # %(prop:~repl)s
-            # if prop exists and is true (nonempty), use it; otherwise, use repl
-            prop, repl = mo.group(1,2)
-            if prop in self.temp_vals and self.temp_vals[prop]:
-                return self.temp_vals[prop]
+            # if prop exists and is true (nonempty), use it; otherwise, use
+            # repl
+            if prop in temp_vals and temp_vals[prop]:
+                rv = temp_vals[prop]
             elif properties.has_key(prop) and properties[prop]:
-                return properties[prop]
+                rv = properties[prop]
             else:
-                return repl
-
-        def colon_plus(mo):
+                rv = repl
+        else:
             # %(prop:+repl)s
             # if prop exists, use repl; otherwise, an empty string
-            prop, repl = mo.group(1,2)
-            if properties.has_key(prop) or prop in self.temp_vals:
-                return repl
+            if properties.has_key(prop) or prop in temp_vals:
+                rv = repl
             else:
-                return ''
-
-        for regexp, fn in [
-            ( self.colon_minus_re, colon_minus ),
-            ( self.colon_tilde_re, colon_tilde ),
-            ( self.colon_plus_re, colon_plus ),
-            ]:
-            mo = regexp.match(key)
-            if mo:
-                rv = fn(mo)
-                break
-        else:
-            # If explicitly passed as a kwarg, use that,
-            # otherwise, use the property value.
-            if key in self.temp_vals:
-                rv = self.temp_vals[key]
-            else:
-                rv = properties[key]
+                rv = ''
 
         # translate 'None' to an empty string
         if rv is None: rv = ''
@@ -254,6 +282,21 @@ class PropertyMap:
     def clear_temporary_values(self):
         self.temp_vals = {}
 
+class _Substitutions(dict):
+    """
+    Privately-used mapping of the values substituted into a WithProperties
+    format string, which looks up any key that was not found in advance.
+    """
+
+    def __init__(self, pmap, temp_vals):
+        dict.__init__(self)
+        self.pmap = pmap
+        self.temp_vals = temp_vals
+
+    def __missing__(self, key):
+        op, prop, repl = self.pmap.parseKey(key)
+        return self.pmap.lookup(op, prop, repl, self.temp_vals)
+
 class WithProperties(util.ComparableMixin):
     """
     This is a marker class, used fairly widely to indicate that we
@@ -263,6 +306,12 @@ class WithProperties(util.ComparableMixin):
     implements(IRenderable)
     compare_attrs = ('fmtstring', 'args')
 
+    # finds the keys in a format string, skipping '%%'
+    key_re = re.compile(r"%(?:%|\(([^()]*)\))")
+
+    # the parsed keys of fmtstring; see getSubstitutionPlan
+    plan = None
+
     def __init__(self, fmtstring, *args, **lambda_subs):
         self.fmtstring = fmtstring
         self.args = args
@@ -274,18 +323,36 @@ class WithProperties(util.ComparableMixin):
         elif lambda_subs:
             raise ValueError('WithProperties takes either positional or keyword substitutions, not both.')
 
+    def getSubstitutionPlan(self):
+        """Return the keys of the format string, each parsed by
+        L{PropertyMap.parseKey}.  This is only done once per instance."""
+        if self.plan is None:
+            if self.args:
+                keys = self.args
+            else:
+                keys = []
+                for mo in self.key_re.finditer(self.fmtstring):
+                    key = mo.group(1)
+                    if key is not None and key not in keys:
+                        keys.append(key)
+            self.plan = [ (key,) + PropertyMap.parseKey(key) for key in keys ]
+        return self.plan
+
     def getRenderingFor(self, build):
         pmap = build.getProperties().pmap
+        plan = self.getSubstitutionPlan()
         if self.args:
-            strings = []
-            for name in self.args:
-                strings.append(pmap[name])
+            strings = [ pmap.lookup(op, prop, repl, {})
+                        for (key, op, prop, repl) in plan ]
             s = self.fmtstring % tuple(strings)
         else:
+            temp_vals = {}
             for k,v in self.lambda_subs.iteritems():
-                pmap.add_temporary_value(k, v(build))
-            s = self.fmtstring % pmap
-            pmap.clear_temporary_values()
+                temp_vals[k] = v(build)
+            values = _Substitutions(pmap, temp_vals)
+            for (key, op, prop, repl) in plan:
+                values[key] = pmap.lookup(op, prop, repl, temp_vals)
+            s = self.fmtstring % values
         return s
 
 
@@ -352,7 +419,11 @@ class _ListRenderer(object):
         self.value = value
 
     def getRenderingFor(self, build):
-        return [ build.render(e) for e in self.value ]
+        for e in self.value:
+            if type(e) not in _plainTypes:
+                return [ build.render(e) for e in self.value ]
+        # nothing to render
+        return list(self.value)
 
 registerAdapter(_ListRenderer, list, IRenderable)
 
@@ -368,7 +439,11 @@ class _TupleRenderer(object):
         self.value = value
 
     def getRenderingFor(self, build):
-        return tuple([ build.render(e) for e in self.value ])
+        for e in self.value:
+            if type(e) not in _plainTypes:
+                return tuple([ build.render(e) for e in self.value ])
+        # nothing to render
+        return self.value
 
 registerAdapter(_TupleRenderer, tuple, IRenderable)
 
@@ -384,7 +459,12 @@ class _DictRenderer(object):
         self.value = value
 
     def getRenderingFor(self, build):
-        return dict([ (build.render(k), build.render(v)) for k,v in self.value.iteritems() ])
+        for k, v in self.value.iteritems():
+            if type(k) not in _plainTypes or type(v) not in _plainTypes:
+                return dict([ (build.render(k), build.render(v))
+                              for k,v in self.value.iteritems() ])
+        # nothing to render
+        return dict(self.value)
 
 
 registerAdapter(_DictRenderer, dict, IRenderable)
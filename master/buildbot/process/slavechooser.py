@@ -0,0 +1,206 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import random
+from twisted.internet import defer
+from buildbot import util
+from buildbot.process import metrics
+from buildbot.process.slavebuilder import LATENT
+from buildbot.status.results import SUCCESS, WARNINGS
+
+class SlaveRecord(object):
+    """
+    What I{AffinitySlaveChooser} knows about the builds of one builder on one
+    slave.
+
+    @ivar repository: repository of the last build
+    @ivar branch: branch of the last build
+    @ivar revision: revision of the last build
+    @ivar duration: duration of the last successful build, in seconds
+    @ivar warmDuration: moving average of the duration of successful builds
+        of the same branch as the build before them
+    @ivar coldDuration: the same, for builds of another branch
+    @ivar skipped: number of times the slave was available but not chosen,
+        since it was last chosen
+    """
+
+    def __init__(self):
+        self.repository = None
+        self.branch = None
+        self.revision = None
+        self.duration = None
+        self.warmDuration = None
+        self.coldDuration = None
+        self.skipped = 0
+
+    def isWarmFor(self, source):
+        return source is not None and \
+                (self.repository, self.branch) == source
+
+class AffinitySlaveChooser(util.ComparableMixin):
+    """
+    A C{nextSlave} for builders whose builds are much faster in a workdir
+    that last built the same branch.  For each builder and slave, it
+    remembers what was last built there and how long builds took, and picks
+    the available slave that is expected to finish the request soonest:
+    one whose workdir holds the request's branch, unless the builds of this
+    builder show that does not help.
+
+    Slaves whose expected durations are within C{tolerance} of the best are
+    chosen at random, to spread the load, and a slave that was passed over
+    C{maxSkips} times in a row is chosen next, so that no slave is starved.
+
+    Each slave's builds, and the builds that reused a workdir of the same
+    branch, are counted in the C{slavechooser.<slave>.builds} and
+    C{slavechooser.<slave>.warm_builds} metrics; see also L{getHitRates}.
+    """
+
+    compare_attrs = ('maxSkips', 'tolerance', 'smoothing')
+
+    def __init__(self, maxSkips=5, tolerance=0.1, smoothing=0.3):
+        """
+        @param maxSkips: the number of times in a row a slave can be passed
+            over before it is chosen regardless
+        @param tolerance: the fraction by which a slave's expected duration
+            may exceed the best one and still be considered as good
+        @param smoothing: the weight of the last build in the moving
+            averages of durations
+        """
+        self.maxSkips = maxSkips
+        self.tolerance = tolerance
+        self.smoothing = smoothing
+
+        # (buildername, slavename) : SlaveRecord
+        self.records = {}
+        # (buildername, warm) : moving average of build durations
+        self.durations = {}
+        # slavename : [ builds, warm builds ]
+        self.hits = {}
+
+    def getRecord(self, buildername, slavename):
+        key = (buildername, slavename)
+        try:
+            return self.records[key]
+        except KeyError:
+            rec = self.records[key] = SlaveRecord()
+            return rec
+
+    def getHitRates(self):
+        """Return a dictionary mapping each slave to the fraction of its
+        builds that reused a workdir of the same branch."""
+        return dict([ (slavename, float(warm) / builds)
+                      for slavename, (builds, warm) in self.hits.iteritems()
+                      if builds ])
+
+    def _average(self, old, value):
+        if old is None:
+            return value
+        return old + self.smoothing * (value - old)
+
+    def expectedDuration(self, buildername, rec, source):
+        """Return how long the build of C{source}, a (repository, branch)
+        tuple, is expected to take on the slave of C{rec}.  Until both warm
+        and cold builds of this builder have been timed, this is 0 for a
+        warm workdir and 1 otherwise."""
+        warm = rec.isWarmFor(source)
+        warmAvg = self.durations.get((buildername, True))
+        coldAvg = self.durations.get((buildername, False))
+        if warmAvg is None or coldAvg is None:
+            if warm:
+                return 0
+            return 1
+        if warm:
+            if rec.warmDuration is not None:
+                return rec.warmDuration
+            return warmAvg
+        else:
+            if rec.coldDuration is not None:
+                return rec.coldDuration
+            return coldAvg
+
+    # nextSlave interface
+
+    def __call__(self, builder, slavebuilders):
+        return self.chooseSlaveForRequest(builder, slavebuilders, None)
+
+    @defer.deferredGenerator
+    def chooseSlaveForRequest(self, builder, slavebuilders, brdict):
+        source = None
+        if brdict is not None:
+            wfd = defer.waitForDeferred(
+                    builder._brdictToBuildRequest(brdict))
+            yield wfd
+            breq = wfd.getResult()
+            source = (breq.source.repository, breq.source.branch)
+
+        # like the default, prefer slaves that are ready to build
+        candidates = [ sb for sb in slavebuilders if sb.state != LATENT ]
+        if not candidates:
+            candidates = slavebuilders
+        records = dict([ (sb, self.getRecord(builder.name,
+                                             sb.slave.slavename))
+                         for sb in candidates ])
+
+        starved = [ sb for sb in candidates
+                    if records[sb].skipped >= self.maxSkips ]
+        if starved:
+            starved.sort(key=lambda sb : -records[sb].skipped)
+            choice = starved[0]
+        else:
+            expected = dict([ (sb, self.expectedDuration(builder.name,
+                                                         records[sb], source))
+                              for sb in candidates ])
+            limit = min(expected.values()) * (1 + self.tolerance)
+            choice = random.choice([ sb for sb in candidates
+                                     if expected[sb] <= limit ])
+
+        for sb in candidates:
+            if sb is choice:
+                records[sb].skipped = 0
+            else:
+                records[sb].skipped += 1
+        yield choice
+
+    def buildFinished(self, builder, slavebuilder, build):
+        """Called by the builder when a build is finished, to record it."""
+        build_status = build.build_status
+        slavename = build_status.getSlavename()
+        rec = self.getRecord(builder.name, slavename)
+        source = (build.source.repository, build.source.branch)
+        warm = rec.isWarmFor(source)
+
+        hits = self.hits.setdefault(slavename, [0, 0])
+        hits[0] += 1
+        metrics.MetricCountEvent.log("slavechooser.%s.builds" % slavename, 1)
+        if warm:
+            hits[1] += 1
+            metrics.MetricCountEvent.log(
+                    "slavechooser.%s.warm_builds" % slavename, 1)
+
+        # only complete builds say how long a build takes
+        if build_status.getResults() in (SUCCESS, WARNINGS):
+            start, end = build_status.getTimes()
+            duration = end - start
+            rec.duration = duration
+            key = (builder.name, warm)
+            self.durations[key] = self._average(self.durations.get(key),
+                                                duration)
+            if warm:
+                rec.warmDuration = self._average(rec.warmDuration, duration)
+            else:
+                rec.coldDuration = self._average(rec.coldDuration, duration)
+
+        rec.repository, rec.branch = source
+        rec.revision = build.source.revision
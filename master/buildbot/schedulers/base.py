@@ -219,7 +219,8 @@ class BaseScheduler(service.MultiService, ComparableMixin):
                 self._change_consumption_lock.release()
             d.addBoth(release)
             d.addErrback(log.err, 'while processing change')
-        self._change_subscription = self.master.subscribeToChanges(changeCallback)
+        self._change_subscription = self.master.subscribeToChanges(
+                changeCallback, change_filter)
 
         return defer.succeed(None)
 
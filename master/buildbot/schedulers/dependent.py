@@ -31,7 +31,9 @@ class Dependent(base.BaseScheduler):
         self.upstream_name = upstream.name
         self._buildset_addition_subscr = None
         self._buildset_completion_subscr = None
-        self._cached_upstream_bsids = None
+        # completion subscriptions for the upstream buildsets we are waiting
+        # on, keyed by bsid
+        self._buildset_completion_subscrs = {}
 
         # the subscription lock makes sure that we're done inserting a
         # subcription into the DB before registering that the buildset is
@@ -41,22 +43,42 @@ class Dependent(base.BaseScheduler):
     def startService(self):
         self._buildset_addition_subscr = \
                 self.master.subscribeToBuildsets(self._buildsetAdded)
-        self._buildset_completion_subscr = \
-                self.master.subscribeToBuildsetCompletions(self._buildsetCompleted)
-
-        # check for any buildsets completed before we started
-        d = self._checkCompletedBuildsets(None, None)
-        d.addErrback(log.err, 'while checking for completed buildsets in start')
+        # completions are only delivered on the master which completed the
+        # buildset, so with several masters the buildsets we are waiting on
+        # may be completed elsewhere; look for those whenever some other
+        # buildset completes
+        if self.master.config.multiMaster:
+            self._buildset_completion_subscr = \
+                    self.master.subscribeToBuildsetCompletions(
+                                                self._anyBuildsetCompleted)
+
+        # pick up the buildsets we were waiting on, and check for any that
+        # completed before we started
+        d = self._checkUpstreamBuildsets()
+        d.addErrback(log.err, 'while loading upstream buildsets in start')
 
     def stopService(self):
         if self._buildset_addition_subscr:
             self._buildset_addition_subscr.unsubscribe()
         if self._buildset_completion_subscr:
             self._buildset_completion_subscr.unsubscribe()
-        self._cached_upstream_bsids = None
+            self._buildset_completion_subscr = None
+        for sub in self._buildset_completion_subscrs.values():
+            sub.unsubscribe()
+        self._buildset_completion_subscrs = {}
         return defer.succeed(None)
 
-    @util.deferredLocked('_subscription_lock')
+    def _trackBuildset(self, bsid):
+        if bsid not in self._buildset_completion_subscrs:
+            self._buildset_completion_subscrs[bsid] = \
+                self.master.subscribeToBuildsetCompletion(bsid,
+                                                self._buildsetCompleted)
+
+    def _untrackBuildset(self, bsid):
+        sub = self._buildset_completion_subscrs.pop(bsid, None)
+        if sub:
+            sub.unsubscribe()
+
     def _buildsetAdded(self, bsid=None, properties=None, **kwargs):
         # check if this was submitetted by our upstream by checking the
         # scheduler property
@@ -64,116 +86,81 @@ class Dependent(base.BaseScheduler):
         if submitter != self.upstream_name:
             return
 
-        # record our interest in this buildset
+        # listen for its completion right away, and record our interest in
+        # the database
+        self._trackBuildset(bsid)
         d = self._addUpstreamBuildset(bsid)
         d.addErrback(log.err, 'while subscribing to buildset %d' % bsid)
 
     def _buildsetCompleted(self, bsid, result):
-        d = self._checkCompletedBuildsets(bsid, result)
+        self._untrackBuildset(bsid)
+        d = self._checkCompletedBuildset(bsid, result)
+        d.addErrback(log.err, 'while checking completed buildset %d' % bsid)
+
+    def _anyBuildsetCompleted(self, bsid, result):
+        # only subscribed in a multi-master configuration
+        if (not self._buildset_completion_subscrs
+                or bsid in self._buildset_completion_subscrs):
+            return
+        d = self._checkUpstreamBuildsets()
         d.addErrback(log.err, 'while checking for completed buildsets')
 
+    @util.deferredLocked('_subscription_lock')
+    def _addUpstreamBuildset(self, bsid):
+        return self.master.db.schedulers.addUpstreamBuildset(
+                                                self.objectid, bsid)
+
     @util.deferredLocked('_subscription_lock')
     @defer.deferredGenerator
-    def _checkCompletedBuildsets(self, bsid, result):
+    def _checkUpstreamBuildsets(self):
         wfd = defer.waitForDeferred(
-            self._getUpstreamBuildsets())
+            self.master.db.schedulers.getUpstreamBuildsets(self.objectid))
         yield wfd
         subs = wfd.getResult()
 
-        sub_bsids = []
         for (sub_bsid, sub_sssetid, sub_complete, sub_results) in subs:
-            # skip incomplete builds, handling the case where the 'complete'
-            # column has not been updated yet
-            if not sub_complete and sub_bsid != bsid:
-                continue
-
-            # build a dependent build if the status is appropriate
-            if sub_results in (SUCCESS, WARNINGS):
-                wfd = defer.waitForDeferred(
-                    self.addBuildsetForSourceStamp(setid=sub_sssetid,
-                                               reason='downstream'))
-                yield wfd
-                wfd.getResult()
-
-            sub_bsids.append(sub_bsid)
-
-        # and regardless of status, remove the subscriptions
-        wfd = defer.waitForDeferred(
-            self._removeUpstreamBuildsets(sub_bsids))
-        yield wfd
-        wfd.getResult()
-
-    @defer.deferredGenerator
-    def _updateCachedUpstreamBuilds(self):
-        if self._cached_upstream_bsids is None:
-            wfd = defer.waitForDeferred(
-                self.master.db.state.getState(self.objectid,
-                                        'upstream_bsids', []))
-            yield wfd
-            self._cached_upstream_bsids = wfd.getResult()[:]
-
-    @defer.deferredGenerator
-    def _getUpstreamBuildsets(self):
-        # get a list of (bsid, sssid, complete, results) for all
-        # upstream buildsets
-        wfd = defer.waitForDeferred(
-            self._updateCachedUpstreamBuilds())
-        yield wfd
-        wfd.getResult()
-
-        changed = False
-        rv = []
-        for bsid in self._cached_upstream_bsids[:]:
-            wfd = defer.waitForDeferred(
-                self.master.db.buildsets.getBuildset(bsid))
-            yield wfd
-            bsdict = wfd.getResult()
-            if not bsdict:
-                self._cached_upstream_bsids.remove(bsid)
-                changed = True
+            if not sub_complete:
+                self._trackBuildset(sub_bsid)
                 continue
 
-            rv.append((bsid, bsdict['sourcestampsetid'], bsdict['complete'],
-                bsdict['results']))
-
-        if changed:
+            self._untrackBuildset(sub_bsid)
             wfd = defer.waitForDeferred(
-                self.master.db.state.setState(self.objectid,
-                                'upstream_bsids', self._cached_upstream_bsids))
+                self._upstreamBuildsetComplete(sub_bsid, sub_sssetid,
+                                               sub_results))
             yield wfd
             wfd.getResult()
 
-        yield rv
-
+    @util.deferredLocked('_subscription_lock')
     @defer.deferredGenerator
-    def _addUpstreamBuildset(self, bsid):
+    def _checkCompletedBuildset(self, bsid, result):
         wfd = defer.waitForDeferred(
-            self._updateCachedUpstreamBuilds())
+            self.master.db.schedulers.getUpstreamBuildsets(self.objectid))
         yield wfd
-        wfd.getResult()
+        subs = wfd.getResult()
 
-        if bsid not in self._cached_upstream_bsids:
-            self._cached_upstream_bsids.append(bsid)
+        # the buildset may already have been handled by
+        # _checkUpstreamBuildsets, or no longer exist
+        for (sub_bsid, sub_sssetid, sub_complete, sub_results) in subs:
+            if sub_bsid == bsid:
+                wfd = defer.waitForDeferred(
+                    self._upstreamBuildsetComplete(bsid, sub_sssetid, result))
+                yield wfd
+                wfd.getResult()
+                break
 
+    @defer.deferredGenerator
+    def _upstreamBuildsetComplete(self, bsid, sssetid, result):
+        # build a dependent build if the status is appropriate
+        if result in (SUCCESS, WARNINGS):
             wfd = defer.waitForDeferred(
-                self.master.db.state.setState(self.objectid,
-                                'upstream_bsids', self._cached_upstream_bsids))
+                self.addBuildsetForSourceStamp(setid=sssetid,
+                                               reason='downstream'))
             yield wfd
             wfd.getResult()
 
-    @defer.deferredGenerator
-    def _removeUpstreamBuildsets(self, bsids):
-        wfd = defer.waitForDeferred(
-            self._updateCachedUpstreamBuilds())
-        yield wfd
-        wfd.getResult()
-
-        old = set(self._cached_upstream_bsids)
-        self._cached_upstream_bsids = list(old - set(bsids))
-
+        # and regardless of status, remove the subscription
         wfd = defer.waitForDeferred(
-            self.master.db.state.setState(self.objectid,
-                            'upstream_bsids', self._cached_upstream_bsids))
+            self.master.db.schedulers.removeUpstreamBuildsets(
+                                                self.objectid, [bsid]))
         yield wfd
         wfd.getResult()
-
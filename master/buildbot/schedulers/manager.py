@@ -18,6 +18,7 @@ from twisted.application import service
 from twisted.python import log, reflect
 from buildbot.process import metrics
 from buildbot import config, util
+from buildbot.schedulers import timed
 
 class SchedulerManager(config.ReconfigurableServiceMixin,
                        service.MultiService):
@@ -25,6 +26,13 @@ class SchedulerManager(config.ReconfigurableServiceMixin,
         service.MultiService.__init__(self)
         self.setName('scheduler_manager')
         self.master = master
+        # shared by the timed schedulers
+        self.timerWheel = timed.TimerWheel(master)
+
+    def stopService(self):
+        d = defer.maybeDeferred(service.MultiService.stopService, self)
+        d.addCallback(lambda _ : self.timerWheel.stop())
+        return d
 
     @defer.deferredGenerator
     def reconfigService(self, new_config):
@@ -101,4 +109,8 @@ class SchedulerManager(config.ReconfigurableServiceMixin,
         yield wfd
         wfd.getResult()
 
-        timer.stop()
+        elapsed = timer.stop()
+        log.msg("reconfigured schedulers: added %d, removed %d, kept %d, "
+                "in %.3fs" % (len(added_names), len(removed_names),
+                    len(old_set & new_set) - len(removed_names & added_names),
+                    elapsed))
@@ -14,12 +14,226 @@
 # Copyright Buildbot Team Members
 
 import time
+import bisect
+import calendar
 from buildbot import util
 from buildbot.schedulers import base
 from twisted.internet import defer, reactor
-from twisted.python import log
+from twisted.python import log, failure
 from buildbot import config
 from buildbot.changes import filter
+from buildbot.process import metrics
+
+class CronSchedule(object):
+    """
+    The times matched by the C{minute}, C{hour}, C{dayOfMonth}, C{month} and
+    C{dayOfWeek} arguments of L{Nightly}, in local time.  Each is C{'*'}, a
+    single value or a list of values; days of the week count from 0 for
+    Monday.  As in cron, if both C{dayOfMonth} and C{dayOfWeek} are given, a
+    day matching either of them matches.
+
+    L{getNextRunTime} finds the next matching time a field at a time, jumping
+    straight to the next matching month, day, hour and minute.
+    """
+
+    # long enough to find February 29th after any date
+    searchYears = 9
+
+    def __init__(self, minute='*', hour='*', dayOfMonth='*', month='*',
+                 dayOfWeek='*'):
+        self.minutes = self._getValues(minute, 0, 59)
+        self.hours = self._getValues(hour, 0, 23)
+        self.daysOfMonth = set(self._getValues(dayOfMonth, 1, 31))
+        self.months = self._getValues(month, 1, 12)
+        self.daysOfWeek = set(self._getValues(dayOfWeek, 0, 6))
+        self.eitherDay = dayOfMonth != '*' and dayOfWeek != '*'
+
+    def _getValues(self, spec, low, high):
+        if spec == '*':
+            return range(low, high + 1)
+        if isinstance(spec, int):
+            spec = [ spec ]
+        return sorted([ v for v in set(spec) if low <= v <= high ])
+
+    def _nextValue(self, values, value):
+        i = bisect.bisect_left(values, value)
+        if i < len(values):
+            return values[i]
+        return None
+
+    def _dayMatches(self, year, month, day):
+        inMonth = day in self.daysOfMonth
+        inWeek = calendar.weekday(year, month, day) in self.daysOfWeek
+        if self.eitherDay:
+            return inMonth or inWeek
+        return inMonth and inWeek
+
+    def getNextRunTime(self, after):
+        """Return the first whole minute after C{after} that matches, in
+        seconds since the epoch, or None if no time matches."""
+        year, month, day, hour, minute = time.localtime(after)[:5]
+        minute += 1
+        lastYear = year + self.searchYears
+
+        while year <= lastYear:
+            # carry over any field that overflowed
+            if minute > 59:
+                hour, minute = hour + 1, 0
+            if hour > 23:
+                day, hour = day + 1, 0
+            if day > calendar.monthrange(year, month)[1]:
+                month, day = month + 1, 1
+            if month > 12:
+                year, month = year + 1, 1
+                continue
+
+            nextMonth = self._nextValue(self.months, month)
+            if nextMonth is None:
+                year, month, day, hour, minute = year + 1, 1, 1, 0, 0
+                continue
+            if nextMonth != month:
+                month, day, hour, minute = nextMonth, 1, 0, 0
+                continue
+
+            if not self._dayMatches(year, month, day):
+                day, hour, minute = day + 1, 0, 0
+                continue
+
+            nextHour = self._nextValue(self.hours, hour)
+            if nextHour is None:
+                day, hour, minute = day + 1, 0, 0
+                continue
+            if nextHour != hour:
+                hour, minute = nextHour, 0
+
+            nextMinute = self._nextValue(self.minutes, minute)
+            if nextMinute is None:
+                hour, minute = hour + 1, 0
+                continue
+
+            when = time.mktime((year, month, day, hour, nextMinute,
+                                0, 0, 0, -1))
+            # around daylight saving time changes, the local time may map
+            # to a time that is not after C{after}
+            if when > after:
+                return when
+            minute = nextMinute + 1
+
+        return None
+
+class _WheelCall(object):
+    # returned by TimerWheel.callAt, like an IDelayedCall
+
+    def __init__(self, wheel, time, fn, args):
+        self.wheel = wheel
+        self.time = time
+        self.fn = fn
+        self.args = args
+
+    def cancel(self):
+        self.wheel._cancel(self)
+
+class TimerWheel(object):
+    """
+    A timer shared by all of the timed schedulers of a master.  The
+    schedulers' actuations are kept in slots, one per actuation time, under
+    a single reactor timer for the earliest slot.  All of the schedulers
+    that are due at the same time are actuated together, and the state
+    values they set while actuating are written to the database in one
+    transaction.
+    """
+
+    def __init__(self, master, _reactor=reactor):
+        self.master = master
+        self._reactor = _reactor
+        # actuation time : [ _WheelCall ]
+        self.slots = {}
+        self.timer = None
+        self.timerAt = None
+        # state writes waiting for the end of the current actuation, or
+        # None if not actuating
+        self.pendingStates = None
+
+    def callAt(self, when, fn, *args):
+        """Call C{fn} at time C{when}, in seconds since the epoch; returns
+        an object with a C{cancel} method.  Calls for the same C{when} share
+        a slot."""
+        call = _WheelCall(self, when, fn, args)
+        self.slots.setdefault(call.time, []).append(call)
+        self._reschedule()
+        return call
+
+    def callLater(self, delay, fn, *args):
+        """Call C{fn} in C{delay} seconds; returns an object with a
+        C{cancel} method."""
+        return self.callAt(self._reactor.seconds() + delay, fn, *args)
+
+    def setState(self, sched, name, value):
+        """Set a state value of C{sched}.  Writes made while the wheel is
+        actuating schedulers are batched.  Returns a Deferred."""
+        if self.pendingStates is None or sched._objectid is None:
+            return sched.setState(name, value)
+        d = defer.Deferred()
+        self.pendingStates.append((sched._objectid, name, value, d))
+        return d
+
+    def stop(self):
+        self.slots = {}
+        self._reschedule()
+
+    def _cancel(self, call):
+        calls = self.slots.get(call.time, [])
+        if call in calls:
+            calls.remove(call)
+            if not calls:
+                del self.slots[call.time]
+                self._reschedule()
+
+    def _reschedule(self):
+        nextAt = None
+        if self.slots:
+            nextAt = min(self.slots)
+        if nextAt == self.timerAt:
+            return
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
+        self.timerAt = nextAt
+        if nextAt is not None:
+            delay = max(nextAt - self._reactor.seconds(), 0)
+            self.timer = self._reactor.callLater(delay, self._fire)
+
+    def _fire(self):
+        self.timer = self.timerAt = None
+        now = self._reactor.seconds()
+        due = [ t for t in self.slots if t <= now ]
+        due.sort()
+
+        self.pendingStates = []
+        for t in due:
+            for call in self.slots.pop(t):
+                try:
+                    call.fn(*call.args)
+                except:
+                    log.err(failure.Failure(), 'while actuating scheduler')
+        pending, self.pendingStates = self.pendingStates, None
+
+        metrics.MetricCountEvent.log("TimerWheel.actuations", len(due))
+        self._reschedule()
+        self._writeStates(pending)
+
+    def _writeStates(self, pending):
+        if not pending:
+            return
+        d = self.master.db.state.setStates([ (objectid, name, value)
+                for objectid, name, value, _ in pending ])
+        def done(res):
+            for _, _, _, waiting in pending:
+                waiting.callback(None)
+        def failed(f):
+            for _, _, _, waiting in pending:
+                waiting.errback(f)
+        d.addCallbacks(done, failed)
 
 class Timed(base.BaseScheduler):
     """
@@ -44,10 +258,14 @@ class Timed(base.BaseScheduler):
         self.actuateAtTimer = None
 
         self._reactor = reactor # patched by tests
+        self.timerWheel = None
 
     def startService(self):
         base.BaseScheduler.startService(self)
 
+        # use the timer shared by the timed schedulers, if there is one
+        self.timerWheel = getattr(self.parent, 'timerWheel', None)
+
         # no need to lock this; nothing else can run before the service is started
         self.actuateOk = True
 
@@ -94,6 +312,8 @@ class Timed(base.BaseScheduler):
     def getPendingBuildTimes(self):
         # take the latest-calculated value of actuateAt as a reasonable
         # estimate
+        if self.actuateAt is None:
+            return []
         return [ self.actuateAt ]
 
     ## Timed methods
@@ -150,13 +370,21 @@ class Timed(base.BaseScheduler):
 
         # set up the new timer
         def set_timer(actuateAt):
+            if actuateAt is None:
+                self.actuateAt = None
+                return
             now = self.now()
             self.actuateAt = max(actuateAt, now)
-            if actuateAt is not None:
-                untilNext = self.actuateAt - now
-                if untilNext == 0:
-                    log.msg(("%s: missed scheduled build time, so building "
-                             "immediately") % self.name)
+            untilNext = self.actuateAt - now
+            if untilNext == 0:
+                log.msg(("%s: missed scheduled build time, so building "
+                         "immediately") % self.name)
+            if self.timerWheel:
+                # key the wheel's slot on the actuation time itself, so
+                # schedulers due at the same time share it
+                self.actuateAtTimer = self.timerWheel.callAt(self.actuateAt,
+                                                             self._actuate)
+            else:
                 self.actuateAtTimer = self._reactor.callLater(untilNext,
                                                               self._actuate)
         d.addCallback(set_timer)
@@ -178,8 +406,12 @@ class Timed(base.BaseScheduler):
 
             # mark the last build time
             self.actuateAt = None
-            wfd = defer.waitForDeferred(self.setState('last_build',
-                                                    self.lastActuated))
+            if self.timerWheel:
+                d = self.timerWheel.setState(self, 'last_build',
+                                             self.lastActuated)
+            else:
+                d = self.setState('last_build', self.lastActuated)
+            wfd = defer.waitForDeferred(d)
             yield wfd
             wfd.getResult()
 
@@ -255,6 +487,8 @@ class Nightly(Timed):
         self.dayOfMonth = dayOfMonth
         self.month = month
         self.dayOfWeek = dayOfWeek
+        self.schedule = CronSchedule(minute, hour, dayOfMonth, month,
+                                     dayOfWeek)
         self.branch = branch
         self.onlyIfChanged = onlyIfChanged
         self.fileIsImportant = fileIsImportant
@@ -281,54 +515,11 @@ class Nightly(Timed):
                 self.objectid, { change.number : important })
 
     def getNextBuildTime(self, lastActuated):
-        def addTime(timetuple, secs):
-            return time.localtime(time.mktime(timetuple)+secs)
-
-        def check(ourvalue, value):
-            if ourvalue == '*': return True
-            if isinstance(ourvalue, int): return value == ourvalue
-            return (value in ourvalue)
-
-        dateTime = time.localtime(lastActuated or self.now())
-
-        # Remove seconds by advancing to at least the next minute
-        dateTime = addTime(dateTime, 60-dateTime[5])
-
-        # Now we just keep adding minutes until we find something that matches
-        # TODO: use a smarter algorithm, now that we have thorough tests
-
-        yearLimit = dateTime[0]+2 # only check 2 years (a lot of minutes!)
-        def isRunTime(timetuple):
-
-            if not check(self.minute, timetuple[4]):
-                return False
-
-            if not check(self.hour, timetuple[3]):
-                return False
-
-            if not check(self.month, timetuple[1]):
-                return False
-
-            if self.dayOfMonth != '*' and self.dayOfWeek != '*':
-                # They specified both day(s) of month AND day(s) of week.
-                # This means that we only have to match one of the two. If
-                # neither one matches, this time is not the right time.
-                if not (check(self.dayOfMonth, timetuple[2]) or
-                        check(self.dayOfWeek, timetuple[6])):
-                    return False
-            else:
-                if not check(self.dayOfMonth, timetuple[2]):
-                    return False
-
-                if not check(self.dayOfWeek, timetuple[6]):
-                    return False
-
-            return True
-
-        while not isRunTime(dateTime):
-            dateTime = addTime(dateTime, 60)
-            assert dateTime[0] < yearLimit, 'Something is wrong with this code'
-        return defer.succeed(time.mktime(dateTime))
+        nextTime = self.schedule.getNextRunTime(lastActuated or self.now())
+        if nextTime is None:
+            log.msg("Nightly Scheduler <%s>: no time matches its schedule"
+                    % self.name)
+        return defer.succeed(nextTime)
 
     @defer.deferredGenerator
     def startBuild(self):
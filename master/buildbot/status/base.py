@@ -23,6 +23,12 @@ from buildbot import util, pbutil
 class StatusReceiverBase:
     implements(IStatusReceiver)
 
+    # set this to True in classes whose compare_attrs name every constructor
+    # argument; such listeners are left running on reconfig when they compare
+    # equal to their new versions.  It only applies to the class that sets
+    # it, not to its subclasses.
+    keepOnReconfig = False
+
     def requestSubmitted(self, request):
         pass
 
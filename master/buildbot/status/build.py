@@ -51,6 +51,10 @@ class BuildStatus(styles.Versioned, properties.PropertiesMixin):
     finishedWatchers = []
     testResults = {}
 
+    # incremented whenever anything in this build or its steps changes; this
+    # is not persisted
+    generation = 0
+
     def __init__(self, parent, master, number):
         """
         @type  parent: L{BuilderStatus}
@@ -187,6 +191,9 @@ class BuildStatus(styles.Versioned, properties.PropertiesMixin):
     def getTestResults(self):
         return self.testResults
 
+    def getGeneration(self):
+        return self.generation
+
     def getLogs(self):
         # TODO: steps should contribute significant logs instead of this
         # hack, which returns every log from every step. The logs should get
@@ -236,19 +243,24 @@ class BuildStatus(styles.Versioned, properties.PropertiesMixin):
         s = BuildStepStatus(self, self.master, len(self.steps))
         s.setName(name)
         self.steps.append(s)
+        self.bumpGeneration()
         return s
 
     def addTestResult(self, result):
         self.testResults[result.getName()] = result
+        self.bumpGeneration()
 
     def setSourceStamp(self, sourceStamp):
         self.source = sourceStamp
         self.changes = self.source.changes
+        self.bumpGeneration()
 
     def setReason(self, reason):
         self.reason = reason
+        self.bumpGeneration()
     def setBlamelist(self, blamelist):
         self.blamelist = blamelist
+        self.bumpGeneration()
     def setProgress(self, progress):
         self.progress = progress
 
@@ -257,22 +269,27 @@ class BuildStatus(styles.Versioned, properties.PropertiesMixin):
         be safely queried, so it is time to announce the new build."""
 
         self.started = util.now()
+        self.bumpGeneration()
         # now that we're ready to report status, let the BuilderStatus tell
         # the world about us
         self.builder.buildStarted(self)
 
     def setSlavename(self, slavename):
         self.slavename = slavename
+        self.bumpGeneration()
 
     def setText(self, text):
         assert isinstance(text, (list, tuple))
         self.text = text
+        self.bumpGeneration()
     def setResults(self, results):
         self.results = results
+        self.bumpGeneration()
 
     def buildFinished(self):
         self.currentStep = None
         self.finished = util.now()
+        self.bumpGeneration()
 
         for r in self.updates.keys():
             if self.updates[r] is not None:
@@ -286,8 +303,12 @@ class BuildStatus(styles.Versioned, properties.PropertiesMixin):
 
     # methods called by our BuildStepStatus children
 
+    def bumpGeneration(self):
+        self.generation += 1
+
     def stepStarted(self, step):
         self.currentStep = step
+        self.bumpGeneration()
         for w in self.watchers:
             receiver = w.stepStarted(self, step)
             if receiver:
@@ -302,6 +323,7 @@ class BuildStatus(styles.Versioned, properties.PropertiesMixin):
 
     def _stepFinished(self, step):
         results = step.getResults()
+        self.bumpGeneration()
         for w in self.watchers:
             w.stepFinished(self, step, results)
 
@@ -351,7 +373,7 @@ class BuildStatus(styles.Versioned, properties.PropertiesMixin):
             # someone looking at just this build will be confused as to why
             # the last log is truncated.
         for k in [ 'builder', 'watchers', 'updates', 'finishedWatchers',
-                   'master' ]:
+                   'master', 'generation' ]:
             if k in d: del d[k]
         return d
 
@@ -15,14 +15,17 @@
 
 
 import weakref
-import os, re, itertools
+import os, re, sys, itertools
+import cPickle
 from cPickle import load, dump
 
 from zope.interface import implements
 from twisted.python import log, runtime
+from twisted.internet import reactor, defer, threads
 from twisted.persisted import styles
 from buildbot.process import metrics
 from buildbot import interfaces, util
+from buildbot.util import json
 from buildbot.status.event import Event
 from buildbot.status.build import BuildStatus
 from buildbot.status.buildrequest import BuildRequestStatus
@@ -61,6 +64,26 @@ class BuilderStatus(styles.Versioned):
     currentBigState = "offline" # or idle/waiting/interlocked/building
     basedir = None # filled in by our parent
 
+    # incremented whenever this builder's state, or the set of its current
+    # builds or pending build requests, changes; this is not persisted
+    generation = 0
+
+    # the pickle this status will be loaded from when its persistent
+    # attributes are first used; see deferLoad
+    unloadedFrom = None
+
+    # the lowest build numbers whose pickles, and whose logs, may still be on
+    # disk; None until known (see determineNextBuildNumber)
+    firstBuildNumber = None
+    firstLogBuildNumber = None
+
+    # the attributes that are only known once the pickle is loaded
+    lazyAttributes = ( 'events', 'lastBuildStatus', 'nextBuild' )
+
+    # events added before the pickle is loaded; they are appended to
+    # self.events when it is
+    pendingEvents = ()
+
     def __init__(self, buildername, category, master):
         self.name = buildername
         self.category = category
@@ -78,6 +101,10 @@ class BuilderStatus(styles.Versioned):
         self.watchers = []
         self.buildCache = weakref.WeakValueDictionary()
         self.buildCache_LRU = []
+        # builds past the horizons that were in the build cache when their
+        # turn to be pruned came, mapped to (remove logs, remove build); they
+        # are pruned once they have left the cache
+        self.skippedPrunes = {}
 
     # persistence
 
@@ -86,6 +113,8 @@ class BuilderStatus(styles.Versioned):
         # currently running, because they won't be there when we start back
         # up. Nor do we save self.watchers, nor anything that gets set by our
         # parent like .basedir and .status
+        if self.unloadedFrom is not None:
+            self.loadNow()
         d = styles.Versioned.__getstate__(self)
         d['watchers'] = []
         del d['buildCache']
@@ -99,7 +128,12 @@ class BuilderStatus(styles.Versioned):
         del d['basedir']
         del d['status']
         del d['nextBuildNumber']
+        d.pop('firstBuildNumber', None)
+        d.pop('firstLogBuildNumber', None)
+        d.pop('pendingEvents', None)
+        d.pop('skippedPrunes', None)
         del d['master']
+        d.pop('generation', None)
         return d
 
     def __setstate__(self, d):
@@ -108,6 +142,7 @@ class BuilderStatus(styles.Versioned):
         styles.Versioned.__setstate__(self, d)
         self.buildCache = weakref.WeakValueDictionary()
         self.buildCache_LRU = []
+        self.skippedPrunes = {}
         self.currentBuilds = []
         self.watchers = []
         self.slavenames = []
@@ -123,19 +158,170 @@ class BuilderStatus(styles.Versioned):
             del self.nextBuildNumber # determineNextBuildNumber chooses this
         self.wasUpgraded = True
 
+    def deferLoad(self, filename):
+        """Arrange for the rest of this builder's state (its events and the
+        like) to be loaded from the pickle in C{filename} the first time it is
+        needed, rather than now. This is called by the top-level Status
+        object, so that starting the master does not have to unpickle every
+        builder."""
+        for attr in self.lazyAttributes:
+            self.__dict__.pop(attr, None)
+        self.unloadedFrom = filename
+
+    def __getattr__(self, name):
+        # only called for attributes that are not found; if the pickle has
+        # not been loaded yet, load it and try again
+        if name.startswith('__') or self.unloadedFrom is None:
+            raise AttributeError(name)
+        self.loadNow()
+        return getattr(self, name)
+
+    def loadNow(self):
+        """Load the state deferred by L{deferLoad}, if it has not been loaded
+        yet. The name, category, and other attributes set since then take
+        precedence over the pickled ones."""
+        filename = self.unloadedFrom
+        if filename is None:
+            return
+        del self.unloadedFrom
+
+        timer = metrics.Timer("BuilderStatus.loadNow()")
+        timer.start()
+        log.msg("loading status pickle for builder %s from %s"
+                % (self.name, filename))
+        try:
+            loaded = load(open(filename, "rb"))
+
+            # (bug #1068) if we need to upgrade, we probably need to rewrite
+            # this pickle, too.  We determine this by looking at the list of
+            # Versioned objects that have been unpickled, and (after
+            # doUpgrade) checking to see if any of them set wasUpgraded.  The
+            # Versioneds' upgradeToVersionNN methods all set this.
+            versioneds = styles.versionedsToUpgrade
+            styles.doUpgrade()
+            upgraded = [ o for o in versioneds.values()
+                         if hasattr(o, 'wasUpgraded') ]
+
+            for k, v in loaded.__dict__.iteritems():
+                if k not in self.__dict__ and k != 'wasUpgraded':
+                    self.__dict__[k] = v
+            if upgraded:
+                log.msg("re-writing upgraded builder pickle")
+                self.saveYourself()
+        except:
+            log.msg("error while loading status pickle for builder %s"
+                    % self.name)
+            log.err()
+
+        # whatever the pickle did not have, start afresh
+        self.__dict__.setdefault('events', [])
+        self.__dict__.setdefault('lastBuildStatus', None)
+        self.__dict__.setdefault('nextBuild', None)
+
+        # add the events that arrived while the pickle was not loaded
+        if self.pendingEvents:
+            self.events.extend(self.pendingEvents)
+            del self.pendingEvents
+            self.prune(events_only=True)
+        timer.stop()
+
+    # the build-number index
+
+    def makeIndexFilename(self):
+        return os.path.join(self.basedir, "builder.index")
+
+    def readIndex(self):
+        """Read the small index kept next to the builds, or return None if
+        it is missing or unreadable."""
+        try:
+            f = open(self.makeIndexFilename(), "r")
+            try:
+                index = json.loads(f.read())
+            finally:
+                f.close()
+        except IOError:
+            return None
+        except ValueError:
+            log.msg("ignoring corrupt build index for builder %s" % self.name)
+            return None
+        if not isinstance(index, dict):
+            return None
+        return index
+
+    def writeIndex(self):
+        """Record the next build number, along with the builder's name and
+        category, the lowest surviving build numbers and the builds whose
+        pruning was put off, so that the master can start and prune without
+        scanning the builder directory or loading the pickle."""
+        filename = self.makeIndexFilename()
+        tmpfilename = filename + ".tmp"
+        skipped = [ [ num, logs, build ] for num, (logs, build)
+                    in sorted(self.skippedPrunes.iteritems()) ]
+        index = dict(name=self.name, category=self.category,
+                     nextBuildNumber=self.nextBuildNumber,
+                     firstBuildNumber=self.firstBuildNumber,
+                     firstLogBuildNumber=self.firstLogBuildNumber,
+                     skippedPrunes=skipped)
+        try:
+            f = open(tmpfilename, "w")
+            try:
+                f.write(json.dumps(index))
+            finally:
+                f.close()
+            if runtime.platformType  == 'win32':
+                # windows cannot rename a file on top of an existing one
+                if os.path.exists(filename):
+                    os.unlink(filename)
+            os.rename(tmpfilename, filename)
+        except:
+            log.msg("unable to save build index for builder %s" % self.name)
+            log.err()
+
     def determineNextBuildNumber(self):
-        """Scan our directory of saved BuildStatus instances to determine
-        what our self.nextBuildNumber should be. Set it one larger than the
-        highest-numbered build we discover. This is called by the top-level
-        Status object shortly after we are created or loaded from disk.
+        """Determine what our self.nextBuildNumber should be. This is
+        normally read from the index written by L{newBuild}; if there is no
+        index, or it is out of date (a build with that number already
+        exists), scan our directory of saved BuildStatus instances and set it
+        one larger than the highest-numbered build we discover. This is
+        called by the top-level Status object shortly after we are created
+        or loaded from disk.
         """
-        existing_builds = [int(f)
-                           for f in os.listdir(self.basedir)
-                           if re.match("^\d+$", f)]
+        index = self.readIndex()
+        if index is not None:
+            number = index.get('nextBuildNumber')
+            if (isinstance(number, (int, long)) and number >= 0
+                and not os.path.exists(self.makeBuildFilename(number))):
+                self.nextBuildNumber = number
+                # an index without these will be pruned by a scan, once
+                self.firstBuildNumber = index.get('firstBuildNumber')
+                self.firstLogBuildNumber = index.get('firstLogBuildNumber')
+                try:
+                    self.skippedPrunes = dict([ (num, (logs, build))
+                        for num, logs, build
+                        in index.get('skippedPrunes', []) ])
+                except (TypeError, ValueError):
+                    log.msg("ignoring corrupt skipped prunes for builder %s"
+                            % self.name)
+                return
+
+        existing_builds = []
+        existing_logs = []
+        for f in os.listdir(self.basedir):
+            mo = self.build_file_re.match(f)
+            if mo:
+                if mo.group(2):
+                    existing_logs.append(int(mo.group(1)))
+                else:
+                    existing_builds.append(int(mo.group(1)))
         if existing_builds:
             self.nextBuildNumber = max(existing_builds) + 1
         else:
             self.nextBuildNumber = 0
+        self.firstBuildNumber = min(existing_builds + existing_logs
+                                    + [ self.nextBuildNumber ])
+        self.firstLogBuildNumber = min(existing_logs
+                                       + [ self.nextBuildNumber ])
+        self.writeIndex()
 
     def saveYourself(self):
         for b in self.currentBuilds:
@@ -143,6 +329,9 @@ class BuilderStatus(styles.Versioned):
                 # interrupted build, need to save it anyway.
                 # BuildStatus.saveYourself will mark it as interrupted.
                 b.saveYourself()
+        if self.unloadedFrom is not None:
+            # nothing persistent has changed since the pickle was written
+            return
         filename = os.path.join(self.basedir, "builder")
         tmpfilename = filename + ".tmp"
         try:
@@ -212,60 +401,170 @@ class BuilderStatus(styles.Versioned):
         except EOFError:
             raise IndexError("corrupted build pickle %d" % number)
 
+    # build pickles are named after the build number, and log files start
+    # with it
+    build_file_re = re.compile(r"^([0-9]+)(-.*)?$")
+
     def prune(self, events_only=False):
-        # begin by pruning our own events
+        # begin by pruning our own events, without loading the pickle
         eventHorizon = self.master.config.eventHorizon
-        self.events = self.events[-eventHorizon:]
+        if self.unloadedFrom is not None:
+            self.pendingEvents = self.pendingEvents[-eventHorizon:]
+        else:
+            self.events = self.events[-eventHorizon:]
 
         if events_only:
             return
 
-        # get the horizons straight
+        # old builds and logs are pruned a batch at a time, in the background
+        self.status.pruneBuilder(self)
+
+    def getPruneHorizons(self):
+        """Return the lowest build numbers whose pickles and whose logs,
+        respectively, should be kept."""
         buildHorizon = self.master.config.buildHorizon
         if buildHorizon is not None:
-            earliest_build = self.nextBuildNumber - self.buildHorizon
+            earliest_build = max(self.nextBuildNumber - buildHorizon, 0)
         else:
             earliest_build = 0
 
         logHorizon = self.master.config.logHorizon
         if logHorizon is not None:
-            earliest_log = self.nextBuildNumber - logHorizon
+            earliest_log = max(self.nextBuildNumber - logHorizon, 0)
         else:
             earliest_log = 0
 
         if earliest_log < earliest_build:
             earliest_log = earliest_build
+        return earliest_build, earliest_log
 
-        if earliest_build == 0:
-            return
+    def pruneBatch(self, batchSize):
+        """Delete the pickles and logs of at most C{batchSize} builds that
+        are past the horizons, starting from the lowest surviving ones.  The
+        files are read and deleted in a thread.
+
+        @returns: True if there is more to prune, via Deferred
+        """
+        earliest_build, earliest_log = self.getPruneHorizons()
+        if earliest_log == 0:
+            return defer.succeed(False)
 
-        # skim the directory and delete anything that shouldn't be there anymore
-        build_re = re.compile(r"^([0-9]+)$")
-        build_log_re = re.compile(r"^([0-9]+)-.*$")
         # if the directory doesn't exist, bail out here
         if not os.path.exists(self.basedir):
-            return
+            return defer.succeed(False)
+
+        if self.firstBuildNumber is None or self.firstLogBuildNumber is None:
+            self.pruneByScanning(earliest_build, earliest_log)
+            return defer.succeed(False)
+
+        # decide what to delete here, as the build cache may only be used
+        # from the reactor; each item is (number, remove logs, remove build).
+        # Builds still in the cache are skipped, and retried by later
+        # batches once they have left it.
+        work = []
+        skipped = {}
+        for num, (logs, build) in self.skippedPrunes.iteritems():
+            if len(work) < batchSize and num not in self.buildCache:
+                work.append((num, logs, build))
+            else:
+                skipped[num] = (logs, build)
+
+        first_kept, first_log_kept = \
+                self.firstBuildNumber, self.firstLogBuildNumber
+        while len(work) < batchSize and first_kept < earliest_build:
+            num = first_kept
+            item = (num, num >= first_log_kept, True)
+            first_kept += 1
+            if first_log_kept < first_kept:
+                first_log_kept = first_kept
+            if num in self.buildCache:
+                skipped[num] = item[1:]
+            else:
+                work.append(item)
 
-        for filename in os.listdir(self.basedir):
-            num = None
-            mo = build_re.match(filename)
-            is_logfile = False
-            if mo:
-                num = int(mo.group(1))
+        while len(work) < batchSize and first_log_kept < earliest_log:
+            num = first_log_kept
+            first_log_kept += 1
+            if num in self.buildCache:
+                skipped[num] = (True, False)
             else:
-                mo = build_log_re.match(filename)
-                if mo:
-                    num = int(mo.group(1))
-                    is_logfile = True
+                work.append((num, True, False))
+
+        def done(_):
+            self.skippedPrunes = skipped
+            self.firstBuildNumber = max(self.firstBuildNumber, first_kept)
+            self.firstLogBuildNumber = max(self.firstLogBuildNumber,
+                                           first_log_kept)
+            metrics.MetricCountEvent.log("BuilderStatus.pruned_builds",
+                                         len(work))
+            self.writeIndex()
+            return len(work) == batchSize
+
+        if not work:
+            if (skipped != self.skippedPrunes
+                    or first_kept != self.firstBuildNumber
+                    or first_log_kept != self.firstLogBuildNumber):
+                done(None)
+            return defer.succeed(False)
+
+        d = threads.deferToThread(self.removeBuildFiles, work)
+        d.addCallback(done)
+        return d
 
-            if num is None: continue
-            if num in self.buildCache: continue
+    def removeBuildFiles(self, work):
+        # runs in a thread; see pruneBatch
+        for num, logs, build in work:
+            if logs:
+                self.removeBuildLogs(num)
+            if build:
+                self.removeFile(self.makeBuildFilename(num))
+
+    def pruneByScanning(self, earliest_build, earliest_log):
+        # skim the directory and delete anything that shouldn't be there
+        # anymore; this is only needed until the lowest surviving build
+        # numbers are known
+        log.msg("pruning builder %s by scanning its directory" % self.name)
+        first_kept, first_log_kept = earliest_build, earliest_log
+        for filename in os.listdir(self.basedir):
+            mo = self.build_file_re.match(filename)
+            if not mo:
+                continue
+            num = int(mo.group(1))
+            is_logfile = bool(mo.group(2))
 
             if (is_logfile and num < earliest_log) or num < earliest_build:
-                pathname = os.path.join(self.basedir, filename)
-                log.msg("pruning '%s'" % pathname)
-                try: os.unlink(pathname)
-                except OSError: pass
+                if num in self.buildCache:
+                    first_log_kept = min(first_log_kept, num)
+                    if num < earliest_build:
+                        first_kept = min(first_kept, num)
+                    continue
+                self.removeFile(os.path.join(self.basedir, filename))
+
+        self.firstBuildNumber = first_kept
+        self.firstLogBuildNumber = first_log_kept
+        self.writeIndex()
+
+    def removeBuildLogs(self, number):
+        # the log filenames are only known to the build that wrote them
+        try:
+            filenames = _readLogFilenames(self.makeBuildFilename(number))
+        except IOError:
+            return
+        except:
+            log.msg("unable to load build %d of builder %s to prune its logs"
+                    % (number, self.name))
+            log.err()
+            return
+        for filename in filenames:
+            pathname = os.path.join(self.basedir, filename)
+            for suffix in ('', '.bz2', '.gz'):
+                if os.path.exists(pathname + suffix):
+                    self.removeFile(pathname + suffix)
+
+    def removeFile(self, pathname):
+        log.msg("pruning '%s'" % pathname)
+        try: os.unlink(pathname)
+        except OSError: pass
 
     # IBuilderStatus methods
     def getName(self):
@@ -297,6 +596,9 @@ class BuilderStatus(styles.Versioned):
             b = self.getBuild(-2)
         return b
 
+    def getGeneration(self):
+        return self.generation
+
     def getCategory(self):
         return self.category
 
@@ -363,8 +665,11 @@ class BuilderStatus(styles.Versioned):
         # interleave two event streams (one from self.getBuild and the other
         # from self.getEvent), which would be simpler than this control flow
 
-        eventIndex = -1
-        e = self.getEvent(eventIndex)
+        return self._eventGenerator(self._generateBuilds(), branches,
+                categories, committers, minTime)
+
+    def _generateBuilds(self):
+        # generate this builder's builds, newest first
         for Nb in range(1, self.nextBuildNumber+1):
             b = self.getBuild(-Nb)
             if not b:
@@ -374,6 +679,15 @@ class BuilderStatus(styles.Versioned):
                 if Nb == 1:
                     continue
                 break
+            yield b
+
+    def _eventGenerator(self, builds, branches, categories, committers,
+                        minTime):
+        # interleave the given builds (newest first), and their steps, with
+        # this builder's events; see eventGenerator
+        eventIndex = -1
+        e = self.getEvent(eventIndex)
+        for b in builds:
             if b.getTimes()[0] < minTime:
                 break
             if branches and not b.getSourceStamp().branch in branches:
@@ -415,8 +729,12 @@ class BuilderStatus(styles.Versioned):
 
     ## Builder interface (methods called by the Builder which feeds us)
 
+    def bumpGeneration(self):
+        self.generation += 1
+
     def setSlavenames(self, names):
         self.slavenames = names
+        self.bumpGeneration()
 
     def addEvent(self, text=[]):
         # this adds a duration event. When it is done, the user should call
@@ -424,8 +742,7 @@ class BuilderStatus(styles.Versioned):
         e = Event()
         e.started = util.now()
         e.text = text
-        self.events.append(e)
-        self.prune(events_only=True)
+        self._appendEvent(e)
         return e # they are free to mangle it further
 
     def addPointEvent(self, text=[]):
@@ -435,14 +752,25 @@ class BuilderStatus(styles.Versioned):
         e.started = util.now()
         e.finished = 0
         e.text = text
-        self.events.append(e)
-        self.prune(events_only=True)
+        self._appendEvent(e)
         return e # for consistency, but they really shouldn't touch it
 
+    def _appendEvent(self, e):
+        # events are only written here, so there is no need to load the
+        # pickle just to add one; keep it aside until the pickle is loaded
+        if self.unloadedFrom is not None:
+            if not self.pendingEvents:
+                self.pendingEvents = []
+            self.pendingEvents.append(e)
+        else:
+            self.events.append(e)
+        self.prune(events_only=True)
+
     def setBigState(self, state):
         needToUpdate = state != self.currentBigState
         self.currentBigState = state
         if needToUpdate:
+            self.bumpGeneration()
             self.publishState()
 
     def publishState(self, target=None):
@@ -465,10 +793,9 @@ class BuilderStatus(styles.Versioned):
         Steps). Create a BuildStatus object that it can use."""
         number = self.nextBuildNumber
         self.nextBuildNumber += 1
-        # TODO: self.saveYourself(), to make sure we don't forget about the
-        # build number we've just allocated. This is not quite as important
-        # as it was before we switch to determineNextBuildNumber, but I think
-        # it may still be useful to have the new build save itself.
+        # record the build number we've just allocated, so that the next
+        # startup need not scan the directory for it
+        self.writeIndex()
         s = BuildStatus(self, self.master, number)
         s.waitUntilFinished().addCallback(self._buildFinished)
         return s
@@ -482,6 +809,7 @@ class BuilderStatus(styles.Versioned):
         assert s not in self.currentBuilds
         self.currentBuilds.append(s)
         self.touchBuildCache(s)
+        self.bumpGeneration()
 
         # now that the BuildStatus is prepared to answer queries, we can
         # announce the new build to all our watchers
@@ -504,6 +832,7 @@ class BuilderStatus(styles.Versioned):
         assert s in self.currentBuilds
         s.saveYourself()
         self.currentBuilds.remove(s)
+        self.bumpGeneration()
 
         name = self.getName()
         results = s.getResults()
@@ -557,4 +886,101 @@ class BuilderStatus(styles.Versioned):
     def getMetrics(self):
         return self.botmaster.parent.metrics
 
+class _PickledObject(object):
+    """Stands in for the buildbot and twisted classes in a build pickle
+    read by L{_readLogFilenames}.  Unlike the real classes, it does not queue
+    itself in L{styles.versionedsToUpgrade}, which is not safe to use from a
+    thread."""
+    def __init__(self, *args, **kwargs):
+        pass
+    def __setstate__(self, state):
+        if isinstance(state, dict):
+            self.__dict__.update(state)
+
+def _findPickledGlobal(module, name):
+    if module.split('.')[0] in ('buildbot', 'twisted'):
+        return _PickledObject
+    __import__(module)
+    return getattr(sys.modules[module], name)
+
+def _readLogFilenames(filename):
+    """Return the log filenames recorded in the build pickle C{filename},
+    without creating any status objects; this may be called from a
+    thread."""
+    f = open(filename, "rb")
+    try:
+        unpickler = cPickle.Unpickler(f)
+        unpickler.find_global = _findPickledGlobal
+        build = unpickler.load()
+    finally:
+        f.close()
+    filenames = []
+    for step in getattr(build, 'steps', []):
+        for loog in getattr(step, 'logs', []):
+            filename = getattr(loog, 'filename', None)
+            if filename:
+                filenames.append(filename)
+    return filenames
+
+
+class BuildPruner(object):
+    """I prune the old builds and logs of builders in the background, a
+    batch at a time, waiting C{batchDelay} seconds between batches so that
+    a large backlog does not stall the master."""
+
+    batchSize = 50
+    batchDelay = 0.1
+
+    def __init__(self, _reactor=reactor):
+        self._reactor = _reactor
+        self.pending = []
+        self.timer = None
+        # fires when the batch being pruned is done, if there is one
+        self.running = None
+
+    def add(self, builder_status):
+        """Prune C{builder_status} soon."""
+        if builder_status not in self.pending:
+            self.pending.append(builder_status)
+        metrics.MetricCountEvent.log("BuildPruner.backlog",
+                len(self.pending), absolute=True)
+        if not self.timer and not self.running:
+            self.timer = self._reactor.callLater(0, self._pruneBatch)
+
+    def stop(self):
+        """Stop pruning, and return a Deferred that fires when the batch
+        being pruned, if any, is done."""
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
+        self.pending = []
+        if self.running:
+            d = defer.Deferred()
+            self.running.addBoth(lambda res : d.callback(None) or res)
+            return d
+        return defer.succeed(None)
+
+    def _pruneBatch(self):
+        self.timer = None
+        if not self.pending:
+            return
+        builder_status = self.pending.pop(0)
+        d = self.running = defer.maybeDeferred(builder_status.pruneBatch,
+                                               self.batchSize)
+        def check(more):
+            if more and builder_status not in self.pending:
+                # more to do; let the other builders have a turn first
+                self.pending.append(builder_status)
+        def fail(f):
+            log.err(f, "while pruning builder %s" % builder_status.name)
+        d.addCallbacks(check, fail)
+        def schedule(_):
+            self.running = None
+            metrics.MetricCountEvent.log("BuildPruner.backlog",
+                    len(self.pending), absolute=True)
+            if self.pending and not self.timer:
+                self.timer = self._reactor.callLater(self.batchDelay,
+                                                     self._pruneBatch)
+        d.addCallback(schedule)
+
 # vim: set ts=4 sts=4 sw=4 et:
@@ -62,6 +62,10 @@ class BuildStepStatus(styles.Versioned):
     step_number = None
     hidden = False
 
+    # incremented whenever anything in this step changes; this is not
+    # persisted
+    generation = 0
+
     def __init__(self, parent, master, step_number):
         assert interfaces.IBuildStatus(parent)
         self.build = parent
@@ -102,6 +106,9 @@ class BuildStepStatus(styles.Versioned):
             ret.append(t)
         return ret
 
+    def getGeneration(self):
+        return self.generation
+
     def getLogs(self):
         return self.logs
 
@@ -205,6 +212,12 @@ class BuildStepStatus(styles.Versioned):
 
     # methods to be invoked by the BuildStep
 
+    def bumpGeneration(self):
+        self.generation += 1
+        # anything that changes a step changes its build, too
+        if self.build:
+            self.build.bumpGeneration()
+
     def setName(self, stepname):
         self.name = stepname
 
@@ -216,9 +229,11 @@ class BuildStepStatus(styles.Versioned):
 
     def setHidden(self, hidden):
         self.hidden = hidden
+        self.bumpGeneration()
 
     def stepStarted(self):
         self.started = util.now()
+        self.generation += 1
         if self.build:
             self.build.stepStarted(self)
 
@@ -227,6 +242,7 @@ class BuildStepStatus(styles.Versioned):
         logfilename = self.build.generateLogfileName(self.name, name)
         log = LogFile(self, name, logfilename)
         self.logs.append(log)
+        self.bumpGeneration()
         for w in self.watchers:
             receiver = w.logStarted(self.build, self, log)
             if receiver:
@@ -242,23 +258,28 @@ class BuildStepStatus(styles.Versioned):
         logfilename = self.build.generateLogfileName(self.name, name)
         log = HTMLLogFile(self, name, logfilename, html)
         self.logs.append(log)
+        self.bumpGeneration()
         for w in self.watchers:
             w.logStarted(self.build, self, log)
             w.logFinished(self.build, self, log)
 
     def logFinished(self, log):
+        self.bumpGeneration()
         for w in self.watchers:
             w.logFinished(self.build, self, log)
 
     def addURL(self, name, url):
         self.urls[name] = url
+        self.bumpGeneration()
 
     def setText(self, text):
         self.text = text
+        self.bumpGeneration()
         for w in self.watchers:
             w.stepTextChanged(self.build, self, text)
     def setText2(self, text):
         self.text2 = text
+        self.bumpGeneration()
         for w in self.watchers:
             w.stepText2Changed(self.build, self, text)
 
@@ -266,13 +287,16 @@ class BuildStepStatus(styles.Versioned):
         """Set the given statistic.  Usually called by subclasses.
         """
         self.statistics[name] = value
+        self.bumpGeneration()
 
     def setSkipped(self, skipped):
         self.skipped = skipped
+        self.bumpGeneration()
 
     def stepFinished(self, results):
         self.finished = util.now()
         self.results = results
+        self.bumpGeneration()
         cld = [] # deferreds for log compression
         logCompressionLimit = self.master.config.logCompressionLimit
         for loog in self.logs:
@@ -308,6 +332,7 @@ class BuildStepStatus(styles.Versioned):
 
     def setWaitingForLocks(self, waiting):
         self.waitingForLocks = waiting
+        self.bumpGeneration()
 
     # persistence
 
@@ -320,6 +345,7 @@ class BuildStepStatus(styles.Versioned):
         del d['finishedWatchers']
         del d['updates']
         del d['master']
+        d.pop('generation', None)
         return d
 
     def __setstate__(self, d):
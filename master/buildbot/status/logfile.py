@@ -14,12 +14,14 @@
 # Copyright Buildbot Team Members
 
 import os
+from array import array
+from bisect import bisect_left, bisect_right
 from cStringIO import StringIO
 from bz2 import BZ2File
 from gzip import GzipFile
 
 from zope.interface import implements
-from twisted.python import log, runtime
+from twisted.python import log, runtime, failure
 from twisted.internet import defer, threads, reactor
 from buildbot.util import netstrings
 from buildbot.util.eventual import eventually
@@ -41,6 +43,111 @@ class LogFileScanner(netstrings.NetstringParser):
         if not self.channels or (channel in self.channels):
             self.chunk_cb((channel, line[1:]))
 
+class LogChunkIndex:
+    """
+    The position of each chunk of a logfile, both in the file on disk and in
+    the log's text, so that a part of a log can be read without reading
+    everything before it.  Text positions count only stdout and stderr, not
+    headers, so they match the text view of the log.  The offsets are kept
+    in arrays, rather than lists of tuples, as large logs have many chunks.
+
+    @ivar fileLength: the length of the indexed part of the file
+    @ivar textLength: the number of bytes of non-header text in the log
+    @ivar newlines: the number of newlines in the non-header text
+    """
+
+    fileLength = 0
+    textLength = 0
+    newlines = 0
+    endsWithNewline = True
+
+    def __init__(self):
+        # file offset of each chunk's netstring
+        self.fileOffsets = array('L')
+        # bytes, and newlines, of non-header text before each chunk
+        self.textOffsets = array('L')
+        self.lineOffsets = array('L')
+
+    def __len__(self):
+        return len(self.fileOffsets)
+
+    def addChunk(self, fileOffset, fileLength, channel, text):
+        self.fileOffsets.append(fileOffset)
+        self.textOffsets.append(self.textLength)
+        self.lineOffsets.append(self.newlines)
+        self.fileLength = fileLength
+        if channel != HEADER and text:
+            self.textLength += len(text)
+            self.newlines += text.count('\n')
+            self.endsWithNewline = text.endswith('\n')
+
+    def getLineCount(self):
+        """
+        Get the number of lines of non-header text, including a last line
+        without a newline.
+        """
+        if self.endsWithNewline:
+            return self.newlines
+        return self.newlines + 1
+
+    def getFileOffset(self, i):
+        """
+        Get the file offset of chunk C{i}, or of the end of the indexed data
+        if C{i} is past the last chunk.
+        """
+        if i >= len(self.fileOffsets):
+            return self.fileLength
+        return self.fileOffsets[i]
+
+    def getTextOffset(self, i):
+        if i >= len(self.textOffsets):
+            return self.textLength
+        return self.textOffsets[i]
+
+    def getLineOffset(self, i):
+        if i >= len(self.lineOffsets):
+            return self.newlines
+        return self.lineOffsets[i]
+
+    def findText(self, pos):
+        """
+        Find the chunk containing byte C{pos} of the text.  Header chunks
+        just before that byte are included.
+
+        @returns: chunk number
+        """
+        i = bisect_right(self.textOffsets, pos) - 1
+        if i < 0:
+            return 0
+        return bisect_left(self.textOffsets, self.textOffsets[i])
+
+    def findTextEnd(self, pos):
+        """
+        Find the first chunk entirely at or after byte C{pos} of the text.
+
+        @returns: chunk number
+        """
+        if pos <= 0:
+            return 0
+        return bisect_right(self.textOffsets, pos - 1)
+
+    def findLine(self, n):
+        """
+        Find the chunk in which line C{n} (counting from zero) starts, that
+        is, the chunk holding the C{n}th newline.
+
+        @returns: chunk number
+        """
+        return max(bisect_left(self.lineOffsets, n) - 1, 0)
+
+    def findLineEnd(self, n):
+        """
+        Find the first chunk entirely after the end of line C{n - 1}.
+
+        @returns: chunk number
+        """
+        return bisect_left(self.lineOffsets, n)
+
 class LogFileProducer:
     """What's the plan?
 
@@ -79,19 +186,21 @@ class LogFileProducer:
     subscribed = False
     BUFFERSIZE = 2048
 
-    def __init__(self, logfile, consumer):
+    def __init__(self, logfile, consumer, start=0, stop=None):
         self.logfile = logfile
         self.consumer = consumer
+        self.start = start
+        self.stop = stop
         self.chunkGenerator = self.getChunks()
         consumer.registerProducer(self, True)
 
     def getChunks(self):
         f = self.logfile.getFile()
-        offset = 0
+        offset = self.start
         chunks = []
         p = LogFileScanner(chunks.append)
         f.seek(offset)
-        data = f.read(self.BUFFERSIZE)
+        data = f.read(self._readSize(offset))
         offset = f.tell()
         while data:
             p.dataReceived(data)
@@ -99,10 +208,14 @@ class LogFileProducer:
                 c = chunks.pop(0)
                 yield c
             f.seek(offset)
-            data = f.read(self.BUFFERSIZE)
+            data = f.read(self._readSize(offset))
             offset = f.tell()
         del f
 
+        if self.stop is not None:
+            # only part of the log was asked for, so don't wait for the rest
+            return
+
         # now subscribe them to receive new entries
         self.subscribed = True
         self.logfile.watchers.append(self)
@@ -120,6 +233,11 @@ class LogFileProducer:
         # during the yield.
         d.addCallback(self.logfileFinished)
 
+    def _readSize(self, offset):
+        if self.stop is None:
+            return self.BUFFERSIZE
+        return max(min(self.stop - offset, self.BUFFERSIZE), 0)
+
     def stopProducing(self):
         # TODO: should we still call consumer.finish? probably not.
         self.paused = True
@@ -160,6 +278,8 @@ class LogFileProducer:
         except StopIteration:
             # if the generator finished, it will have done releaseFile
             self.chunkGenerator = None
+            if self.stop is not None:
+                self.logfileFinished(self.logfile)
         # now everything goes through the subscription, and they don't get to
         # pause anymore
 
@@ -203,6 +323,8 @@ class LogFile:
     BUFFERSIZE = 2048
     filename = None # relative to the Builder's basedir
     openfile = None
+    chunkIndex = None # not kept for logs from older versions
+    _indexWaiters = None
 
     def __init__(self, parent, name, logfilename):
         """
@@ -228,6 +350,7 @@ class LogFile:
         if not os.path.exists(dirname):
             os.makedirs(dirname)
         self.openfile = open(fn, "w+")
+        self.chunkIndex = LogChunkIndex()
         self.runEntries = []
         self.watchers = []
         self.finishedWatchers = []
@@ -416,10 +539,62 @@ class LogFile:
         if receiver in self.watchers:
             self.watchers.remove(receiver)
 
-    def subscribeConsumer(self, consumer):
-        p = LogFileProducer(self, consumer)
+    def subscribeConsumer(self, consumer, start=0, stop=None):
+        p = LogFileProducer(self, consumer, start, stop)
         p.resumeProducing()
 
+    def getChunkIndex(self):
+        """
+        Get the L{LogChunkIndex} of this log.  The index of a log written by
+        this master is kept up to date as the log is written; that of an
+        older log is built by reading through it, in a thread, the first time
+        it is needed.
+
+        @returns: L{LogChunkIndex} via Deferred
+        """
+        if self.chunkIndex is not None:
+            if not self.finished:
+                # make the index cover everything written so far
+                self._merge()
+            return defer.succeed(self.chunkIndex)
+        if self._indexWaiters is None:
+            self._indexWaiters = []
+            d = threads.deferToThread(self._buildChunkIndex)
+            def done(result):
+                waiters = self._indexWaiters
+                self._indexWaiters = None
+                if not isinstance(result, failure.Failure):
+                    self.chunkIndex = result
+                for w in waiters:
+                    w.callback(result)
+            d.addBoth(done)
+        d = defer.Deferred()
+        self._indexWaiters.append(d)
+        return d
+
+    def _buildChunkIndex(self):
+        index = LogChunkIndex()
+        f = self.getFile()
+        f.seek(0)
+        offset = 0
+        while True:
+            header = ''
+            while True:
+                c = f.read(1)
+                if not c or c == ':':
+                    break
+                header += c
+            if not c:
+                break
+            size = int(header)
+            data = f.read(size + 1) # including the trailing comma
+            if len(data) < size + 1:
+                break # a partial chunk, as left by a crash
+            end = offset + len(header) + 1 + size + 1
+            index.addChunk(offset, end, int(data[0]), data[1:-1])
+            offset = end
+        return index
+
     # interface used by the build steps to add things to the log
 
     def _merge(self):
@@ -435,9 +610,13 @@ class LogFile:
         offset = 0
         while offset < len(text):
             size = min(len(text)-offset, self.chunkSize)
+            fileOffset = f.tell()
             f.write("%d:%d" % (1 + size, channel))
             f.write(text[offset:offset+size])
             f.write(",")
+            if self.chunkIndex is not None:
+                self.chunkIndex.addChunk(fileOffset, f.tell(), channel,
+                                         text[offset:offset+size])
             offset += size
         self.runEntries = []
         self.runLength = 0
@@ -630,6 +809,9 @@ class LogFile:
             del d['finished']
         if d.has_key('openfile'):
             del d['openfile']
+        # the index is rebuilt when it is needed
+        d.pop('chunkIndex', None)
+        d.pop('_indexWaiters', None)
         return d
 
     def __setstate__(self, d):
@@ -666,7 +848,11 @@ class HTMLLogFile:
         return self.html # looks kinda like text
     def getTextWithHeaders(self):
         return self.html
-    def getChunks(self):
+    def getChunks(self, channels=[], onlyText=False):
+        if channels and STDERR not in channels:
+            return []
+        if onlyText:
+            return [self.html]
         return [(STDERR, self.html)]
 
     def subscribe(self, receiver, catchup):
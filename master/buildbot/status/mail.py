@@ -16,23 +16,25 @@
 
 import re
 import types
+from collections import deque
 from email.Message import Message
 from email.Utils import formatdate
 from email.MIMEText import MIMEText
+from email.MIMEMessage import MIMEMessage
 from email.MIMENonMultipart import MIMENonMultipart
 from email.MIMEMultipart import MIMEMultipart
 from StringIO import StringIO
 import urllib
 
 from zope.interface import implements
-from twisted.internet import defer, reactor
+from twisted.internet import defer, reactor, protocol, threads
 from twisted.python import log as twlog
 
 try:
-    from twisted.mail.smtp import ESMTPSenderFactory
-    ESMTPSenderFactory = ESMTPSenderFactory # for pyflakes
+    from twisted.mail import smtp
+    ESMTPSenderFactory = smtp.ESMTPSenderFactory
 except ImportError:
-    ESMTPSenderFactory = None
+    smtp = ESMTPSenderFactory = None
 
 have_ssl = True
 try:
@@ -44,6 +46,7 @@ except ImportError:
 from buildbot import interfaces, util, config
 from buildbot.process.users import users
 from buildbot.status import base
+from buildbot.status.logfile import STDOUT, STDERR
 from buildbot.status.results import FAILURE, SUCCESS, WARNINGS, Results
 
 VALID_EMAIL = re.compile("[a-zA-Z0-9\.\_\%\-\+]+@[a-zA-Z0-9\.\_\%\-]+.[a-zA-Z]{2,6}")
@@ -138,6 +141,165 @@ def defaultMessage(mode, name, build, results, master_status):
     text += "\n"
     return { 'body' : text, 'type' : 'plain' }
 
+if smtp:
+    class _OutboxSender(smtp.ESMTPSender):
+        """
+        An ESMTP client that sends the messages queued in an L{SMTPOutbox}
+        one after the other, instead of a single message per connection.
+        """
+
+        current = None
+        sent = 0
+
+        def getMailFrom(self):
+            self.current = self.factory.nextMessage(self)
+            if self.current is None:
+                return None
+            self.sent += 1
+            return str(self.factory.fromEmail)
+
+        def getMailTo(self):
+            return self.current[1]
+
+        def getMailData(self):
+            return StringIO(self.current[0])
+
+        def sentMail(self, code, resp, numOk, addresses, log):
+            msg, self.current = self.current, None
+            if code in smtp.SUCCESS:
+                self.factory.messageDone(msg, (numOk, addresses))
+                return
+            errlog = [ "%s: %03d %s" % (addr, acode, aresp)
+                       for addr, acode, aresp in addresses
+                       if acode not in smtp.SUCCESS ]
+            errlog.append(log.str())
+            self.factory.messageDone(msg, smtp.SMTPDeliveryError(code, resp,
+                                            '\n'.join(errlog), addresses))
+
+        def sendError(self, exc):
+            smtp.SMTPClient.sendError(self, exc)
+            msg, self.current = self.current, None
+            self.factory.connectionError(msg, exc)
+
+        def connectionLost(self, reason=protocol.connectionDone):
+            smtp.ESMTPSender.connectionLost(self, reason)
+            if self.current is not None:
+                msg, self.current = self.current, None
+                self.factory.messageDone(msg, smtp.SMTPConnectError(-1,
+                        "Connection lost while sending message"))
+else:
+    _OutboxSender = None
+
+class SMTPOutbox(protocol.ClientFactory):
+    """
+    Outgoing mail for a relay host.  Messages queued while a connection to
+    the relay is open are sent over that connection, rather than each over
+    a connection of its own, so that a burst of notifications costs one
+    connection (and one TLS handshake and login) instead of hundreds.
+
+    @ivar maxMessagesPerConnection: the number of messages after which the
+    connection is closed and a new one opened
+    @ivar retries: the number of times in a row to retry connecting to the
+    relay before giving up on the queued messages
+    """
+
+    protocol = _OutboxSender
+    maxMessagesPerConnection = 100
+    retries = 5
+    timeout = 300
+
+    def __init__(self, relayhost, port, fromaddr, username=None,
+                 password=None, contextFactory=None,
+                 requireTransportSecurity=False, requireAuthentication=False):
+        self.relayhost = relayhost
+        self.port = port
+        self.fromEmail = smtp.Address(fromaddr)
+        self.username = username
+        self.password = password
+        self.contextFactory = contextFactory
+        self.requireTransportSecurity = requireTransportSecurity
+        self.requireAuthentication = requireAuthentication
+        self.queue = []
+        self.connector = None
+        self.failures = 0
+        self.sentOnConnection = 0
+        self.lastError = None
+        self._reactor = reactor # seam for tests
+
+    def send(self, data, recipients):
+        """
+        Queue a message for delivery.
+
+        @returns: Deferred that fires when the relay has accepted the message
+        """
+        d = defer.Deferred()
+        self.queue.append((data, recipients, d))
+        if self.connector is None:
+            self.connect()
+        return d
+
+    def connect(self):
+        self.sentOnConnection = 0
+        self.lastError = None
+        self.connector = self._reactor.connectTCP(self.relayhost, self.port,
+                                                  self)
+
+    def buildProtocol(self, addr):
+        p = self.protocol(self.username, self.password, self.contextFactory,
+                          smtp.DNSNAME, self.maxMessagesPerConnection * 2 + 2)
+        p.requireAuthentication = self.requireAuthentication
+        p.requireTransportSecurity = self.requireTransportSecurity
+        p.factory = self
+        p.timeout = self.timeout
+        return p
+
+    def nextMessage(self, proto):
+        if not self.queue or proto.sent >= self.maxMessagesPerConnection:
+            return None
+        self.sentOnConnection += 1
+        return self.queue.pop(0)
+
+    def messageDone(self, msg, result):
+        self.failures = 0
+        if isinstance(result, Exception):
+            msg[2].errback(result)
+        else:
+            msg[2].callback(result)
+
+    def connectionError(self, msg, exc):
+        self.lastError = exc
+        if msg is not None:
+            msg[2].errback(exc)
+
+    def clientConnectionFailed(self, connector, reason):
+        self.connector = None
+        self.lastError = reason.value
+        self._connectionDone()
+
+    def clientConnectionLost(self, connector, reason):
+        self.connector = None
+        if self.sentOnConnection:
+            self.failures = 0
+        self._connectionDone()
+
+    def _connectionDone(self):
+        if not self.queue:
+            return
+        if not self.sentOnConnection:
+            # nothing could be sent on that connection
+            self.failures += 1
+            if self.failures > self.retries:
+                self.failures = 0
+                exc = self.lastError or smtp.SMTPConnectError(-1,
+                        "Unable to connect to server.")
+                queue, self.queue = self.queue, []
+                for data, recipients, d in queue:
+                    d.errback(exc)
+                return
+            twlog.msg("SMTP outbox retrying %s" % (self.relayhost,))
+        # more mail was queued while the last connection was closing
+        self.connect()
+
 class MailNotifier(base.StatusReceiverMultiService):
     """This is a status notifier which sends email to a list of recipients
     upon the completion of each build. It can be configured to only send out
@@ -161,8 +323,11 @@ class MailNotifier(base.StatusReceiverMultiService):
 
     compare_attrs = ["extraRecipients", "lookup", "fromaddr", "mode",
                      "categories", "builders", "addLogs", "relayhost",
-                     "subject", "sendToInterestedUsers", "customMesg",
-                     "messageFormatter", "extraHeaders"]
+                     "buildSetSummary", "subject", "sendToInterestedUsers",
+                     "customMesg", "messageFormatter", "extraHeaders",
+                     "addPatch", "useTls", "smtpUser", "smtpPassword",
+                     "smtpPort", "logTailLines", "maxLogSize", "digestDelay"]
+    keepOnReconfig = True
 
     possible_modes = ("change", "failing", "passing", "problem", "warnings")
 
@@ -174,7 +339,8 @@ class MailNotifier(base.StatusReceiverMultiService):
                  sendToInterestedUsers=True, customMesg=None,
                  messageFormatter=defaultMessage, extraHeaders=None,
                  addPatch=True, useTls=False, 
-                 smtpUser=None, smtpPassword=None, smtpPort=25):
+                 smtpUser=None, smtpPassword=None, smtpPort=25,
+                 logTailLines=None, maxLogSize=None, digestDelay=None):
         """
         @type  fromaddr: string
         @param fromaddr: the email address to be used in the 'From' header.
@@ -288,6 +454,19 @@ class MailNotifier(base.StatusReceiverMultiService):
         @type smtpPort: int
         @param smtpPort: The port that will be used when connecting to the
                          relayhost. Defaults to 25.
+
+        @type logTailLines: int
+        @param logTailLines: if given, only attach the last logTailLines
+                             lines of each log.
+
+        @type maxLogSize: int
+        @param maxLogSize: if given, only attach the last maxLogSize bytes of
+                           each log.
+
+        @type digestDelay: int
+        @param digestDelay: if given, the messages for each recipient are
+                            held for digestDelay seconds after the first
+                            one, and sent together as a single digest.
         """
         base.StatusReceiverMultiService.__init__(self)
 
@@ -339,6 +518,13 @@ class MailNotifier(base.StatusReceiverMultiService):
         self.smtpUser = smtpUser
         self.smtpPassword = smtpPassword
         self.smtpPort = smtpPort
+        self.logTailLines = logTailLines
+        self.maxLogSize = maxLogSize
+        self.digestDelay = digestDelay
+        self.outbox = None
+        self.digests = {}
+        self.digestTimers = {}
+        self._reactor = reactor # seam for tests
         self.buildSetSummary = buildSetSummary
         self.buildSetSubscription = None
         self.watched = []
@@ -376,8 +562,16 @@ class MailNotifier(base.StatusReceiverMultiService):
         if self.buildSetSubscription is not None:
             self.buildSetSubscription.unsubscribe()
             self.buildSetSubscription = None
-            
-        return base.StatusReceiverMultiService.stopService(self)
+
+        # don't keep the pending digests waiting
+        dl = []
+        for recipient in self.digestTimers.keys():
+            self.digestTimers[recipient].cancel()
+            dl.append(self.sendDigest(recipient))
+        d = defer.DeferredList(dl)
+        d.addCallback(lambda _ :
+                base.StatusReceiverMultiService.stopService(self))
+        return d
 
     def disownServiceParent(self):
         self.master_status.unsubscribe(self)
@@ -585,9 +779,9 @@ class MailNotifier(base.StatusReceiverMultiService):
                                   log.getName())
                 if ( self._shouldAttachLog(log.getName()) or
                      self._shouldAttachLog(name) ):
-                    text = log.getText()
+                    text = self.getLogText(log)
                     if not isinstance(text, unicode):
-                        text = text.decode(LOG_ENCODING)
+                        text = text.decode(LOG_ENCODING, 'replace')
                     a = MIMEText(text.encode(ENCODING),
                                  _charset=ENCODING)
                     a.add_header('Content-Disposition', "attachment",
@@ -611,7 +805,54 @@ class MailNotifier(base.StatusReceiverMultiService):
                 m[k] = v
     
         return m
-    
+
+    def getLogText(self, logf):
+        """
+        Get the text of a log to attach to a message.  With logTailLines or
+        maxLogSize, only the end of the log is kept; the log is then read a
+        chunk at a time, so that a large log is never all in memory at once.
+        """
+        if self.logTailLines is None and self.maxLogSize is None:
+            return logf.getText()
+
+        maxLines, maxSize = self.logTailLines, self.maxLogSize
+        tail = deque()
+        size = 0
+        lines = 0
+        partial = []
+        partialSize = 0
+        for text in logf.getChunks([STDOUT, STDERR], onlyText=True):
+            pieces = text.split('\n')
+            if len(pieces) > 1:
+                partial.append(pieces[0])
+                pieces[0] = ''.join(partial)
+                for line in pieces[:-1]:
+                    tail.append(line + '\n')
+                    size += len(line) + 1
+                lines += len(pieces) - 1
+                partial = [ pieces[-1] ]
+                partialSize = len(pieces[-1])
+            else:
+                partial.append(text)
+                partialSize += len(text)
+            if maxSize is not None and partialSize > maxSize:
+                partial = [ ''.join(partial)[-maxSize:] ]
+                partialSize = maxSize
+            # an unfinished last line counts as a line too
+            while tail and (maxLines is not None and
+                            len(tail) + bool(partialSize) > maxLines or
+                            maxSize is not None and
+                            size + partialSize > maxSize):
+                size -= len(tail.popleft())
+
+        text = ''.join(tail) + ''.join(partial)
+        if maxSize is not None:
+            text = text[-maxSize:]
+        omitted = lines - len(tail)
+        if omitted:
+            text = "[%d earlier lines not included]\n%s" % (omitted, text)
+        return text
+
     def buildMessageDict(self, name, build, results):
         if self.customMesg:
             # the customMesg stuff can be *huge*, so we prefer not to load it
@@ -646,9 +887,19 @@ class MailNotifier(base.StatusReceiverMultiService):
             if "subject" in tmp:
                 msgdict['subject'] = tmp['subject']
 
-        m = self.createEmail(msgdict, name, self.master_status.getTitle(),
-                             results, builds, patches, logs)
+        title = self.master_status.getTitle()
+        if logs:
+            # reading the logs and encoding them takes a while, so keep it
+            # out of the reactor thread
+            d = threads.deferToThread(self.createEmail, msgdict, name, title,
+                                      results, builds, patches, logs)
+        else:
+            d = defer.succeed(self.createEmail(msgdict, name, title,
+                                               results, builds, patches, logs))
+        d.addCallback(self._gotEmail, builds)
+        return d
 
+    def _gotEmail(self, m, builds):
         # now, who is this message going to?
         if self.sendToInterestedUsers:
             dl = []
@@ -745,38 +996,88 @@ class MailNotifier(base.StatusReceiverMultiService):
         if cc_recipients:
             m['CC'] = ", ".join(sorted(cc_recipients))
 
+        if self.digestDelay:
+            for r in sorted(to_recipients | cc_recipients):
+                self.addToDigest(r, m)
+            return defer.succeed(None)
         return self.sendMessage(m, list(to_recipients | cc_recipients))
 
-    def sendmail(self, s, recipients):
-        result = defer.Deferred()
-        
-        if have_ssl and self.useTls:
-            client_factory = ssl.ClientContextFactory()
-            client_factory.method = SSLv3_METHOD
+    def addToDigest(self, recipient, m):
+        if recipient not in self.digests:
+            self.digests[recipient] = []
+            self.digestTimers[recipient] = self._reactor.callLater(
+                    self.digestDelay, self.sendDigest, recipient)
+        self.digests[recipient].append(m)
+
+    def sendDigest(self, recipient):
+        messages = self.digests.pop(recipient)
+        del self.digestTimers[recipient]
+        if len(messages) == 1:
+            d = self.sendMessage(messages[0], [recipient])
         else:
-            client_factory = None
+            m = self.createDigest(messages)
+            m['To'] = recipient
+            d = self.sendMessage(m, [recipient])
+        d.addErrback(twlog.err, "while sending digest to %s" % (recipient,))
+        return d
 
-        if self.smtpUser and self.smtpPassword:
-            useAuth = True
-        else:
-            useAuth = False
-        
+    def createDigest(self, messages):
+        """
+        Create a message holding each of C{messages}, as attachments, after a
+        list of their subjects.
+        """
+        title = self.master_status.getTitle()
+        subjects = []
+        for msg in messages:
+            subject = msg['Subject']
+            if isinstance(subject, unicode):
+                subject = subject.encode(ENCODING)
+            subjects.append(" * %s\n" % (subject,))
+        if isinstance(title, unicode):
+            title = title.encode(ENCODING)
+        text = "%d build notifications:\n\n%s" % (len(messages),
+                                                   "".join(subjects))
+
+        m = MIMEMultipart()
+        m.attach(MIMEText(text, 'plain', ENCODING))
+        for msg in messages:
+            m.attach(MIMEMessage(msg))
+        m['Date'] = formatdate(localtime=True)
+        m['Subject'] = "buildbot: %d notifications from %s" % (len(messages),
+                                                               title)
+        m['From'] = self.fromaddr
+        return m
+
+    def sendmail(self, s, recipients):
         if not ESMTPSenderFactory:
             raise RuntimeError("twisted-mail is not installed - cannot "
                                "send mail")
-        sender_factory = ESMTPSenderFactory(
-            self.smtpUser, self.smtpPassword,
-            self.fromaddr, recipients, StringIO(s),
-            result, contextFactory=client_factory,
-            requireTransportSecurity=self.useTls,
-            requireAuthentication=useAuth)
-
-        reactor.connectTCP(self.relayhost, self.smtpPort, sender_factory)
-        
-        return result
 
-    def sendMessage(self, m, recipients):
-        s = m.as_string()
-        twlog.msg("sending mail (%d bytes) to" % len(s), recipients)
-        return self.sendmail(s, recipients)
+        if self.outbox is None:
+            if have_ssl and self.useTls:
+                client_factory = ssl.ClientContextFactory()
+                client_factory.method = SSLv3_METHOD
+            else:
+                client_factory = None
 
+            useAuth = bool(self.smtpUser and self.smtpPassword)
+
+            self.outbox = SMTPOutbox(self.relayhost, self.smtpPort,
+                    self.fromaddr, self.smtpUser, self.smtpPassword,
+                    contextFactory=client_factory,
+                    requireTransportSecurity=self.useTls,
+                    requireAuthentication=useAuth)
+
+        return self.outbox.send(s, recipients)
+
+    def sendMessage(self, m, recipients):
+        if m.is_multipart():
+            # attachments can be large, so flatten them in a thread
+            d = threads.deferToThread(m.as_string)
+        else:
+            d = defer.succeed(m.as_string())
+        def send(s):
+            twlog.msg("sending mail (%d bytes) to" % len(s), recipients)
+            return self.sendmail(s, recipients)
+        d.addCallback(send)
+        return d
@@ -14,14 +14,13 @@
 # Copyright Buildbot Team Members
 
 import os, urllib
-from cPickle import load
 from twisted.python import log
-from twisted.persisted import styles
 from twisted.internet import defer
 from twisted.application import service
 from zope.interface import implements
 from buildbot import interfaces, config
 from buildbot.util import bbcollections
+from buildbot.process import metrics
 from buildbot.util.eventual import eventually
 from buildbot.changes import changes
 from buildbot.status import buildset, builder, buildrequest
@@ -39,10 +38,15 @@ class Status(config.ReconfigurableServiceMixin, service.MultiService):
         # No default limit to the log size
         self.logMaxSize = None
 
+        # incremented on reconfig and when builders come and go
+        self.generation = 0
+
         self._builder_observers = bbcollections.KeyedSets()
         self._buildreq_observers = bbcollections.KeyedSets()
         self._buildset_finished_waiters = bbcollections.KeyedSets()
 
+        self.buildPruner = builder.BuildPruner()
+
     # service management
 
     def startService(self):
@@ -64,8 +68,30 @@ class Status(config.ReconfigurableServiceMixin, service.MultiService):
 
     @defer.deferredGenerator
     def reconfigService(self, new_config):
-        # remove the old listeners, then add the new
+        timer = metrics.Timer("Status.reconfigService")
+        timer.start()
+
+        self.generation += 1
+
+        # keep the listeners that opt in with keepOnReconfig and compare equal
+        # to a new one, using their compare_attrs; all others are replaced.
+        # The flag is not inherited, as a subclass may take more arguments
+        # than its parent compares.
+        added = list(new_config.status)
+        removed = []
         for sr in list(self):
+            for new_sr in added:
+                if (sr.__class__.__dict__.get('keepOnReconfig', False)
+                        and getattr(sr, 'compare_attrs', None)
+                        and sr.__class__ is new_sr.__class__
+                        and sr == new_sr):
+                    added.remove(new_sr)
+                    break
+            else:
+                removed.append(sr)
+
+        # remove the old listeners, then add the new
+        for sr in removed:
             wfd = defer.waitForDeferred(
                 defer.maybeDeferred(lambda :
                     sr.disownServiceParent()))
@@ -73,7 +99,7 @@ class Status(config.ReconfigurableServiceMixin, service.MultiService):
             wfd.getResult()
             sr.master = None
 
-        for sr in new_config.status:
+        for sr in added:
             sr.master = self.master
             sr.setServiceParent(self)
 
@@ -84,13 +110,21 @@ class Status(config.ReconfigurableServiceMixin, service.MultiService):
         yield wfd
         wfd.getResult()
 
+        elapsed = timer.stop()
+        log.msg("reconfigured status: added %d listeners, removed %d, "
+                "kept %d, in %.3fs" % (len(added), len(removed),
+                    len(list(self)) - len(added), elapsed))
+
     def stopService(self):
         self._buildset_completion_sub.unsubscribe()
         self._buildset_sub.unsubscribe()
         self._build_request_sub.unsubscribe()
         self._change_sub.unsubscribe()
 
-        return service.MultiService.stopService(self)
+        # let a batch of pruning finish before stopping
+        d = self.buildPruner.stop()
+        d.addCallback(lambda _ : service.MultiService.stopService(self))
+        return d
 
     # clean shutdown
 
@@ -122,6 +156,9 @@ class Status(config.ReconfigurableServiceMixin, service.MultiService):
     def getMetrics(self):
         return self.master.metrics
 
+    def getGeneration(self):
+        return self.generation
+
     def getURLForBuild(self, builder_name, build_number):
         prefix = self.getBuildbotURL()
         return prefix + "builders/%s/builds/%d" % (
@@ -311,52 +348,35 @@ class Status(config.ReconfigurableServiceMixin, service.MultiService):
         @rtype: L{BuilderStatus}
         """
         filename = os.path.join(self.basedir, basedir, "builder")
-        log.msg("trying to load status pickle from %s" % filename)
-        builder_status = None
-        try:
-            builder_status = load(open(filename, "rb"))
-            builder_status.master = self.master
-
-            # (bug #1068) if we need to upgrade, we probably need to rewrite
-            # this pickle, too.  We determine this by looking at the list of
-            # Versioned objects that have been unpickled, and (after doUpgrade)
-            # checking to see if any of them set wasUpgraded.  The Versioneds'
-            # upgradeToVersionNN methods all set this.
-            versioneds = styles.versionedsToUpgrade
-            styles.doUpgrade()
-            if True in [ hasattr(o, 'wasUpgraded') for o in versioneds.values() ]:
-                log.msg("re-writing upgraded builder pickle")
-                builder_status.saveYourself()
-
-        except IOError:
+        builder_status = builder.BuilderStatus(name, category, self.master)
+        builder_status.basedir = os.path.join(self.basedir, basedir)
+        builder_status.status = self
+        if os.path.exists(filename):
+            # the pickle is only loaded once something needs the builder's
+            # history, so that startup does not have to unpickle every builder
+            builder_status.deferLoad(filename)
+        else:
             log.msg("no saved status pickle, creating a new one")
-        except:
-            log.msg("error while loading status pickle, creating a new one")
-            log.msg("error follows:")
-            log.err()
-        if not builder_status:
-            builder_status = builder.BuilderStatus(name, category, self.master)
             builder_status.addPointEvent(["builder", "created"])
         log.msg("added builder %s in category %s" % (name, category))
-        # an unpickled object might not have category set from before,
-        # so set it here to make sure
-        builder_status.master = self.master
-        builder_status.basedir = os.path.join(self.basedir, basedir)
-        builder_status.name = name # it might have been updated
-        builder_status.status = self
 
         if not os.path.isdir(builder_status.basedir):
             os.makedirs(builder_status.basedir)
         builder_status.determineNextBuildNumber()
 
         builder_status.setBigState("offline")
+        self.generation += 1
 
         for t in self.watchers:
             self.announceNewBuilder(t, name, builder_status)
 
         return builder_status
 
+    def pruneBuilder(self, builder_status):
+        self.buildPruner.add(builder_status)
+
     def builderRemoved(self, name):
+        self.generation += 1
         for t in self.watchers:
             if hasattr(t, 'builderRemoved'):
                 t.builderRemoved(name)
@@ -440,6 +460,10 @@ class Status(config.ReconfigurableServiceMixin, service.MultiService):
 
     def _buildRequestCallback(self, notif):
         buildername = notif['buildername']
+        if buildername in self.botmaster.builders:
+            # the builder's pending build requests have changed
+            self.botmaster.builders[buildername].builder_status \
+                    .bumpGeneration()
         if buildername in self._builder_observers:
             brs = buildrequest.BuildRequestStatus(buildername,
                                                 notif['brid'], self)
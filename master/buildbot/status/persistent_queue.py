@@ -16,6 +16,7 @@
 
 from collections import deque
 import os
+import struct
 import cPickle as pickle
 
 from zope.interface import implements, Interface
@@ -251,6 +252,320 @@ class DiskQueue(object):
             self.lastItemId = files[-1]
 
 
+class JournalQueue(object):
+    """Keeps a list of abstract items in a journal on disk.
+
+    Items are appended as length-prefixed records to segment files of about
+    segmentSize bytes each, and read back from a cursor at the head of the
+    journal.  Segments are deleted whole once they have been read.  This
+    avoids the file per item of DiskQueue, which makes a large backlog slow
+    to write and to replay.
+
+    Items queued by a DiskQueue in the same directory are moved into the
+    journal when it is opened.
+
+    Use pickle for serialization."""
+    implements(IQueue)
+
+    # bytes in each segment file
+    segmentSize = 1024*1024
+
+    # appended records between each fsync of the journal
+    syncInterval = 100
+
+    # each record is its length, as a 4-byte big-endian integer, then data
+    _headerFormat = '>I'
+    _headerSize = struct.calcsize(_headerFormat)
+
+    def __init__(self, path, maxItems=None, pickleFn=pickle.dumps,
+                 unpickleFn=pickle.loads, segmentSize=None):
+        """
+        @path: directory to save the items.
+        @maxItems: maximum number of items to keep on disk, flush the
+        older ones.
+        @pickleFn: function used to pack the items to disk.
+        @unpickleFn: function used to unpack items from disk.
+        @segmentSize: size of the segment files.
+        """
+        self.path = path
+        self._maxItems = maxItems
+        if self._maxItems is None:
+            self._maxItems = 100000
+        if segmentSize is not None:
+            self.segmentSize = segmentSize
+        if not os.path.isdir(self.path):
+            os.mkdir(self.path)
+        self.pickleFn = pickleFn
+        self.unpickleFn = unpickleFn
+
+        # Numbers of the segment files, oldest first.
+        self._segments = []
+        # Position of the read cursor in the first segment.
+        self._readOffset = 0
+        # Where reading starts in later segments, for those that do not start
+        # at the beginning; this happens when items are inserted back ahead
+        # of a partly read segment.
+        self._startOffsets = {}
+        # File the last segment is appended through, and records appended
+        # to it since the last fsync.
+        self._writer = None
+        self._unsynced = 0
+        self._nbItems = 0
+        self._loadFromDisk()
+
+    def pushItem(self, item):
+        ret = None
+        if self._nbItems == self._maxItems:
+            ret = self.popChunk(1)[0]
+        self._append([self.pickleFn(item)])
+        return ret
+
+    def insertBackChunk(self, chunk):
+        ret = None
+        excess = self._nbItems + len(chunk) - self._maxItems
+        if excess > 0:
+            ret = chunk[0:excess]
+            chunk = chunk[excess:]
+        if not chunk:
+            return ret
+        # The journal is append-only, so the items go in a new segment ahead
+        # of the others, and the segment that was being read keeps its read
+        # position.  The new segment is complete on disk before the cursor
+        # names it, and a segment ahead of the cursor is removed on load, so
+        # a crash leaves either the old or the new queue.
+        if self._segments:
+            id = self._segments[0] - 1
+            if self._readOffset:
+                self._startOffsets[self._segments[0]] = self._readOffset
+        else:
+            id = 0
+        path = self._segmentPath(id)
+        f = open(path + '.tmp', 'wb')
+        try:
+            for item in chunk:
+                data = self.pickleFn(item)
+                f.write(struct.pack(self._headerFormat, len(data)) + data)
+            self._sync(f)
+        finally:
+            f.close()
+        os.rename(path + '.tmp', path)
+        self._segments.insert(0, id)
+        self._readOffset = 0
+        self._nbItems += len(chunk)
+        self._saveCursor()
+        return ret
+
+    def popChunk(self, nbItems=None):
+        if nbItems is None:
+            nbItems = self._maxItems
+        ret = []
+        if not self._nbItems:
+            return ret
+        if self._writer:
+            self._writer.flush()
+        while len(ret) < nbItems and self._segments:
+            f = open(self._segmentPath(self._segments[0]), 'rb')
+            try:
+                f.seek(self._readOffset)
+                while len(ret) < nbItems:
+                    data = self._readRecord(f)
+                    if data is None:
+                        break
+                    ret.append(self.unpickleFn(data))
+                    self._nbItems -= 1
+                self._readOffset = f.tell()
+            finally:
+                f.close()
+            if len(ret) < nbItems or not self._nbItems:
+                self._dropSegment()
+        if self._nbItems and self._segments:
+            self._saveCursor()
+        else:
+            self._clear()
+        return ret
+
+    def save(self):
+        if self._writer:
+            self._sync(self._writer)
+        self._saveCursor()
+
+    def items(self):
+        """Warning, slow."""
+        ret = []
+        if self._writer:
+            self._writer.flush()
+        for id in self._segments:
+            f = open(self._segmentPath(id), 'rb')
+            try:
+                f.seek(self._startOffset(id))
+                while True:
+                    data = self._readRecord(f)
+                    if data is None:
+                        break
+                    ret.append(self.unpickleFn(data))
+            finally:
+                f.close()
+        return ret
+
+    def nbItems(self):
+        return self._nbItems
+
+    def maxItems(self):
+        return self._maxItems
+
+    #### Protected functions
+
+    def _segmentPath(self, id):
+        return os.path.join(self.path, 'segment-%d' % id)
+
+    def _cursorPath(self):
+        return os.path.join(self.path, 'cursor')
+
+    def _startOffset(self, id):
+        if self._segments and id == self._segments[0]:
+            return self._readOffset
+        return self._startOffsets.get(id, 0)
+
+    def _readRecord(self, f):
+        header = f.read(self._headerSize)
+        if len(header) < self._headerSize:
+            return None
+        size, = struct.unpack(self._headerFormat, header)
+        data = f.read(size)
+        if len(data) < size:
+            return None
+        return data
+
+    def _sync(self, f):
+        f.flush()
+        os.fsync(f.fileno())
+        self._unsynced = 0
+
+    def _append(self, records):
+        if self._writer is None:
+            if self._segments:
+                id = self._segments[-1] + 1
+            else:
+                id = 0
+            self._segments.append(id)
+            self._writer = open(self._segmentPath(id), 'wb')
+        for data in records:
+            self._writer.write(struct.pack(self._headerFormat, len(data)) + data)
+        self._nbItems += len(records)
+        self._unsynced += len(records)
+        if self._writer.tell() >= self.segmentSize:
+            # Start a new segment with the next item.
+            self._sync(self._writer)
+            self._writer.close()
+            self._writer = None
+        elif self._unsynced >= self.syncInterval:
+            self._sync(self._writer)
+
+    def _closeWriter(self):
+        if self._writer:
+            self._writer.close()
+            self._writer = None
+
+    def _dropSegment(self):
+        id = self._segments.pop(0)
+        if not self._segments:
+            self._closeWriter()
+        os.remove(self._segmentPath(id))
+        self._readOffset = 0
+        if self._segments:
+            self._readOffset = self._startOffsets.pop(self._segments[0], 0)
+
+    def _saveCursor(self):
+        """Record the first segment and the read position in it, followed by
+        the start of any later segments which are partly read."""
+        if not self._segments:
+            return
+        lines = [ '%d %d\n' % (self._segments[0], self._readOffset) ]
+        for id in self._segments[1:]:
+            if id in self._startOffsets:
+                lines.append('%d %d\n' % (id, self._startOffsets[id]))
+        path = self._cursorPath()
+        WriteFile(path + '.tmp', ''.join(lines))
+        os.rename(path + '.tmp', path)
+
+    def _clear(self):
+        """Remove everything from disk once the queue is empty."""
+        self._closeWriter()
+        for id in self._segments:
+            os.remove(self._segmentPath(id))
+        self._segments = []
+        self._readOffset = 0
+        self._startOffsets = {}
+        self._nbItems = 0
+        if os.path.exists(self._cursorPath()):
+            os.remove(self._cursorPath())
+
+    def _loadFromDisk(self):
+        oldItems = []
+        for name in os.listdir(self.path):
+            if name.endswith('.tmp'):
+                # left by a crash before it was renamed into place
+                os.remove(os.path.join(self.path, name))
+            elif name.startswith('segment-'):
+                try:
+                    self._segments.append(int(name[len('segment-'):]))
+                except ValueError:
+                    pass
+            else:
+                try:
+                    oldItems.append(int(name))
+                except ValueError:
+                    pass
+        self._segments.sort()
+
+        if self._segments and os.path.exists(self._cursorPath()):
+            offsets = [ map(int, line.split())
+                        for line in ReadFile(self._cursorPath()).splitlines() ]
+            id = offsets[0][0]
+            # Segments before the cursor have been read already, or were
+            # being inserted back when the master stopped.
+            while self._segments and self._segments[0] < id:
+                os.remove(self._segmentPath(self._segments.pop(0)))
+            self._startOffsets = dict([ (id, offset)
+                                        for id, offset in offsets
+                                        if id in self._segments ])
+            if self._segments:
+                self._readOffset = self._startOffsets.pop(self._segments[0],
+                                                          0)
+
+        # Count the items, and cut off a record left incomplete by a crash.
+        for id in self._segments:
+            f = open(self._segmentPath(id), 'rb+')
+            try:
+                f.seek(self._startOffset(id))
+                while True:
+                    end = f.tell()
+                    header = f.read(self._headerSize)
+                    if not header:
+                        break
+                    if len(header) == self._headerSize:
+                        size, = struct.unpack(self._headerFormat, header)
+                        f.seek(size, 1)
+                        if f.tell() <= os.fstat(f.fileno()).st_size:
+                            self._nbItems += 1
+                            continue
+                    f.truncate(end)
+                    break
+            finally:
+                f.close()
+
+        # Move the items of a DiskQueue into the journal, oldest first.
+        oldItems.sort()
+        if oldItems:
+            self._append([ ReadFile(os.path.join(self.path, str(id)))
+                           for id in oldItems ])
+            self.save()
+            for id in oldItems:
+                os.remove(os.path.join(self.path, str(id)))
+        if not self._nbItems:
+            self._clear()
+
+
 class PersistentQueue(object):
     """Keeps a list of abstract items and serializes it to the disk.
 
@@ -272,7 +587,7 @@ class PersistentQueue(object):
             self.primaryQueue = MemoryQueue()
         self.secondaryQueue = secondaryQueue
         if self.secondaryQueue is None:
-            self.secondaryQueue = DiskQueue(path)
+            self.secondaryQueue = JournalQueue(path)
         # Preload data from the secondary queue only if we know we won't start
         # using the secondary queue right away.
         if self.secondaryQueue.nbItems() < self.primaryQueue.maxItems():
@@ -327,6 +642,7 @@ class PersistentQueue(object):
 
     def save(self):
         self.secondaryQueue.insertBackChunk(self.primaryQueue.popChunk())
+        self.secondaryQueue.save()
 
     def items(self):
         return self.primaryQueue.items() + self.secondaryQueue.items()
@@ -28,6 +28,9 @@ class SlaveStatus:
     connected = False
     graceful_shutdown = False
 
+    # incremented whenever anything about this slave changes
+    generation = 0
+
     def __init__(self, name):
         self.name = name
         self._lastMessageReceived = 0
@@ -51,20 +54,29 @@ class SlaveStatus:
         return self._lastMessageReceived
     def getRunningBuilds(self):
         return self.runningBuilds
+    def getGeneration(self):
+        return self.generation
     def getConnectCount(self):
         then = time.time() - 3600
         return len([ t for t in self.connect_times if t > then ])
 
+    def bumpGeneration(self):
+        self.generation += 1
     def setAdmin(self, admin):
         self.admin = admin
+        self.bumpGeneration()
     def setHost(self, host):
         self.host = host
+        self.bumpGeneration()
     def setAccessURI(self, access_uri):
         self.access_uri = access_uri
+        self.bumpGeneration()
     def setVersion(self, version):
         self.version = version
+        self.bumpGeneration()
     def setConnected(self, isConnected):
         self.connected = isConnected
+        self.bumpGeneration()
     def setLastMessageReceived(self, when):
         self._lastMessageReceived = when
 
@@ -75,8 +87,10 @@ class SlaveStatus:
 
     def buildStarted(self, build):
         self.runningBuilds.append(build)
+        self.bumpGeneration()
     def buildFinished(self, build):
         self.runningBuilds.remove(build)
+        self.bumpGeneration()
 
     def getGraceful(self):
         """Return the graceful shutdown flag"""
@@ -84,6 +98,7 @@ class SlaveStatus:
     def setGraceful(self, graceful):
         """Set the graceful shutdown flag, and notify all the watchers"""
         self.graceful_shutdown = graceful
+        self.bumpGeneration()
         for cb in self.graceful_callbacks:
             eventually(cb, graceful)
     def addGracefulWatcher(self, watcher):
@@ -19,10 +19,12 @@
 Implements the HTTP receiver."""
 
 import datetime
+import gzip
 import logging
 import os
 import urllib
 import urlparse
+from cStringIO import StringIO
 
 try:
     import simplejson as json
@@ -31,13 +33,31 @@ except ImportError:
     import json
 
 from buildbot.status.base import StatusReceiverMultiService
-from buildbot.status.persistent_queue import DiskQueue, IndexedQueue, \
+from buildbot.status.persistent_queue import IndexedQueue, JournalQueue, \
         MemoryQueue, PersistentQueue
 from buildbot.status.web.status_json import FilterOut
-from twisted.internet import defer, reactor
+from twisted.internet import defer, reactor, protocol
 from twisted.python import log
-from twisted.web import client
+from twisted.web import client, error, http
+from twisted.web.http_headers import Headers
 
+try:
+    # persistent connections need Twisted-12.1 or higher
+    from twisted.web.client import Agent, FileBodyProducer, \
+            HTTPConnectionPool, ResponseDone
+except ImportError:
+    HTTPConnectionPool = None
+
+
+
+class _PendingEvent(object):
+    """An event which has not been serialized yet."""
+
+    def __init__(self, event, timestamp, objs):
+        self.event = event
+        self.timestamp = timestamp
+        self.objs = objs
+        self.superseded = False
 
 
 class StatusPush(StatusReceiverMultiService):
@@ -49,8 +69,40 @@ class StatusPush(StatusReceiverMultiService):
     shutdown so they can be pushed back when the master is restarted.
     """
 
+    # Events which only report the latest state of an object, mapped to the
+    # name of that object in their payload.  While such an event waits to be
+    # sent, a newer one for the same object replaces it.
+    collapsibleEvents = {
+        'builderChangedState': 'builderName',
+        'buildETAUpdate': 'build',
+        'stepTextChanged': 'step',
+        'stepText2Changed': 'step',
+        'stepETAUpdate': 'step',
+    }
+
+    # asDict() fields which can be projected without calling asDict(), and
+    # the methods which return them.
+    projectableFields = {
+        'name': 'getName',
+        'number': 'getNumber',
+        'reason': 'getReason',
+        'results': 'getResults',
+        'slave': 'getSlavename',
+        'text': 'getText',
+        'times': 'getTimes',
+        'eta': 'getETA',
+        'isStarted': 'isStarted',
+        'isFinished': 'isFinished',
+    }
+
+    # the constructor arguments, as given
+    compare_attrs = ["pushCb", "queueArg", "path", "filter", "bufferDelay",
+                     "retryDelay", "blackList", "projections"]
+    keepOnReconfig = True
+
     def __init__(self, serverPushCb, queue=None, path=None, filter=True,
-                 bufferDelay=1, retryDelay=5, blackList=None):
+                 bufferDelay=1, retryDelay=5, blackList=None,
+                 projections=None):
         """
         @serverPushCb: callback to be used. It receives 'self' as parameter. It
         should call self.queueNextServerPush() when it's done to queue the next
@@ -66,10 +118,16 @@ class StatusPush(StatusReceiverMultiService):
         @retryDelay: amount of time between retries when no items were pushed on
         last serverPushCb call.
         @blackList: events that shouldn't be sent.
+        @projections: fields to send for the objects of some events, as a
+        dict mapping an event name to a dict mapping the name of an object
+        in its payload to a list of field names, e.g. {'buildFinished':
+        {'build': ['number', 'results', 'times']}}.
         """
         StatusReceiverMultiService.__init__(self)
 
         # Parameters.
+        self.pushCb = serverPushCb
+        self.queueArg = queue
         self.queue = queue
         if self.queue is None:
             self.queue = MemoryQueue()
@@ -81,6 +139,7 @@ class StatusPush(StatusReceiverMultiService):
         if not callable(serverPushCb):
             raise NotImplementedError('Please pass serverPushCb parameter.')
         def hookPushCb():
+            self.flushPending()
             # Update the index so we know if the next push succeed or not, don't
             # update the value when the queue is empty.
             if not self.queue.nbItems():
@@ -89,12 +148,17 @@ class StatusPush(StatusReceiverMultiService):
             return serverPushCb(self)
         self.serverPushCb = hookPushCb
         self.blackList = blackList
+        self.projections = projections or {}
 
         # Other defaults.
         # IDelayedCall object that represents the next queued push.
         self.task = None
         self.stopped = False
         self.lastIndex = -1
+        # Events pushed since the last push to the server; they are
+        # serialized into the queue just before it.
+        self.pending = []
+        self.pendingUpdates = {}
         self.state = {}
         self.state['started'] = str(datetime.datetime.utcnow())
         self.state['next_id'] = 1
@@ -197,6 +261,7 @@ class StatusPush(StatusReceiverMultiService):
             d = defer.succeed(None)
 
         # We're dying, make sure we save the results.
+        self.flushPending()
         self.queue.save()
         if self.path and os.path.isdir(self.path):
             state_path = os.path.join(self.path, 'state')
@@ -213,29 +278,64 @@ class StatusPush(StatusReceiverMultiService):
         - Queued in memory to reduce network usage
         - Queued to disk when the sink server is down
         - Pushed (along the other queued items) to the server
+
+        The objects of the event are serialized when it is about to be
+        pushed, so they describe the state at that time.
         """
         if self.blackList and event in self.blackList:
             return
-        # First, generate the packet.
-        packet = {}
-        packet['id'] = self.state['next_id']
-        self.state['next_id'] += 1
-        packet['timestamp'] = str(datetime.datetime.utcnow())
-        packet['project'] = self.status.getTitle()
-        packet['started'] = self.state['started']
-        packet['event'] = event
-        packet['payload'] = {}
-        for obj_name, obj in objs.items():
-            if hasattr(obj, 'asDict'):
-                obj = obj.asDict()
-            if self.filter:
-                obj = FilterOut(obj)
-            packet['payload'][obj_name] = obj
-        self.queue.pushItem(packet)
+        pending = _PendingEvent(event, str(datetime.datetime.utcnow()), objs)
+        if event in self.collapsibleEvents:
+            obj = objs.get(self.collapsibleEvents[event])
+            if not isinstance(obj, basestring):
+                obj = id(obj)
+            key = (event, obj)
+            if key in self.pendingUpdates:
+                self.pendingUpdates[key].superseded = True
+            self.pendingUpdates[key] = pending
+        self.pending.append(pending)
         if self.task is None or not self.task.active():
             # No task queued since it was probably idle, let's queue a task.
             return self.queueNextServerPush()
 
+    def flushPending(self):
+        """Serialize the pending events into the queue."""
+        pending, self.pending = self.pending, []
+        self.pendingUpdates = {}
+        for p in pending:
+            if p.superseded:
+                continue
+            packet = {}
+            packet['id'] = self.state['next_id']
+            self.state['next_id'] += 1
+            packet['timestamp'] = p.timestamp
+            packet['project'] = self.status.getTitle()
+            packet['started'] = self.state['started']
+            packet['event'] = p.event
+            packet['payload'] = {}
+            for obj_name, obj in p.objs.items():
+                fields = self.projections.get(p.event, {}).get(obj_name)
+                if fields is not None and hasattr(obj, 'asDict'):
+                    obj = self.project(obj, fields)
+                elif hasattr(obj, 'asDict'):
+                    obj = obj.asDict()
+                elif callable(obj):
+                    obj = obj()
+                if self.filter:
+                    obj = FilterOut(obj)
+                packet['payload'][obj_name] = obj
+            self.queue.pushItem(packet)
+
+    def project(self, obj, fields):
+        """Returns a dict of the given asDict() fields of obj."""
+        getters = [ self.projectableFields.get(f) for f in fields ]
+        if not [ g for g in getters if g is None or not hasattr(obj, g) ]:
+            # Avoid serializing the whole object.
+            return dict([ (f, getattr(obj, g)())
+                          for f, g in zip(fields, getters) ])
+        d = obj.asDict()
+        return dict([ (f, d[f]) for f in fields if f in d ])
+
     #### Events
 
     def initialPush(self):
@@ -270,41 +370,41 @@ class StatusPush(StatusReceiverMultiService):
 
     def stepStarted(self, build, step):
         self.push('stepStarted',
-                  properties=build.getProperties().asList(),
+                  properties=build.getProperties().asList,
                   step=step)
 
     def stepTextChanged(self, build, step, text):
         self.push('stepTextChanged',
-                  properties=build.getProperties().asList(),
+                  properties=build.getProperties().asList,
                   step=step,
                   text=text)
 
     def stepText2Changed(self, build, step, text2):
         self.push('stepText2Changed',
-                  properties=build.getProperties().asList(),
+                  properties=build.getProperties().asList,
                   step=step,
                   text2=text2)
 
     def stepETAUpdate(self, build, step, ETA, expectations):
         self.push('stepETAUpdate',
-                  properties=build.getProperties().asList(),
+                  properties=build.getProperties().asList,
                   step=step,
                   ETA=ETA,
                   expectations=expectations)
 
     def logStarted(self, build, step, log):
         self.push('logStarted',
-                  properties=build.getProperties().asList(),
+                  properties=build.getProperties().asList,
                   step=step)
 
     def logFinished(self, build, step, log):
         self.push('logFinished',
-                  properties=build.getProperties().asList(),
+                  properties=build.getProperties().asList,
                   step=step)
 
     def stepFinished(self, build, step, results):
         self.push('stepFinished',
-                  properties=build.getProperties().asList(),
+                  properties=build.getProperties().asList,
                   step=step)
 
     def buildFinished(self, builderName, build, results):
@@ -323,12 +423,34 @@ class StatusPush(StatusReceiverMultiService):
         self.push('slaveDisconnected', slavename=slavename)
 
 
+class _DiscardBody(protocol.Protocol):
+    """Reads a response body, so that its connection can be reused."""
+
+    def __init__(self, finished):
+        self.finished = finished
+
+    def dataReceived(self, data):
+        pass
+
+    def connectionLost(self, reason):
+        if reason.check(ResponseDone, http.PotentialDataLoss):
+            self.finished.callback(None)
+        else:
+            self.finished.errback(reason)
+
+
 class HttpStatusPush(StatusPush):
     """Event streamer to a HTTP server."""
 
+    # the queue is built from maxMemoryItems and maxDiskItems
+    compare_attrs = ["serverUrl", "debug", "maxMemoryItems", "maxDiskItems",
+                     "chunkSize", "maxHttpRequestSize", "compress",
+                     "maxInFlight", "filter", "bufferDelay", "retryDelay",
+                     "blackList", "projections"]
+
     def __init__(self, serverUrl, debug=None, maxMemoryItems=None,
                  maxDiskItems=None, chunkSize=200, maxHttpRequestSize=2**20,
-                 **kwargs):
+                 compress=False, maxInFlight=1, **kwargs):
         """
         @serverUrl: Base URL to be used to push events notifications.
         @maxMemoryItems: Maximum number of items to keep queued in memory.
@@ -338,20 +460,39 @@ class HttpStatusPush(StatusPush):
         @chunkSize: maximum number of items to send in each at each HTTP POST.
         @maxHttpRequestSize: limits the size of encoded data for AE, the default
         is 1MB.
+        @compress: send the items as a gzip-compressed JSON body, instead of
+        a url-encoded form.
+        @maxInFlight: maximum number of HTTP POSTs in progress at once.
         """
         # Parameters.
         self.serverUrl = serverUrl
         self.debug = debug
+        self.maxMemoryItems = maxMemoryItems
+        self.maxDiskItems = maxDiskItems
         self.chunkSize = chunkSize
         self.lastPushWasSuccessful = True
         self.maxHttpRequestSize = maxHttpRequestSize
+        self.compress = compress
+        self.maxInFlight = max(maxInFlight, 1)
+        # Items of each push in progress, in the order they were sent, and
+        # those of the pushes that failed, to be queued back once the others
+        # are done.
+        self.inFlight = []
+        self.failedChunks = []
+        self.idleDeferreds = []
+        if HTTPConnectionPool:
+            self.pool = HTTPConnectionPool(reactor, persistent=True)
+            self.pool.maxPersistentPerHost = self.maxInFlight
+            self.agent = Agent(reactor, pool=self.pool)
+        else:
+            self.pool = None
         if maxDiskItems != 0:
             # The queue directory is determined by the server url.
             path = ('events_' +
                     urlparse.urlparse(self.serverUrl)[1].split(':')[0])
             queue = PersistentQueue(
                         primaryQueue=MemoryQueue(maxItems=maxMemoryItems),
-                        secondaryQueue=DiskQueue(path, maxItems=maxDiskItems))
+                        secondaryQueue=JournalQueue(path, maxItems=maxDiskItems))
         else:
             path = None
             queue = MemoryQueue(maxItems=maxMemoryItems)
@@ -360,9 +501,30 @@ class HttpStatusPush(StatusPush):
         StatusPush.__init__(self, serverPushCb=HttpStatusPush.pushHttp,
                             queue=queue, path=path, **kwargs)
 
+    def stopService(self):
+        d = StatusPush.stopService(self)
+        if self.pool:
+            d.addCallback(lambda _ : self.pool.closeCachedConnections())
+        return d
+
     def wasLastPushSuccessful(self):
         return self.lastPushWasSuccessful
 
+    def encodeItem(self, item):
+        """Returns the encoded form of an item, as it appears in a request
+        body."""
+        if self.debug:
+            packet = json.dumps(item, indent=2, sort_keys=True)
+        else:
+            packet = json.dumps(item, separators=(',',':'))
+        if self.compress:
+            # The size limit applies to the uncompressed body, which is
+            # larger.
+            return packet
+        # Url-encoding the list of packets is the same as url-encoding each
+        # packet, so the encoded size can be added up as items are added.
+        return urllib.quote_plus(packet)
+
     def popChunk(self):
         """Pops items from the pending list.
 
@@ -372,59 +534,146 @@ class HttpStatusPush(StatusPush):
         else:
             chunkSize = 1
 
+        if self.compress:
+            start, separator, end = '[', ',', ']'
+        else:
+            start, separator, end = [ 'packets=' + urllib.quote_plus('[') ] + \
+                    [ urllib.quote_plus(c) for c in ',]' ]
+        overhead = len(start) + len(end)
+
         while True:
             items = self.queue.popChunk(chunkSize)
-            if self.debug:
-                packets = json.dumps(items, indent=2, sort_keys=True)
-            else:
-                packets = json.dumps(items, separators=(',',':'))
-            data = urllib.urlencode({'packets': packets})
-            if (not self.maxHttpRequestSize or
-                len(data) < self.maxHttpRequestSize):
-                return (data, items)
-
-            if chunkSize == 1:
-                # This packet is just too large. Drop this packet.
-                log.msg("ERROR: packet %s was dropped, too large: %d > %d" %
-                        (items[0]['id'], len(data), self.maxHttpRequestSize))
-                chunkSize = self.chunkSize
-            else:
-                # Try with half the packets.
-                chunkSize /= 2
-                self.queue.insertBackChunk(items)
+            sent = []
+            parts = []
+            size = overhead
+            for i, item in enumerate(items):
+                part = self.encodeItem(item)
+                itemSize = len(part)
+                if parts:
+                    itemSize += len(separator)
+                if (self.maxHttpRequestSize and
+                    size + itemSize >= self.maxHttpRequestSize):
+                    if not parts:
+                        # This packet is just too large. Drop this packet.
+                        log.msg("ERROR: packet %s was dropped, too large: "
+                                "%d > %d" % (item['id'], overhead + len(part),
+                                             self.maxHttpRequestSize))
+                        continue
+                    # Send the others next time.
+                    self.queue.insertBackChunk(items[i:])
+                    break
+                parts.append(part)
+                sent.append(item)
+                size += itemSize
+            if sent or not items:
+                data = start + separator.join(parts) + end
+                if self.compress:
+                    buf = StringIO()
+                    f = gzip.GzipFile(fileobj=buf, mode='wb')
+                    f.write(data)
+                    f.close()
+                    data = buf.getvalue()
+                return (data, sent)
+            # Everything popped was dropped, try the next items.
+            chunkSize = self.chunkSize
 
     def pushHttp(self):
-        """Do the HTTP POST to the server."""
-        (encoded_packets, items) = self.popChunk()
+        """Do the HTTP POSTs to the server, up to maxInFlight at once."""
+        while (len(self.inFlight) < self.maxInFlight and
+               self.queue.nbItems()):
+            # While the server is down, only probe it with one push.
+            probing = not self.wasLastPushSuccessful()
+            if probing and self.inFlight:
+                break
+            (encoded_packets, items) = self.popChunk()
+            if not items:
+                break
+            self.sendChunk(encoded_packets, items)
+            if probing:
+                break
+        if not self.inFlight:
+            return self.queueNextServerPush()
+        d = defer.Deferred()
+        self.idleDeferreds.append(d)
+        return d
+
+    def sendChunk(self, encoded_packets, items):
+        self.inFlight.append(items)
 
         def Success(result):
             """Queue up next push."""
             log.msg('Sent %d events to %s' % (len(items), self.serverUrl))
-            self.lastPushWasSuccessful = True
-            return self.queueNextServerPush()
+            if not self.failedChunks:
+                self.lastPushWasSuccessful = True
+            self.inFlight.remove(items)
+            if (self.maxInFlight > 1 and not self.stopped and
+                not self.failedChunks and
+                self.queue.nbItems() >= self.chunkSize):
+                # There is a backlog, keep sending without waiting.
+                self.pushHttp()
+            return self.pushDone()
 
         def Failure(result):
             """Insert back items not sent and queue up next push."""
             # Server is now down.
             log.msg('Failed to push %d events to %s: %s' %
                     (len(items), self.serverUrl, str(result)))
-            self.queue.insertBackChunk(items)
+            self.lastPushWasSuccessful = False
+            self.inFlight.remove(items)
+            self.failedChunks.append(items)
+            return self.pushDone()
+
+        d = self.postData(encoded_packets)
+        d.addCallbacks(Success, Failure)
+        return d
+
+    def pushDone(self):
+        """Called when a push finishes, to queue back the items of failed
+        pushes and queue up the next push once none are in progress."""
+        if self.inFlight:
+            return
+        if self.failedChunks:
+            # Queue back the items in the order they were popped.
+            for items in reversed(self.failedChunks):
+                self.queue.insertBackChunk(items)
+            self.failedChunks = []
             if self.stopped:
-                # Bad timing, was being called on shutdown and the server died
-                # on us. Make sure the queue is saved since we just queued back
-                # items.
+                # Bad timing, was being called on shutdown and the server
+                # died on us. Make sure the queue is saved since we just
+                # queued back items.
                 self.queue.save()
-            self.lastPushWasSuccessful = False
-            return self.queueNextServerPush()
-
-        # Trigger the HTTP POST request.
-        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
-        connection = client.getPage(self.serverUrl,
-                                    method='POST',
-                                    postdata=encoded_packets,
-                                    headers=headers,
-                                    agent='buildbot')
-        connection.addCallbacks(Success, Failure)
-        return connection
+        idle, self.idleDeferreds = self.idleDeferreds, []
+        d = self.queueNextServerPush()
+        for w in idle:
+            w.callback(None)
+        return d
+
+    def postData(self, data):
+        """Do the HTTP POST of data, firing when the server has answered with
+        a success."""
+        if self.compress:
+            headers = {'Content-Type': 'application/json',
+                       'Content-Encoding': 'gzip'}
+        else:
+            headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+        if not self.pool:
+            return client.getPage(self.serverUrl, method='POST',
+                                  postdata=data, headers=headers,
+                                  agent='buildbot')
+
+        headers = Headers(dict([ (k, [v]) for k, v in headers.items() ]))
+        headers.addRawHeader('User-Agent', 'buildbot')
+        d = self.agent.request('POST', self.serverUrl, headers,
+                               FileBodyProducer(StringIO(data)))
+        def readBody(response):
+            finished = defer.Deferred()
+            response.deliverBody(_DiscardBody(finished))
+            if not 200 <= response.code < 300:
+                finished.addCallback(lambda _ :
+                    defer.fail(error.Error(response.code,
+                                           http.RESPONSES.get(response.code))))
+            return finished
+        d.addCallback(readBody)
+        return d
 
 # vim: set ts=4 sts=4 sw=4 et:
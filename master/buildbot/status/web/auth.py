@@ -16,6 +16,7 @@
 
 import os
 from zope.interface import Interface, Attribute, implements
+from buildbot import util
 from buildbot.status.web.base import HtmlResource, ActionResource
 from buildbot.status.web.base import path_to_authfail
 
@@ -53,10 +54,12 @@ class AuthBase:
         """default dummy impl"""
         return dict(userName=user, fullName=user, email=user+"@localhost", groups=[ user ])
 
-class BasicAuth(AuthBase):
+class BasicAuth(AuthBase, util.ComparableMixin):
     implements(IAuth)
     """Implement basic authentication against a list of user/passwd."""
 
+    compare_attrs = ['userpass']
+
     userpass = []
     """List of user/pass tuples."""
 
@@ -81,10 +84,12 @@ class BasicAuth(AuthBase):
         self.err = "Invalid username or password"
         return False
 
-class HTPasswdAuth(AuthBase):
+class HTPasswdAuth(AuthBase, util.ComparableMixin):
     implements(IAuth)
     """Implement authentication against an .htpasswd file."""
 
+    compare_attrs = ['file']
+
     file = ""
     """Path to the .htpasswd file to use."""
 
@@ -118,10 +123,13 @@ class HTPasswdAuth(AuthBase):
             self.err = "Invalid user/passwd"
         return res
 
-class UsersAuth(AuthBase):
+class UsersAuth(AuthBase, util.ComparableMixin):
     """Implement authentication against users in database"""
     implements(IAuth)
 
+    # takes no arguments
+    compare_attrs = []
+
     def authenticate(self, user, passwd):
         """
         It checks for a matching uid in the database for the credentials
@@ -14,13 +14,16 @@
 # Copyright Buildbot Team Members
 
 from twisted.internet import defer
+from buildbot import util
 from buildbot.status.web.auth import IAuth
 from buildbot.status.web.session import SessionManager
 
 COOKIE_KEY="BuildBotSession"
-class Authz(object):
+class Authz(util.ComparableMixin, object):
     """Decide who can do what."""
 
+    compare_attrs = ['auth', 'useHttpHeader', 'config']
+
     knownActions = [
     # If you add a new action here, be sure to also update the documentation
     # at docs/cfg-statustargets.texinfo
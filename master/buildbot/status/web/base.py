@@ -22,6 +22,7 @@ from twisted.internet import defer
 from twisted.web import resource, static, server
 from twisted.python import log
 from buildbot.status import builder, buildstep, build
+from buildbot.status.web import matrix
 from buildbot.status.results import SUCCESS, WARNINGS, FAILURE, SKIPPED
 from buildbot.status.results import EXCEPTION, RETRY
 from buildbot import version, util
@@ -93,7 +94,7 @@ def build_get_class(b):
     """
     # FIXME: this getResults duplicity might need to be fixed
     result = b.getResults()
-    if isinstance(b, build.BuildStatus):
+    if isinstance(b, (build.BuildStatus, matrix.MatrixEntry)):
         result = b.getResults()
     elif isinstance(b, buildstep.BuildStepStatus):
         result = b.getResults()[0]
@@ -22,16 +22,19 @@ from twisted.application import strports, service
 from twisted.web import server, distrib, static
 from twisted.spread import pb
 from twisted.web.util import Redirect
-from buildbot import config
+from buildbot import config, util
 from buildbot.interfaces import IStatusReceiver
 from buildbot.status.web.base import StaticFile, createJinjaEnv
 from buildbot.status.web.feeds import Rss20StatusResource, \
      Atom10StatusResource
-from buildbot.status.web.waterfall import WaterfallStatusResource
+from buildbot.status.web.waterfall import WaterfallStatusResource, \
+     WaterfallTimeline
 from buildbot.status.web.console import ConsoleStatusResource
 from buildbot.status.web.olpb import OneLinePerBuild
 from buildbot.status.web.grid import GridStatusResource
 from buildbot.status.web.grid import TransposedGridStatusResource
+from buildbot.status.web.matrix import BuildMatrix
+from buildbot.status.web.events import EventHub, EventsResource
 from buildbot.status.web.changes import ChangesResource
 from buildbot.status.web.builder import BuildersResource
 from buildbot.status.web.buildstatus import BuildStatusStatusResource
@@ -47,7 +50,8 @@ from buildbot.status.web.change_hook import ChangeHookResource
 # this class contains the WebStatus class.  Basic utilities are in base.py,
 # and specific pages are each in their own module.
 
-class WebStatus(service.MultiService):
+class WebStatus(service.MultiService, util.ComparableMixin,
+                config.ReconfigurableServiceMixin):
     implements(IStatusReceiver)
     # TODO: IStatusReceiver is really about things which subscribe to hear
     # about buildbot events. We need a different interface (perhaps a parent
@@ -136,11 +140,17 @@ class WebStatus(service.MultiService):
 
     """
 
-    # we are not a ComparableMixin, and therefore the webserver will be
-    # rebuilt every time we reconfig. This is because WebStatus.putChild()
-    # makes it too difficult to tell whether two instances are the same or
-    # not (we'd have to do a recursive traversal of all children to discover
-    # all the changes).
+    # A WebStatus that is equal to its new version is left running on
+    # reconfig.  Resources are compared by identity, so one with children
+    # added by putChild() in the config file is always rebuilt, as is one
+    # with its own site.
+    compare_attrs = ["http_port", "distrib_port", "authz", "public_html",
+                     "site", "numbuilds", "num_events", "num_events_max",
+                     "orderConsoleByTime", "changecommentlink", "revlink",
+                     "projects", "repositories", "logRotateLength",
+                     "maxRotatedFiles", "change_hook_dialects",
+                     "provide_feeds", "extraChildren"]
+    keepOnReconfig = True
 
     def __init__(self, http_port=None, distrib_port=None, allowForce=None,
                  public_html="public_html", site=None, numbuilds=20,
@@ -278,7 +288,9 @@ class WebStatus(service.MultiService):
             if distrib_port[0] in "/~.": # pathnames
                 distrib_port = "unix:%s" % distrib_port
         self.distrib_port = distrib_port
+        self.numbuilds = numbuilds
         self.num_events = num_events
+        self.num_events_max = None
         if num_events_max:
             if num_events_max < num_events:
                 raise config.ConfigErrors([
@@ -318,8 +330,10 @@ class WebStatus(service.MultiService):
         self.logRotateLength = logRotateLength
         self.maxRotatedFiles = maxRotatedFiles        
 
-        # create the web site page structure
+        # create the web site page structure; children added after the
+        # constructor are also kept in extraChildren
         self.childrenToBeAdded = {}
+        self.extraChildren = None
         self.setupUsualPages(numbuilds=numbuilds, num_events=num_events,
                              num_events_max=num_events_max)
 
@@ -331,6 +345,16 @@ class WebStatus(service.MultiService):
         # keep track of cached connections so we can break them when we shut
         # down. See ticket #102 for more details.
         self.channels = weakref.WeakKeyDictionary()
+
+        # the timeline shared by all waterfall pages; see getWaterfallTimeline
+        self.waterfallTimeline = None
+
+        # the build index shared by the console and grid pages; see
+        # getBuildMatrix
+        self.buildMatrix = None
+
+        # the source of events for /events; see getEventHub
+        self.eventHub = None
         
         # do we want to allow change_hook
         self.change_hook_dialects = {}
@@ -344,6 +368,8 @@ class WebStatus(service.MultiService):
         else:
             self.provide_feeds = provide_feeds
 
+        self.extraChildren = {}
+
     def setupUsualPages(self, numbuilds, num_events, num_events_max):
         #self.putChild("", IndexOrWaterfallRedirection())
         self.putChild("waterfall", WaterfallStatusResource(num_events=num_events,
@@ -357,6 +383,7 @@ class WebStatus(service.MultiService):
         self.putChild("changes", ChangesResource())
         self.putChild("buildslaves", BuildSlavesResource())
         self.putChild("buildstatus", BuildStatusStatusResource())
+        self.putChild("events", EventsResource())
         self.putChild("one_line_per_build",
                       OneLinePerBuild(numbuilds=numbuilds))
         self.putChild("about", AboutBuildbot())
@@ -399,12 +426,7 @@ class WebStatus(service.MultiService):
         maxRotatedFiles = either(self.maxRotatedFiles, self.master.log_rotation.maxRotatedFiles)
 
         # Set up the jinja templating engine.
-        if self.revlink:
-            revlink = self.revlink
-        else:
-            revlink = self.master.config.revlink
-        self.templates = createJinjaEnv(revlink, self.changecommentlink,
-                                        self.repositories, self.projects)
+        self.setupTemplates(self.master.config.revlink)
 
         if not self.site:
             
@@ -444,6 +466,22 @@ class WebStatus(service.MultiService):
 
         self.setupSite()
 
+    def setupTemplates(self, globalRevlink):
+        if self.revlink:
+            revlink = self.revlink
+        else:
+            revlink = globalRevlink
+        self.templatesRevlink = revlink
+        self.templates = createJinjaEnv(revlink, self.changecommentlink,
+                                        self.repositories, self.projects)
+
+    def reconfigService(self, new_config):
+        # when left running across a reconfig, follow the global revlink
+        if not self.revlink and self.templatesRevlink != new_config.revlink:
+            self.setupTemplates(new_config.revlink)
+        return config.ReconfigurableServiceMixin.reconfigService(self,
+                                                            new_config)
+
     def setupSite(self):
         # this is responsible for creating the root resource. It isn't done
         # at __init__ time because we need to reference the parent's basedir.
@@ -480,11 +518,22 @@ class WebStatus(service.MultiService):
     def putChild(self, name, child_resource):
         """This behaves a lot like root.putChild() . """
         self.childrenToBeAdded[name] = child_resource
+        if self.extraChildren is not None:
+            self.extraChildren[name] = child_resource
 
     def registerChannel(self, channel):
         self.channels[channel] = 1 # weakrefs
 
     def stopService(self):
+        if self.waterfallTimeline:
+            self.waterfallTimeline.detach()
+            self.waterfallTimeline = None
+        if self.buildMatrix:
+            self.buildMatrix.detach()
+            self.buildMatrix = None
+        if self.eventHub:
+            self.eventHub.detach()
+            self.eventHub = None
         for channel in self.channels:
             try:
                 channel.transport.loseConnection()
@@ -500,6 +549,36 @@ class WebStatus(service.MultiService):
     def getChangeSvc(self):
         return self.master.change_svc
 
+    def getWaterfallTimeline(self):
+        """
+        Get the L{WaterfallTimeline} used by the waterfall pages, creating it
+        and subscribing it to status events the first time it is needed.
+        """
+        if not self.waterfallTimeline:
+            self.waterfallTimeline = WaterfallTimeline()
+            self.waterfallTimeline.attach(self.getStatus())
+        return self.waterfallTimeline
+
+    def getBuildMatrix(self):
+        """
+        Get the L{BuildMatrix} used by the console and grid pages, creating it
+        and subscribing it to status events the first time it is needed.
+        """
+        if not self.buildMatrix:
+            self.buildMatrix = BuildMatrix()
+            self.buildMatrix.attach(self.getStatus())
+        return self.buildMatrix
+
+    def getEventHub(self):
+        """
+        Get the L{EventHub} feeding the /events clients, creating it and
+        subscribing it to status events the first time it is needed.
+        """
+        if not self.eventHub:
+            self.eventHub = EventHub()
+            self.eventHub.attach(self.getStatus())
+        return self.eventHub
+
     def getPortnum(self):
         # this is for the benefit of unit tests
         s = list(self)[0]
@@ -20,7 +20,9 @@ import urllib
 from twisted.internet import defer
 from buildbot import util
 from buildbot.status import builder
+from buildbot.status.results import SUCCESS, WARNINGS
 from buildbot.status.web.base import HtmlResource
+from buildbot.status.web.matrix import ANYBRANCH
 from buildbot.changes import changes
 
 class DoesNotPassFilter(Exception): pass # Used for filtering revs
@@ -57,8 +59,6 @@ def getResultsClass(results, prevResults, inProgress):
     # Any other results? Like EXCEPTION?
     return "exception"
 
-class ANYBRANCH: pass # a flag value, used below
-
 class DevRevision:
     """Helper class that contains all the information we need for a revision."""
 
@@ -162,20 +162,17 @@ class ConsoleStatusResource(HtmlResource):
         debugInfo["source_fetch_len"] = len(allChanges)
         return allChanges                
 
+    def getBuildMatrix(self, request):
+        return request.site.buildbot_service.getBuildMatrix()
+
     @defer.deferredGenerator
     def getAllChanges(self, request, status, debugInfo):
         master = request.site.buildbot_service.master
 
+        # the build matrix keeps the recent changes in memory, so this only
+        # goes to the database the first time
         wfd = defer.waitForDeferred(
-                master.db.changes.getRecentChanges(25))
-        yield wfd
-        chdicts = wfd.getResult()
-
-        # convert those to Change instances
-        wfd = defer.waitForDeferred(
-            defer.gatherResults([
-                changes.Change.fromChdict(master, chdict)
-                for chdict in chdicts ]))
+                self.getBuildMatrix(request).getRecentChanges(master, 25))
         yield wfd
         allChanges = wfd.getResult()
 
@@ -235,11 +232,9 @@ class ConsoleStatusResource(HtmlResource):
         revision = lastRevision 
 
         builds = []
-        build = self.getHeadBuild(builder)
-        number = 0
-        while build and number < numBuilds:
+        entries = self.getBuildMatrix(request).getEntries(builder)
+        for build in entries[:numBuilds]:
             debugInfo["builds_scanned"] += 1
-            number += 1
 
             # Get the last revision in this build.
             # We first try "got_revision", but if it does not work, then
@@ -253,7 +248,15 @@ class ConsoleStatusResource(HtmlResource):
             # with the update source step. We need to find a way to tell the
             # user that his change might have broken the source update.
             if got_rev != -1:
-                details = self.getBuildDetails(request, builderName, build)
+                # Successful builds have nothing to explain on the page, so
+                # only the others (including unfinished builds) need to be
+                # loaded to look at their steps.
+                details = {}
+                if build.getResults() not in (SUCCESS, WARNINGS):
+                    fullBuild = builder.getBuild(build.getNumber())
+                    if fullBuild:
+                        details = self.getBuildDetails(request, builderName,
+                                                       fullBuild)
                 devBuild = DevBuild(got_rev, build, details)
                 builds.append(devBuild)
 
@@ -264,8 +267,6 @@ class ConsoleStatusResource(HtmlResource):
                     devBuild, current_revision):
                     break
 
-            build = build.getPreviousBuild()
-
         return builds
 
     def getChangeForBuild(self, build, revision):
@@ -0,0 +1,488 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+"""Live status events over HTTP, as Server-Sent Events or long-polls."""
+
+import time
+
+from zope.interface import implements
+from twisted.internet import reactor, task, interfaces as tw_interfaces
+from twisted.python import log
+from twisted.web import resource, server
+
+from buildbot.status.base import StatusReceiverBase
+from buildbot.util import json
+
+class StatusEvent(object):
+    """
+    A single status event.  It is serialized once, when it is created, no
+    matter how many clients it is sent to.
+
+    @ivar id: the event id, a string which is unique within this master
+    process
+    @ivar builder: the name of the builder this event concerns, or None
+    @ivar category: that builder's category, or None
+    @ivar branch: the branch this event concerns, or None
+    """
+
+    def __init__(self, id, type, data, builder=None, category=None,
+                 branch=None):
+        self.id = id
+        self.type = type
+        self.builder = builder
+        self.category = category
+        self.branch = branch
+        data = json.dumps(data, sort_keys=True, separators=(',',':'))
+        self.sse = 'id: %s\nevent: %s\ndata: %s\n\n' % (id, type, data)
+        self.json = '{"id":%s,"event":%s,"data":%s}' % (
+                json.dumps(id), json.dumps(type), data)
+
+
+class EventFilter(object):
+    """
+    Which events a client wants to see.  An empty list matches anything;
+    otherwise events must match one of the given values, and events without
+    a builder, category, or branch do not match a filter on that field.
+    """
+
+    def __init__(self, builders=[], categories=[], branches=[]):
+        self.builders = builders
+        self.categories = categories
+        self.branches = branches
+
+    def matches(self, event):
+        if self.builders and event.builder not in self.builders:
+            return False
+        if self.categories and event.category not in self.categories:
+            return False
+        if self.branches and event.branch not in self.branches:
+            return False
+        return True
+
+
+class EventHub(StatusReceiverBase):
+    """
+    I turn status events into L{StatusEvent}s, keep the most recent of them
+    so that clients can resume after a reconnect, and hand them to the
+    connected clients that want them.  One hub is shared by all clients, so
+    each event is only serialized once.
+
+    @ivar historySize: the number of past events kept for resuming clients
+
+    @ivar heartbeatInterval: seconds between keepalive messages to
+    streaming clients
+    """
+
+    historySize = 1000
+    heartbeatInterval = 15
+
+    def __init__(self, _reactor=reactor):
+        self._reactor = _reactor
+        self.status = None
+        self.builderStatuses = {}
+        # event ids start over when the master restarts, so they carry a
+        # marker of this process, so that stale cursors can be recognized
+        self.epoch = '%x' % int(time.time())
+        self.lastSerial = 0
+        self.history = []
+        # clients filtering on builder, by builder name; and all others
+        self.clientsByBuilder = {}
+        self.otherClients = set()
+        self.streamingClients = 0
+        self.heartbeat = None
+
+    def attach(self, status):
+        self.status = status
+        status.subscribe(self)
+
+    def detach(self):
+        for client in self.getClients():
+            client.close()
+        if self.status:
+            self.status.unsubscribe(self)
+            for builder_status in self.builderStatuses.values():
+                builder_status.unsubscribe(self)
+            self.status = None
+        self.builderStatuses = {}
+
+    # clients
+
+    def getClients(self):
+        clients = set(self.otherClients)
+        for s in self.clientsByBuilder.values():
+            clients.update(s)
+        return clients
+
+    def addClient(self, client):
+        if client.filter.builders:
+            for name in client.filter.builders:
+                self.clientsByBuilder.setdefault(name, set()).add(client)
+        else:
+            self.otherClients.add(client)
+        if client.streaming:
+            self.streamingClients += 1
+            if not self.heartbeat:
+                self.heartbeat = task.LoopingCall(self._sendHeartbeat)
+                self.heartbeat.clock = self._reactor
+                self.heartbeat.start(self.heartbeatInterval, now=False)
+
+    def removeClient(self, client):
+        found = False
+        if client.filter.builders:
+            for name in client.filter.builders:
+                clients = self.clientsByBuilder.get(name)
+                if clients and client in clients:
+                    found = True
+                    clients.remove(client)
+                    if not clients:
+                        del self.clientsByBuilder[name]
+        elif client in self.otherClients:
+            found = True
+            self.otherClients.remove(client)
+        if found and client.streaming:
+            self.streamingClients -= 1
+            if not self.streamingClients and self.heartbeat:
+                self.heartbeat.stop()
+                self.heartbeat = None
+
+    def _sendHeartbeat(self):
+        for client in self.getClients():
+            if client.streaming:
+                client.heartbeat()
+
+    def getCursor(self):
+        """
+        Get the id of the most recent event, for clients that want only
+        events that come after now.
+        """
+        return '%s-%d' % (self.epoch, self.lastSerial)
+
+    def getEventsSince(self, cursor, filter):
+        """
+        Get the events after the one with id C{cursor} which match
+        C{filter}.
+
+        @returns: (events, complete), where complete is False if some events
+        after the cursor are no longer available, or the cursor is not
+        recognized
+        """
+        try:
+            epoch, serial = cursor.rsplit('-', 1)
+            serial = int(serial)
+        except (ValueError, AttributeError):
+            return [], False
+        if epoch != self.epoch or serial > self.lastSerial:
+            return [], False
+        # serials are consecutive, so the position of the next event in the
+        # history can be calculated
+        first = self.lastSerial - len(self.history) + 1
+        if serial + 1 < first:
+            return [], False
+        events = self.history[serial + 1 - first:]
+        return [ e for e in events if filter.matches(e) ], True
+
+    # publishing
+
+    def publish(self, type, data, builderName=None, branch=None):
+        category = None
+        if builderName in self.builderStatuses:
+            category = self.builderStatuses[builderName].getCategory()
+        self.lastSerial += 1
+        event = StatusEvent('%s-%d' % (self.epoch, self.lastSerial), type,
+                            data, builder=builderName, category=category,
+                            branch=branch)
+        self.history.append(event)
+        # trim occasionally, rather than on every event
+        if len(self.history) > self.historySize * 2:
+            del self.history[:-self.historySize]
+
+        clients = list(self.otherClients)
+        if builderName in self.clientsByBuilder:
+            clients.extend(self.clientsByBuilder[builderName])
+        for client in clients:
+            if client.filter.matches(event):
+                try:
+                    client.eventReceived(event)
+                except:
+                    log.err(None, "while sending status event")
+        return event
+
+    def _buildInfo(self, build):
+        ss = build.getSourceStamp()
+        return (build.getBuilder().getName(), build.getNumber(),
+                ss and ss.branch)
+
+    # IStatusReceiver methods
+
+    def builderAdded(self, builderName, builder):
+        self.builderStatuses[builderName] = builder
+        self.publish('builderAdded', dict(builder=builderName),
+                     builderName=builderName)
+        return self
+
+    def builderRemoved(self, builderName):
+        self.publish('builderRemoved', dict(builder=builderName),
+                     builderName=builderName)
+        self.builderStatuses.pop(builderName, None)
+
+    def builderChangedState(self, builderName, state):
+        self.publish('builderChangedState',
+                     dict(builder=builderName, state=state),
+                     builderName=builderName)
+
+    def buildStarted(self, builderName, build):
+        ss = build.getSourceStamp()
+        branch = ss and ss.branch
+        self.publish('buildStarted',
+                     dict(builder=builderName, number=build.getNumber(),
+                          branch=branch, revision=ss and ss.revision,
+                          reason=build.getReason(),
+                          slave=build.getSlavename()),
+                     builderName=builderName, branch=branch)
+        return self
+
+    def buildFinished(self, builderName, build, results):
+        ss = build.getSourceStamp()
+        branch = ss and ss.branch
+        self.publish('buildFinished',
+                     dict(builder=builderName, number=build.getNumber(),
+                          results=results, text=build.getText()),
+                     builderName=builderName, branch=branch)
+
+    def stepStarted(self, build, step):
+        builderName, number, branch = self._buildInfo(build)
+        self.publish('stepStarted',
+                     dict(builder=builderName, number=number,
+                          step=step.getName()),
+                     builderName=builderName, branch=branch)
+        # get logStarted and logFinished for this step
+        return self
+
+    def stepFinished(self, build, step, results):
+        builderName, number, branch = self._buildInfo(build)
+        self.publish('stepFinished',
+                     dict(builder=builderName, number=number,
+                          step=step.getName(), results=results[0],
+                          text=step.getText()),
+                     builderName=builderName, branch=branch)
+
+    def logStarted(self, build, step, log):
+        builderName, number, branch = self._buildInfo(build)
+        self.publish('logStarted',
+                     dict(builder=builderName, number=number,
+                          step=step.getName(), log=log.getName()),
+                     builderName=builderName, branch=branch)
+
+    def logFinished(self, build, step, log):
+        builderName, number, branch = self._buildInfo(build)
+        self.publish('logFinished',
+                     dict(builder=builderName, number=number,
+                          step=step.getName(), log=log.getName()),
+                     builderName=builderName, branch=branch)
+
+    def changeAdded(self, change):
+        self.publish('changeAdded', change.asDict(), branch=change.branch)
+
+    def slaveConnected(self, slaveName):
+        self.publish('slaveConnected', dict(slave=slaveName))
+
+    def slaveDisconnected(self, slaveName):
+        self.publish('slaveDisconnected', dict(slave=slaveName))
+
+
+class StreamClient(object):
+    """
+    A client receiving events as Server-Sent Events, on a response that
+    stays open.  The request's transport tells me to pause when the client
+    is not reading fast enough; while paused, events are queued, and if too
+    many are queued the response is ended.  An EventSource reconnects by
+    itself, resuming from the last event it received.
+    """
+    implements(tw_interfaces.IPushProducer)
+
+    streaming = True
+
+    # the number of events that may be queued for a paused client
+    maxQueuedEvents = 1000
+
+    # tells EventSource how long to wait before reconnecting, in ms
+    retry = 5000
+
+    def __init__(self, hub, request, filter):
+        self.hub = hub
+        self.request = request
+        self.filter = filter
+        self.paused = False
+        self.queue = []
+        self.closed = False
+
+    def start(self, events, complete):
+        request = self.request
+        request.setHeader("content-type", "text/event-stream")
+        request.setHeader("cache-control", "no-cache")
+        request.registerProducer(self, True)
+        request.notifyFinish().addBoth(lambda _ : self.stopProducing())
+        self.hub.addClient(self)
+        request.write('retry: %d\n\n' % self.retry)
+        if not complete:
+            # the client should reload whatever it is displaying, since it
+            # may have missed some events
+            request.write('id: %s\nevent: reset\ndata: {}\n\n'
+                          % self.hub.getCursor())
+        for event in events:
+            self.eventReceived(event)
+
+    def eventReceived(self, event):
+        if self.closed:
+            return
+        if self.paused:
+            self.queue.append(event)
+            if len(self.queue) > self.maxQueuedEvents:
+                self.close()
+            return
+        self.request.write(event.sse)
+
+    def heartbeat(self):
+        if not self.paused and not self.closed:
+            self.request.write(': keepalive\n\n')
+
+    def close(self):
+        if self.closed:
+            return
+        self.stopProducing()
+        self.request.unregisterProducer()
+        self.request.finish()
+
+    # IPushProducer
+
+    def pauseProducing(self):
+        self.paused = True
+
+    def resumeProducing(self):
+        self.paused = False
+        queue, self.queue = self.queue, []
+        for event in queue:
+            self.eventReceived(event)
+
+    def stopProducing(self):
+        if not self.closed:
+            self.closed = True
+            self.queue = []
+            self.hub.removeClient(self)
+
+
+class PollClient(object):
+    """
+    A client receiving events as a JSON long-poll: the response is sent as
+    soon as there is at least one event for the client, or after
+    C{timeout} seconds with no events.
+    """
+
+    streaming = False
+
+    # seconds to wait for events before replying with none
+    timeout = 30
+
+    def __init__(self, hub, request, filter):
+        self.hub = hub
+        self.request = request
+        self.filter = filter
+        self.timer = None
+        self.done = False
+
+    def start(self, events, complete):
+        self.request.setHeader("content-type", "application/json")
+        self.request.setHeader("cache-control", "no-cache")
+        if events or not complete:
+            self.reply(events, complete)
+            return
+        self.hub.addClient(self)
+        self.timer = self.hub._reactor.callLater(self.timeout,
+                                                 self.reply, [], True)
+        self.request.notifyFinish().addBoth(lambda _ : self.stop())
+
+    def eventReceived(self, event):
+        self.reply([ event ], True)
+
+    def heartbeat(self):
+        pass
+
+    def close(self):
+        self.reply([], True)
+
+    def reply(self, events, complete):
+        if self.done:
+            return
+        if events:
+            cursor = events[-1].id
+        else:
+            cursor = self.hub.getCursor()
+        self.request.write('{"cursor":%s,"reset":%s,"events":[%s]}' % (
+                json.dumps(cursor), complete and 'false' or 'true',
+                ','.join([ e.json for e in events ])))
+        self.request.finish()
+        self.stop()
+
+    def stop(self):
+        self.done = True
+        if self.timer and self.timer.active():
+            self.timer.cancel()
+        self.timer = None
+        self.hub.removeClient(self)
+
+
+class EventsResource(resource.Resource):
+    """
+    /events: live status events.
+
+    Clients that send C{Accept: text/event-stream} (as EventSource does), or
+    C{mode=sse}, get a stream of Server-Sent Events; others get a single
+    JSON long-poll reply.  Events can be limited with any number of
+    C{builder=}, C{category=} and C{branch=} arguments.  A client resumes
+    from an event id given in a C{Last-Event-ID} header or C{since=}
+    argument; without one, it only gets events that happen from now on.
+    """
+
+    isLeaf = True
+
+    def render_GET(self, request):
+        service = request.site.buildbot_service
+        if hasattr(request, "channel"):
+            # so the connection is dropped when the WebStatus goes away
+            service.registerChannel(request.channel)
+        hub = service.getEventHub()
+
+        filter = EventFilter(builders=request.args.get('builder', []),
+                             categories=request.args.get('category', []),
+                             branches=request.args.get('branch', []))
+        mode = request.args.get('mode', [None])[0]
+        if mode is None:
+            if 'text/event-stream' in (request.getHeader('accept') or ''):
+                mode = 'sse'
+            else:
+                mode = 'poll'
+        if mode == 'sse':
+            client = StreamClient(hub, request, filter)
+        else:
+            client = PollClient(hub, request, filter)
+
+        cursor = request.getHeader('last-event-id') \
+                or request.args.get('since', [None])[0]
+        if cursor:
+            events, complete = hub.getEventsSince(cursor, filter)
+        else:
+            events, complete = [], True
+        client.start(events, complete)
+        return server.NOT_DONE_YET
@@ -16,10 +16,9 @@
 from twisted.internet import defer
 from buildbot.status.web.base import HtmlResource
 from buildbot.status.web.base import build_get_class, path_to_builder, path_to_build
+from buildbot.status.web.matrix import ANYBRANCH, getSourceStampKey
 from buildbot.sourcestamp import SourceStamp
 
-class ANYBRANCH: pass # a flag value, used below
-
 class GridStatusMixin(object):
     def getPageTitle(self, request):
         status = self.getStatus(request)
@@ -96,47 +95,39 @@ class GridStatusMixin(object):
 
         This function returns an appropriate comparison key for that.
         """
-        return (ss.branch, ss.revision, ss.patch)
+        return getSourceStampKey(ss)
+
+    def getBuildMatrix(self, request):
+        return request.site.buildbot_service.getBuildMatrix()
 
-    def getRecentBuilds(self, builder, numBuilds, branch):
+    def getRecentBuilds(self, matrix, builder, numBuilds, branch):
         """
-        get a list of most recent builds on given builder
+        get a list of most recent builds on given builder, as
+        L{MatrixEntry} instances
         """
-        build = builder.getBuild(-1)
-        num = 0
-        while build and num < numBuilds:
-            start = build.getTimes()[0]
-            ss = build.getSourceStamp(absolute=True)
-
-            okay_build = True
-
+        builds = []
+        for entry in matrix.getEntries(builder, branch=branch):
+            if len(builds) >= numBuilds:
+                break
             # skip un-started builds
-            if not start:
-                okay_build = False
-
-            # skip non-matching branches
-            if branch != ANYBRANCH and ss.branch != branch:
-                okay_build = False
-
-            if okay_build:
-                num += 1
-                yield build
-
-            build = build.getPreviousBuild()
-        return
+            if not entry.getTimes()[0]:
+                continue
+            builds.append(entry)
+        return builds
 
-    def getRecentSourcestamps(self, status, numBuilds, categories, branch):
+    def getRecentSourcestamps(self, matrix, status, numBuilds, categories,
+                              branch):
         """
         get a list of the most recent NUMBUILDS SourceStamp tuples, sorted
         by the earliest start we've seen for them
         """
-        # TODO: use baseweb's getLastNBuilds?
         sourcestamps = { } # { ss-tuple : earliest time }
         for bn in status.getBuilderNames():
             builder = status.getBuilder(bn)
             if categories and builder.category not in categories:
                 continue
-            for build in self.getRecentBuilds(builder, numBuilds, branch):
+            for build in self.getRecentBuilds(matrix, builder, numBuilds,
+                                              branch):
                 ss = build.getSourceStamp(absolute=True)
                 key= self.getSourceStampKey(ss)
                 start = build.getTimes()[0]
@@ -151,6 +142,13 @@ class GridStatusMixin(object):
 
         return sourcestamps
 
+    def getBuildsForStamps(self, matrix, builder, stamps):
+        """
+        get the most recent build of each of the given source stamps on the
+        given builder, or None where it has not been built
+        """
+        return [ matrix.lookup(ss, builder) for ss in stamps ]
+
 class GridStatusResource(HtmlResource, GridStatusMixin):
     # TODO: docs
     status = None
@@ -170,7 +168,9 @@ class GridStatusResource(HtmlResource, GridStatusMixin):
 
         # and the data we want to render
         status = self.getStatus(request)
-        stamps = self.getRecentSourcestamps(status, numBuilds, categories, branch)
+        matrix = self.getBuildMatrix(request)
+        stamps = self.getRecentSourcestamps(matrix, status, numBuilds,
+                                            categories, branch)
 
         cxt['refresh'] = self.get_reload_time(request)
 
@@ -186,18 +186,11 @@ class GridStatusResource(HtmlResource, GridStatusMixin):
         cxt['builders'] = []
 
         for bn in sortedBuilderNames:
-            builds = [None] * len(stamps)
-
             builder = status.getBuilder(bn)
             if categories and builder.category not in categories:
                 continue
 
-            for build in self.getRecentBuilds(builder, numBuilds, branch):
-                ss = build.getSourceStamp(absolute=True)
-                key= self.getSourceStampKey(ss)
-                for i in range(len(stamps)):
-                    if key == self.getSourceStampKey(stamps[i]) and builds[i] is None:
-                        builds[i] = build
+            builds = self.getBuildsForStamps(matrix, builder, stamps)
 
             wfd = defer.waitForDeferred(
                     self.builder_cxt(request, builder))
@@ -239,7 +232,9 @@ class TransposedGridStatusResource(HtmlResource, GridStatusMixin):
 
         # and the data we want to render
         status = self.getStatus(request)
-        stamps = self.getRecentSourcestamps(status, numBuilds, categories, branch)
+        matrix = self.getBuildMatrix(request)
+        stamps = self.getRecentSourcestamps(matrix, status, numBuilds,
+                                            categories, branch)
 
         cxt.update({'categories': categories,
                     'branch': branch,
@@ -258,18 +253,11 @@ class TransposedGridStatusResource(HtmlResource, GridStatusMixin):
             cxt['range'].reverse()
         
         for bn in sortedBuilderNames:
-            builds = [None] * len(stamps)
-
             builder = status.getBuilder(bn)
             if categories and builder.category not in categories:
                 continue
 
-            for build in self.getRecentBuilds(builder, numBuilds, branch):
-                ss = build.getSourceStamp(absolute=True)
-                key = self.getSourceStampKey(ss)
-                for i in range(len(stamps)):
-                    if key == self.getSourceStampKey(stamps[i]) and builds[i] is None:
-                        builds[i] = build
+            builds = self.getBuildsForStamps(matrix, builder, stamps)
 
             wfd = defer.waitForDeferred(
                     self.builder_cxt(request, builder))
@@ -17,7 +17,7 @@
 from zope.interface import implements
 from twisted.python import components
 from twisted.spread import pb
-from twisted.web import server
+from twisted.web import server, http
 from twisted.web.resource import Resource
 from twisted.web.error import NoResource
 
@@ -25,25 +25,178 @@ from buildbot import interfaces
 from buildbot.status import logfile
 from buildbot.status.web.base import IHTMLLog, HtmlResource, path_to_root
 
+class UnsatisfiableRange(Exception):
+    pass
+
+def parseByteRange(header, length):
+    """
+    Parse a C{Range} header, for a resource of C{length} bytes.  Only a
+    single range is supported; anything else is ignored, as RFC 2616 allows.
+
+    @returns: (start, end) with C{end} exclusive, or None to send the whole
+    resource
+    @raises UnsatisfiableRange: if the range is beyond the end of the
+    resource
+    """
+    if '=' not in header:
+        return None
+    unit, spec = header.split('=', 1)
+    if unit.strip() != 'bytes' or ',' in spec or '-' not in spec:
+        return None
+    first, last = spec.strip().split('-', 1)
+    try:
+        if not first:
+            # the last N bytes
+            n = int(last)
+            if n <= 0:
+                raise UnsatisfiableRange
+            return max(length - n, 0), length
+        start = int(first)
+        if last:
+            end = int(last) + 1
+            if end <= start:
+                return None
+        else:
+            end = length
+    except ValueError:
+        return None
+    if start >= length:
+        raise UnsatisfiableRange
+    return start, min(end, length)
+
+def parseLineRange(arg):
+    """
+    Parse a C{lines=} argument: C{a-b}, C{a-} or C{a}, where lines are
+    numbered from one and C{b} is included.
+
+    @returns: (start, end) counting from zero, with C{end} exclusive or
+    None, or None if the argument is not valid
+    """
+    if '-' not in arg:
+        arg = '%s-%s' % (arg, arg)
+    first, last = arg.split('-', 1)
+    try:
+        start = max(int(first or 1), 1) - 1
+        if not last:
+            return start, None
+        end = int(last)
+    except ValueError:
+        return None
+    if end < start:
+        return None
+    return start, end
+
+def _afterNewline(text, n):
+    # the index just after the nth newline in text, or None
+    i = -1
+    while n > 0:
+        i = text.find('\n', i + 1)
+        if i == -1:
+            return None
+        n -= 1
+    return i + 1
+
+class TextRange:
+    """
+    A range of the text of a log, in bytes or lines, counting from zero,
+    with C{end} exclusive or None to follow the log to its end.  As with the
+    text view, only stdout and stderr count; header chunks are passed on
+    when they fall within the range.
+
+    L{locate} finds the chunks to read from the log's index; L{trim} then
+    cuts the parts of the first and last chunks that are outside the range.
+    """
+
+    def __init__(self, unit, start, end=None):
+        assert unit in ('bytes', 'lines')
+        self.unit = unit
+        self.start = start
+        self.end = end
+        # the position, in bytes or lines, of the next chunk to be trimmed
+        self.pos = 0
+
+    def locate(self, index):
+        """
+        @returns: (start, stop) file offsets, for
+        L{IStatusLog.subscribeConsumer}; C{stop} is None if the range has no
+        end
+        """
+        if self.unit == 'bytes':
+            first = index.findText(self.start)
+            self.pos = index.getTextOffset(first)
+            if self.end is not None:
+                last = index.findTextEnd(self.end)
+        else:
+            first = index.findLine(self.start)
+            self.pos = index.getLineOffset(first)
+            if self.end is not None:
+                last = index.findLineEnd(self.end)
+        start = index.getFileOffset(first)
+        if self.end is None:
+            return start, None
+        return start, max(start, index.getFileOffset(last))
+
+    def inRange(self):
+        return self.pos >= self.start and (self.end is None
+                                           or self.pos < self.end)
+
+    def trim(self, chunk):
+        """
+        @returns: the part of C{chunk} within the range, or None
+        """
+        channel, text = chunk
+        if channel == logfile.HEADER:
+            if self.inRange():
+                return chunk
+            return None
+        if self.unit == 'bytes':
+            begin = max(self.start - self.pos, 0)
+            stop = len(text)
+            if self.end is not None:
+                stop = min(self.end - self.pos, stop)
+            self.pos += len(text)
+        else:
+            newlines = text.count('\n')
+            begin = 0
+            if self.pos < self.start:
+                begin = _afterNewline(text, self.start - self.pos)
+            stop = len(text)
+            if self.end is not None and self.pos + newlines >= self.end:
+                stop = _afterNewline(text, self.end - self.pos) or 0
+            self.pos += newlines
+            if begin is None:
+                return None
+        if begin >= stop:
+            return None
+        if begin == 0 and stop == len(text):
+            return chunk
+        return (channel, text[begin:stop])
+
+
 class ChunkConsumer:
     implements(interfaces.IStatusLogConsumer)
 
-    def __init__(self, original, textlog):
+    def __init__(self, original, textlog, range=None):
         self.original = original
         self.textlog = textlog
+        self.range = range
     def registerProducer(self, producer, streaming):
         self.producer = producer
         self.original.registerProducer(producer, streaming)
     def unregisterProducer(self):
         self.original.unregisterProducer()
     def writeChunk(self, chunk):
+        if self.range:
+            chunk = self.range.trim(chunk)
+            if chunk is None:
+                return
         formatted = self.textlog.content([chunk])
         try:
             if isinstance(formatted, unicode):
                 formatted = formatted.encode('utf-8')
             self.original.write(formatted)
         except pb.DeadReferenceError:
-            self.producing.stopProducing()
+            self.producer.stopProducing()
     def finish(self):
         self.textlog.finished()
 
@@ -57,6 +210,9 @@ class TextLog(Resource):
     asText = False
     subscribed = False
 
+    # lines of the log in each page of the HTML view
+    pageLines = 2000
+
     def __init__(self, original):
         Resource.__init__(self)
         self.original = original
@@ -97,24 +253,116 @@ class TextLog(Resource):
 
         # vague approximation, ignores markup
         req.setHeader("content-length", self.original.length)
+        if self.asText:
+            req.setHeader("accept-ranges", "bytes")
         return ''
 
     def render_GET(self, req):
         self._setContentType(req)
         self.req = req
 
-        if not self.asText:
-            self.template = req.site.buildbot_service.templates.get_template("logs.html")                
-            
+        if self.asText:
+            req.setHeader("accept-ranges", "bytes")
+            if not (req.getHeader("range") or 'lines' in req.args
+                    or 'tail' in req.args):
+                # the whole log, which doesn't need the index
+                self.original.subscribeConsumer(ChunkConsumer(req, self))
+                return server.NOT_DONE_YET
+
+        d = self.original.getChunkIndex()
+        d.addCallback(self._renderRange, req)
+        def fail(f):
+            self.req = None
+            req.processingFailed(f)
+        d.addErrback(fail)
+        return server.NOT_DONE_YET
+
+    def _getRange(self, req, index):
+        # a Range header takes precedence, then lines=, then tail=
+        if self.asText and req.getHeader("range"):
+            byterange = parseByteRange(req.getHeader("range"),
+                                       index.textLength)
+            if byterange:
+                return TextRange('bytes', *byterange)
+        if 'lines' in req.args:
+            linerange = parseLineRange(req.args['lines'][0])
+            if linerange:
+                return TextRange('lines', *linerange)
+        if 'tail' in req.args:
+            try:
+                n = int(req.args['tail'][0])
+            except ValueError:
+                n = None
+            if n is not None:
+                return TextRange('lines', max(index.getLineCount() - n, 0))
+        return None
+
+    def _renderRange(self, index, req):
+        try:
+            rng = self._getRange(req, index)
+        except UnsatisfiableRange:
+            req.setResponseCode(http.REQUESTED_RANGE_NOT_SATISFIABLE)
+            req.setHeader("content-range", "bytes */%d" % index.textLength)
+            self.req = None
+            req.finish()
+            return
+
+        if self.asText:
+            if rng and rng.unit == 'bytes':
+                req.setResponseCode(http.PARTIAL_CONTENT)
+                req.setHeader("content-range", "bytes %d-%d/%d"
+                              % (rng.start, rng.end - 1, index.textLength))
+                req.setHeader("content-length", rng.end - rng.start)
+        else:
+            rng = self._getPage(req, index, rng)
+            self.template = req.site.buildbot_service.templates.get_template("logs.html")
+
             data = self.template.module.page_header(
                     pageTitle = "Log File contents",
                     texturl = req.childLink("text"),
-                    path_to_root = path_to_root(req))
-            data = data.encode('utf-8')                   
+                    path_to_root = path_to_root(req),
+                    pages = self._getPageLinks(index, rng))
+            data = data.encode('utf-8')
             req.write(data)
 
-        self.original.subscribeConsumer(ChunkConsumer(req, self))
-        return server.NOT_DONE_YET
+        if rng:
+            start, stop = rng.locate(index)
+        else:
+            start, stop = 0, None
+        self.original.subscribeConsumer(ChunkConsumer(req, self, rng),
+                                        start, stop)
+
+    def _getPage(self, req, index, rng):
+        # limit the HTML view to a page of lines, by default the last; if
+        # the page reaches the end of a running log, it follows the log
+        count = index.getLineCount()
+        if rng is None:
+            rng = TextRange('lines', max(count - self.pageLines, 0))
+        end = rng.start + self.pageLines
+        if (rng.end is None or rng.end > end) and end < count:
+            rng.end = end
+        return rng
+
+    def _getPageLinks(self, index, rng):
+        count = index.getLineCount()
+        if rng.start == 0 and (rng.end is None or rng.end >= count):
+            return None
+        links = []
+        def pageLink(label, start):
+            end = min(start + self.pageLines, count)
+            links.append((label, "?lines=%d-%d" % (start + 1, end)))
+        if rng.start > 0:
+            pageLink("first", 0)
+            pageLink("previous", max(rng.start - self.pageLines, 0))
+        if rng.end is not None and rng.end < count:
+            pageLink("next", rng.end)
+            links.append(("last", "?tail=%d" % self.pageLines))
+        last = count
+        if rng.end is not None:
+            last = min(rng.end, count)
+        return dict(description="lines %d-%d of %d" % (rng.start + 1, last,
+                                                      count),
+                    links=links)
 
     def _setContentType(self, req):
         if self.asText:
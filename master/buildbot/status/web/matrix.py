@@ -0,0 +1,308 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+from twisted.internet import defer
+from buildbot.status.base import StatusReceiverBase
+from buildbot.changes import changes
+
+class ANYBRANCH: pass # a flag value, used below
+
+def getSourceStampKey(ss):
+    """Given two source stamps, we want to assign them to the same row if
+    they are the same version of code, even if they differ in minor detail.
+
+    This function returns an appropriate comparison key for that.
+    """
+    return (ss.branch, ss.revision, ss.patch)
+
+class MatrixEntry(object):
+    """
+    What the console and grid views need to know about a single build.  While
+    the build is running, queries are passed through to its L{BuildStatus};
+    once it has finished, the answers are kept here, so that the build never
+    has to be reloaded from disk to draw a page.
+
+    This implements the parts of L{IBuildStatus} used by those views.
+    """
+
+    def __init__(self, builder_status, build):
+        self.builder = builder_status
+        self.builderName = builder_status.getName()
+        self.number = build.getNumber()
+        self.build = None
+        self.update(build)
+
+    def update(self, build):
+        # the source stamp can change while the build runs, as got_revision
+        # is set
+        self.source = build.getSourceStamp(absolute=True)
+        self.key = getSourceStampKey(self.source)
+        self.changes = build.getChanges()
+        self.times = build.getTimes()
+        self.revision = build.getProperty("got_revision",
+                                          build.getProperty("revision", -1))
+        if build.isFinished():
+            self.build = None
+            self.finished = True
+            self.results = build.getResults()
+            self.text = build.getText()
+        else:
+            self.build = build
+            self.finished = False
+            self.results = None
+            self.text = None
+
+    # IBuildStatus methods
+
+    def getBuilder(self):
+        return self.builder
+
+    def getNumber(self):
+        return self.number
+
+    def getSourceStamp(self, absolute=False):
+        # entries always hold the absolute source stamp
+        return self.source
+
+    def getChanges(self):
+        return self.changes
+
+    def getTimes(self):
+        if self.build:
+            return self.build.getTimes()
+        return self.times
+
+    def isFinished(self):
+        if self.build:
+            return self.build.isFinished()
+        return self.finished
+
+    def getResults(self):
+        if self.build:
+            return self.build.getResults()
+        return self.results
+
+    def getText(self):
+        if self.build:
+            return self.build.getText()
+        return self.text
+
+    def getETA(self):
+        if self.build:
+            return self.build.getETA()
+        return None
+
+    def getProperty(self, propname, default=None):
+        if self.build:
+            return self.build.getProperty(propname, default)
+        if propname in ("got_revision", "revision") and self.revision != -1:
+            return self.revision
+        return default
+
+
+class BuildMatrix(StatusReceiverBase):
+    """
+    An index of each builder's recent builds by source stamp, kept up to date
+    by status events, along with the most recent changes.  This lets the
+    console and grid views look up the build of a given revision on a given
+    builder directly, instead of walking back through each builder's history
+    on every page view.
+
+    A builder's builds are loaded the first time they are needed; after that,
+    builds are added as they start and updated as they finish.
+    """
+
+    # the number of recent builds of each builder held in the index
+    maxBuilds = 100
+
+    # the number of recent changes held in memory
+    maxChanges = 200
+
+    def __init__(self):
+        self.status = None
+        self.builderStatuses = {}
+        # builder name -> list of MatrixEntry, newest first
+        self.entries = {}
+        # source stamp key -> builder name -> list of MatrixEntry, newest first
+        self.byStamp = {}
+        # recent Change instances, oldest first, or None if not loaded yet
+        self.changes = None
+
+    def attach(self, status):
+        self.status = status
+        status.subscribe(self)
+
+    def detach(self):
+        if not self.status:
+            return
+        self.status.unsubscribe(self)
+        for builder_status in self.builderStatuses.values():
+            builder_status.unsubscribe(self)
+        self.builderStatuses = {}
+        self.entries = {}
+        self.byStamp = {}
+        self.changes = None
+        self.status = None
+
+    # queries
+
+    def getEntries(self, builder_status, branch=ANYBRANCH, repository=None):
+        """
+        Get the indexed builds of C{builder_status}, newest first, optionally
+        limited to those on the given branch or repository.
+
+        @returns: list of L{MatrixEntry}
+        """
+        name = builder_status.getName()
+        entries = self.entries.get(name)
+        if entries is None:
+            entries = []
+            for b in builder_status._generateBuilds():
+                entries.append(MatrixEntry(builder_status, b))
+                if len(entries) >= self.maxBuilds:
+                    break
+            # only index builders we are getting events for
+            if self.builderStatuses.get(name) is builder_status:
+                self.entries[name] = entries
+                for e in entries:
+                    self._addToStampIndex(e, atEnd=True)
+
+        if branch is ANYBRANCH and repository is None:
+            return entries[:]
+        return [ e for e in entries
+                 if (branch is ANYBRANCH or e.source.branch == branch)
+                 and (repository is None
+                      or e.source.repository == repository) ]
+
+    def lookup(self, ss, builder_status):
+        """
+        Get the most recent build of the given source stamp on the given
+        builder, or None.
+
+        @returns: L{MatrixEntry} or None
+        """
+        # make sure this builder has been loaded
+        self.getEntries(builder_status)
+        name = builder_status.getName()
+        entries = self.byStamp.get(getSourceStampKey(ss), {}).get(name)
+        if entries:
+            return entries[0]
+        return None
+
+    @defer.deferredGenerator
+    def getRecentChanges(self, master, count, branch=ANYBRANCH,
+                         repository=None, project=None):
+        """
+        Get up to C{count} of the most recent changes, oldest first,
+        optionally limited to a branch, repository, or project.  The changes
+        are loaded from the database the first time; after that they are
+        kept up to date as changes are added.
+
+        @returns: list of L{Change} instances via Deferred
+        """
+        if self.changes is None:
+            wfd = defer.waitForDeferred(
+                    master.db.changes.getRecentChanges(self.maxChanges))
+            yield wfd
+            chdicts = wfd.getResult()
+
+            wfd = defer.waitForDeferred(
+                defer.gatherResults([
+                    changes.Change.fromChdict(master, chdict)
+                    for chdict in chdicts ]))
+            yield wfd
+            loaded = wfd.getResult()
+            # changes may have arrived in the meantime
+            if self.changes is None:
+                self.changes = loaded
+
+        result = []
+        for change in reversed(self.changes):
+            if len(result) >= count:
+                break
+            if branch is not ANYBRANCH and change.branch != branch:
+                continue
+            if repository is not None and change.repository != repository:
+                continue
+            if project is not None and change.project != project:
+                continue
+            result.append(change)
+        result.reverse()
+        yield result
+
+    # index maintenance
+
+    def _addToStampIndex(self, entry, atEnd=False):
+        builders = self.byStamp.setdefault(entry.key, {})
+        entries = builders.setdefault(entry.builderName, [])
+        if atEnd:
+            entries.append(entry)
+        else:
+            entries.insert(0, entry)
+
+    def _removeFromStampIndex(self, entry):
+        builders = self.byStamp.get(entry.key, {})
+        entries = builders.get(entry.builderName, [])
+        if entry in entries:
+            entries.remove(entry)
+        if not entries:
+            builders.pop(entry.builderName, None)
+        if not builders:
+            self.byStamp.pop(entry.key, None)
+
+    def _forgetBuilder(self, builderName):
+        for entry in self.entries.pop(builderName, []):
+            self._removeFromStampIndex(entry)
+
+    # IStatusReceiver methods
+
+    def builderAdded(self, builderName, builder):
+        self._forgetBuilder(builderName)
+        self.builderStatuses[builderName] = builder
+        return self
+
+    def builderRemoved(self, builderName):
+        self._forgetBuilder(builderName)
+        self.builderStatuses.pop(builderName, None)
+
+    def buildStarted(self, builderName, build):
+        entries = self.entries.get(builderName)
+        if entries is None:
+            return
+        if [ e for e in entries if e.number == build.getNumber() ]:
+            return
+        entry = MatrixEntry(build.getBuilder(), build)
+        entries.insert(0, entry)
+        self._addToStampIndex(entry)
+        for old in entries[self.maxBuilds:]:
+            self._removeFromStampIndex(old)
+        del entries[self.maxBuilds:]
+
+    def buildFinished(self, builderName, build, results):
+        for entry in self.entries.get(builderName, []):
+            if entry.number == build.getNumber():
+                # the source stamp may have changed since the build started
+                self._removeFromStampIndex(entry)
+                entry.update(build)
+                self._addToStampIndex(entry)
+                # keep the per-stamp list in build order
+                self.byStamp[entry.key][builderName].sort(
+                        key=lambda e : -e.number)
+                break
+
+    def changeAdded(self, change):
+        if self.changes is not None:
+            self.changes.append(change)
+            del self.changes[:-self.maxChanges]
@@ -19,12 +19,21 @@
 import datetime
 import os
 import re
+import time
+import gzip
+from cStringIO import StringIO
+try:
+    from hashlib import md5
+    md5 = md5 # make pyflakes happy
+except ImportError:
+    from md5 import new as md5
 
 from twisted.internet import defer
-from twisted.web import html, resource, server
+from twisted.web import html, http, resource, server
 
+from buildbot import util
 from buildbot.status.web.base import HtmlResource
-from buildbot.util import json
+from buildbot.util import json, lru
 
 
 _IS_INT = re.compile('^[-+]?\d+$')
@@ -120,6 +129,74 @@ def FilterOut(data):
         return data
 
 
+def AcceptsGzip(request):
+    """Returns True if the client accepts gzip-encoded responses."""
+    for coding in (request.getHeader('accept-encoding') or '').split(','):
+        params = [ p.strip() for p in coding.split(';') ]
+        if params[0].lower() not in ('gzip', 'x-gzip'):
+            continue
+        for param in params[1:]:
+            if param.replace(' ', '') in ('q=0', 'q=0.0', 'q=0.00',
+                                          'q=0.000'):
+                return False
+        return True
+    return False
+
+
+class JsonResponse(object):
+    """A serialized response, with its gzip-encoded form computed on
+    demand."""
+
+    def __init__(self, data):
+        if isinstance(data, unicode):
+            data = data.encode("utf-8")
+        self.data = data
+        self.gzipped = None
+
+    def getGzipped(self):
+        if self.gzipped is None:
+            buf = StringIO()
+            f = gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=6)
+            f.write(self.data)
+            f.close()
+            self.gzipped = buf.getvalue()
+        return self.gzipped
+
+
+class ResponseCache(object):
+    """Serialized responses, keyed by the request path and arguments and by
+    the generation of the status objects they describe.  A response is
+    reused until one of those objects changes, and concurrent requests for
+    the same response only render it once."""
+
+    max_size = 100
+
+    def __init__(self):
+        # generations start over when the master restarts, so ETags from a
+        # previous process must not match those from this one
+        self.epoch = '%x' % int(time.time())
+        self.cache = lru.AsyncLRUCache(self._render, self.max_size)
+
+    def _render(self, key, resource, request):
+        d = defer.maybeDeferred(lambda : resource.content(request))
+        d.addCallback(JsonResponse)
+        return d
+
+    def getKey(self, request, generation):
+        args = [ (k, tuple(v)) for (k, v) in request.args.iteritems() ]
+        args.sort()
+        return (request.path, tuple(args), generation)
+
+    def getETag(self, key, gzipped):
+        etag = '%s-%s' % (self.epoch, md5(repr(key)).hexdigest())
+        if gzipped:
+            etag += '-gzip'
+        return '"%s"' % etag
+
+    def get(self, key, resource, request):
+        return self.cache.get(key, resource=resource, request=request)
+
+
 class JsonResource(resource.Resource):
     """Base class for json data."""
 
@@ -129,6 +206,17 @@ class JsonResource(resource.Resource):
     pageTitle = None
     level = 0
 
+    # the ResponseCache shared by the whole tree, or None to not cache
+    # responses; this is set by putChild
+    responseCache = None
+
+    # the responses for running builds are reused for at most this many
+    # seconds, as their ETAs change continuously
+    live_seconds = 5
+
+    # responses smaller than this are not worth compressing
+    gzip_min_size = 512
+
     def __init__(self, status):
         """Adds transparent lazy-child initialization."""
         resource.Resource.__init__(self)
@@ -151,10 +239,12 @@ class JsonResource(resource.Resource):
         return self.getChild(path, request)
 
     def putChild(self, name, res):
-        """Adds the resource's level for help links generation."""
+        """Adds the resource's level for help links generation, and shares
+        the response cache."""
 
         def RecurseFix(res, level):
             res.level = level + 1
+            res.responseCache = self.responseCache
             for c in res.children.itervalues():
                 RecurseFix(c, res.level)
 
@@ -163,17 +253,38 @@ class JsonResource(resource.Resource):
 
     def render_GET(self, request):
         """Renders a HTTP GET at the http request level."""
-        d = defer.maybeDeferred(lambda : self.content(request))
-        def handle(data):
-            if isinstance(data, unicode):
-                data = data.encode("utf-8")
+        gzipped = AcceptsGzip(request)
+        generation = None
+        if self.responseCache is not None:
+            generation = self.getRequestGeneration(request)
+        if generation is None:
+            d = defer.maybeDeferred(lambda : self.content(request))
+            d.addCallback(JsonResponse)
+        else:
+            key = self.responseCache.getKey(request, generation)
+            if request.setETag(self.responseCache.getETag(key, gzipped)) \
+                    == http.CACHED:
+                # the client already has this version
+                request.setHeader("Access-Control-Allow-Origin", "*")
+                return ''
+            d = self.responseCache.get(key, self, request)
+        filename = self.getDownloadName(request)
+        def handle(response):
+            data = response.data
             request.setHeader("Access-Control-Allow-Origin", "*")
+            request.setHeader("Vary", "Accept-Encoding")
+            # cached responses are compressed at most once, so they are
+            # always worth compressing
+            if gzipped and (generation is not None
+                            or len(data) >= self.gzip_min_size):
+                data = response.getGzipped()
+                request.setHeader("Content-Encoding", "gzip")
             if RequestArgToBool(request, 'as_text', False):
                 request.setHeader("content-type", 'text/plain')
             else:
                 request.setHeader("content-type", self.contentType)
                 request.setHeader("content-disposition",
-                                "attachment; filename=\"%s.json\"" % request.path)
+                                "attachment; filename=\"%s.json\"" % filename)
             # Make sure we get fresh pages.
             if self.cache_seconds:
                 now = datetime.datetime.utcnow()
@@ -214,18 +325,12 @@ class JsonResource(resource.Resource):
             for item in select:
                 # Start back at root.
                 node = data
-                # Implementation similar to twisted.web.resource.getChildForRequest
-                # but with a hacked up request.
-                child = self
                 prepath = request.prepath[:]
                 postpath = request.postpath[:]
-                request.postpath = filter(None, item.split('/'))
-                while request.postpath and not child.isLeaf:
-                    pathElement = request.postpath.pop(0)
+                child, pathElements = self.getSelectedChild(request, item)
+                for pathElement in pathElements:
                     node[pathElement] = {}
                     node = node[pathElement]
-                    request.prepath.append(pathElement)
-                    child = child.getChildWithDefault(pathElement, request)
 
                 # some asDict methods return a Deferred, so handle that
                 # properly
@@ -263,6 +368,91 @@ class JsonResource(resource.Resource):
                 data = '%s(%s);' % (callback, data)
         yield data
 
+    def getSelectedChild(self, request, item):
+        """Finds the child named by a select= item.  This leaves the path
+        elements it consumed on request.prepath; the caller must restore
+        request.prepath and request.postpath.
+
+        Returns the child and the list of path elements consumed."""
+        # Implementation similar to twisted.web.resource.getChildForRequest
+        # but with a hacked up request.
+        child = self
+        pathElements = []
+        request.postpath = filter(None, item.split('/'))
+        while request.postpath and not child.isLeaf:
+            pathElement = request.postpath.pop(0)
+            pathElements.append(pathElement)
+            request.prepath.append(pathElement)
+            child = child.getChildWithDefault(pathElement, request)
+        return child, pathElements
+
+    def getDownloadName(self, request):
+        """Returns the base name of the file offered for download."""
+        return request.path
+
+    def getRequestGeneration(self, request):
+        """Returns the generation of the data this request would render, or
+        None if it cannot be cached."""
+        select = request.args.get('select')
+        if select is None:
+            return self.getGeneration(request)
+        generations = []
+        for item in select:
+            prepath = request.prepath[:]
+            postpath = request.postpath[:]
+            try:
+                child, pathElements = self.getSelectedChild(request,
+                                                            item.strip('/'))
+                if isinstance(child, JsonResource):
+                    generation = child.getGeneration(request)
+                elif hasattr(child, 'asDict'):
+                    generation = None
+                else:
+                    # rendered as an error, which never changes
+                    generation = 0
+            finally:
+                request.prepath = prepath
+                request.postpath = postpath
+            if generation is None:
+                return None
+            generations.append(generation)
+        return tuple(generations)
+
+    def getGeneration(self, request):
+        """Returns a value that changes whenever the data rendered by asDict
+        changes, or None if the data cannot be cached.
+
+        By default, combines the generations of every child, as asDict
+        renders every child."""
+        if not self.children:
+            return None
+        generations = []
+        for name in self.children:
+            child = self.children[name]
+            if not isinstance(child, JsonResource):
+                continue
+            generation = child.getGeneration(request)
+            if generation is None:
+                return None
+            generations.append((name, generation))
+        generations.sort()
+        return tuple(generations)
+
+    def getLiveGeneration(self):
+        """Returns a generation that changes every live_seconds, for data
+        that depends on the current time."""
+        return int(util.now() / self.live_seconds)
+
+    def getBuildGeneration(self, build_status):
+        """Returns the generation of a build, taking ETAs into account.  As
+        the generations of builds all start at 0, it names the build too, so
+        that paths like builds/-1 are not answered for a previous build."""
+        generation = (build_status.getBuilder().getName(),
+                      build_status.getNumber(), build_status.getGeneration())
+        if build_status.isFinished():
+            return generation
+        return (generation, self.getLiveGeneration())
+
     @defer.deferredGenerator
     def asDict(self, request):
         """Generates the json dictionary.
@@ -375,6 +565,9 @@ class BuilderPendingBuildsJsonResource(JsonResource):
         d.addCallback(to_dict)
         return d
 
+    def getGeneration(self, request):
+        return self.builder_status.getGeneration()
+
 
 class BuilderJsonResource(JsonResource):
     help = """Describe a single builder.
@@ -395,6 +588,11 @@ class BuilderJsonResource(JsonResource):
         # buildbot.status.builder.BuilderStatus
         return self.builder_status.asDict_async()
 
+    def getGeneration(self, request):
+        # the builder's schedulers change on reconfig
+        return (self.status.getGeneration(),
+                self.builder_status.getGeneration())
+
 
 class BuildersJsonResource(JsonResource):
     help = """List of all the builders defined on a master.
@@ -439,6 +637,9 @@ class BuildJsonResource(JsonResource):
     def asDict(self, request):
         return self.build_status.asDict()
 
+    def getGeneration(self, request):
+        return self.getBuildGeneration(self.build_status)
+
 
 class AllBuildsJsonResource(JsonResource):
     help = """All the builds that were run on a builder.
@@ -479,6 +680,13 @@ class AllBuildsJsonResource(JsonResource):
             results[child.build_status.getNumber()] = child.asDict(request)
         return results
 
+    def getGeneration(self, request):
+        # finished builds do not change, so only the builder and its current
+        # builds matter
+        return (self.builder_status.getGeneration(),
+                tuple([ self.getBuildGeneration(b) for b in
+                        self.builder_status.getCurrentBuilds() ]))
+
 
 class BuildsJsonResource(AllBuildsJsonResource):
     help = """Builds that were run on a builder.
@@ -505,6 +713,10 @@ class BuildsJsonResource(AllBuildsJsonResource):
         ])
         return builds
 
+    def getGeneration(self, request):
+        # build pickles are written as builds finish
+        return self.builder_status.getGeneration()
+
 
 class BuildStepJsonResource(JsonResource):
     help = """A single build step.
@@ -520,6 +732,16 @@ class BuildStepJsonResource(JsonResource):
     def asDict(self, request):
         return self.build_step_status.asDict()
 
+    def getGeneration(self, request):
+        step = self.build_step_status
+        build_status = step.getBuild()
+        generation = (build_status.getBuilder().getName(),
+                      build_status.getNumber(), step.getName(),
+                      step.getGeneration())
+        if step.isStarted() and not step.isFinished():
+            return (generation, self.getLiveGeneration())
+        return generation
+
 
 class BuildStepsJsonResource(JsonResource):
     help = """A list of build steps that occurred during a build.
@@ -560,6 +782,9 @@ class BuildStepsJsonResource(JsonResource):
             index += 1
         return results
 
+    def getGeneration(self, request):
+        return self.getBuildGeneration(self.build_status)
+
 
 class ChangeJsonResource(JsonResource):
     help = """Describe a single change that originates from a change source.
@@ -574,6 +799,10 @@ class ChangeJsonResource(JsonResource):
     def asDict(self, request):
         return self.change.asDict()
 
+    def getGeneration(self, request):
+        # changes never change
+        return 0
+
 
 class ChangesJsonResource(JsonResource):
     help = """List of changes.
@@ -614,6 +843,9 @@ class ChangeSourcesJsonResource(JsonResource):
             n += 1
         return result
 
+    def getGeneration(self, request):
+        return self.status.getGeneration()
+
 
 class ProjectJsonResource(JsonResource):
     help = """Project-wide settings.
@@ -623,6 +855,9 @@ class ProjectJsonResource(JsonResource):
     def asDict(self, request):
         return self.status.asDict()
 
+    def getGeneration(self, request):
+        return self.status.getGeneration()
+
 
 class SlaveJsonResource(JsonResource):
     help = """Describe a slave.
@@ -663,6 +898,15 @@ class SlaveJsonResource(JsonResource):
             results['builders'][builderName] = builds
         return results
 
+    def getGeneration(self, request):
+        builders = [ self.status.getBuilder(builderName).getGeneration()
+                     for builderName in self.getBuilders() ]
+        running = [ self.getBuildGeneration(b)
+                    for b in self.slave_status.getRunningBuilds() ]
+        return (self.status.getGeneration(),
+                self.slave_status.getGeneration(),
+                tuple(builders), tuple(running))
+
 
 class SlavesJsonResource(JsonResource):
     help = """List the registered slaves.
@@ -695,6 +939,10 @@ class SourceStampJsonResource(JsonResource):
     def asDict(self, request):
         return self.source_stamp.asDict()
 
+    def getGeneration(self, request):
+        # source stamps never change
+        return 0
+
 class MetricsJsonResource(JsonResource):
     help = """Master metrics.
 """
@@ -724,6 +972,7 @@ For help on any sub directory, use url /child/help
     def __init__(self, status):
         JsonResource.__init__(self, status)
         self.level = 1
+        self.responseCache = ResponseCache()
         self.putChild('builders', BuildersJsonResource(status))
         self.putChild('change_sources', ChangeSourcesJsonResource(status))
         self.putChild('project', ProjectJsonResource(status))
@@ -732,11 +981,8 @@ For help on any sub directory, use url /child/help
         # This needs to be called before the first HelpResource().body call.
         self.hackExamples()
 
-    def content(self, request):
-        result = JsonResource.content(self, request)
-        # This is done to hook the downloaded filename.
-        request.path = 'buildbot'
-        return result
+    def getDownloadName(self, request):
+        return 'buildbot'
 
     def hackExamples(self):
         global EXAMPLES
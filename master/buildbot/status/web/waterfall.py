@@ -24,6 +24,7 @@ import operator
 
 from buildbot import interfaces, util
 from buildbot.status import builder, buildstep, build
+from buildbot.status.base import StatusReceiverBase
 from buildbot.changes import changes
 
 from buildbot.status.web.base import Box, HtmlResource, IBox, ICurrentBox, \
@@ -326,16 +327,157 @@ class ChangeEventSource(object):
                 continue
             yield change
 
+class WaterfallTimeline(StatusReceiverBase):
+    """
+    An in-memory index of the numbers of each builder's recent builds, kept
+    up to date by status events, so that drawing the waterfall does not have
+    to walk back through each builder's history on every page view.  The
+    builds themselves are fetched from the builder, and its build cache.
+
+    The C{generation} attribute is incremented whenever anything that might
+    appear on the waterfall changes, and can be used to validate cached
+    renderings.
+    """
+
+    # the number of recent builds of each builder indexed; older builds are
+    # found by walking back from the oldest indexed build
+    maxBuilds = 50
+
+    def __init__(self):
+        self.status = None
+        self.generation = 0
+        self.builderStatuses = {}
+        # builder name -> list of build numbers, newest first; a builder's
+        # list is loaded the first time it is needed.  Only the numbers are
+        # kept, so that the builds themselves can leave the builder's cache
+        self.builds = {}
+
+    def attach(self, status):
+        self.status = status
+        status.subscribe(self)
+
+    def detach(self):
+        if not self.status:
+            return
+        self.status.unsubscribe(self)
+        for builder_status in self.builderStatuses.values():
+            builder_status.unsubscribe(self)
+        self.builderStatuses = {}
+        self.builds = {}
+        self.status = None
+
+    def changed(self):
+        self.generation += 1
+
+    def getBuilds(self, builder_status):
+        """
+        Generate the builds of C{builder_status}, newest first, using the
+        index where possible.
+        """
+        name = builder_status.getName()
+        numbers = self.builds.get(name)
+        if numbers is None:
+            numbers = []
+            for b in builder_status._generateBuilds():
+                numbers.append(b.getNumber())
+                if len(numbers) >= self.maxBuilds:
+                    break
+            # only index builders we are getting events for
+            if self.builderStatuses.get(name) is builder_status:
+                self.builds[name] = numbers
+
+        for number in numbers[:]:
+            b = builder_status.getBuild(number)
+            if b:
+                yield b
+
+        if len(numbers) >= self.maxBuilds:
+            for number in range(numbers[-1]-1, -1, -1):
+                b = builder_status.getBuild(number)
+                if not b:
+                    break
+                yield b
+
+    def eventGenerator(self, builder_status, branches, categories, committers,
+                       minTime):
+        "like L{BuilderStatus.eventGenerator}, but using the index"
+        return builder_status._eventGenerator(self.getBuilds(builder_status),
+                branches, categories, committers, minTime)
+
+    # IStatusReceiver methods
+
+    def builderAdded(self, builderName, builder):
+        self.builderStatuses[builderName] = builder
+        self.builds.pop(builderName, None)
+        self.changed()
+        return self
+
+    def builderRemoved(self, builderName):
+        self.builderStatuses.pop(builderName, None)
+        self.builds.pop(builderName, None)
+        self.changed()
+
+    def builderChangedState(self, builderName, state):
+        self.changed()
+
+    def requestSubmitted(self, request):
+        self.changed()
+
+    def requestCancelled(self, builder, request):
+        self.changed()
+
+    def buildStarted(self, builderName, build):
+        numbers = self.builds.get(builderName)
+        if numbers is not None and build.getNumber() not in numbers:
+            numbers.insert(0, build.getNumber())
+            del numbers[self.maxBuilds:]
+        self.changed()
+        return self
+
+    def stepStarted(self, build, step):
+        self.changed()
+
+    def stepTextChanged(self, build, step, text):
+        self.changed()
+
+    def stepText2Changed(self, build, step, text2):
+        self.changed()
+
+    def stepFinished(self, build, step, results):
+        self.changed()
+
+    def buildFinished(self, builderName, build, results):
+        self.changed()
+
+    def changeAdded(self, change):
+        self.changed()
+
+    def slaveConnected(self, slaveName):
+        self.changed()
+
+    def slaveDisconnected(self, slaveName):
+        self.changed()
+
+
 class WaterfallStatusResource(HtmlResource):
     """This builds the main status page, with the waterfall display, and
     all child pages."""
 
+    # rendered waterfalls are reused for identical requests for this many
+    # seconds, as long as nothing has changed in the meantime
+    cacheTTL = 10
+
+    # the maximum number of distinct requests to keep renderings for
+    maxCacheEntries = 20
+
     def __init__(self, categories=None, num_events=200, num_events_max=None):
         HtmlResource.__init__(self)
         self.categories = categories
         self.num_events=num_events
         self.num_events_max=num_events_max
         self.putChild("help", WaterfallHelp(categories))
+        # cache key -> (generation, expiry time, context fragment)
+        self.renderCache = {}
 
     def getPageTitle(self, request):
         status = self.getStatus(request)
@@ -345,6 +487,15 @@ class WaterfallStatusResource(HtmlResource):
         else:
             return "BuildBot"
 
+    def getTimeline(self, request):
+        return request.site.buildbot_service.getWaterfallTimeline()
+
+    def getCacheKey(self, request):
+        args = [ (k, tuple(v)) for k, v in request.args.iteritems() ]
+        args.sort()
+        # links in the rendered boxes are relative to the request path
+        return (tuple(request.prepath), tuple(args))
+
     def getChangeManager(self, request):
         # TODO: this wants to go away, access it through IStatus
         return request.site.buildbot_service.getChangeSvc()
@@ -390,6 +541,18 @@ class WaterfallStatusResource(HtmlResource):
         status = self.getStatus(request)
         master = request.site.buildbot_service.master
 
+        # identical requests are served from the cache until something
+        # changes or the rendering expires (it contains ETAs and the like)
+        timeline = self.getTimeline(request)
+        generation = timeline.generation
+        key = self.getCacheKey(request)
+        cached = self.renderCache.get(key)
+        if cached:
+            cached_generation, expires, fragment = cached
+            if cached_generation == generation and util.now() < expires:
+                return self.render_fragment(fragment, request, ctx)
+            del self.renderCache[key]
+
         # before calling content_with_db_data, make a bunch of database
         # queries.  This is a sick hack, but beats rewriting the entire
         # waterfall around asynchronous calls
@@ -407,29 +570,37 @@ class WaterfallStatusResource(HtmlResource):
             results['changes'] = changes
         changes_d.addCallback(keep_changes)
 
-        # build request counts for each builder
+        # build request counts for each builder, from a single query
         allBuilderNames = status.getBuilderNames(categories=self.categories)
-        brstatus_ds = []
-        brcounts = {}
-        def keep_count(statuses, builderName):
-            brcounts[builderName] = len(statuses)
-        for builderName in allBuilderNames:
-            builder_status = status.getBuilder(builderName)
-            d = builder_status.getPendingBuildRequestStatuses()
-            d.addCallback(keep_count, builderName)
-            brstatus_ds.append(d)
+        brcounts = dict([ (name, 0) for name in allBuilderNames ])
+        brs_d = master.db.buildrequests.getBuildRequests(claimed=False)
+        def keep_counts(brdicts):
+            for brdict in brdicts:
+                if brdict['buildername'] in brcounts:
+                    brcounts[brdict['buildername']] += 1
+        brs_d.addCallback(keep_counts)
 
         # wait for it all to finish
-        d = defer.gatherResults([ changes_d ] + brstatus_ds)
+        d = defer.gatherResults([ changes_d, brs_d ])
         def call_content(_):
             return self.content_with_db_data(results['changes'],
-                    brcounts, request, ctx)
+                    brcounts, request, ctx, generation)
         d.addCallback(call_content)
         return d
 
-    def content_with_db_data(self, changes, brcounts, request, ctx):
+    def render_fragment(self, fragment, request, ctx):
+        ctx.update(fragment)
+        template = request.site.buildbot_service.templates.get_template("waterfall.html")
+        data = template.render(**ctx)
+        return data
+
+    def content_with_db_data(self, changes, brcounts, request, ctx,
+                             generation=None):
         status = self.getStatus(request)
-        ctx['refresh'] = self.get_reload_time(request)
+        # the parts of the context that depend only on the request arguments
+        # and the state of the buildmaster; these are cached
+        fragment = {}
+        fragment['refresh'] = self.get_reload_time(request)
 
         # we start with all Builders available to this Waterfall: this is
         # limited by the config-file -time categories= argument, and defaults
@@ -469,10 +640,10 @@ class WaterfallStatusResource(HtmlResource):
             locale_tz = unicode(time.tzname[time.localtime()[-1]], locale_enc)
         else:
             locale_tz = unicode(time.tzname[time.localtime()[-1]])
-        ctx['tz'] = locale_tz
-        ctx['changes_url'] = request.childLink("../changes")
+        fragment['tz'] = locale_tz
+        fragment['changes_url'] = request.childLink("../changes")
         
-        bn = ctx['builders'] = []
+        bn = fragment['builders'] = []
                 
         for name in builderNames:
             builder = status.getBuilder(name)
@@ -486,8 +657,8 @@ class WaterfallStatusResource(HtmlResource):
                        'status_class': current_box.class_,                       
                         })
 
-        ctx.update(self.phase2(request, changeNames + builderNames, timestamps, eventGrid,
-                  sourceEvents))
+        fragment.update(self.phase2(request, changeNames + builderNames,
+                  timestamps, eventGrid, sourceEvents))
 
         def with_args(req, remove_args=[], new_args=[], new_path=None):
             # sigh, nevow makes this sort of manipulation easier
@@ -517,23 +688,30 @@ class WaterfallStatusResource(HtmlResource):
 
         if timestamps:
             bottom = timestamps[-1]
-            ctx['nextpage'] = with_args(request, ["last_time"],
+            fragment['nextpage'] = with_args(request, ["last_time"],
                                  [("last_time", str(int(bottom)))])
 
 
         helpurl = path_to_root(request) + "waterfall/help"
-        ctx['help_url'] = with_args(request, new_path=helpurl)
+        fragment['help_url'] = with_args(request, new_path=helpurl)
 
         if self.get_reload_time(request) is not None:
-            ctx['no_reload_page'] = with_args(request, remove_args=["reload"])
-
-        template = request.site.buildbot_service.templates.get_template("waterfall.html")
-        data = template.render(**ctx)
-        return data
+            fragment['no_reload_page'] = with_args(request,
+                                                   remove_args=["reload"])
+
+        if generation is not None:
+            if len(self.renderCache) >= self.maxCacheEntries:
+                # drop the entry closest to expiring
+                oldest = min(self.renderCache.iteritems(),
+                             key=lambda (k, v) : v[1])[0]
+                del self.renderCache[oldest]
+            self.renderCache[self.getCacheKey(request)] = \
+                    (generation, util.now() + self.cacheTTL, fragment)
+
+        return self.render_fragment(fragment, request, ctx)
     
     def buildGrid(self, request, builders, changes):
         debug = False
-        # TODO: see if we can use a cached copy
 
         showEvents = False
         if request.args.get("show_events", ["false"])[0].lower() == "true":
@@ -563,9 +741,9 @@ class WaterfallStatusResource(HtmlResource):
         # array of events, and stop when we have a reasonable number.
 
         commit_source = ChangeEventSource(changes)
+        timeline = self.getTimeline(request)
 
         lastEventTime = util.now()
-        sources = [commit_source] + builders
         changeNames = ["changes"]
         builderNames = map(lambda builder: builder.getName(), builders)
         sourceNames = changeNames + builderNames
@@ -597,13 +775,16 @@ class WaterfallStatusResource(HtmlResource):
                 event = None
             return event
 
-        for s in sources:
-            gen = insertGaps(s.eventGenerator(filterBranches,
-                                              filterCategories,
-                                              filterCommitters,
-                                              minTime),
-                             showEvents,
-                             lastEventTime)
+        # builders' events come from the timeline, which avoids reloading
+        # their recent builds
+        eventGenerators = [ commit_source.eventGenerator(filterBranches,
+                                filterCategories, filterCommitters, minTime) ]
+        for b in builders:
+            eventGenerators.append(timeline.eventGenerator(b, filterBranches,
+                                filterCategories, filterCommitters, minTime))
+
+        for g in eventGenerators:
+            gen = insertGaps(g, showEvents, lastEventTime)
             sourceGenerators.append(gen)
             # get the first event
             sourceEvents.append(get_event_from(gen))
@@ -113,17 +113,22 @@ class RemoveDirectory(buildstep.BuildStep):
     haltOnFailure = True
     flunkOnFailure = True
 
-    def __init__(self, dir, **kwargs):
+    def __init__(self, dir, trash=False, **kwargs):
         buildstep.BuildStep.__init__(self, **kwargs)
-        self.addFactoryArguments(dir = dir)
+        self.addFactoryArguments(dir = dir, trash = trash)
         self.dir = dir
+        self.trash = trash
 
     def start(self):
         slavever = self.slaveVersion('rmdir')
         if not slavever:
             raise BuildSlaveTooOldError("slave is too old, does not know "
                                         "about rmdir")
-        cmd = buildstep.RemoteCommand('rmdir', {'dir': self.dir })
+        args = {'dir': self.dir }
+        if self.trash:
+            # older slaves ignore this and just remove the directory
+            args['trash'] = True
+        cmd = buildstep.RemoteCommand('rmdir', args)
         d = self.runCommand(cmd)
         d.addCallback(lambda res: self.commandComplete(cmd))
         d.addErrback(self.failed)
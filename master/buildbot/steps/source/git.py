@@ -14,12 +14,19 @@
 # Copyright Buildbot Team Members
 
 from twisted.python import log
-from twisted.internet import defer
+from twisted.internet import defer, reactor
 
 from buildbot.process import buildstep
 from buildbot.steps.source import Source
 from buildbot.interfaces import BuildSlaveTooOldError
 
+# Mirrors are shared by all builders on a slave.  These are keyed by (slave
+# name, mirror path); the locks ensure that only one build at a time fetches
+# into each mirror, and the refresh times let builds that were waiting for
+# the lock skip a fetch that has just been done for them.
+_mirrorLocks = {}
+_mirrorRefreshed = {}
+
 class Git(Source):
     """ Class for Git with all the smarts """
     name='git'
@@ -27,7 +34,8 @@ class Git(Source):
 
     def __init__(self, repourl=None, branch='HEAD', mode='incremental',
                  method=None, submodules=False, shallow=False, progress=False,
-                 retryFetch=False, clobberOnFailure=False, **kwargs):
+                 retryFetch=False, clobberOnFailure=False, mirror=None,
+                 **kwargs):
         """
         @type  repourl: string
         @param repourl: the URL which points at the git repository
@@ -57,6 +65,13 @@ class Git(Source):
 
         @type  retryFetch: boolean
         @param retryFetch: Retry fetching before failing source checkout.
+
+        @type  mirror: string
+        @param mirror: path on the slave, relative to the builder's base
+                       directory, of a bare mirror of the repository to share
+                       objects with every other builder on that slave using
+                       the same mirror.  The mirror is created and refreshed
+                       as needed, and new clones borrow its objects.
         """
 
         self.branch    = branch
@@ -69,6 +84,7 @@ class Git(Source):
         self.fetchcount = 0
         self.clobberOnFailure = clobberOnFailure
         self.mode = mode
+        self.mirror = mirror
         Source.__init__(self, **kwargs)
         self.addFactoryArguments(branch=branch,
                                  mode=mode,
@@ -80,6 +96,7 @@ class Git(Source):
                                  retryFetch=retryFetch,
                                  clobberOnFailure=
                                  clobberOnFailure,
+                                 mirror=mirror,
                                  )
 
         assert self.mode in ['incremental', 'full']
@@ -264,8 +281,10 @@ class Git(Source):
         d.addCallback(setrev)
         return d
 
-    def _dovccmd(self, command, abandonOnFailure=True, collectStdout=False, extra_args={}):
-        cmd = buildstep.RemoteShellCommand(self.workdir, ['git'] + command,
+    def _dovccmd(self, command, abandonOnFailure=True, collectStdout=False,
+                 extra_args={}, workdir=None):
+        cmd = buildstep.RemoteShellCommand(workdir or self.workdir,
+                                           ['git'] + command,
                                            env=self.env,
                                            logEnviron=self.logEnviron,
                                            collectStdout=collectStdout,
@@ -343,15 +362,12 @@ class Git(Source):
         res = wfd.getResult()
 
     def _full(self):
-        if self.shallow:
-            command = ['clone', '--depth', '1', '--branch', self.branch, self.repourl, '.']
+        # only a clone uses the mirror, so it is refreshed just before one
+        if self.mirror:
+            d = self._refreshMirror()
         else:
-            command = ['clone', '--branch', self.branch, self.repourl, '.']
-        #Fix references
-        if self.prog:
-            command.append('--progress')
-
-        d = self._dovccmd(command, not self.clobberOnFailure)
+            d = defer.succeed(None)
+        d.addCallback(lambda _: self._clone())
         # If revision specified checkout that revision
         if self.revision:
             d.addCallback(lambda _: self._dovccmd(['reset', '--hard',
@@ -365,6 +381,19 @@ class Git(Source):
                                                   not self.clobberOnFailure))
         return d
 
+    def _clone(self):
+        if self.shallow:
+            command = ['clone', '--depth', '1', '--branch', self.branch]
+        else:
+            command = ['clone', '--branch', self.branch]
+        if self.mirror:
+            command.extend(['--reference', self._mirrorFromWorkdir()])
+        command.extend([self.repourl, '.'])
+        #Fix references
+        if self.prog:
+            command.append('--progress')
+        return self._dovccmd(command, not self.clobberOnFailure)
+
     def _doFull(self):
         d = self._full()
         def clobber(res):
@@ -395,6 +424,76 @@ class Git(Source):
         d.addCallback(_fail)
         return d
 
+    def _mirrorFromWorkdir(self):
+        # the mirror path, relative to the current workdir
+        if self.mirror.startswith('/') or self.mirror[1:3] in (':/', ':\\'):
+            return self.mirror
+        depth = len([ p for p in self.workdir.replace('\\', '/').split('/')
+                      if p and p != '.' ])
+        return '/'.join(['..'] * depth + [self.mirror])
+
+    def _refreshMirror(self):
+        key = (self.getSlaveName(), self.mirror)
+        if key not in _mirrorLocks:
+            _mirrorLocks[key] = defer.DeferredLock()
+        return _mirrorLocks[key].run(self._doRefreshMirror, key,
+                                     reactor.seconds())
+
+    @defer.deferredGenerator
+    def _doRefreshMirror(self, key, requested):
+        cmd = buildstep.RemoteCommand('stat', {'file': self.mirror + '/HEAD',
+                                               'logEnviron': self.logEnviron,})
+        cmd.useLog(self.stdio_log, False)
+        wfd = defer.waitForDeferred(self.runCommand(cmd))
+        yield wfd
+        wfd.getResult()
+        if cmd.rc != 0:
+            cmd = buildstep.RemoteCommand('mkdir', {'dir': self.mirror,
+                                                'logEnviron': self.logEnviron,})
+            cmd.useLog(self.stdio_log, False)
+            wfd = defer.waitForDeferred(self.runCommand(cmd))
+            yield wfd
+            wfd.getResult()
+            wfd = defer.waitForDeferred(
+                self._dovccmd(['init', '--bare'], abandonOnFailure=False,
+                              workdir=self.mirror))
+            yield wfd
+            if wfd.getResult() != 0:
+                self._abandonMirror()
+                return
+
+        # another build may have refreshed the mirror while we waited
+        if _mirrorRefreshed.get(key, 0) >= requested:
+            return
+
+        if self.revision:
+            wfd = defer.waitForDeferred(
+                self._dovccmd(['cat-file', '-e', '%s^{commit}' % self.revision],
+                              abandonOnFailure=False, workdir=self.mirror))
+            yield wfd
+            if wfd.getResult() == 0:
+                return
+
+        command = ['fetch', '-t', self.repourl, '+refs/heads/*:refs/heads/*']
+        if self.branch.startswith('refs/'):
+            command.append('+%s:%s' % (self.branch, self.branch))
+        if self.prog:
+            command.append('--progress')
+        wfd = defer.waitForDeferred(
+            self._dovccmd(command, abandonOnFailure=False, workdir=self.mirror))
+        yield wfd
+        if wfd.getResult() != 0:
+            self._abandonMirror()
+            return
+        _mirrorRefreshed[key] = reactor.seconds()
+
+    def _abandonMirror(self):
+        # a broken mirror should not break the build
+        log.msg("could not update git mirror %s; not using it" % self.mirror)
+        self.stdio_log.addHeader("could not update mirror %s; "
+                                 "not using it\n" % self.mirror)
+        self.mirror = None
+
     def _updateSubmodule(self, _):
         if self.submodules:
             return self._dovccmd(['submodule', 'update', '--recursive'])
@@ -78,7 +78,8 @@ class Source(LoggingBuildStep):
 
     def __init__(self, workdir=None, mode='update', alwaysUseLatest=False,
                  timeout=20*60, retry=None, env=None, logEnviron=True,
-                 description=None, descriptionDone=None, **kwargs):
+                 description=None, descriptionDone=None, trash=False,
+                 copyMethod='copy', copySync=False, **kwargs):
         """
         @type  workdir: string
         @param workdir: local directory (relative to the Builder's root)
@@ -167,6 +168,23 @@ class Source(LoggingBuildStep):
                            environment is not relevant and is long, it may
                            be easier to set logEnviron=False.
 
+        @type trash: boolean
+        @param trash: If true, directories are clobbered by moving them into
+                      the slave's trash directory, where they are deleted in
+                      the background, rather than being deleted during the
+                      step.  Slaves older than 0.8.6 ignore this option.
+
+        @type copyMethod: string
+        @param copyMethod: In 'copy' mode, how the source tree is copied into
+                           the workdir: one of 'copy' (cp -R), 'reflink',
+                           'hardlink' or 'auto'.
+
+        @type copySync: boolean
+        @param copySync: In 'copy' mode, update the existing workdir in place,
+                         copying only changed files and removing files that
+                         are not in the source tree, instead of deleting and
+                         re-copying it.
+
         """
 
         LoggingBuildStep.__init__(self, **kwargs)
@@ -178,10 +196,14 @@ class Source(LoggingBuildStep):
                                  logEnviron=logEnviron,
                                  env=env,
                                  description=description,
-                                 descriptionDone=descriptionDone
+                                 descriptionDone=descriptionDone,
+                                 trash=trash,
+                                 copyMethod=copyMethod,
+                                 copySync=copySync,
                                  )
 
         assert mode in ("update", "copy", "clobber", "export")
+        assert copyMethod in ("copy", "reflink", "hardlink", "auto")
         if retry:
             delay, repeats = retry
             assert isinstance(repeats, int)
@@ -191,6 +213,12 @@ class Source(LoggingBuildStep):
                      'retry': retry,
                      'patch': None, # set during .start
                      }
+        if trash:
+            self.args['trash'] = True
+        if copyMethod != 'copy':
+            self.args['copy_method'] = copyMethod
+        if copySync:
+            self.args['copy_sync'] = True
         # This will get added to args later, after properties are rendered
         self.workdir = workdir
 
@@ -842,6 +870,7 @@ class Git(Source):
                  reference=None,
                  shallow=False,
                  progress=False,
+                 mirror=None,
                  **kwargs):
         """
         @type  repourl: string
@@ -867,6 +896,13 @@ class Git(Source):
         @param progress: Pass the --progress option when fetching. This
                          can solve long fetches getting killed due to
                          lack of output, but requires Git 1.7.2+.
+
+        @type  mirror: string
+        @param mirror: The path, relative to the builder's base directory,
+                       of a bare mirror of the repository shared by all
+                       builders on the slave.  The slave refreshes the mirror
+                       once for all builders, and checkouts fetch from it and
+                       borrow its objects.
         """
         Source.__init__(self, **kwargs)
         self.repourl = _ComputeRepositoryURL(repourl)
@@ -878,7 +914,10 @@ class Git(Source):
                                  reference=reference,
                                  shallow=shallow,
                                  progress=progress,
+                                 mirror=mirror,
                                  )
+        if mirror:
+            self.args['mirror'] = mirror
         self.args.update({'submodules': submodules,
                           'ignore_ignores': ignore_ignores,
                           'reference': reference,
@@ -221,6 +221,17 @@ class SchedulerChange(Row):
     required_columns = ( 'objectid', 'changeid' )
 
 
+class SchedulerUpstreamBuildset(Row):
+    table = "scheduler_upstream_buildsets"
+
+    defaults = dict(
+        objectid = None,
+        buildsetid = None,
+    )
+
+    required_columns = ( 'objectid', 'buildsetid' )
+
+
 class Buildset(Row):
     table = "buildsets"
 
@@ -374,6 +385,13 @@ class FakeChangesComponent(FakeDBComponent):
 
         return defer.succeed(changeid)
 
+    def addChanges(self, changes):
+        changeids = []
+        for kwargs in changes:
+            d = self.addChange(**kwargs)
+            d.addCallback(changeids.append)
+        return defer.succeed(changeids)
+
     def getLatestChangeid(self):
         if self.changes:
             return defer.succeed(max(self.changes.iterkeys()))
@@ -445,12 +463,16 @@ class FakeSchedulersComponent(FakeDBComponent):
     def setUp(self):
         self.states = {}
         self.classifications = {}
+        self.upstream_bsids = {}
 
     def insertTestData(self, rows):
         for row in rows:
             if isinstance(row, SchedulerChange):
                 cls = self.classifications.setdefault(row.objectid, {})
                 cls[row.changeid] = row.important
+            if isinstance(row, SchedulerUpstreamBuildset):
+                bsids = self.upstream_bsids.setdefault(row.objectid, set())
+                bsids.add(row.buildsetid)
 
     # component methods
 
@@ -480,12 +502,38 @@ class FakeSchedulersComponent(FakeDBComponent):
                     if k in change_branches and change_branches[k] == branch )
         return defer.succeed(classifications)
 
+    def addUpstreamBuildset(self, objectid, bsid):
+        self.upstream_bsids.setdefault(objectid, set()).add(bsid)
+        return defer.succeed(None)
+
+    def removeUpstreamBuildsets(self, objectid, bsids):
+        self.upstream_bsids.setdefault(objectid, set()).difference_update(bsids)
+        return defer.succeed(None)
+
+    def getUpstreamBuildsets(self, objectid):
+        bsids = self.upstream_bsids.setdefault(objectid, set())
+        rv = []
+        for bsid in sorted(bsids):
+            bsdict = self.db.buildsets.buildsets.get(bsid)
+            if not bsdict:
+                bsids.discard(bsid)
+                continue
+            rv.append((bsid, bsdict['sourcestampsetid'],
+                       bool(bsdict['complete'])
+                            or bsid in self.db.buildsets.completed_bsids,
+                       bsdict['results']))
+        return defer.succeed(rv)
+
     # fake methods
 
     def fakeClassifications(self, objectid, classifications):
         """Set the set of classifications for a scheduler"""
         self.classifications[objectid] = classifications
 
+    def assertUpstreamBuildsets(self, objectid, bsids):
+        self.t.assertEqual(sorted(self.upstream_bsids.get(objectid, ())),
+                           sorted(bsids))
+
     # assertions
 
     def assertClassifications(self, objectid, classifications):
@@ -820,6 +868,13 @@ class FakeStateComponent(FakeDBComponent):
         self.states[objectid][name] = json.dumps(value)
         return defer.succeed(None)
 
+    def setStates(self, states):
+        encoded = [ (objectid, name, json.dumps(value))
+                    for objectid, name, value in states ]
+        for objectid, name, value_json in encoded:
+            self.states[objectid][name] = value_json
+        return defer.succeed(None)
+
     # fake methods
 
     def fakeState(self, name, class_name, **kwargs):
@@ -1015,6 +1070,19 @@ class FakeBuildsComponent(FakeDBComponent):
                
         return defer.succeed(ret)            
 
+    def getRecentBuildDurations(self, buildername, count=5):
+        reqs = self.db.buildrequests.reqs
+        ret = []
+        for id in sorted(self.builds, reverse=True):
+            row = self.builds[id]
+            req = reqs.get(row.brid)
+            if (not req or req.buildername != buildername
+                    or not req.complete or req.results not in (0, 1)
+                    or row.finish_time is None):
+                continue
+            ret.append(row.finish_time - row.start_time)
+        return defer.succeed(ret[:count])
+
     def addBuild(self, brid, number, _reactor=reactor):
         bid = self._newId()
         self.builds[bid] = Build(id=bid, number=number, brid=brid,
@@ -1027,6 +1095,7 @@ class FakeBuildsComponent(FakeDBComponent):
             b = self.builds.get(bid)
             if b:
                 b.finish_time = now
+        return defer.succeed(None)
 
 class FakeUsersComponent(FakeDBComponent):
 
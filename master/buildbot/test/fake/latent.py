@@ -0,0 +1,65 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import mock
+from twisted.internet import defer, task
+from buildbot import buildslave
+
+class Clock(task.Clock):
+    """
+    A L{task.Clock} that also accepts (and ignores) system event triggers, as
+    latent slaves add one for shutdown.
+    """
+
+    def addSystemEventTrigger(self, phase, event, f, *args, **kwargs):
+        return (phase, event, f)
+
+    def removeSystemEventTrigger(self, handle):
+        pass
+
+class FakeLatentBuildSlave(buildslave.AbstractLatentBuildSlave):
+    """
+    A latent slave with a fake C{start_instance}: its instances boot after
+    C{boot_time} seconds on the given clock, then substantiate without a real
+    slave connecting.
+
+    @ivar started: the build given to each call to C{start_instance}
+    @ivar stopped: the number of calls to C{stop_instance}
+    """
+
+    boot_time = 30
+
+    def __init__(self, name, clock, **kwargs):
+        buildslave.AbstractLatentBuildSlave.__init__(self, name, 'pass',
+                                                     **kwargs)
+        self._reactor = clock
+        self.started = []
+        self.stopped = 0
+
+    def start_instance(self, build):
+        self.started.append(build)
+        d = defer.Deferred()
+        self._reactor.callLater(self.boot_time, self._booted, d)
+        return d
+
+    def _booted(self, d):
+        d.callback(True)
+        self.slave = mock.Mock(name='remote-%s' % self.slavename)
+        self._substantiated()
+
+    def stop_instance(self, fast=False):
+        self.stopped += 1
+        self.slave = None
+        return defer.succeed(None)
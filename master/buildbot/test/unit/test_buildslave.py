@@ -15,9 +15,9 @@
 
 import mock
 from twisted.trial import unittest
-from twisted.internet import defer
-from buildbot import buildslave, config
-from buildbot.test.fake import fakemaster
+from twisted.internet import defer, task
+from buildbot import buildslave, config, locks
+from buildbot.test.fake import fakemaster, latent
 
 class AbstractBuildSlave(unittest.TestCase):
 
@@ -62,6 +62,22 @@ class AbstractBuildSlave(unittest.TestCase):
             self.ConcreteBuildSlave('bot', 'pass',
                     notify_on_missing=['a@b.com', 13]))
 
+    def test_acquireLocks_shared_with_step(self):
+        bs = self.ConcreteBuildSlave('bot', 'pass')
+        lockid = locks.MasterLock('lk', maxCount=2)
+        lock = locks.BaseLock('lk', maxCount=2, _reactor=task.Clock())
+        counting = lockid.access('counting')
+        bs.locks = [ (lock, counting) ]
+        # one step holds the lock and another is queued for it exclusively
+        lock.claim('step1', counting)
+        lock.waitUntilMaybeAvailable('step2', lockid.access('exclusive'))
+        # the lock still has room for the slave
+        self.assertTrue(bs.locksAvailable())
+        self.assertTrue(bs.acquireLocks())
+        self.assertFalse(bs.locksAvailable())
+        bs.releaseLocks()
+        self.assertTrue(bs.locksAvailable())
+
     @defer.deferredGenerator
     def do_test_reconfigService(self, old, old_port, new, new_port):
         master = self.master = fakemaster.make_master()
@@ -142,6 +158,29 @@ class AbstractBuildSlave(unittest.TestCase):
         self.assertTrue(self.old_registration.unregister.called)
         self.assertTrue(self.master.pbmanager.register.called)
 
+    def test_isReconfigNeeded(self):
+        old = self.ConcreteBuildSlave('bot', 'pass', max_builds=2,
+                properties={'a':'b'})
+        old.registration = mock.Mock(name='registration')
+        old.registered_port = 'tcp:1234'
+        new_config = mock.Mock()
+        new_config.slavePortnum = 'tcp:1234'
+
+        same = self.ConcreteBuildSlave('bot', 'pass', max_builds=2,
+                properties={'a':'b'})
+        self.assertFalse(old.isReconfigNeeded(same, new_config))
+
+        for kwargs in [ dict(max_builds=3), dict(properties={'a':'c'}),
+                        dict(missing_timeout=10), dict(password='new') ]:
+            args = dict(name='bot', password='pass', max_builds=2,
+                        properties={'a':'b'})
+            args.update(kwargs)
+            new = self.ConcreteBuildSlave(**args)
+            self.assertTrue(old.isReconfigNeeded(new, new_config), kwargs)
+
+        new_config.slavePortnum = 'tcp:5678'
+        self.assertTrue(old.isReconfigNeeded(same, new_config))
+
     def test_startMissingTimer_no_parent(self):
         bs = self.ConcreteBuildSlave('bot', 'pass',
                 notify_on_missing=['abc'],
@@ -174,3 +213,184 @@ class AbstractBuildSlave(unittest.TestCase):
         bs.stopMissingTimer()
         self.assertEqual(bs.missing_timer, None)
 
+
+class LatentSlavePool(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = latent.Clock()
+        self.pending = []
+        self.master = mock.Mock(name='master')
+        self.master.db.buildrequests.getBuildRequests = \
+            lambda buildername, claimed : defer.succeed(self.pending)
+        self.pool = buildslave.LatentSlavePool('pool', min_spares=1,
+                max_spares=3, max_parallel=2, boot_time=30)
+        self.pool._reactor = self.clock
+
+    def tearDown(self):
+        for sl in self.pool.slaves[:]:
+            self.pool.removeSlave(sl)
+
+    def makeSlaves(self, n):
+        slaves = []
+        for i in range(n):
+            sl = latent.FakeLatentBuildSlave('sl%d' % i, self.clock,
+                    build_wait_timeout=600, pool=self.pool)
+            sl.master = self.master
+            sl.slavebuilders = { 'bldr' : mock.Mock() }
+            slaves.append(sl)
+        for sl in slaves:
+            self.pool.addSlave(sl)
+        return slaves
+
+    def test_constructor_checks(self):
+        self.assertRaises(config.ConfigErrors, lambda :
+                buildslave.LatentSlavePool('p', min_spares=2, max_spares=1))
+        self.assertRaises(config.ConfigErrors, lambda :
+                buildslave.LatentSlavePool('p', max_parallel=0))
+
+    def test_min_spares(self):
+        slaves = self.makeSlaves(3)
+        self.assertEqual([ sl.started for sl in slaves ], [[None], [], []])
+        self.assertEqual(len(self.pool.getSpares()), 1)
+        self.clock.advance(30)
+        self.assertTrue(slaves[0].substantiated)
+        self.assertEqual(self.pool.boot_time, 30)
+        # checking again starts nothing more
+        self.clock.advance(self.pool.check_interval)
+        self.assertEqual([ len(sl.started) for sl in slaves ], [1, 0, 0])
+
+    def test_pending_requests(self):
+        self.pending = [ {} ] * 5
+        slaves = self.makeSlaves(4)
+        self.assertEqual(self.pool.target, 3)
+        # only max_parallel at a time
+        self.assertEqual([ len(sl.started) for sl in slaves ], [1, 1, 0, 0])
+        self.clock.advance(30)
+        self.pool.check()
+        self.assertEqual([ len(sl.started) for sl in slaves ], [1, 1, 1, 0])
+
+    def test_arrival_rate(self):
+        self.makeSlaves(1)
+        for i in range(40):
+            self.pool.buildRequestAdded(dict(buildername='bldr'))
+        # 40 requests in the last 600s, and a 30s boot: 2 more expected
+        self.assertEqual(self.pool.getTarget(0), 2)
+        self.pool.buildRequestAdded(dict(buildername='other'))
+        self.assertEqual(len(self.pool.arrivals), 40)
+        self.clock.advance(self.pool.arrival_window + 1)
+        self.assertEqual(self.pool.getTarget(0), 1)
+
+    def test_spare_kept(self):
+        slaves = self.makeSlaves(2)
+        self.clock.advance(30)
+        self.clock.advance(600)
+        self.assertTrue(slaves[0].substantiated)
+        self.assertEqual(slaves[0].stopped, 0)
+        self.assertEqual(self.pool.idle_time, 0)
+
+        # no longer needed
+        self.pool.min_spares = 0
+        self.pool.check()
+        self.clock.advance(600)
+        self.assertFalse(slaves[0].substantiated)
+        self.assertEqual(slaves[0].stopped, 1)
+        self.assertEqual(self.pool.idle_time, 1200)
+
+    def test_idle_time(self):
+        slaves = self.makeSlaves(1)
+        self.clock.advance(30)
+        self.clock.advance(100)
+        sb = mock.Mock()
+        sb.builder_name = 'bldr'
+        slaves[0].substantiate(sb, mock.Mock())
+        slaves[0].buildStarted(sb)
+        self.assertEqual(self.pool.idle_time, 100)
+        self.assertFalse(slaves[0].isSpare())
+
+    def test_spare_taken_while_substantiating(self):
+        slaves = self.makeSlaves(2)
+        self.assertEqual([ len(sl.started) for sl in slaves ], [1, 0])
+        # a build waits for the spare before it has booted, so another
+        # spare is started
+        sb = mock.Mock()
+        sb.builder_name = 'bldr'
+        slaves[0].substantiate(sb, mock.Mock())
+        self.assertFalse(slaves[0].isSpare())
+        self.pool.check()
+        self.assertEqual([ len(sl.started) for sl in slaves ], [1, 1])
+
+    def makePool(self, **kwargs):
+        args = dict(min_spares=1, max_spares=3, max_parallel=2, boot_time=30)
+        args.update(kwargs)
+        pool = buildslave.LatentSlavePool('pool', **args)
+        pool._reactor = self.clock
+        return pool
+
+    def test_compare(self):
+        self.pool.slaveBooted(None, 100)
+        self.assertEqual(self.pool, self.makePool())
+        self.assertNotEqual(self.pool, self.makePool(min_spares=2))
+        self.assertNotEqual(self.pool, self.makePool(boot_time=60))
+
+    def reconfigSlave(self, sl, new_pool):
+        self.patch(buildslave.AbstractBuildSlave, 'reconfigService',
+                   lambda self, new_config : defer.succeed(None))
+        new = latent.FakeLatentBuildSlave(sl.slavename, self.clock,
+                pool=new_pool)
+        new_config = mock.Mock()
+        new_config.slaves = [ new ]
+        return sl.reconfigService(new_config)
+
+    def test_reconfig_unchanged_pool(self):
+        slaves = self.makeSlaves(1)
+        new_pool = self.makePool()
+        new = latent.FakeLatentBuildSlave('sl0', self.clock, pool=new_pool)
+        new_config = mock.Mock()
+        new_config.slavePortnum = 'tcp:1234'
+        slaves[0].registration = mock.Mock()
+        slaves[0].registered_port = 'tcp:1234'
+        self.assertFalse(slaves[0].isReconfigNeeded(new, new_config))
+        self.reconfigSlave(slaves[0], new_pool)
+        self.assertIdentical(slaves[0].pool, self.pool)
+        self.assertEqual(self.pool.slaves, slaves)
+
+    def test_reconfig_changed_pool(self):
+        slaves = self.makeSlaves(1)
+        self.pool.slaveBooted(slaves[0], 100)
+        self.pool.buildRequestAdded(dict(buildername='bldr'))
+        new_pool = self.makePool(min_spares=2, boot_time=60)
+        self.reconfigSlave(slaves[0], new_pool)
+        self.assertIdentical(slaves[0].pool, new_pool)
+        self.assertEqual(self.pool.slaves, [])
+        # what the old pool measured is carried over
+        self.assertEqual(new_pool.boot_time, self.pool.boot_time)
+        self.assertEqual(list(new_pool.arrivals), list(self.pool.arrivals))
+
+    def test_reconfig_changed_pool_nothing_measured(self):
+        slaves = self.makeSlaves(1)
+        new_pool = self.makePool(boot_time=60)
+        self.reconfigSlave(slaves[0], new_pool)
+        self.assertEqual(new_pool.boot_time, 60)
+
+    def test_new_slave_joins_running_pool(self):
+        slaves = self.makeSlaves(1)
+        new = latent.FakeLatentBuildSlave('sl1', self.clock,
+                pool=self.makePool())
+        new.master = self.master
+        new.botmaster = mock.Mock()
+        new.botmaster.slaves = dict(sl0=slaves[0], sl1=new)
+        new.botmaster.getBuildersForSlave.return_value = []
+        new.updateSlave()
+        self.assertIdentical(new.pool, self.pool)
+        self.assertEqual(self.pool.slaves, slaves + [new])
+
+    def test_removeSlave(self):
+        slaves = self.makeSlaves(2)
+        subscription = self.pool.subscription
+        for sl in slaves:
+            self.pool.removeSlave(sl)
+        self.assertTrue(subscription.unsubscribe.called)
+        self.assertEqual(self.pool.loop, None)
+        self.assertEqual(self.pool.master, None)
+        self.clock.advance(30)
+        slaves[0].insubstantiate()
@@ -123,3 +123,108 @@ class ChangeFilter(unittest.TestCase):
         self.yes(Change(project='p', repository='r', branch='b', category='c', ff=True),
                 "all match and fn returns True -> False")
         self.check()
+
+
+class ChangeRouter(unittest.TestCase):
+
+    def setUp(self):
+        self.router = filter.ChangeRouter("changes")
+        self.got = []
+
+    def subscribe(self, name, **kwargs):
+        filt = None
+        if kwargs:
+            filt = filter.ChangeFilter(**kwargs)
+        def cb(change):
+            self.got.append(name)
+        return self.router.subscribe(cb, filt)
+
+    def deliver(self, **kwargs):
+        self.got = []
+        self.router.deliver(Change(**kwargs))
+        return sorted(self.got)
+
+    def test_unfiltered(self):
+        self.subscribe('all')
+        self.subscribe('fn', filter_fn=lambda c : False)
+        self.assertEqual(self.deliver(project='p'), ['all', 'fn'])
+
+    def test_by_value(self):
+        self.subscribe('p', project='p')
+        self.subscribe('pq', project=['p', 'q'], branch='b')
+        self.subscribe('b', branch='b')
+        self.subscribe('default', branch=None)
+        self.assertEqual(self.deliver(project='p'), ['p', 'pq'])
+        self.assertEqual(self.deliver(project='q', branch='b'), ['b', 'pq'])
+        self.assertEqual(self.deliver(branch=None), ['default'])
+        self.assertEqual(self.deliver(project='x', branch='x'), [])
+
+    def test_by_regex(self):
+        self.subscribe('a', branch_re='a')
+        self.subscribe('a2', branch_re='a')
+        self.subscribe('ab', branch_re='a.*b$')
+        self.subscribe('rel', category_re='rel-')
+        self.assertEqual(self.deliver(branch='axb'), ['a', 'a2', 'ab'])
+        self.assertEqual(self.deliver(branch='ax'), ['a', 'a2'])
+        self.assertEqual(self.deliver(branch='xa', category='rel-1'), ['rel'])
+        self.assertEqual(self.deliver(branch=None), [])
+        self.assertEqual(len(self.router.byRegex['branch']), 2)
+
+    def test_by_regex_uncombinable(self):
+        self.subscribe('twice', branch_re=r'(.)\1')
+        self.subscribe('named', branch_re='(?P<x>a)')
+        self.subscribe('named2', branch_re='(?P<x>b)')
+        self.assertEqual(self.deliver(branch='aa'), ['named', 'twice'])
+        self.assertEqual(self.deliver(branch='b'), ['named2'])
+
+    def test_by_regex_inline_flags(self):
+        self.subscribe('ci', branch_re='(?i)rel')
+        self.subscribe('ci2', branch_re='(?i)stable')
+        self.subscribe('verbose', branch_re='(?x) t r u n k')
+        self.assertEqual(self.deliver(branch='REL'), ['ci'])
+        self.assertEqual(self.deliver(branch='Stable'), ['ci2'])
+        self.assertEqual(self.deliver(branch='trunk'), ['verbose'])
+        self.assertEqual(self.deliver(branch='t r u n k'), [])
+        combined, combinable, uncombined = \
+                self.router._getCombined('branch')
+        self.assertEqual(combined, None)
+        self.assertEqual(sorted([ k[0] for k in uncombined ]),
+                ['(?i)rel', '(?i)stable', '(?x) t r u n k'])
+
+    def test_unsubscribe(self):
+        p = self.subscribe('p', project='p')
+        a = self.subscribe('a', branch_re='a')
+        self.subscribe('b', branch_re='b')
+        u = self.subscribe('all')
+        self.assertEqual(self.deliver(project='p', branch='a'),
+                         ['a', 'all', 'p'])
+        p.unsubscribe()
+        a.unsubscribe()
+        u.unsubscribe()
+        self.assertEqual(self.deliver(project='p', branch='a'), [])
+        self.assertEqual(self.deliver(branch='b'), ['b'])
+        self.assertEqual(self.router.byValue, {})
+        self.assertEqual(self.router.routes.values(), [('regex', 'branch',
+                ('b', 0), self.router.byRegex['branch'][('b', 0)][0])])
+
+    def test_matches_filters(self):
+        # every change a filter accepts is delivered to its subscriber
+        filters = dict(
+            p=dict(project='p', branch_re='x'),
+            re=dict(repository_re='r(.)', category=['c', None]),
+            cat=dict(category_fn=lambda c : c == 'c'))
+        for name, kwargs in filters.items():
+            self.subscribe(name, **kwargs)
+        for project in ('p', 'q'):
+            for branch in ('x', 'y', None):
+                for repository in ('r1', 'r', ''):
+                    for category in ('c', None):
+                        kwargs = dict(project=project, branch=branch,
+                                      repository=repository,
+                                      category=category)
+                        got = self.deliver(**kwargs)
+                        for name, fkwargs in filters.items():
+                            f = filter.ChangeFilter(**fkwargs)
+                            if f.filter_change(Change(**kwargs)):
+                                self.assertIn(name, got)
+
@@ -16,7 +16,6 @@
 import os
 from twisted.trial import unittest
 from twisted.internet import defer
-from exceptions import Exception
 from buildbot.changes import gitpoller
 from buildbot.test.util import changesource, gpo
 from buildbot.util import epoch2datetime
@@ -24,6 +23,16 @@ from buildbot.util import epoch2datetime
 # Test that environment variables get propagated to subprocesses (See #2116)
 os.environ['TEST_THAT_ENVIRONMENT_GETS_PASSED_TO_SUBPROCESSES'] = 'TRUE'
 
+def makeLogOutput(commits):
+    # produce output like 'git log -z --name-only' with LOG_FORMAT
+    out = []
+    for rev, stamp, author, comments, files in commits:
+        out.append('\x01%s\0%s\0%s\0%s\n\0\0' % (rev, stamp, author,
+                                                comments))
+        if files:
+            out.append('\n' + ''.join([ f + '\0' for f in files ]))
+    return ''.join(out)
+
 class GitOutputParsing(gpo.GetProcessOutputMixin, unittest.TestCase):
     """Test GitPoller methods for parsing git output"""
     def setUp(self):
@@ -32,74 +41,62 @@ class GitOutputParsing(gpo.GetProcessOutputMixin, unittest.TestCase):
 
     def tearDown(self):
         self.tearDownGetProcessOutput()
-        
-    def _perform_git_output_test(self, methodToTest,
-                                 desiredGoodOutput, desiredGoodResult,
-                                 emptyRaisesException=True):
-        dummyRevStr = '12345abcde'
-
-        # make this call to self.patch here so that we raise a SkipTest if it
-        # is not supported
-        self.addGetProcessOutputResult(self.gpoAnyPattern(), '')
-
-        d = defer.succeed(None)
-        def call_empty(_):
-            # we should get an Exception with empty output from git
-            return methodToTest(dummyRevStr)
-        d.addCallback(call_empty)
-    
-        def cb_empty(_):
-            if emptyRaisesException:
-                self.fail("getProcessOutput should have failed on empty output")
-        def eb_empty(f):
-            if not emptyRaisesException:
-                self.fail("getProcessOutput should NOT have failed on empty output")
-        d.addCallbacks(cb_empty, eb_empty)
-
-        # and the method shouldn't supress any exceptions
-        def call_exception(_):
-            # we should get an Exception with empty output from git
-            self.addGetProcessOutputResult(self.gpoAnyPattern(),
-                    lambda b, a, **k: defer.fail(Exception('fake')))
-            return methodToTest(dummyRevStr)
-        d.addCallback(call_exception)
-    
-        def cb_exception(_):
-            self.fail("getProcessOutput should have failed on empty output")
-        def eb_exception(f):
-            pass
-        d.addCallbacks(cb_exception, eb_exception)
-
-        # finally we should get what's expected from good output
-        def call_desired(_):
-            self.addGetProcessOutputResult(self.gpoAnyPattern(),
-                desiredGoodOutput)
-            return methodToTest(dummyRevStr)
-        d.addCallback(call_desired)
-    
-        def cb_desired(r):
-            self.assertEquals(r, desiredGoodResult)
-        d.addCallback(cb_desired)
-        
-    def test_get_commit_author(self):
-        authorStr = 'Sammy Jankis <email@example.com>'
-        return self._perform_git_output_test(self.poller._get_commit_author,
-                authorStr, authorStr)
-        
-    def test_get_commit_comments(self):
-        commentStr = 'this is a commit message\n\nthat is multiline'
-        return self._perform_git_output_test(self.poller._get_commit_comments,
-                commentStr, commentStr)
-        
-    def test_get_commit_files(self):
-        filesStr = 'file1\nfile2'
-        return self._perform_git_output_test(self.poller._get_commit_files, filesStr, 
-                                      filesStr.split(), emptyRaisesException=False)    
-        
-    def test_get_commit_timestamp(self):
-        stampStr = '1273258009'
-        return self._perform_git_output_test(self.poller._get_commit_timestamp,
-                stampStr, float(stampStr))
+
+    def _perform_get_commits_test(self, commits, expected):
+        self.addGetProcessOutputResult(
+                self.gpoSubcommandPattern('git', 'log'),
+                makeLogOutput(commits))
+        d = self.poller._get_commits('master')
+        def check(result):
+            self.assertEqual(result, expected)
+        d.addCallback(check)
+        return d
+
+    def test_get_commits_timestamp(self):
+        return self._perform_get_commits_test(
+            [ ('4423cdbc', '1273258009', 'S <s@example.com>', 'c', ['a']) ],
+            [ ('4423cdbc', 1273258009.0, u'S <s@example.com>', ['a'],
+               u'c') ])
+
+    def test_get_commits_files(self):
+        return self._perform_get_commits_test(
+            [ ('4423cdbc', '1273258009', 'S <s@example.com>', 'c',
+               ['file1', 'dir/file2', 'file 3']) ],
+            [ ('4423cdbc', 1273258009.0, u'S <s@example.com>',
+               ['file1', 'dir/file2', 'file 3'], u'c') ])
+
+    def test_get_commits_unicode_author(self):
+        return self._perform_get_commits_test(
+            [ ('4423cdbc', '1273258009', 'J\xc3\xbcrgen <j@example.com>',
+               'caf\xc3\xa9', ['a']) ],
+            [ ('4423cdbc', 1273258009.0, u'J\xfcrgen <j@example.com>',
+               ['a'], u'caf\xe9') ])
+
+    def test_get_commits_multiline_comments(self):
+        return self._perform_get_commits_test(
+            [ ('4423cdbc', '1273258009', 'S <s@example.com>',
+               'this is a commit message\n\nthat is multiline', []) ],
+            [ ('4423cdbc', 1273258009.0, u'S <s@example.com>', [],
+               u'this is a commit message\n\nthat is multiline') ])
+
+    def test_get_commits_empty_comments(self):
+        d = self._perform_get_commits_test(
+            [ ('4423cdbc', '1273258009', 'S <s@example.com>', '', ['a']) ],
+            None)
+        return self.assertFailure(d, EnvironmentError)
+
+    def test_get_commits_bad_timestamp(self):
+        d = self._perform_get_commits_test(
+            [ ('4423cdbc', 'yesterday', 'S <s@example.com>', 'c', ['a']) ],
+            None)
+        return self.assertFailure(d, ValueError)
+
+    def test_get_commits_failure(self):
+        # the method shouldn't supress any exceptions
+        self.addGetProcessOutputResult(self.gpoAnyPattern(),
+                lambda b, a, **k: defer.fail(RuntimeError('fake')))
+        d = self.poller._get_commits('master')
+        return self.assertFailure(d, RuntimeError)
 
     # _get_changes is tested in TestGitPoller, below
 
@@ -123,6 +120,39 @@ class TestGitPoller(gpo.GetProcessOutputMixin,
     def test_describe(self):
         self.assertSubstring("GitPoller", self.poller.describe())
 
+    def test_parse_log(self):
+        output = makeLogOutput([
+            ('4423cdbc', '1273258009', 'Sammy <s@example.com>',
+                'first\n\nwith body', ['a', 'dir/b']),
+            ('64a5dc2a', '1273258010', 'Bob <b@example.com>',
+                'merge', []),
+        ])
+        self.assertEqual(list(self.poller._parse_log(output)), [
+            ('4423cdbc', 1273258009.0, u'Sammy <s@example.com>',
+                ['a', 'dir/b'], u'first\n\nwith body'),
+            ('64a5dc2a', 1273258010.0, u'Bob <b@example.com>', [],
+                u'merge'),
+        ])
+
+    def test_parse_log_no_timestamps(self):
+        self.poller.usetimestamps = False
+        output = makeLogOutput([
+            ('4423cdbc', '1273258009', 'S <s@example.com>', 'c', ['a']) ])
+        self.assertEqual(list(self.poller._parse_log(output)),
+            [ ('4423cdbc', None, u'S <s@example.com>', ['a'], u'c') ])
+
+    def test_parse_log_empty(self):
+        self.assertEqual(list(self.poller._parse_log('')), [])
+
+    def test_parse_log_garbage(self):
+        self.assertRaises(EnvironmentError,
+                lambda : list(self.poller._parse_log('\x01abc')))
+
+    def addRefs(self, refs):
+        self.addGetProcessOutputResult(
+                self.gpoSubcommandPattern('git', 'for-each-ref'),
+                ''.join([ '%s %s\n' % (sha, ref) for ref, sha in refs ]))
+
     def test_poll(self):
         # Test that environment variables get propagated to subprocesses (See #2116)
         os.putenv('TEST_THAT_ENVIRONMENT_GETS_PASSED_TO_SUBPROCESSES', 'TRUE')
@@ -134,37 +164,37 @@ class TestGitPoller(gpo.GetProcessOutputMixin,
         self.addGetProcessOutputResult(
                 self.gpoSubcommandPattern('git', 'fetch'),
                 "no interesting output")
+        self.addRefs([
+            ('refs/heads/master', 'fa3ae8ed'),
+            ('refs/remotes/origin/master', '64a5dc2a'),
+        ])
+        log_args = []
+        def log(bin, args, **kwargs):
+            log_args.append(args)
+            return makeLogOutput([
+                ('4423cdbcbb89c14e50dd5f4152415afd686c5241', '1273258009',
+                    'by:4423cdbc', 'hello!', ['/etc/442']),
+                ('64a5dc2a4bd4f558b5dd193d47c83c7d7abc9a1a', '1273258009',
+                    'by:64a5dc2a', 'hello!', ['/etc/64a']),
+            ])
         self.addGetProcessOutputResult(
-                self.gpoSubcommandPattern('git', 'log'),
-                '\n'.join([
-                    '64a5dc2a4bd4f558b5dd193d47c83c7d7abc9a1a',
-                    '4423cdbcbb89c14e50dd5f4152415afd686c5241']))
+                self.gpoSubcommandPattern('git', 'log'), log)
         self.addGetProcessOutputAndValueResult(
                 self.gpoSubcommandPattern('git', 'reset'),
                 ('done', '', 0))
 
-        # and patch out the _get_commit_foo methods which were already tested
-        # above
-        def timestamp(rev):
-            return defer.succeed(1273258009.0)
-        self.patch(self.poller, '_get_commit_timestamp', timestamp)
-        def author(rev):
-            return defer.succeed('by:' + rev[:8])
-        self.patch(self.poller, '_get_commit_author', author)
-        def files(rev):
-            return defer.succeed(['/etc/' + rev[:3]])
-        self.patch(self.poller, '_get_commit_files', files)
-        def comments(rev):
-            return defer.succeed('hello!')
-        self.patch(self.poller, '_get_commit_comments', comments)
-
         # do the poll
         d = self.poller.poll()
 
         # check the results
         def check_changes(_):
+            # a single git process is used for all of the commits
+            self.assertEqual(len(log_args), 1)
+            self.assertEqual(log_args[0][-1], 'master..origin/master')
             self.assertEqual(len(self.changes_added), 2)
             self.assertEqual(self.changes_added[0]['author'], 'by:4423cdbc')
+            self.assertEqual(self.changes_added[0]['revision'],
+                    '4423cdbcbb89c14e50dd5f4152415afd686c5241')
             self.assertEqual(self.changes_added[0]['when_timestamp'],
                                         epoch2datetime(1273258009))
             self.assertEqual(self.changes_added[0]['comments'], 'hello!')
@@ -177,6 +207,72 @@ class TestGitPoller(gpo.GetProcessOutputMixin,
             self.assertEqual(self.changes_added[1]['comments'], 'hello!')
             self.assertEqual(self.changes_added[1]['files'], [ '/etc/64a' ])
             self.assertEqual(self.changes_added[1]['src'], 'git')
+            # and the tracking branch was caught up
+            self.assertEqual(self._gpoav_patterns, [])
         d.addCallback(check_changes)
 
         return d
+
+    def test_poll_no_changes(self):
+        self.addGetProcessOutputResult(
+                self.gpoSubcommandPattern('git', 'fetch'), "")
+        self.addRefs([
+            ('refs/heads/master', '64a5dc2a'),
+            ('refs/remotes/origin/master', '64a5dc2a'),
+        ])
+
+        # no log or reset commands are expected
+        d = self.poller.poll()
+        def check(_):
+            self.assertEqual(self.changes_added, [])
+            self.assertEqual(self._gpo_patterns, [])
+        d.addCallback(check)
+        return d
+
+    def test_poll_multiple_branches(self):
+        self.poller = gitpoller.GitPoller('git@example.com:foo/baz.git',
+                branches=['master', 'release', 'newbranch', 'missing'])
+        self.poller.master = self.master
+        self.assertEqual(self.poller.branch, 'master')
+
+        self.addGetProcessOutputResult(
+                self.gpoSubcommandPattern('git', 'fetch'), "")
+        self.addRefs([
+            ('refs/heads/master', '11111111'),
+            ('refs/heads/release', '22222222'),
+            ('refs/remotes/origin/HEAD', '33333333'),
+            ('refs/remotes/origin/master', '33333333'),
+            ('refs/remotes/origin/release', '44444444'),
+            ('refs/remotes/origin/newbranch', '55555555'),
+        ])
+        def log(bin, args, **kwargs):
+            branch = args[-1].split('..')[0]
+            return makeLogOutput([
+                ('rev-' + branch, '1273258009', 'A <a@example.com>',
+                    'on ' + branch, ['f']) ])
+        self.addGetProcessOutputResult(
+                self.gpoSubcommandPattern('git', 'log'), log)
+        self.addGetProcessOutputResult(
+                self.gpoSubcommandPattern('git', 'log'), log)
+        catchup = []
+        def record(bin, args, **kwargs):
+            catchup.append(args)
+            return ('', '', 0)
+        for i in range(3):
+            self.addGetProcessOutputAndValueResult(self.gpoAnyPattern(),
+                                                   record)
+
+        d = self.poller.poll()
+        def check(_):
+            self.assertEqual(
+                [ (ch['revision'], ch['branch'], ch['comments'])
+                  for ch in self.changes_added ],
+                [ ('rev-master', 'master', 'on master'),
+                  ('rev-release', 'release', 'on release') ])
+            self.assertEqual(sorted(catchup), [
+                ['reset', '--hard', 'origin/master'],
+                ['update-ref', 'refs/heads/newbranch', 'origin/newbranch'],
+                ['update-ref', 'refs/heads/release', 'origin/release'],
+            ])
+        d.addCallback(check)
+        return d
@@ -14,8 +14,7 @@
 # Copyright Buildbot Team Members
 
 import os
-import xml.dom.minidom
-from twisted.internet import defer
+from twisted.internet import defer, error, utils
 from twisted.python import failure
 from twisted.trial import unittest
 from buildbot.test.util import changesource, gpo, compat
@@ -233,10 +232,20 @@ def make_changes_output(maxrevision):
     output = changes_output_template % ("".join(logs))
     return output
 
-def make_logentry_elements(maxrevision):
-    "return the corresponding logentry elements for the given revisions"
-    doc = xml.dom.minidom.parseString(make_changes_output(maxrevision))
-    return doc.getElementsByTagName("logentry")
+def make_log_result(maxrevision):
+    # return a getProcessOutput result that answers the 'svn log' commands
+    # SVNPoller runs, as they would be answered just after the given revision
+    # was committed
+    def result(bin, args, **kwargs):
+        logs = sample_logentries[0:maxrevision]
+        if '--limit=1' in args:
+            logs = logs[-1:]
+        else:
+            rev_args = [ a for a in args if a.startswith('--revision=') ]
+            first = int(rev_args[0].split('=')[1].split(':')[0])
+            logs = logs[first-1:]
+        return changes_output_template % ("".join(logs))
+    return result
 
 def split_file(path):
     pieces = path.split("/")
@@ -262,6 +271,19 @@ class TestSVNPoller(gpo.GetProcessOutputMixin,
     def attachSVNPoller(self, *args, **kwargs):
         s = svnpoller.SVNPoller(*args, **kwargs)
         self.attachChangeSource(s)
+        self.spawned_args = []
+        def spawnProcess(pp, args):
+            # run the command through the patched getProcessOutput, and
+            # deliver the result to the protocol a few bytes at a time
+            self.spawned_args.append(args)
+            d = utils.getProcessOutput(s.svnbin, args, s.environ)
+            def deliver(output):
+                for i in range(0, len(output), 50):
+                    pp.outReceived(output[i:i+50])
+                pp.processEnded(failure.Failure(error.ProcessDone(0)))
+            # a failure here stands for a process that could not be run
+            d.addCallbacks(deliver, pp.deferred.errback)
+        s.spawnProcess = spawnProcess
         return s
 
     def add_svn_command_result(self, command, result):
@@ -312,33 +334,72 @@ class TestSVNPoller(gpo.GetProcessOutputMixin,
         s = self.attachSVNPoller('file:///foo')
         output = make_changes_output(4)
         entries = s.parse_logs(output)
-        # no need for elaborate assertions here; this is minidom's logic
-        self.assertEqual(len(entries), 4)
-
-    def test_get_new_logentries(self):
-        s = self.attachSVNPoller('file:///foo')
-        entries = make_logentry_elements(4)
-
-        s.last_change = 4
-        new = s.get_new_logentries(entries)
-        self.assertEqual(s.last_change, 4)
-        self.assertEqual(len(new), 0)
-
-        s.last_change = 3
-        new = s.get_new_logentries(entries)
-        self.assertEqual(s.last_change, 4)
-        self.assertEqual(len(new), 1)
-
-        s.last_change = 1
-        new = s.get_new_logentries(entries)
-        self.assertEqual(s.last_change, 4)
-        self.assertEqual(len(new), 3)
+        self.assertEqual([ e.revision for e in entries ], [4, 3, 2, 1])
+        self.assertEqual(entries[1].author, u'warner')
+        self.assertEqual(entries[1].msg, u'commit_on_branch')
+        self.assertEqual(entries[1].paths, [(u'M', u'/sample/branch/main.c')])
+
+    def test_log_parser_incremental(self):
+        parser = svnpoller.LogParser()
+        output = make_changes_output(3)
+        revisions = []
+        # feed the output one byte at a time; each entry should be returned
+        # as soon as its closing tag has been parsed
+        for i, c in enumerate(output):
+            for e in parser.feed(c):
+                revisions.append(e.revision)
+                self.assertTrue(output[:i+1].endswith('</logentry>'))
+        parser.close()
+        self.assertEqual(revisions, [3, 2, 1])
+
+    def test_log_parser_no_paths(self):
+        parser = svnpoller.LogParser()
+        entries = parser.feed(changes_output_template %
+                '<logentry revision="9"><msg>x</msg></logentry>')
+        entries += parser.close()
+        self.assertEqual(entries[0].paths, None)
+        self.assertEqual(entries[0].author, u'<unknown>')
+
+    def test_log_protocol_process_failure(self):
+        received = []
+        pp = svnpoller.LogProcessProtocol(received.append)
+        pp.outReceived(changes_output_template % sample_logentries[0])
+        pp.errReceived('svn: E170001: Authorization failed')
+        pp.processEnded(failure.Failure(error.ProcessTerminated(1)))
+        self.assertEqual([ e.revision for e in received ], [1])
+        d = pp.deferred
+        def check(f):
+            f.trap(EnvironmentError)
+            self.assertIn('Authorization failed', str(f.value))
+        d.addCallbacks(lambda _ : self.fail("should have failed"), check)
+        return d
 
-        # special case: if last_change is None, then no new changes are queued
-        s.last_change = None
-        new = s.get_new_logentries(entries)
-        self.assertEqual(s.last_change, 4)
-        self.assertEqual(len(new), 0)
+    def test_log_protocol_bad_xml(self):
+        pp = svnpoller.LogProcessProtocol(lambda e : None)
+        pp.outReceived('<log><logentry revision="1"></log>')
+        pp.processEnded(failure.Failure(error.ProcessDone(0)))
+        return self.assertFailure(pp.deferred,
+                                  svnpoller.xml.parsers.expat.ExpatError)
+
+    def test_get_logs_args(self):
+        s = self.attachSVNPoller(sample_base, histmax=10)
+        s._prefix = 'sample'
+        self.add_svn_command_result('log', make_log_result(2))
+        self.add_svn_command_result('log', make_log_result(2))
+        d = s.get_logs(None)
+        def check_first(_):
+            self.assertEqual(self.spawned_args[-1][-2:],
+                             ['--limit=1', sample_base])
+            self.assertEqual(s.last_change, 2)
+        d.addCallback(check_first)
+        d.addCallback(s.get_logs)
+        def check_second(_):
+            self.assertEqual(self.spawned_args[-1][-3:],
+                             ['--revision=2:HEAD', '--limit=10', sample_base])
+            self.assertEqual(s.last_change, 2)
+            self.assertEqual(self.changes_added, [])
+        d.addCallback(check_second)
+        return d
 
     def test_create_changes(self):
         base = ("file:///home/warner/stuff/Projects/BuildBot/trees/" +
@@ -346,10 +407,10 @@ class TestSVNPoller(gpo.GetProcessOutputMixin,
         s = self.attachSVNPoller(base, split_file=split_file)
         s._prefix = "sample"
 
-        logentries = dict(zip(xrange(1, 7), reversed(make_logentry_elements(6))))
-        changes = s.create_changes(reversed([ logentries[3], logentries[2] ]))
+        logentries = dict([ (e.revision, e) for e in
+                            s.parse_logs(make_changes_output(6)) ])
+        changes = s.create_changes([ logentries[2], logentries[3] ])
         self.failUnlessEqual(len(changes), 2)
-        # note that parsing occurs in reverse
         self.failUnlessEqual(changes[0]['branch'], "branch")
         self.failUnlessEqual(changes[0]['revision'], '2')
         self.failUnlessEqual(changes[1]['branch'], "branch")
@@ -382,7 +443,7 @@ class TestSVNPoller(gpo.GetProcessOutputMixin,
         # fire it the first time; it should do nothing
         def setup_first(_):
             self.add_svn_command_result('info', sample_info_output) # for get_root
-            self.add_svn_command_result('log', make_changes_output(1))
+            self.add_svn_command_result('log', make_log_result(1))
         d.addCallback(setup_first)
         d.addCallback(lambda _ : s.poll())
         def check_first(_):
@@ -393,7 +454,7 @@ class TestSVNPoller(gpo.GetProcessOutputMixin,
 
         # now fire it again, nothing changing
         def setup_second(_):
-            self.add_svn_command_result('log', make_changes_output(1))
+            self.add_svn_command_result('log', make_log_result(1))
         d.addCallback(setup_second)
         d.addCallback(lambda _ : s.poll())
         def check_second(_):
@@ -403,7 +464,7 @@ class TestSVNPoller(gpo.GetProcessOutputMixin,
 
         # and again, with r2 this time
         def setup_third(_):
-            self.add_svn_command_result('log', make_changes_output(2))
+            self.add_svn_command_result('log', make_log_result(2))
         d.addCallback(setup_third)
         d.addCallback(lambda _ : s.poll())
         def check_third(_):
@@ -420,7 +481,7 @@ class TestSVNPoller(gpo.GetProcessOutputMixin,
         # and again with both r3 and r4 appearing together
         def setup_fourth(_):
             self.changes_added = []
-            self.add_svn_command_result('log', make_changes_output(4))
+            self.add_svn_command_result('log', make_log_result(4))
         d.addCallback(setup_fourth)
         d.addCallback(lambda _ : s.poll())
         def check_fourth(_):
@@ -442,6 +503,65 @@ class TestSVNPoller(gpo.GetProcessOutputMixin,
 
         return d
 
+    def test_poll_batches(self):
+        cachepath = os.path.abspath('revcache')
+        open(cachepath, "w").write('1')
+        s = self.attachSVNPoller(sample_base, split_file=split_file,
+                                 cachepath=cachepath)
+        s.changeBatchSize = 2
+        s._prefix = 'sample'
+        self.add_svn_command_result('log', make_log_result(6))
+
+        # record the checkpointed revision as each batch is added
+        checkpoints = []
+        addChanges = self.master.addChanges
+        def recordingAddChanges(changes):
+            checkpoints.append((open(cachepath).read(),
+                                [ c['revision'] for c in changes ]))
+            return addChanges(changes)
+        self.master.addChanges = recordingAddChanges
+
+        d = s.poll()
+        def check(_):
+            # r5 is a branch deletion, so it makes no change but is still
+            # checkpointed
+            self.assertEqual(checkpoints, [
+                ('1', ['2', '3']),
+                ('3', ['4', '6']),
+            ])
+            self.assertEqual(s.last_change, 6)
+            self.assertEqual(open(cachepath).read(), '6')
+        d.addCallback(check)
+        return d
+
+    @compat.usesFlushLoggedErrors
+    def test_poll_batch_failure(self):
+        s = self.attachSVNPoller(sample_base, split_file=split_file)
+        s.changeBatchSize = 2
+        s._prefix = 'sample'
+        s.last_change = 1
+        self.add_svn_command_result('log', make_log_result(6))
+
+        addChanges = self.master.addChanges
+        calls = []
+        def failingAddChanges(changes):
+            calls.append(changes)
+            if len(calls) > 1:
+                return defer.fail(RuntimeError("db down"))
+            return addChanges(changes)
+        self.master.addChanges = failingAddChanges
+
+        d = s.poll()
+        def check(_):
+            self.assertEqual(len(self.flushLoggedErrors(RuntimeError)), 1)
+            # only the first batch was checkpointed, so the rest will be
+            # retried by the next poll
+            self.assertEqual([ c['revision'] for c in self.changes_added ],
+                             ['2', '3'])
+            self.assertEqual(s.last_change, 3)
+        d.addCallback(check)
+        return d
+
     @compat.usesFlushLoggedErrors
     def test_poll_get_prefix_exception(self):
         s = self.attachSVNPoller(sample_base, split_file=split_file,
@@ -987,6 +987,13 @@ class BuilderConfig(ConfigErrorsMixin, unittest.TestCase):
             'slavenames': ['s2', 's1'],
         })
 
+    def test_compare(self):
+        mk = lambda **kw : config.BuilderConfig(name='b', slavename='s1',
+                                        factory=self.factory, **kw)
+        self.assertEqual(mk(), mk())
+        self.assertNotEqual(mk(), mk(category='c'))
+        self.assertNotEqual(mk(), mk(nextSlave=lambda : None))
+
 
 
 class FakeService(config.ReconfigurableServiceMixin,
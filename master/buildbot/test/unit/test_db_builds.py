@@ -92,6 +92,37 @@ class TestBuildsConnectorComponent(
         d.addCallback(check)
         return d
 
+    def test_getRecentBuildDurations(self):
+        d = self.insertTestData(self.background_data + [
+            fakedb.BuildRequest(id=43, buildsetid=30, buildername='b1',
+                                complete=1, results=0),
+            fakedb.BuildRequest(id=44, buildsetid=30, buildername='b1',
+                                complete=1, results=2),
+            fakedb.BuildRequest(id=45, buildsetid=30, buildername='b2',
+                                complete=1, results=0),
+            fakedb.BuildRequest(id=46, buildsetid=30, buildername='b1',
+                                complete=1, results=1),
+            # unfinished
+            fakedb.Build(id=50, brid=42, number=5, start_time=1304262222),
+            fakedb.Build(id=51, brid=43, number=6, start_time=1304262223,
+                                                  finish_time=1304262233),
+            # failed
+            fakedb.Build(id=52, brid=44, number=7, start_time=1304262224,
+                                                  finish_time=1304262235),
+            # another builder
+            fakedb.Build(id=53, brid=45, number=1, start_time=1304262224,
+                                                  finish_time=1304262235),
+            fakedb.Build(id=54, brid=46, number=8, start_time=1304262300,
+                                                  finish_time=1304262320),
+        ])
+        d.addCallback(lambda _ :
+                self.db.builds.getRecentBuildDurations('b1'))
+        d.addCallback(self.assertEqual, [20, 10])
+        d.addCallback(lambda _ :
+                self.db.builds.getRecentBuildDurations('b1', count=1))
+        d.addCallback(self.assertEqual, [20])
+        return d
+
     def test_addBuild(self):
         clock = task.Clock()
         clock.advance(1302222222)
@@ -294,6 +294,49 @@ class TestChangesConnectorComponent(
         d.addCallback(check_change_users)
         return d
 
+    def test_addChanges(self):
+        clock = task.Clock()
+        clock.advance(1239898353)
+        d = self.db.changes.addChanges([
+                dict(author=u'dustin', files=[u'a', u'b'],
+                     comments=u'first', revision=u'2d6caa52',
+                     when_timestamp=epoch2datetime(266738400),
+                     branch=u'master',
+                     properties={u'platform': (u'linux', 'Change')}),
+                dict(author=u'warner', comments=u'second',
+                     revision=u'3e7dbb63', branch=u'release'),
+            ], _reactor=clock)
+        def check_changes(changeids):
+            self.assertEqual(changeids, [1, 2])
+            def thd(conn):
+                r = conn.execute(self.db.model.changes.select(
+                            order_by=self.db.model.changes.c.changeid))
+                r = [ (row.changeid, row.author, row.revision, row.branch,
+                       row.when_timestamp, row.repository, row.project)
+                      for row in r.fetchall() ]
+                self.assertEqual(r, [
+                    (1, 'dustin', '2d6caa52', 'master', 266738400, '', ''),
+                    (2, 'warner', '3e7dbb63', 'release', 1239898353, '', ''),
+                ])
+                r = conn.execute(self.db.model.change_files.select())
+                self.assertEqual(sorted([ (row.changeid, row.filename)
+                                          for row in r.fetchall() ]),
+                                 [ (1, 'a'), (1, 'b') ])
+                r = conn.execute(self.db.model.change_properties.select())
+                self.assertEqual([ (row.changeid, row.property_name)
+                                   for row in r.fetchall() ],
+                                 [ (1, 'platform') ])
+            return self.db.pool.do(thd)
+        d.addCallback(check_changes)
+        return d
+
+    def test_addChanges_empty(self):
+        d = self.db.changes.addChanges([])
+        def check(changeids):
+            self.assertEqual(changeids, [])
+        d.addCallback(check)
+        return d
+
     def test_addChange_with_uid(self):
         d = self.insertTestData([
                 fakedb.User(uid=1, identifier="one"),
@@ -430,6 +473,58 @@ class TestChangesConnectorComponent(
         d.addCallback(check)
         return d
 
+    def test_pruneChanges_batches(self):
+        self.db.changes.pruneBatchSize = 2
+        d = self.insertTestData([ fakedb.Change(changeid=i)
+                                  for i in range(11, 16) ])
+
+        d.addCallback(lambda _ : self.db.changes.pruneChanges(1))
+        def check(_):
+            def thd(conn):
+                tbl = self.db.model.changes
+                r = conn.execute(tbl.select())
+                self.assertEqual([ row.changeid for row in r.fetchall() ],
+                                 [ 15 ])
+            return self.db.pool.do(thd)
+        d.addCallback(check)
+        return d
+
+    def test_pruneChanges_rollback(self):
+        d = self.insertTestData([
+            fakedb.Object(id=29),
+            fakedb.Change(changeid=11),
+            fakedb.SchedulerChange(objectid=29, changeid=11),
+            fakedb.Change(changeid=12),
+        ])
+
+        # fail on the last table, after the others have been deleted from
+        metadata = self.db.model.metadata
+        tables = dict(metadata.tables)
+        tables['change_users'] = mock.Mock()
+        tables['change_users'].delete.side_effect = RuntimeError('oops')
+        fake_metadata = mock.Mock()
+        fake_metadata.tables = tables
+        d.addCallback(lambda _ :
+                self.patch(self.db.model, 'metadata', fake_metadata))
+        d.addCallback(lambda _ : self.db.changes.pruneChanges(1))
+        d.addCallbacks(lambda _ : self.fail("should have failed"),
+                       lambda f : f.trap(RuntimeError))
+        def check(_):
+            def thd(conn):
+                results = {}
+                for tbl_name in ('scheduler_changes', 'changes'):
+                    tbl = metadata.tables[tbl_name]
+                    r = conn.execute(sa.select([tbl.c.changeid]))
+                    results[tbl_name] = sorted([ r[0] for r in r.fetchall() ])
+                # nothing was deleted
+                self.assertEqual(results, {
+                    'scheduler_changes': [11],
+                    'changes': [11, 12],
+                })
+            return self.db.pool.do(thd)
+        d.addCallback(check)
+        return d
+
     def test_pruneChanges_None(self):
         d = self.insertTestData(self.change13_rows)
 
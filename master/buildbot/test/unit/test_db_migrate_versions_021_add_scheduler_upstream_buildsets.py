@@ -0,0 +1,96 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import sqlalchemy as sa
+from twisted.trial import unittest
+from buildbot.test.util import migration
+
+class Migration(migration.MigrateTestMixin, unittest.TestCase):
+
+    def setUp(self):
+        return self.setUpMigrateTest()
+
+    def tearDown(self):
+        return self.tearDownMigrateTest()
+
+    def create_tables_thd(self, conn):
+        metadata = sa.MetaData()
+        metadata.bind = conn
+
+        buildsets = sa.Table('buildsets', metadata,
+            sa.Column('id', sa.Integer,  primary_key=True),
+            # the rest is unimportant
+        )
+        buildsets.create()
+
+        self.objects = sa.Table("objects", metadata,
+            sa.Column("id", sa.Integer, primary_key=True),
+            sa.Column('name', sa.String(128), nullable=False),
+            sa.Column('class_name', sa.String(128), nullable=False),
+        )
+        self.objects.create()
+
+        self.object_state = sa.Table("object_state", metadata,
+            sa.Column("objectid", sa.Integer, sa.ForeignKey('objects.id'),
+                nullable=False),
+            sa.Column("name", sa.String(length=256), nullable=False),
+            sa.Column("value_json", sa.Text, nullable=False),
+        )
+        self.object_state.create()
+
+        conn.execute(buildsets.insert(), [ dict(id=11), dict(id=13) ])
+        conn.execute(self.objects.insert(), [
+            dict(id=1, name='dep', class_name='Dependent'),
+            dict(id=2, name='other', class_name='Periodic'),
+        ])
+        conn.execute(self.object_state.insert(), [
+            # buildset 12 no longer exists
+            dict(objectid=1, name='upstream_bsids', value_json='[11, 12, 13]'),
+            dict(objectid=2, name='last_build', value_json='1234'),
+        ])
+
+    # tests
+
+    def test_update(self):
+        def setup_thd(conn):
+            self.create_tables_thd(conn)
+
+        def verify_thd(conn):
+            metadata = sa.MetaData()
+            metadata.bind = conn
+
+            tbl = sa.Table('scheduler_upstream_buildsets', metadata,
+                           autoload=True)
+            q = sa.select([ tbl.c.objectid, tbl.c.buildsetid ],
+                          order_by=[ tbl.c.buildsetid ])
+            self.assertEqual(
+                [ tuple(row) for row in conn.execute(q).fetchall() ],
+                [ (1, 11), (1, 13) ])
+
+            # the state was moved over, but other state is untouched
+            object_state = sa.Table('object_state', metadata, autoload=True)
+            q = sa.select([ object_state.c.objectid, object_state.c.name ])
+            self.assertEqual(
+                [ tuple(row) for row in conn.execute(q).fetchall() ],
+                [ (2, 'last_build') ])
+
+            insp = sa.engine.reflection.Inspector.from_engine(conn)
+            indexes = dict([ (idx['name'], idx)
+                for idx in insp.get_indexes('scheduler_upstream_buildsets') ])
+            self.assertTrue(indexes['scheduler_upstream_buildsets_unique']
+                                                                ['unique'])
+            self.assertIn('scheduler_upstream_buildsets_buildsetid', indexes)
+
+        return self.do_test_migration(20, 21, setup_thd, verify_thd)
@@ -24,7 +24,9 @@ class TestSchedulersConnectorComponent(
 
     def setUp(self):
         d = self.setUpConnectorComponent(
-            table_names=['changes', 'objects', 'scheduler_changes' ])
+            table_names=['changes', 'objects', 'scheduler_changes',
+                         'sourcestampsets', 'buildsets',
+                         'scheduler_upstream_buildsets' ])
 
         def finish_setup(_):
             self.db.schedulers = \
@@ -159,3 +161,67 @@ class TestSchedulersConnectorComponent(
             self.assertEqual(cls, { 6 : True })
         d.addCallback(check)
         return d
+
+    def getUpstreamRows(self):
+        def thd(conn):
+            tbl = self.db.model.scheduler_upstream_buildsets
+            q = tbl.select(order_by=[tbl.c.objectid, tbl.c.buildsetid])
+            return [ (row.objectid, row.buildsetid)
+                     for row in conn.execute(q).fetchall() ]
+        return self.db.pool.do(thd)
+
+    upstream_data = [
+        fakedb.Object(id=25, name='other'),
+        fakedb.SourceStampSet(id=99),
+        fakedb.Buildset(id=11, sourcestampsetid=99),
+        fakedb.Buildset(id=13, sourcestampsetid=99, complete=1, results=2),
+    ]
+
+    def test_addUpstreamBuildset(self):
+        d = self.insertTestData([ self.scheduler24 ] + self.upstream_data)
+        d.addCallback(lambda _ :
+            self.db.schedulers.addUpstreamBuildset(24, 11))
+        d.addCallback(lambda _ :
+            self.db.schedulers.addUpstreamBuildset(25, 11))
+        # adding it again is harmless
+        d.addCallback(lambda _ :
+            self.db.schedulers.addUpstreamBuildset(24, 11))
+        d.addCallback(lambda _ : self.getUpstreamRows())
+        def check(rows):
+            self.assertEqual(rows, [ (24, 11), (25, 11) ])
+        d.addCallback(check)
+        return d
+
+    def test_removeUpstreamBuildsets(self):
+        d = self.insertTestData([ self.scheduler24 ] + self.upstream_data + [
+            fakedb.SchedulerUpstreamBuildset(objectid=24, buildsetid=11),
+            fakedb.SchedulerUpstreamBuildset(objectid=24, buildsetid=13),
+            fakedb.SchedulerUpstreamBuildset(objectid=25, buildsetid=11),
+        ])
+        d.addCallback(lambda _ :
+            self.db.schedulers.removeUpstreamBuildsets(24, [11, 12]))
+        d.addCallback(lambda _ : self.getUpstreamRows())
+        def check(rows):
+            self.assertEqual(rows, [ (24, 13), (25, 11) ])
+        d.addCallback(check)
+        return d
+
+    def test_getUpstreamBuildsets(self):
+        d = self.insertTestData([ self.scheduler24 ] + self.upstream_data + [
+            fakedb.SchedulerUpstreamBuildset(objectid=24, buildsetid=11),
+            fakedb.SchedulerUpstreamBuildset(objectid=24, buildsetid=12),
+            fakedb.SchedulerUpstreamBuildset(objectid=24, buildsetid=13),
+            fakedb.SchedulerUpstreamBuildset(objectid=25, buildsetid=11),
+        ])
+        d.addCallback(lambda _ :
+            self.db.schedulers.getUpstreamBuildsets(24))
+        def check(subs):
+            self.assertEqual(subs, [ (11, 99, False, -1), (13, 99, True, 2) ])
+        d.addCallback(check)
+        # the missing buildset was forgotten
+        d.addCallback(lambda _ : self.getUpstreamRows())
+        def check_rows(rows):
+            self.assertEqual(rows, [ (24, 11), (24, 13), (25, 11) ])
+        d.addCallback(check_rows)
+        return d
+
@@ -174,6 +174,44 @@ class TestStateConnectorComponent(
         d.addCallback(check)
         return d
 
+    def test_setStates(self):
+        d = self.insertTestData([
+            fakedb.Object(id=10, name='a', class_name='-'),
+            fakedb.Object(id=11, name='b', class_name='-'),
+            fakedb.ObjectState(objectid=10, name='x', value_json='99'),
+        ])
+        d.addCallback(lambda _ :
+            self.db.state.setStates([ (10, 'x', 1), (11, 'x', 2),
+                                      (11, 'y', [3]) ]))
+        def check(_):
+            def thd(conn):
+                q = self.db.model.object_state.select()
+                rows = conn.execute(q).fetchall()
+                self.assertEqual(
+                    sorted([ (r.objectid, r.name, r.value_json)
+                             for r in rows ]),
+                    [ (10, 'x', '1'), (11, 'x', '2'), (11, 'y', '[3]') ])
+            return self.db.pool.do(thd)
+        d.addCallback(check)
+        return d
+
+    def test_setStates_badjson(self):
+        d = self.insertTestData([
+            fakedb.Object(id=10, name='x', class_name='y'),
+        ])
+        d.addCallback(lambda _ :
+            self.db.state.setStates([ (10, 'x', 1), (10, 'y', self) ]))
+        def cb(_):
+            self.fail("should not have succeeded!")
+        def eb(f):
+            f.trap(TypeError)
+            def thd(conn):
+                q = self.db.model.object_state.select()
+                self.assertEqual(conn.execute(q).fetchall(), [])
+            return self.db.pool.do(thd)
+        d.addCallbacks(cb, eb)
+        return d
+
     def test_setState_conflict(self):
         d = self.insertTestData([
             fakedb.Object(id=10, name='-', class_name='-'),
@@ -0,0 +1,297 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import mock
+from twisted.trial import unittest
+from twisted.internet import task
+from buildbot import locks
+from buildbot.process import metrics, build
+
+class BaseLock(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.lockid = locks.MasterLock('lk', maxCount=2)
+        self.lock = locks.BaseLock('lk', maxCount=2, _reactor=self.clock)
+        self.counting = locks.LockAccess(self.lockid, 'counting')
+        self.exclusive = locks.LockAccess(self.lockid, 'exclusive')
+        self.fired = []
+
+    def wait(self, owner, access):
+        d = self.lock.waitUntilMaybeAvailable(owner, access)
+        d.addCallback(lambda _ : self.fired.append(owner))
+        return d
+
+    def test_counting(self):
+        self.lock.claim('a', self.counting)
+        self.lock.claim('b', self.counting)
+        self.assertFalse(self.lock.isAvailable('c', self.counting))
+        self.assertFalse(self.lock.isAvailable('c', self.exclusive))
+        self.assertEqual(self.lock._getOwnersCount(), (0, 2))
+        self.assertTrue(self.lock.isOwner('a', self.counting))
+        self.lock.release('a', self.counting)
+        self.assertFalse(self.lock.isOwner('a', self.counting))
+        self.assertTrue(self.lock.isAvailable('c', self.counting))
+        self.assertEqual(self.lock._getOwnersCount(), (0, 1))
+
+    def test_exclusive(self):
+        self.lock.claim('a', self.exclusive)
+        self.assertFalse(self.lock.isAvailable('b', self.counting))
+        self.assertEqual(self.lock._getOwnersCount(), (1, 0))
+        self.lock.release('a', self.exclusive)
+        self.assertTrue(self.lock.isAvailable('b', self.exclusive))
+
+    def test_fifo(self):
+        self.lock.claim('a', self.counting)
+        self.wait('x', self.exclusive)
+        # there is room for a counting owner, but 'x' came first
+        self.assertFalse(self.lock.isAvailable('b', self.counting))
+        self.wait('b', self.counting)
+        self.wait('c', self.counting)
+        self.assertEqual([ w.owner for w in self.lock.getWaiters() ],
+                         ['x', 'b', 'c'])
+
+        self.lock.release('a', self.counting)
+        self.clock.advance(0)
+        self.assertEqual(self.fired, ['x'])
+        # the room is kept for 'x'
+        self.assertFalse(self.lock.isAvailable('d', self.counting))
+        self.assertTrue(self.lock.isAvailable('x', self.exclusive))
+        self.lock.claim('x', self.exclusive)
+
+        self.lock.release('x', self.exclusive)
+        self.clock.advance(0)
+        self.assertEqual(self.fired, ['x', 'b', 'c'])
+        self.lock.claim('c', self.counting)
+        self.lock.claim('b', self.counting)
+        self.assertEqual(self.lock.getWaiters(), [])
+
+    def test_tickets(self):
+        self.lock.claim('a', self.exclusive)
+        self.wait('b', self.counting)
+        self.wait('c', self.counting)
+        self.assertEqual([ w.ticket for w in self.lock.getWaiters() ],
+                         [0, 1])
+
+    def test_waiter_joins_woken(self):
+        self.lock.claim('a', self.exclusive)
+        self.wait('b', self.counting)
+        self.lock.release('a', self.exclusive)
+        # 'b' is woken but has not claimed yet; there is room for one more,
+        # which a newcomer gets right away, as nobody is queued ahead of it
+        self.wait('c', self.counting)
+        self.assertEqual(self.fired, ['c'])
+        self.clock.advance(0)
+        self.assertEqual(self.fired, ['c', 'b'])
+
+    def test_stopWaiting_woken(self):
+        self.lock.claim('a', self.exclusive)
+        self.wait('b', self.exclusive)
+        self.wait('c', self.counting)
+        self.lock.release('a', self.exclusive)
+        self.clock.advance(0)
+        self.assertEqual(self.fired, ['b'])
+        # 'b' gives up, so its room goes to 'c'
+        self.lock.stopWaitingUntilAvailable('b', self.exclusive)
+        self.clock.advance(0)
+        self.assertEqual(self.fired, ['b', 'c'])
+        self.assertTrue(self.lock.isAvailable('c', self.counting))
+
+    def test_stopWaiting_queued(self):
+        self.lock.claim('a', self.exclusive)
+        d = self.wait('b', self.counting)
+        self.wait('c', self.counting)
+        self.lock.stopWaitingUntilAvailable('b', self.counting, d)
+        # not waiting at all is fine too
+        self.lock.stopWaitingUntilAvailable('z', self.counting)
+        self.lock.release('a', self.exclusive)
+        self.clock.advance(0)
+        self.assertEqual(self.fired, ['c'])
+        self.assertEqual(list(self.lock.waiting), [])
+
+    def test_interrupted_before_wakeup(self):
+        self.lock.claim('a', self.exclusive)
+        d = self.wait('b', self.counting)
+        self.lock.release('a', self.exclusive)
+        # as Build.stopBuild does, before the wakeup is delivered
+        self.lock.stopWaitingUntilAvailable('b', self.counting, d)
+        d.callback(None)
+        self.clock.advance(0)
+        self.assertEqual(self.fired, ['b'])
+
+    def test_metrics(self):
+        times = mock.Mock()
+        counts = mock.Mock()
+        self.patch(metrics.MetricTimeEvent, 'log', times)
+        self.patch(metrics.MetricCountEvent, 'log', counts)
+
+        self.lock.claim('a', self.exclusive)
+        self.wait('b', self.counting)
+        counts.assert_called_with('locks.lk.queue', 1, absolute=True)
+        self.clock.advance(3)
+        self.lock.release('a', self.exclusive)
+        times.assert_called_with('locks.lk.hold', 3)
+        self.clock.advance(2)
+        self.lock.claim('b', self.counting)
+        times.assert_called_with('locks.lk.wait', 5)
+        counts.assert_called_with('locks.lk.queue', 0, absolute=True)
+
+    def test_suspendWaiting(self):
+        self.lock.claim('a', self.exclusive)
+        self.wait('b', self.exclusive)
+        self.wait('c', self.counting)
+        self.lock.release('a', self.exclusive)
+        self.clock.advance(0)
+        self.assertEqual(self.fired, ['b'])
+        # 'b' has to wait on another lock, so 'c' gets the room
+        self.lock.suspendWaiting('b')
+        self.clock.advance(0)
+        self.assertEqual(self.fired, ['b', 'c'])
+        self.assertFalse(self.lock.isAvailable('b', self.exclusive))
+        self.assertEqual([ w.owner for w in self.lock.getWaiters() ],
+                         ['b', 'c'])
+        # 'b' kept its place, ahead of newcomers
+        self.lock.claim('c', self.counting)
+        self.wait('d', self.exclusive)
+        self.wait('b', self.exclusive)
+        self.lock.release('c', self.counting)
+        self.clock.advance(0)
+        self.assertEqual(self.fired, ['b', 'c', 'b'])
+
+    def test_suspended_claims_leftover_room(self):
+        self.lock.claim('a', self.exclusive)
+        self.wait('b', self.counting)
+        self.lock.suspendWaiting('b')
+        self.lock.release('a', self.exclusive)
+        self.clock.advance(0)
+        # not woken, but nothing is waiting ahead of it
+        self.assertEqual(self.fired, [])
+        self.assertTrue(self.lock.isAvailable('b', self.counting))
+        self.lock.claim('b', self.counting)
+        self.assertEqual(self.lock.getWaiters(), [])
+
+
+    def test_suspended_newcomer_not_blocked(self):
+        self.lock.claim('a', self.exclusive)
+        self.wait('b', self.counting)
+        self.lock.suspendWaiting('b')
+        self.lock.release('a', self.exclusive)
+        # only a suspended waiter is queued, so a newcomer need not wait
+        self.assertTrue(self.lock.isAvailable('c', self.counting))
+
+    def test_not_queued_requester(self):
+        # a slave lock also used by steps: the slave never queues, so it
+        # only needs room, even while steps are queued
+        self.lock.claim('step1', self.counting)
+        self.wait('step2', self.exclusive)
+        self.assertFalse(self.lock.isAvailable('slave', self.counting))
+        self.assertTrue(self.lock.isAvailable('slave', self.counting,
+                                              queue=False))
+        self.lock.claim('slave', self.counting, queue=False)
+        self.assertFalse(self.lock.isAvailable('slave2', self.counting,
+                                               queue=False))
+        # but room kept for a woken waiter is not given away
+        self.lock.release('step1', self.counting)
+        self.lock.release('slave', self.counting)
+        self.assertFalse(self.lock.isAvailable('slave', self.counting,
+                                               queue=False))
+        self.clock.advance(0)
+        self.assertEqual(self.fired, ['step2'])
+
+    def test_many_waiters(self):
+        # waiters that leave or are suspended are skipped over lazily
+        self.lock.claim('a', self.exclusive)
+        for i in range(200):
+            self.wait(i, self.counting)
+        for i in range(0, 200, 2):
+            self.lock.suspendWaiting(i)
+        self.lock.stopWaitingUntilAvailable(1, self.counting)
+        self.lock.release('a', self.exclusive)
+        self.clock.advance(0)
+        self.assertEqual(self.fired, [3, 5])
+        # the first waiter is back at the head of the queue
+        self.wait(0, self.counting)
+        self.lock.claim(3, self.counting)
+        self.lock.claim(5, self.counting)
+        self.lock.release(3, self.counting)
+        self.lock.release(5, self.counting)
+        self.clock.advance(0)
+        self.assertEqual(self.fired, [3, 5, 0, 7])
+
+
+class FakeBuild(object):
+    # uses the real Build.acquireLocks
+
+    stopped = False
+    _acquiringLock = None
+
+    def __init__(self, name, locks):
+        self.name = name
+        self.locks = locks
+
+    def __repr__(self):
+        return self.name
+
+    def acquireLocks(self, res=None):
+        return build.Build.acquireLocks.im_func(self, res)
+
+    def releaseLocks(self):
+        for lock, access in self.locks:
+            lock.release(self, access)
+
+class MultipleLocks(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.accesses = {}
+        self.locks = {}
+        for name in 'AB':
+            lockid = locks.MasterLock(name)
+            self.locks[name] = locks.BaseLock(name, _reactor=self.clock)
+            self.accesses[name] = locks.LockAccess(lockid, 'exclusive')
+
+    def makeBuild(self, name, lockNames):
+        return FakeBuild(name, [ (self.locks[n], self.accesses[n])
+                                 for n in lockNames ])
+
+    def test_opposite_orders(self):
+        holder = self.makeBuild('H', 'AB')
+        x = self.makeBuild('X', 'AB')
+        y = self.makeBuild('Y', 'BA')
+        started = []
+        holder.acquireLocks()
+        for b in x, y:
+            d = b.acquireLocks()
+            d.addCallback(lambda _, b=b : started.append(b))
+        self.assertEqual([ w.owner for w in self.locks['A'].getWaiters() ],
+                         [x])
+        self.assertEqual([ w.owner for w in self.locks['B'].getWaiters() ],
+                         [y])
+
+        holder.releaseLocks()
+        for i in range(10):
+            self.clock.advance(0)
+        self.assertEqual(len(started), 1)
+        first = started[0]
+        for name in 'AB':
+            self.assertTrue(self.locks[name].isOwner(first,
+                                                     self.accesses[name]))
+
+        first.releaseLocks()
+        for i in range(10):
+            self.clock.advance(0)
+        self.assertEqual(sorted(started), sorted([x, y]))
+        for name in 'AB':
+            self.assertEqual(self.locks[name].getWaiters(), [])
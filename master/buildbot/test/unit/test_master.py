@@ -182,6 +182,40 @@ class Subscriptions(dirs.DirsMixin, unittest.TestCase):
                 kwargs=dict(who='me', src='git'),
                 exp_args=(self.master, 'me', 'git'))
 
+    def test_addChanges(self):
+        chdicts = { 20 : dict(changeid=20), 21 : dict(changeid=21) }
+        self.master.db = mock.Mock()
+        self.master.db.changes.addChanges.return_value = \
+            defer.succeed([20, 21])
+        self.master.db.changes.getChange = \
+                lambda changeid : defer.succeed(chdicts[changeid])
+        self.patch(changes.Change, 'fromChdict',
+                classmethod(lambda cls, master, chdict :
+                                defer.succeed('change%d' % chdict['changeid'])))
+        def fake_createUserObject(master, author, src):
+            return defer.succeed(dict(me=7)[author])
+        self.patch(users, 'createUserObject', fake_createUserObject)
+
+        cb = mock.Mock()
+        self.master.subscribeToChanges(cb)
+
+        d = self.master.addChanges([
+            dict(author='me', revision='1', properties={'a' : 'b'},
+                 src='git'),
+            dict(author='you', revision='2'),
+        ])
+        def check(added):
+            self.master.db.changes.addChanges.assert_called_with([
+                dict(author='me', revision='1',
+                     properties={'a' : ('b', 'Change')}, uid=7),
+                dict(author='you', revision='2', properties={}),
+            ])
+            self.assertEqual(added, ['change20', 'change21'])
+            self.assertEqual(cb.call_args_list,
+                    [ (('change20',), {}), (('change21',), {}) ])
+        d.addCallback(check)
+        return d
+
     def test_buildset_subscription(self):
         self.master.db = mock.Mock()
         self.master.db.buildsets.addBuildset.return_value = \
@@ -213,6 +247,18 @@ class Subscriptions(dirs.DirsMixin, unittest.TestCase):
         # assert the notification sub was called correctly
         cb.assert_called_with(938593, 999)
 
+    def test_buildset_completion_subscription_by_bsid(self):
+        self.master.db = mock.Mock()
+
+        cb = mock.Mock()
+        sub = self.master.subscribeToBuildsetCompletion(938593, cb)
+        self.assertIsInstance(sub, subscription.Subscription)
+
+        self.master._buildsetComplete(938594, 999)
+        self.assertFalse(cb.called)
+        self.master._buildsetComplete(938593, 999)
+        cb.assert_called_with(938593, 999)
+
 class StartupAndReconfig(dirs.DirsMixin, unittest.TestCase):
 
     def setUp(self):
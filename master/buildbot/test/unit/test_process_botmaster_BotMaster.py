@@ -19,6 +19,7 @@ from twisted.trial import unittest
 from twisted.internet import defer
 from twisted.application import service
 from buildbot.process.botmaster import BotMaster
+from buildbot.process.builder import Builder
 from buildbot import config, interfaces
 from buildbot.test.fake import fakemaster
 
@@ -124,6 +125,15 @@ class FakeBuildSlave2(FakeBuildSlave):
     pass
 
 
+class FakeBuilder(Builder):
+
+    reconfig_count = 0
+
+    def reconfigService(self, new_config):
+        self.reconfig_count += 1
+        return defer.succeed(None)
+
+
 class TestBotMaster(unittest.TestCase):
 
     def setUp(self):
@@ -138,12 +148,19 @@ class TestBotMaster(unittest.TestCase):
     def test_reconfigService(self):
         # check that reconfigServiceSlaves and reconfigServiceBuilders are
         # both called; they will be tested invidually below
+        def reconfigServiceBuilders(c):
+            self.botmaster.reconfig_builders = set(['b1'])
+            return defer.succeed(None)
         self.patch(self.botmaster, 'reconfigServiceBuilders',
-                mock.Mock(side_effect=lambda c : defer.succeed(None)))
+                mock.Mock(side_effect=reconfigServiceBuilders))
         self.patch(self.botmaster, 'reconfigServiceSlaves',
                 mock.Mock(side_effect=lambda c : defer.succeed(None)))
-        self.patch(self.botmaster, 'maybeStartBuildsForAllBuilders',
-                mock.Mock())
+        self.botmaster.reconfig_slaves = set(['sl1'])
+        b2 = mock.Mock()
+        b2.name = 'b2'
+        self.patch(self.botmaster, 'getBuildersForSlave',
+                mock.Mock(return_value=[ b2 ]))
+        self.patch(self.botmaster.brd, 'maybeStartBuildsOn', mock.Mock())
 
         old_config, new_config = mock.Mock(), mock.Mock()
         d = self.botmaster.reconfigService(new_config)
@@ -153,8 +170,26 @@ class TestBotMaster(unittest.TestCase):
                     new_config)
             self.botmaster.reconfigServiceSlaves.assert_called_with(
                     new_config)
-            self.assertTrue(
-                    self.botmaster.maybeStartBuildsForAllBuilders.called)
+            # builds are started on the changed builders, and on the
+            # builders of changed slaves
+            self.botmaster.getBuildersForSlave.assert_called_with('sl1')
+            self.botmaster.brd.maybeStartBuildsOn.assert_called_with(
+                    ['b1', 'b2'])
+        return d
+
+    def test_reconfigService_skips_unchanged(self):
+        sl1, sl2 = FakeBuildSlave('sl1'), FakeBuildSlave('sl2')
+        b1, b2 = FakeBuilder('b1'), FakeBuilder('b2')
+        for child in sl1, sl2, b1, b2:
+            child.setServiceParent(self.botmaster)
+        self.botmaster.reconfig_slaves = set(['sl2'])
+        self.botmaster.reconfig_builders = set(['b1'])
+        d = config.ReconfigurableServiceMixin.reconfigService(
+                self.botmaster, self.new_config)
+        @d.addCallback
+        def check(_):
+            self.assertEqual([ c.reconfig_count for c in (sl1, sl2, b1, b2) ],
+                             [ 0, 1, 1, 0 ])
         return d
 
     @defer.deferredGenerator
@@ -199,6 +234,27 @@ class TestBotMaster(unittest.TestCase):
 
         # sl was not replaced..
         self.assertIdentical(self.botmaster.slaves['sl1'], sl)
+        # .. and is reconfigured, since it does not know whether it changed
+        self.assertEqual(self.botmaster.reconfig_slaves, set(['sl1']))
+
+    @defer.deferredGenerator
+    def test_reconfigServiceSlaves_unchanged(self):
+        sl = FakeBuildSlave('sl1')
+        sl.isReconfigNeeded = mock.Mock(return_value=False)
+        self.botmaster.slaves = dict(sl1=sl)
+        sl.setServiceParent(self.botmaster)
+
+        sl_new = FakeBuildSlave('sl1')
+        sl2 = FakeBuildSlave('sl2')
+        self.new_config.slaves = [ sl_new, sl2 ]
+
+        wfd = defer.waitForDeferred(
+                self.botmaster.reconfigServiceSlaves(self.new_config))
+        yield wfd
+        wfd.getResult()
+
+        sl.isReconfigNeeded.assert_called_with(sl_new, self.new_config)
+        self.assertEqual(self.botmaster.reconfig_slaves, set(['sl2']))
 
     @defer.deferredGenerator
     def test_reconfigServiceSlaves_class_changes(self):
@@ -247,6 +303,40 @@ class TestBotMaster(unittest.TestCase):
         self.assertEqual(self.botmaster.builders, {})
         self.assertEqual(self.botmaster.builderNames, [])
 
+    @defer.deferredGenerator
+    def test_reconfigServiceBuilders_changed(self):
+        factory = mock.Mock()
+        for name in 'sl1', 'sl2', 'sl3', 'sl4':
+            self.botmaster.slaves[name] = FakeBuildSlave(name)
+        for name, slavename in ('same', 'sl1'), ('changed', 'sl2'):
+            bldr = self.botmaster.builders[name] = FakeBuilder(name)
+            bldr.setServiceParent(self.botmaster)
+            bldr.config = config.BuilderConfig(name=name, factory=factory,
+                                               slavename=slavename)
+        self.botmaster.reconfig_slaves = set()
+
+        self.new_config.builders = [
+            config.BuilderConfig(name='same', factory=factory,
+                                 slavename='sl1'),
+            config.BuilderConfig(name='changed', factory=factory,
+                                 slavename='sl3'),
+            config.BuilderConfig(name='new', factory=factory,
+                                 slavename='sl4'),
+        ]
+
+        wfd = defer.waitForDeferred(
+                self.botmaster.reconfigServiceBuilders(self.new_config))
+        yield wfd
+        wfd.getResult()
+
+        self.assertEqual(self.botmaster.reconfig_builders,
+                         set(['changed', 'new']))
+        self.assertEqual(self.botmaster.reconfig_slaves,
+                         set(['sl2', 'sl3', 'sl4']))
+
+        for bldr in self.botmaster.builders.values():
+            bldr.builder_status = mock.Mock()
+
     def test_maybeStartBuildsForBuilder(self):
         brd = self.botmaster.brd = mock.Mock()
 
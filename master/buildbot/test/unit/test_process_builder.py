@@ -20,8 +20,9 @@ from twisted.python import failure
 from twisted.internet import defer
 from buildbot import config
 from buildbot.test.fake import fakedb, fakemaster
-from buildbot.process import builder
+from buildbot.process import builder, slavebuilder
 from buildbot.db import buildrequests
+from buildbot.status.results import SUCCESS
 from buildbot.util import epoch2datetime
 
 class TestBuilderBuildCreation(unittest.TestCase):
@@ -82,7 +83,7 @@ class TestBuilderBuildCreation(unittest.TestCase):
         """C{slaves} maps name : available"""
         self.bldr.slaves = []
         for name, avail in slavebuilders.iteritems():
-            sb = mock.Mock(spec=['isAvailable'], name=name)
+            sb = mock.Mock(spec=['isAvailable', 'state'], name=name)
             sb.name = name
             sb.isAvailable.return_value = avail
             self.bldr.slaves.append(sb)
@@ -252,7 +253,7 @@ class TestBuilderBuildCreation(unittest.TestCase):
         yield wfd
         wfd.getResult()
 
-        self.bldr._chooseSlave = lambda avail : defer.succeed(None)
+        self.bldr._chooseSlave = lambda avail, brdict : defer.succeed(None)
         self.setSlaveBuilders({'test-slave1':1, 'test-slave2':1})
         rows = self.base_rows + [
             fakedb.BuildRequest(id=11, buildsetid=11, buildername="bldr"),
@@ -270,7 +271,8 @@ class TestBuilderBuildCreation(unittest.TestCase):
         yield wfd
         wfd.getResult()
 
-        self.bldr._chooseSlave = lambda avail : defer.succeed(mock.Mock())
+        self.bldr._chooseSlave = lambda avail, brdict : \
+                defer.succeed(mock.Mock())
         self.setSlaveBuilders({'test-slave1':1, 'test-slave2':1})
         rows = self.base_rows + [
             fakedb.BuildRequest(id=11, buildsetid=11, buildername="bldr"),
@@ -288,7 +290,8 @@ class TestBuilderBuildCreation(unittest.TestCase):
         yield wfd
         wfd.getResult()
 
-        self.bldr._chooseSlave = lambda avail : defer.fail(RuntimeError("xx"))
+        self.bldr._chooseSlave = lambda avail, brdict : \
+                defer.fail(RuntimeError("xx"))
         self.setSlaveBuilders({'test-slave1':1, 'test-slave2':1})
         rows = self.base_rows + [
             fakedb.BuildRequest(id=11, buildsetid=11, buildername="bldr"),
@@ -445,6 +448,16 @@ class TestBuilderBuildCreation(unittest.TestCase):
         self.patch(random, "choice", lambda lst : lst[2])
         return self.do_test_chooseSlave(None, exp_choice=2)
 
+    def test_chooseSlave_default_prefers_substantiated(self):
+        self.patch(random, "choice", lambda lst : lst[-1])
+        slavebuilders = [ mock.Mock(name='sb%d' % i) for i in range(3) ]
+        slavebuilders[1].state = slavebuilder.IDLE
+        slavebuilders[2].state = slavebuilder.LATENT
+        d = self.makeBuilder()
+        d.addCallback(lambda _ : self.bldr._chooseSlave(slavebuilders))
+        d.addCallback(self.assertIdentical, slavebuilders[1])
+        return d
+
     def test_chooseSlave_nextSlave_simple(self):
         def nextSlave(bldr, lst):
             self.assertIdentical(bldr, self.bldr)
@@ -467,6 +480,38 @@ class TestBuilderBuildCreation(unittest.TestCase):
             return defer.fail(failure.Failure(RuntimeError()))
         return self.do_test_chooseSlave(nextSlave, exp_fail=RuntimeError)
 
+    def test_chooseSlave_chooseSlaveForRequest(self):
+        slavebuilders = [ mock.Mock(name='sb%d' % i) for i in range(4) ]
+        brdict = dict(brid=10)
+        class NextSlave(object):
+            def __call__(nextSlave, bldr, lst):
+                self.fail("should not be called")
+            def chooseSlaveForRequest(nextSlave, bldr, lst, brd):
+                self.assertIdentical(bldr, self.bldr)
+                self.assertIdentical(brd, brdict)
+                return defer.succeed(lst[3])
+        d = self.makeBuilder(nextSlave=NextSlave())
+        d.addCallback(lambda _ :
+                self.bldr._chooseSlave(slavebuilders, brdict))
+        d.addCallback(self.assertIdentical, slavebuilders[3])
+        return d
+
+    def test_buildFinished_nextSlave(self):
+        nextSlave = mock.Mock(spec=['__call__', 'buildFinished'])
+        d = self.makeBuilder(nextSlave=nextSlave)
+        def finish(_):
+            build = mock.Mock(name='build')
+            build.requests = []
+            build.build_status.getResults.return_value = SUCCESS
+            sb = mock.Mock(name='sb')
+            self.db.buildrequests.completeBuildRequests = \
+                    lambda brids, results : defer.succeed(None)
+            self.bldr.building.append(build)
+            self.bldr.buildFinished(build, sb, [])
+            nextSlave.buildFinished.assert_called_with(self.bldr, sb, build)
+        d.addCallback(finish)
+        return d
+
     # _chooseBuild
 
     def do_test_chooseBuild(self, nextBuild, exp_choice=None, exp_fail=None):
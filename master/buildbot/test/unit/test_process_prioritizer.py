@@ -0,0 +1,122 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import mock
+from twisted.trial import unittest
+from twisted.internet import defer, task
+from buildbot.process import prioritizer, metrics
+from buildbot.test.fake import fakedb, fakemaster
+from buildbot.util import epoch2datetime
+
+class TestDurationPrioritizer(unittest.TestCase):
+
+    def setUp(self):
+        self.patch(metrics.MetricCountEvent, 'log', mock.Mock())
+        self.clock = task.Clock()
+        self.clock.advance(1000)
+        self.master = fakemaster.make_master()
+        self.master.db = fakedb.FakeDBConnector(self)
+
+    def makeBuilder(self, name, submitted_at=None, duration=None,
+                    slavenames=('s1',)):
+        bldr = mock.Mock(name=name)
+        bldr.name = name
+        bldr.config.slavenames = list(slavenames)
+        if duration is None:
+            bldr.expectations = None
+        else:
+            bldr.expectations.expectedBuildTime.return_value = duration
+        oldest = None
+        if submitted_at is not None:
+            oldest = epoch2datetime(submitted_at)
+        bldr.getOldestRequestTime.return_value = defer.succeed(oldest)
+        return bldr
+
+    def sort(self, prio, builders):
+        d = prio(self.master, builders)
+        d.addCallback(lambda bldrs : [ b.name for b in bldrs ])
+        return d
+
+    def test_shortest_first(self):
+        prio = prioritizer.DurationPrioritizer(_reactor=self.clock)
+        builders = [ self.makeBuilder('long', 900, 7200),
+                     self.makeBuilder('short', 950, 300),
+                     self.makeBuilder('idle', None, 10) ]
+        d = self.sort(prio, builders)
+        d.addCallback(self.assertEqual, ['short', 'long', 'idle'])
+        return d
+
+    def test_aging(self):
+        prio = prioritizer.DurationPrioritizer(_reactor=self.clock)
+        # the long build has waited long enough to go first
+        self.clock.advance(20000)
+        builders = [ self.makeBuilder('long', 900, 7200),
+                     self.makeBuilder('short', 20950, 300) ]
+        d = self.sort(prio, builders)
+        d.addCallback(self.assertEqual, ['long', 'short'])
+        return d
+
+    def test_weights(self):
+        prio = prioritizer.DurationPrioritizer(weights=dict(long=100),
+                                               _reactor=self.clock)
+        builders = [ self.makeBuilder('long', 900, 7200),
+                     self.makeBuilder('short', 950, 300) ]
+        d = self.sort(prio, builders)
+        d.addCallback(self.assertEqual, ['long', 'short'])
+        return d
+
+    def test_no_durations_oldest_first(self):
+        prio = prioritizer.DurationPrioritizer(_reactor=self.clock)
+        builders = [ self.makeBuilder('b1', 950), self.makeBuilder('b2', 900),
+                     self.makeBuilder('b3', 990) ]
+        d = self.sort(prio, builders)
+        d.addCallback(self.assertEqual, ['b2', 'b1', 'b3'])
+        return d
+
+    def test_durations_from_db(self):
+        self.master.db.insertTestData([
+            fakedb.SourceStampSet(id=1),
+            fakedb.SourceStamp(id=1, sourcestampsetid=1),
+            fakedb.Buildset(id=1, sourcestampsetid=1),
+            fakedb.BuildRequest(id=1, buildsetid=1, buildername='dbshort',
+                                complete=1, results=0),
+            fakedb.Build(id=1, brid=1, number=1, start_time=100,
+                         finish_time=110),
+        ])
+        prio = prioritizer.DurationPrioritizer(_reactor=self.clock)
+        builders = [ self.makeBuilder('long', 900, 7200),
+                     self.makeBuilder('dbshort', 950) ]
+        d = self.sort(prio, builders)
+        d.addCallback(self.assertEqual, ['dbshort', 'long'])
+        def check_cache(_):
+            self.assertEqual(prio.durationCache['dbshort'], (1300, 10))
+        d.addCallback(check_cache)
+        return d
+
+    def test_projected_waits(self):
+        prio = prioritizer.DurationPrioritizer(_reactor=self.clock)
+        builders = [ self.makeBuilder('a', 900, 100, slavenames=['s1']),
+                     self.makeBuilder('b', 900, 200, slavenames=['s1', 's2']),
+                     self.makeBuilder('c', 900, 300, slavenames=['s3']),
+                     self.makeBuilder('idle', None, 10) ]
+        d = prio(self.master, builders)
+        def check(_):
+            self.assertEqual(prio.getProjectedWaits(),
+                             dict(a=0, b=50, c=0))
+            metrics.MetricCountEvent.log.assert_any_call(
+                    'DurationPrioritizer.b.projected_wait', 50,
+                    absolute=True)
+        d.addCallback(check)
+        return d
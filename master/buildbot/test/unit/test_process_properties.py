@@ -54,6 +54,12 @@ class TestPropertyMap(unittest.TestCase):
     def testSimpleStr(self):
         self.assertEqual(self.pm['prop_str'], 'a-string')
 
+    def testParseKey(self):
+        self.assertEqual(PropertyMap.parseKey('p'), (None, 'p', None))
+        self.assertEqual(PropertyMap.parseKey('p:-x:+y'), ('-', 'p', 'x:+y'))
+        self.assertEqual(PropertyMap.parseKey('p:~'), ('~', 'p', ''))
+        self.assertEqual(PropertyMap.parseKey('p:+y'), ('+', 'p', 'y'))
+
     def testSimpleNone(self):
         # None is special-cased to become an empty string
         self.assertEqual(self.pm['prop_none'], '')
@@ -342,6 +348,58 @@ class TestWithProperties(unittest.TestCase):
         command = WithProperties('%(z)s', z=lambda props: props.getProperty('x') + props.getProperty('y'))
         self.failUnlessEqual(self.build.render(command), '30')
 
+    def testPercentLiteral(self):
+        self.props.setProperty('y', 1, 'test')
+        command = WithProperties('%%(x)s %(y)s %%')
+        self.failUnlessEqual(self.build.render(command), '%(x)s 1 %')
+
+    def testFormatSpec(self):
+        self.props.setProperty('x', 7, 'test')
+        command = WithProperties('%(x)05d|%(x)-3s|')
+        self.failUnlessEqual(self.build.render(command), '00007|7  |')
+
+    def testNestedParens(self):
+        self.props.setProperty('a(b)', 'c', 'test')
+        command = WithProperties('%(a(b))s')
+        self.failUnlessEqual(self.build.render(command), 'c')
+
+    def testSubstitutionPlan(self):
+        self.props.setProperty('x', 'X', 'test')
+        command = WithProperties('%(x)s %(y:-d)s %(x)s %(z:+p)s')
+        self.failUnlessEqual(self.build.render(command), 'X d X ')
+        plan = command.plan
+        self.assertEqual(plan, [ ('x', None, 'x', None),
+                                 ('y:-d', '-', 'y', 'd'),
+                                 ('z:+p', '+', 'z', 'p') ])
+        # the plan is reused, but the values are not
+        self.props.setProperty('z', 'Z', 'test')
+        self.failUnlessEqual(self.build.render(command), 'X d X p')
+        self.assertIdentical(command.plan, plan)
+
+    def testSubstitutionPlanPositional(self):
+        self.props.setProperty('x', 'X', 'test')
+        command = WithProperties('%s-%s-%s', 'x', 'y:-d', 'x')
+        self.failUnlessEqual(self.build.render(command), 'X-d-X')
+        self.assertEqual(len(command.plan), 3)
+
+    def testRenderPlainContainers(self):
+        command = [ 'make', 'all', 1 ]
+        rendered = self.build.render(command)
+        self.assertEqual(rendered, command)
+        self.assertNotIdentical(rendered, command)
+        env = { 'A' : 'b', 'C' : None }
+        rendered = self.build.render(env)
+        self.assertEqual(rendered, env)
+        self.assertNotIdentical(rendered, env)
+        self.assertEqual(self.build.render(('a', 'b')), ('a', 'b'))
+
+    def testRenderNestedContainers(self):
+        self.props.setProperty('x', 'X', 'test')
+        command = [ 'a', [ 'b', WithProperties('%(x)s') ],
+                    { 'c' : ( WithProperties('%(x)s'), ) } ]
+        self.failUnlessEqual(self.build.render(command),
+                             [ 'a', [ 'b', 'X' ], { 'c' : ( 'X', ) } ])
+
 class TestProperties(unittest.TestCase):
     def setUp(self):
         self.props = Properties()
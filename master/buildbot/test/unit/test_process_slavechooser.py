@@ -0,0 +1,107 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import mock
+from twisted.trial import unittest
+from twisted.internet import defer
+from buildbot.process import slavechooser, metrics
+from buildbot.process.slavebuilder import IDLE, LATENT
+from buildbot.status.results import SUCCESS, FAILURE
+
+class TestAffinitySlaveChooser(unittest.TestCase):
+
+    def setUp(self):
+        self.patch(metrics.MetricCountEvent, 'log', mock.Mock())
+        self.chooser = slavechooser.AffinitySlaveChooser(maxSkips=3)
+        self.builder = mock.Mock(name='builder')
+        self.builder.name = 'bldr'
+        def _brdictToBuildRequest(brdict):
+            breq = mock.Mock(name='breq')
+            breq.source.repository = 'repo'
+            breq.source.branch = brdict['branch']
+            return defer.succeed(breq)
+        self.builder._brdictToBuildRequest = _brdictToBuildRequest
+        self.slavebuilders = dict([ (name, self.makeSlaveBuilder(name))
+                                    for name in ('s1', 's2', 's3') ])
+
+    def makeSlaveBuilder(self, name, state=IDLE):
+        sb = mock.Mock(name=name)
+        sb.slave.slavename = name
+        sb.state = state
+        return sb
+
+    def finish(self, slavename, branch, duration=10, results=SUCCESS):
+        build = mock.Mock(name='build')
+        build.source.repository = 'repo'
+        build.source.branch = branch
+        build.source.revision = 'abcd'
+        build.build_status.getSlavename.return_value = slavename
+        build.build_status.getResults.return_value = results
+        build.build_status.getTimes.return_value = (100, 100 + duration)
+        self.chooser.buildFinished(self.builder,
+                self.slavebuilders[slavename], build)
+
+    def choose(self, branch, names=('s1', 's2', 's3')):
+        sbs = [ self.slavebuilders[n] for n in names ]
+        d = self.chooser.chooseSlaveForRequest(self.builder, sbs,
+                                               dict(branch=branch))
+        chosen = []
+        d.addCallback(lambda sb : chosen.append(sb.slave.slavename))
+        return chosen[0]
+
+    def test_prefers_warm_workdir(self):
+        self.finish('s1', 'br1')
+        self.finish('s2', 'br2')
+        self.assertEqual(self.choose('br2'), 's2')
+        self.assertEqual(self.choose('br1'), 's1')
+
+    def test_anti_starvation(self):
+        self.finish('s1', 'br1')
+        for i in range(3):
+            self.assertEqual(self.choose('br1', ('s1', 's2')), 's1')
+        # s2 was passed over maxSkips times
+        self.assertEqual(self.choose('br1', ('s1', 's2')), 's2')
+        self.assertEqual(self.choose('br1', ('s1', 's2')), 's1')
+
+    def test_uses_durations(self):
+        # warm builds turn out to be slower on this builder
+        self.finish('s1', 'br1', duration=10)
+        self.finish('s1', 'br1', duration=100)
+        self.finish('s2', 'br2', duration=10)
+        self.assertEqual(self.choose('br1', ('s1', 's3')), 's3')
+
+    def test_failed_builds_not_timed(self):
+        self.finish('s1', 'br1', results=FAILURE)
+        self.assertEqual(self.chooser.durations, {})
+        self.assertEqual(self.chooser.getRecord('bldr', 's1').branch, 'br1')
+
+    def test_prefers_non_latent(self):
+        self.slavebuilders['s1'].state = LATENT
+        self.finish('s1', 'br1')
+        self.assertEqual(self.choose('br1', ('s1', 's2')), 's2')
+
+    def test_plain_nextSlave(self):
+        self.finish('s1', 'br1')
+        d = self.chooser(self.builder, [self.slavebuilders['s1']])
+        d.addCallback(self.assertIdentical, self.slavebuilders['s1'])
+        return d
+
+    def test_hit_rates(self):
+        self.finish('s1', 'br1')
+        self.finish('s1', 'br1')
+        self.finish('s2', 'br2')
+        self.assertEqual(self.chooser.getHitRates(), dict(s1=0.5, s2=0.0))
+        metrics.MetricCountEvent.log.assert_any_call(
+                'slavechooser.s1.warm_builds', 1)
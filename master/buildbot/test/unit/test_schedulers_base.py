@@ -151,6 +151,9 @@ class BaseScheduler(scheduler.SchedulerMixin, unittest.TestCase):
             # check that it registered a callback
             callbacks = self.master.getSubscriptionCallbacks()
             self.assertNotEqual(callbacks['changes'], None)
+            # and passed its filter along, for routing
+            self.assertIdentical(self.master.changes_subscr_filter,
+                                 kwargs.get('change_filter'))
 
             # invoke the callback with the change, and check the result
             callbacks['changes'](change)
@@ -14,7 +14,6 @@
 # Copyright Buildbot Team Members
 
 from twisted.trial import unittest
-from twisted.internet import defer
 from buildbot import config
 from buildbot.schedulers import dependent, base
 from buildbot.status.results import SUCCESS, WARNINGS, FAILURE
@@ -32,7 +31,7 @@ class Dependent(scheduler.SchedulerMixin, unittest.TestCase):
     def tearDown(self):
         self.tearDownScheduler()
 
-    def makeScheduler(self, upstream=None):
+    def makeScheduler(self, upstream=None, multiMaster=False):
         # build a fake upstream scheduler
         class Upstream(base.BaseScheduler):
             def __init__(self, name):
@@ -43,11 +42,14 @@ class Dependent(scheduler.SchedulerMixin, unittest.TestCase):
         sched = dependent.Dependent(name='n', builderNames=['b'],
                                     upstream=upstream)
         self.attachScheduler(sched, self.OBJECTID)
+        self.master.config.multiMaster = multiMaster
         return sched
 
-    def assertBuildsetSubscriptions(self, bsids=None):
-        self.db.state.assertState(self.OBJECTID,
-                upstream_bsids=bsids)
+    def assertBuildsetSubscriptions(self, bsids):
+        self.db.schedulers.assertUpstreamBuildsets(self.OBJECTID, bsids)
+        callbacks = self.master.getSubscriptionCallbacks()
+        self.assertEqual(sorted(callbacks['buildset_completion_by_bsid']),
+                         sorted(bsids))
 
     # tests
 
@@ -64,6 +66,24 @@ class Dependent(scheduler.SchedulerMixin, unittest.TestCase):
         sched = self.makeScheduler()
         sched.startService()
 
+        callbacks = self.master.getSubscriptionCallbacks()
+        self.assertNotEqual(callbacks['buildsets'], None)
+        # a single master is told of every completion of the buildsets it
+        # waits on
+        self.assertEqual(callbacks['buildset_completion'], None)
+
+        d = sched.stopService()
+        def check(_):
+            callbacks = self.master.getSubscriptionCallbacks()
+            self.assertEqual(callbacks['buildsets'], None)
+            self.assertEqual(callbacks['buildset_completion_by_bsid'], {})
+        d.addCallback(check)
+        return d
+
+    def test_startService_multiMaster(self):
+        sched = self.makeScheduler(multiMaster=True)
+        sched.startService()
+
         callbacks = self.master.getSubscriptionCallbacks()
         self.assertNotEqual(callbacks['buildsets'], None)
         self.assertNotEqual(callbacks['buildset_completion'], None)
@@ -73,6 +93,7 @@ class Dependent(scheduler.SchedulerMixin, unittest.TestCase):
             callbacks = self.master.getSubscriptionCallbacks()
             self.assertEqual(callbacks['buildsets'], None)
             self.assertEqual(callbacks['buildset_completion'], None)
+            self.assertEqual(callbacks['buildset_completion_by_bsid'], {})
         d.addCallback(check)
         return d
 
@@ -99,7 +120,10 @@ class Dependent(scheduler.SchedulerMixin, unittest.TestCase):
 
         # pretend that the buildset is finished
         self.db.buildsets.fakeBuildsetCompletion(bsid=44, result=result)
-        callbacks['buildset_completion'](44, result)
+        callbacks = self.master.getSubscriptionCallbacks()
+        if expect_subscription:
+            callbacks['buildset_completion_by_bsid'][44](44, result)
+            self.assertBuildsetSubscriptions([])
 
         # and check whether a buildset was added in response
         if expect_buildset:
@@ -129,26 +153,77 @@ class Dependent(scheduler.SchedulerMixin, unittest.TestCase):
     def test_unrelated_buildset(self):
         return self.do_test('unrelated', False, SUCCESS, False)
 
-    @defer.deferredGenerator
-    def test_getUpstreamBuildsets_missing(self):
+    def test_startService_upstream_buildsets(self):
         sched = self.makeScheduler()
 
-        # insert some state, with more bsids than exist
+        # buildsets we were waiting on before the restart, one of which no
+        # longer exists and one of which completed in the meantime
         self.db.insertTestData([
             fakedb.SourceStampSet(id=99),
-            fakedb.Buildset(id=11, sourcestampsetid=99),
+            fakedb.Buildset(id=11, sourcestampsetid=99, complete=1,
+                            results=SUCCESS),
             fakedb.Buildset(id=13, sourcestampsetid=99),
-            fakedb.Object(id=self.OBJECTID),
-            fakedb.ObjectState(objectid=self.OBJECTID,
-                name='upstream_bsids', value_json='[11,12,13]'),
+            fakedb.SchedulerUpstreamBuildset(objectid=self.OBJECTID,
+                                             buildsetid=11),
+            fakedb.SchedulerUpstreamBuildset(objectid=self.OBJECTID,
+                                             buildsetid=12),
+            fakedb.SchedulerUpstreamBuildset(objectid=self.OBJECTID,
+                                             buildsetid=13),
         ])
+        sched.startService()
 
-        # check return value (missing 12)
-        wfd = defer.waitForDeferred(
-            sched._getUpstreamBuildsets())
-        yield wfd
-        self.assertEqual(wfd.getResult(),
-                [(11, 99, False, -1), (13, 99, False, -1)])
+        # the completed buildset was acted on, and the other one is tracked
+        self.assertBuildsetSubscriptions([13])
+        self.db.buildsets.assertBuildsets(3)
+        bsids = self.db.buildsets.allBuildsetIds()
+        self.assertEqual(
+            self.db.buildsets.buildsets[max(bsids)]['sourcestampsetid'], 99)
+        return sched.stopService()
 
-        # and check that it wrote the correct value back to the state
-        self.db.state.assertState(self.OBJECTID, upstream_bsids=[11, 13])
+    def test_buildset_completed_elsewhere(self):
+        sched = self.makeScheduler(multiMaster=True)
+        sched.startService()
+        callbacks = self.master.getSubscriptionCallbacks()
+
+        self.db.insertTestData([
+            fakedb.SourceStampSet(id=99),
+            fakedb.Buildset(id=44, sourcestampsetid=99),
+            fakedb.Buildset(id=45, sourcestampsetid=99),
+            ])
+        callbacks['buildsets'](bsid=44,
+                properties=dict(scheduler=(self.UPSTREAM_NAME, 'Scheduler')))
+        self.assertBuildsetSubscriptions([44])
+
+        # another master completes our buildset, so we are not told of it
+        # directly, but find it when an unrelated buildset completes here
+        self.db.buildsets.fakeBuildsetCompletion(bsid=44, result=SUCCESS)
+        self.db.buildsets.fakeBuildsetCompletion(bsid=45, result=FAILURE)
+        callbacks['buildset_completion'](45, FAILURE)
+
+        self.assertBuildsetSubscriptions([])
+        self.db.buildsets.assertBuildsets(3)
+        return sched.stopService()
+
+    def test_buildset_completed_twice(self):
+        sched = self.makeScheduler()
+        sched.startService()
+        callbacks = self.master.getSubscriptionCallbacks()
+
+        self.db.insertTestData([
+            fakedb.SourceStampSet(id=99),
+            fakedb.Buildset(id=44, sourcestampsetid=99),
+            ])
+        callbacks['buildsets'](bsid=44,
+                properties=dict(scheduler=(self.UPSTREAM_NAME, 'Scheduler')))
+        callback = self.master.getSubscriptionCallbacks()[
+                                    'buildset_completion_by_bsid'][44]
+
+        # a completion found by polling is not acted on again when it is
+        # delivered
+        self.db.buildsets.fakeBuildsetCompletion(bsid=44, result=SUCCESS)
+        sched._checkUpstreamBuildsets()
+        callback(44, SUCCESS)
+
+        self.assertBuildsetSubscriptions([])
+        self.db.buildsets.assertBuildsets(2)
+        return sched.stopService()
@@ -0,0 +1,75 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import time
+from twisted.trial import unittest
+from buildbot.schedulers import timed
+
+class CronSchedule(unittest.TestCase):
+
+    def check(self, schedule, *expectations):
+        for after, expected in expectations:
+            after_ep = time.mktime(after + (0,) * (8 - len(after)) + (-1,))
+            got = schedule.getNextRunTime(after_ep)
+            self.assertEqual(time.localtime(got)[:5], expected[:5],
+                    "%s -> %s != %s" % (after, time.localtime(got), expected))
+
+    def test_every_minute(self):
+        self.check(timed.CronSchedule(),
+            ((2011, 1, 1, 3, 0, 0), (2011, 1, 1, 3, 1)),
+            ((2011, 1, 1, 3, 0, 59), (2011, 1, 1, 3, 1)),
+            ((2011, 12, 31, 23, 59, 30), (2012, 1, 1, 0, 0)),
+        )
+
+    def test_yearly(self):
+        self.check(timed.CronSchedule(minute=15, hour=3, dayOfMonth=1,
+                                      month=1),
+            ((2011, 1, 1, 3, 15), (2012, 1, 1, 3, 15)),
+            ((2011, 6, 7, 8, 9), (2012, 1, 1, 3, 15)),
+        )
+
+    def test_leap_day(self):
+        self.check(timed.CronSchedule(minute=0, hour=0, dayOfMonth=29,
+                                      month=2),
+            ((2011, 1, 1, 0, 0), (2012, 2, 29, 0, 0)),
+            ((2096, 3, 1, 0, 0), (2104, 2, 29, 0, 0)),
+        )
+
+    def test_short_months(self):
+        self.check(timed.CronSchedule(minute=0, hour=12, dayOfMonth=31),
+            ((2011, 3, 31, 13, 0), (2011, 5, 31, 12, 0)),
+        )
+
+    def test_dayOfWeek_or_dayOfMonth(self):
+        # Tuesdays, Fridays and the 5th
+        self.check(timed.CronSchedule(minute=0, hour=1, dayOfWeek=[1, 4],
+                                      dayOfMonth=5),
+            ((2011, 1, 3, 22, 19), (2011, 1, 4, 1, 0)),
+            ((2011, 1, 4, 22, 19), (2011, 1, 5, 1, 0)),
+            ((2011, 1, 5, 22, 19), (2011, 1, 7, 1, 0)),
+        )
+
+    def test_dayOfWeek_and_month(self):
+        # Sundays in March
+        self.check(timed.CronSchedule(minute=30, hour=[6, 18], month=3,
+                                      dayOfWeek=6),
+            ((2011, 2, 27, 10, 0), (2011, 3, 6, 6, 30)),
+            ((2011, 3, 6, 6, 30), (2011, 3, 6, 18, 30)),
+            ((2011, 3, 27, 19, 0), (2012, 3, 4, 6, 30)),
+        )
+
+    def test_never(self):
+        schedule = timed.CronSchedule(dayOfMonth=30, month=2)
+        self.assertEqual(schedule.getNextRunTime(time.time()), None)
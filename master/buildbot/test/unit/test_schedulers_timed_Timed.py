@@ -60,3 +60,17 @@ class Timed(scheduler.SchedulerMixin, unittest.TestCase):
 
         d = sched.stopService()
         return d
+
+    def test_getNextBuildTime_never(self):
+        sched = self.makeScheduler(name='test', builderNames=['foo'])
+        sched.getNextBuildTime = lambda lastActuation : defer.succeed(None)
+
+        sched.startService()
+
+        self.assertEqual(sched.actuateAt, None)
+        self.assertEqual(sched.actuateAtTimer, None)
+        self.assertEqual(sched.getPendingBuildTimes(), [])
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+        d = sched.stopService()
+        return d
@@ -0,0 +1,142 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import mock
+from twisted.trial import unittest
+from twisted.internet import task, defer
+from buildbot.schedulers import timed
+from buildbot.process import metrics
+from buildbot.test.fake import fakedb
+
+class TimerWheel(unittest.TestCase):
+
+    def setUp(self):
+        self.patch(metrics.MetricCountEvent, 'log', mock.Mock())
+        self.clock = task.Clock()
+        self.master = mock.Mock()
+        self.master.db = fakedb.FakeDBConnector(self)
+        self.wheel = timed.TimerWheel(self.master, _reactor=self.clock)
+        self.events = []
+
+    def makeScheduler(self, name, periodicBuildTimer):
+        sched = timed.Periodic(name=name, builderNames=['b'],
+                               periodicBuildTimer=periodicBuildTimer)
+        sched._reactor = self.clock
+        sched.master = self.master
+        sched.parent = mock.Mock()
+        sched.parent.timerWheel = self.wheel
+        def addBuildsetForLatest(reason=None, branch=None):
+            self.events.append('%s@%d' % (name, self.clock.seconds()))
+            return defer.succeed(None)
+        sched.addBuildsetForLatest = addBuildsetForLatest
+        return sched
+
+    def test_shared_timer(self):
+        scheds = [ self.makeScheduler('p%d' % i, 60) for i in range(3) ]
+        scheds.append(self.makeScheduler('q', 90))
+        for sched in scheds:
+            sched.startService()
+        self.clock.advance(0)
+        self.assertEqual(len(self.clock.getDelayedCalls()), 1)
+        self.assertEqual(sorted(self.wheel.slots), [60, 90])
+
+        self.patch(self.master.db.state, 'setStates',
+                   mock.Mock(wraps=self.master.db.state.setStates))
+        self.events = []
+        self.clock.advance(60)
+        self.assertEqual(sorted(self.events), ['p0@60', 'p1@60', 'p2@60'])
+        # all three writes in one batch
+        self.assertEqual(self.master.db.state.setStates.call_count, 1)
+        (states,), _ = self.master.db.state.setStates.call_args
+        self.assertEqual(sorted([ (name, value)
+                                  for _, name, value in states ]),
+                         [ ('last_build', 60) ] * 3)
+        self.assertEqual(sorted(self.wheel.slots), [90, 120])
+        self.assertEqual(len(self.clock.getDelayedCalls()), 1)
+
+        d = defer.gatherResults([ s.stopService() for s in scheds ])
+        def check(_):
+            self.assertEqual(self.wheel.slots, {})
+            self.assertEqual(self.clock.getDelayedCalls(), [])
+        d.addCallback(check)
+        return d
+
+    def test_shared_slot_absolute_time(self):
+        # the schedulers read the time a little before the wheel does, as
+        # happens with a real reactor; their actuations still share a slot
+        class AtHundred(timed.Timed):
+            def getNextBuildTime(self, lastActuation):
+                return defer.succeed(100)
+        scheds = []
+        for lag in (0.25, 0.5):
+            sched = AtHundred(name='at%s' % lag, builderNames=['b'])
+            sched._reactor = self.clock
+            sched.now = lambda lag=lag : self.clock.seconds() - lag
+            sched.parent = mock.Mock()
+            sched.parent.timerWheel = self.wheel
+            sched.getState = lambda name, default=None : defer.succeed(None)
+            scheds.append(sched)
+            sched.startService()
+            self.clock.advance(1)
+        self.assertEqual(self.wheel.slots.keys(), [100])
+        self.assertEqual(len(self.wheel.slots[100]), 2)
+        self.assertEqual([ s.getPendingBuildTimes() for s in scheds ],
+                         [ [100], [100] ])
+
+    def test_callAt(self):
+        calls = []
+        self.clock.advance(3)
+        self.wheel.callAt(10, calls.append, 1)
+        self.wheel.callLater(7, calls.append, 2)
+        self.assertEqual(self.wheel.slots.keys(), [10])
+        self.clock.advance(7)
+        self.assertEqual(calls, [1, 2])
+
+    def test_callLater_cancel(self):
+        calls = []
+        c1 = self.wheel.callLater(10, calls.append, 1)
+        c2 = self.wheel.callLater(5, calls.append, 2)
+        self.assertEqual(self.clock.getDelayedCalls()[0].getTime(), 5)
+        c2.cancel()
+        self.assertEqual(self.clock.getDelayedCalls()[0].getTime(), 10)
+        c2.cancel() # harmless
+        self.clock.advance(10)
+        self.assertEqual(calls, [1])
+        c1.cancel() # already called
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_exception(self):
+        calls = []
+        def fail():
+            raise RuntimeError
+        self.wheel.callLater(5, fail)
+        self.wheel.callLater(5, calls.append, 1)
+        self.clock.advance(5)
+        self.assertEqual(calls, [1])
+        self.assertEqual(len(self.flushLoggedErrors(RuntimeError)), 1)
+
+    def test_setState_not_actuating(self):
+        sched = self.makeScheduler('p', 60)
+        d = sched.getState('last_build', None)
+        d.addCallback(lambda _ :
+                self.wheel.setState(sched, 'last_build', 10))
+        d.addCallback(lambda _ : sched.getState('last_build'))
+        d.addCallback(self.assertEqual, 10)
+        return d
+
+    def test_stop(self):
+        self.wheel.callLater(5, lambda : None)
+        self.wheel.stop()
+        self.assertEqual(self.clock.getDelayedCalls(), [])
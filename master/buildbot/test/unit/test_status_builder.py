@@ -0,0 +1,356 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import os
+import mock
+import cPickle
+from twisted.trial import unittest
+from twisted.internet import task, defer, threads
+from twisted.persisted import styles
+from buildbot.status import builder, master
+from buildbot.process import builder as process_builder
+from buildbot.test.fake import fakemaster
+from buildbot.test.util import dirs
+
+class TestBuilderStatus(dirs.DirsMixin, unittest.TestCase):
+
+    def setUp(self):
+        self.basedir = os.path.abspath('basedir')
+        self.builddir = os.path.join(self.basedir, 'bldr')
+        self.master = fakemaster.make_master()
+        self.master.basedir = self.basedir
+        self.status = master.Status(self.master)
+        self.clock = task.Clock()
+        self.status.buildPruner = builder.BuildPruner(_reactor=self.clock)
+        # run the pruning threads synchronously
+        self.patch(threads, 'deferToThread',
+                lambda f, *args, **kwargs : defer.maybeDeferred(f, *args,
+                                                                **kwargs))
+        return self.setUpDirs(self.basedir)
+
+    def tearDown(self):
+        return self.tearDownDirs()
+
+    def makeBuilderStatus(self):
+        return self.status.builderAdded('bldr', 'bldr', 'cat')
+
+    def touch(self, filename):
+        open(os.path.join(self.builddir, filename), 'w').close()
+
+    def test_new_builder(self):
+        b = self.makeBuilderStatus()
+        self.assertEqual(b.nextBuildNumber, 0)
+        self.assertEqual(b.unloadedFrom, None)
+        self.assertEqual([ e.text for e in b.events ],
+                         [ ["builder", "created"] ])
+
+    def test_index_written_on_newBuild(self):
+        b = self.makeBuilderStatus()
+        b.newBuild()
+        b.newBuild()
+        self.assertEqual(b.readIndex(),
+                dict(name='bldr', category='cat', nextBuildNumber=2,
+                     firstBuildNumber=0, firstLogBuildNumber=0,
+                     skippedPrunes=[]))
+
+    def test_nextBuildNumber_from_index(self):
+        b = self.makeBuilderStatus()
+        for i in range(3):
+            b.newBuild()
+        # the build files were never written, so only the index knows
+        b = self.makeBuilderStatus()
+        self.assertEqual(b.nextBuildNumber, 3)
+
+    def test_nextBuildNumber_stale_index(self):
+        b = self.makeBuilderStatus()
+        b.newBuild()
+        self.touch('1')
+        self.touch('7')
+        self.touch('7-stdio')
+        b = self.makeBuilderStatus()
+        self.assertEqual(b.nextBuildNumber, 8)
+        self.assertEqual(b.readIndex()['nextBuildNumber'], 8)
+
+    def test_nextBuildNumber_corrupt_index(self):
+        os.makedirs(self.builddir)
+        self.touch('4')
+        open(os.path.join(self.builddir, 'builder.index'), 'w').write('{x')
+        b = self.makeBuilderStatus()
+        self.assertEqual(b.nextBuildNumber, 5)
+
+    def test_lazy_load(self):
+        b = self.makeBuilderStatus()
+        b.addPointEvent(["saved"])
+        b.saveYourself()
+
+        b = self.makeBuilderStatus()
+        self.assertNotEqual(b.unloadedFrom, None)
+        self.assertFalse('events' in b.__dict__)
+        self.assertEqual(b.getName(), 'bldr')
+        self.assertEqual(b.getCategory(), 'cat')
+
+        # the first use of the history loads the pickle
+        self.assertEqual([ e.text for e in b.events ],
+                [ ["builder", "created"], ["saved"] ])
+        self.assertEqual(b.unloadedFrom, None)
+
+    def test_lazy_load_events_not_loaded(self):
+        b = self.makeBuilderStatus()
+        b.addPointEvent(["saved"])
+        b.saveYourself()
+
+        b = self.makeBuilderStatus()
+        b.addPointEvent(["pending"])
+        b.addEvent(["also", "pending"])
+        self.assertNotEqual(b.unloadedFrom, None)
+
+        # the new events come after the saved ones once loaded
+        self.assertEqual([ e.text for e in b.events ],
+                [ ["builder", "created"], ["saved"], ["pending"],
+                  ["also", "pending"] ])
+
+    def test_lazy_load_events_pruned(self):
+        self.master.config.eventHorizon = 2
+        b = self.makeBuilderStatus()
+        b.saveYourself()
+
+        b = self.makeBuilderStatus()
+        for i in range(4):
+            b.addPointEvent([str(i)])
+        self.assertNotEqual(b.unloadedFrom, None)
+        self.assertEqual(len(b.pendingEvents), 2)
+        self.assertEqual([ e.text for e in b.events ], [ ["2"], ["3"] ])
+
+    def test_lazy_load_slave_attached(self):
+        b = self.makeBuilderStatus()
+        b.saveYourself()
+
+        b = self.makeBuilderStatus()
+        bldr = process_builder.Builder('bldr')
+        bldr.builder_status = b
+        sb = mock.Mock()
+        sb.slave.slavename = 'sl'
+        bldr.attaching_slaves = [ sb ]
+        bldr._attached(sb)
+        bldr.detached(sb.slave)
+
+        # attaching and detaching a slave does not load the pickle
+        self.assertNotEqual(b.unloadedFrom, None)
+        self.assertEqual([ e.text for e in b.events ][-2:],
+                [ ["connect", "sl"], ["disconnect", "sl"] ])
+
+    def test_lazy_load_keeps_new_attributes(self):
+        b = self.makeBuilderStatus()
+        b.saveYourself()
+
+        b = self.status.builderAdded('bldr', 'bldr', 'newcat')
+        b.setSlavenames(['sl'])
+        b.loadNow()
+        self.assertEqual(b.category, 'newcat')
+        self.assertEqual(b.slavenames, ['sl'])
+
+    def test_lazy_load_corrupt_pickle(self):
+        os.makedirs(self.builddir)
+        open(os.path.join(self.builddir, 'builder'), 'w').write('junk')
+        b = self.makeBuilderStatus()
+        self.assertEqual(b.events, [])
+        self.assertEqual(b.nextBuild, None)
+        self.flushLoggedErrors()
+
+    def test_unknown_attribute(self):
+        b = self.makeBuilderStatus()
+        b.saveYourself()
+        b = self.makeBuilderStatus()
+        self.assertRaises(AttributeError, lambda : b.noSuchAttribute)
+        self.assertEqual(b.unloadedFrom, None)
+
+    def test_saveYourself_unloaded(self):
+        b = self.makeBuilderStatus()
+        b.saveYourself()
+        filename = os.path.join(self.builddir, 'builder')
+        os.utime(filename, (0, 0))
+        b = self.makeBuilderStatus()
+        b.saveYourself()
+        self.assertEqual(os.stat(filename).st_mtime, 0)
+
+    def test_pickle_unloaded(self):
+        b = self.makeBuilderStatus()
+        b.addPointEvent(["saved"])
+        b.saveYourself()
+        b = self.makeBuilderStatus()
+        state = b.__getstate__()
+        self.assertEqual([ e.text for e in state['events'] ],
+                [ ["builder", "created"], ["saved"] ])
+        self.assertFalse('unloadedFrom' in state)
+        cPickle.dumps(b, -1)
+
+    # pruning
+
+    def makeBuilds(self, b, count):
+        for i in range(count):
+            bs = b.newBuild()
+            step = bs.addStepWithName('s')
+            step.stepStarted()
+            step.addLog('stdio').finish()
+            bs.saveYourself()
+
+    def files(self):
+        return sorted(f for f in os.listdir(self.builddir)
+                      if f not in ('builder', 'builder.index'))
+
+    def pruneBatch(self, b, batchSize):
+        results = []
+        b.pruneBatch(batchSize).addCallback(results.append)
+        return results[0]
+
+    def test_pruneBatch(self):
+        self.master.config.buildHorizon = 3
+        self.master.config.logHorizon = 2
+        b = self.makeBuilderStatus()
+        self.makeBuilds(b, 5)
+        self.assertFalse(self.pruneBatch(b, 10))
+        self.assertEqual(self.files(),
+                ['2', '3', '3-log-s-stdio', '4', '4-log-s-stdio'])
+        self.assertEqual((b.firstBuildNumber, b.firstLogBuildNumber), (2, 3))
+        index = b.readIndex()
+        self.assertEqual((index['firstBuildNumber'],
+                          index['firstLogBuildNumber']), (2, 3))
+
+        # only the new builds are looked at next time
+        self.makeBuilds(b, 1)
+        self.assertFalse(self.pruneBatch(b, 10))
+        self.assertEqual(self.files(),
+                ['3', '4', '4-log-s-stdio', '5', '5-log-s-stdio'])
+
+    def test_pruneBatch_bounded(self):
+        self.master.config.buildHorizon = 1
+        b = self.makeBuilderStatus()
+        self.makeBuilds(b, 5)
+        self.assertTrue(self.pruneBatch(b, 2))
+        self.assertEqual(b.firstBuildNumber, 2)
+        self.assertTrue(self.pruneBatch(b, 2))
+        self.assertFalse(self.pruneBatch(b, 2))
+        self.assertEqual(self.files(), ['4', '4-log-s-stdio'])
+
+    def test_pruneBatch_logHorizon_only(self):
+        self.master.config.logHorizon = 1
+        b = self.makeBuilderStatus()
+        self.makeBuilds(b, 3)
+        self.pruneBatch(b, 10)
+        self.assertEqual(self.files(), ['0', '1', '2', '2-log-s-stdio'])
+
+    def test_pruneBatch_cached(self):
+        self.master.config.buildHorizon = 1
+        b = self.makeBuilderStatus()
+        self.makeBuilds(b, 3)
+        build = b.getBuildByNumber(0)
+        self.assertFalse(self.pruneBatch(b, 10))
+        # the cached build is skipped, but does not hold back the others
+        self.assertEqual(self.files(),
+                ['0', '0-log-s-stdio', '2', '2-log-s-stdio'])
+        self.assertEqual((b.firstBuildNumber, b.firstLogBuildNumber), (2, 2))
+        self.assertEqual(b.readIndex()['skippedPrunes'], [[0, True, True]])
+
+        # still cached, so still kept
+        self.assertFalse(self.pruneBatch(b, 10))
+        self.assertEqual(self.files(),
+                ['0', '0-log-s-stdio', '2', '2-log-s-stdio'])
+
+        # once it has left the cache, it is pruned
+        b.buildCache_LRU = []
+        del b.buildCache[0]
+        self.assertFalse(self.pruneBatch(b, 10))
+        self.assertEqual(self.files(), ['2', '2-log-s-stdio'])
+        self.assertEqual(b.skippedPrunes, {})
+        self.assertEqual(b.readIndex()['skippedPrunes'], [])
+
+    def test_pruneBatch_cached_restart(self):
+        self.master.config.buildHorizon = 1
+        b = self.makeBuilderStatus()
+        self.makeBuilds(b, 3)
+        build = b.getBuildByNumber(0)
+        self.pruneBatch(b, 10)
+        del build
+        b.saveYourself()
+
+        # the skipped build is remembered across a restart
+        b = self.makeBuilderStatus()
+        self.assertEqual(b.skippedPrunes, {0 : (True, True)})
+        self.assertFalse(self.pruneBatch(b, 10))
+        self.assertEqual(self.files(), ['2', '2-log-s-stdio'])
+
+    def test_pruneBatch_scans_once(self):
+        b = self.makeBuilderStatus()
+        self.makeBuilds(b, 4)
+        self.touch('1-orphan')
+        self.touch('other')
+        # as if the index was written by an older master
+        b.firstBuildNumber = b.firstLogBuildNumber = None
+        self.master.config.buildHorizon = 2
+        self.assertFalse(self.pruneBatch(b, 1))
+        self.assertEqual(self.files(),
+                ['2', '2-log-s-stdio', '3', '3-log-s-stdio', 'other'])
+        self.assertEqual((b.firstBuildNumber, b.firstLogBuildNumber), (2, 2))
+
+    def test_prune_in_background(self):
+        self.master.config.buildHorizon = 1
+        pruner = self.status.buildPruner
+        pruner.batchSize = 1
+        b = self.makeBuilderStatus()
+        self.makeBuilds(b, 3)
+        b.prune()
+        b.prune()
+        self.assertEqual(pruner.pending, [b])
+        self.assertEqual(len(self.files()), 6)
+        self.clock.advance(0)
+        self.assertEqual(len(self.files()), 4)
+        self.clock.pump([pruner.batchDelay] * 3)
+        self.assertEqual(self.files(), ['2', '2-log-s-stdio'])
+        self.assertEqual(pruner.pending, [])
+        self.assertEqual(pruner.timer, None)
+
+    def test_pruneBatch_logs_not_upgraded(self):
+        self.master.config.logHorizon = 1
+        b = self.makeBuilderStatus()
+        self.makeBuilds(b, 2)
+        # something the reactor thread is in the middle of upgrading
+        upgrading = mock.Mock()
+        styles.versionedsToUpgrade[id(upgrading)] = upgrading
+        try:
+            self.assertFalse(self.pruneBatch(b, 10))
+            # reading the log names from the pickle does not touch the
+            # upgrade queue, which is not safe to use from the pruning thread
+            self.assertEqual(styles.versionedsToUpgrade.values(), [upgrading])
+            self.assertFalse(upgrading.versionedUpgrade.called)
+        finally:
+            styles.versionedsToUpgrade.clear()
+        self.assertEqual(self.files(), ['0', '1', '1-log-s-stdio'])
+
+    def test_pruner_stop_waits(self):
+        self.master.config.buildHorizon = 1
+        pruner = self.status.buildPruner
+        b = self.makeBuilderStatus()
+        self.makeBuilds(b, 3)
+        d = defer.Deferred()
+        self.patch(threads, 'deferToThread', lambda f, *args : d)
+        b.prune()
+        self.clock.advance(0)
+
+        stopped = []
+        pruner.stop().addCallback(stopped.append)
+        self.assertEqual(stopped, [])
+        d.callback(None)
+        self.assertEqual(stopped, [None])
+        self.assertEqual(pruner.timer, None)
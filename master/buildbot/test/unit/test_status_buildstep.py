@@ -27,7 +27,7 @@ class TestBuildStepStatus(unittest.TestCase):
         self.master = fakemaster.make_master()
         self.master.basedir = '/basedir'
 
-        b = builder.BuilderStatus(buildername, self.master, category)
+        b = builder.BuilderStatus(buildername, category, self.master)
         b.master = self.master
         # Ackwardly, Status sets this member variable.
         b.basedir = os.path.abspath(self.mktemp())
@@ -65,3 +65,19 @@ class TestBuildStepStatus(unittest.TestCase):
             [['log_1', ('http://localhost:8080/builders/builder_1/'
                         'builds/0/steps/step_1/logs/log_1')]]
             )
+
+    def testGeneration(self):
+        b = self.setupBuilder('builder_1')
+        self.setupStatus(b)
+        bs = b.newBuild()
+        bss1 = bs.addStepWithName('step_1')
+        build_gen, step_gen = bs.getGeneration(), bss1.getGeneration()
+        bss1.stepStarted()
+        bss1.setText(['running'])
+        self.assertTrue(bss1.getGeneration() > step_gen)
+        self.assertTrue(bs.getGeneration() > build_gen)
+
+        # changes to a build do not affect its steps
+        step_gen = bss1.getGeneration()
+        bs.setText(['text'])
+        self.assertEqual(bss1.getGeneration(), step_gen)
@@ -304,6 +304,69 @@ class TestLogFile(unittest.TestCase, dirs.DirsMixin):
         self.logfile.addHeader('hed')
         addEntry.assert_called_with(2, 'hed')
 
+    def add_lines(self):
+        self.logfile.chunkSize = 10
+        self.logfile.addHeader('head\n')
+        for i in range(5):
+            self.logfile.addStdout('line %d\n' % i)
+        self.logfile.addStderr('err\n')
+        self.logfile.addStdout('partial')
+
+    def check_index(self, index):
+        # header, then stdout in chunks of at most 10 bytes, stderr, stdout
+        self.assertEqual(list(index.textOffsets),
+                         [0, 0, 10, 14, 24, 28, 35, 39])
+        self.assertEqual(list(index.lineOffsets), [0, 0, 1, 2, 3, 4, 5, 6])
+        self.assertEqual(index.textLength, 46)
+        self.assertEqual(index.getLineCount(), 7)
+        fp = self.logfile.getFile()
+        fp.seek(0, 2)
+        self.assertEqual(index.fileLength, fp.tell())
+        fp.seek(index.getFileOffset(3))
+        self.assertEqual(fp.read(14), '11:0line 2\nlin')
+        self.assertEqual(index.findText(0), 0)
+        self.assertEqual(index.findText(12), 2)
+        self.assertEqual(index.findTextEnd(14), 3)
+        self.assertEqual(index.findLine(3), 3)
+        self.assertEqual(index.findLineEnd(3), 4)
+
+    def test_getChunkIndex_live(self):
+        self.add_lines()
+        d = self.logfile.getChunkIndex()
+        d.addCallback(self.check_index)
+        return d
+
+    def test_getChunkIndex_built(self):
+        self.add_lines()
+        self.logfile.finish()
+        self.pickle_and_restore()
+        self.assertEqual(self.logfile.chunkIndex, None)
+        d = self.logfile.getChunkIndex()
+        d.addCallback(self.check_index)
+        d.addCallback(lambda _ :
+                self.assertNotEqual(self.logfile.chunkIndex, None))
+        return d
+
+    def test_subscribeConsumer_range(self):
+        self.logfile.addStdout('abc')
+        self.logfile.addStderr('def')
+        self.logfile.addStdout('ghi')
+        self.logfile._merge()
+        index = self.logfile.chunkIndex
+        consumer = mock.Mock()
+        self.logfile.subscribeConsumer(consumer, index.getFileOffset(1),
+                                       index.getFileOffset(2))
+        d = defer.Deferred()
+        consumer.finish = lambda : d.callback(None)
+        def check(_):
+            self.assertEqual(
+                [ args[0][0] for args in consumer.writeChunk.call_args_list ],
+                [ (1, 'def') ])
+            # the log is not finished, but the consumer is
+            self.assertFalse(self.logfile.isFinished())
+        d.addCallback(check)
+        return d
+
     def do_test_compressLog(self, ext, expect_comp=True):
         self.logfile.openfile.write('xyz' * 1000)
         self.logfile.finish()
@@ -14,11 +14,14 @@
 # Copyright Buildbot Team Members
 
 from mock import Mock
+from email.Message import Message
+from zope.interface import implements
 from buildbot import config
 from twisted.trial import unittest
 from buildbot.status.results import SUCCESS, FAILURE
+from buildbot.status import mail
 from buildbot.status.mail import MailNotifier
-from twisted.internet import defer
+from twisted.internet import defer, protocol, reactor, task
 from buildbot.test.fake import fakedb
 from buildbot.test.fake.fakebuild import FakeBuildStatus
 from buildbot.process import properties
@@ -39,6 +42,10 @@ class FakeLog(object):
     def getText(self):
         return self.text
 
+    def getChunks(self, channels=[], onlyText=False):
+        # a few bytes at a time, to cross line boundaries
+        return [ self.text[i:i+7] for i in range(0, len(self.text), 7) ]
+
 
 class TestMailNotifier(unittest.TestCase):
     def test_createEmail_message_without_patch_and_log_contains_unicode(self):
@@ -508,7 +515,210 @@ class TestMailNotifier(unittest.TestCase):
         mn.buildMessage(builder.name, [build1, build2], build1.result)
         self.assertEqual(m['To'], "tyler@mayhem.net, user2@example.net")
 
+    def test_compare(self):
+        mn = MailNotifier('from@example.org', smtpPort=2525)
+        self.assertEqual(mn, MailNotifier('from@example.org', smtpPort=2525))
+        for kwargs in [ dict(), dict(smtpPort=2525, useTls=True),
+                        dict(smtpPort=2525, smtpUser='u', smtpPassword='p'),
+                        dict(smtpPort=2525, addPatch=False),
+                        dict(smtpPort=2525, buildSetSummary=True) ]:
+            self.assertNotEqual(mn,
+                    MailNotifier('from@example.org', **kwargs))
+
 def create_msgdict():
     unibody = u'Unicode body with non-ascii (\u00E5\u00E4\u00F6).'
     msg_dict = dict(body=unibody, type='plain')
     return msg_dict
+
+
+class TestMailNotifierLogs(unittest.TestCase):
+
+    text = ''.join([ 'line %d\n' % i for i in range(1, 11) ])
+
+    def test_getLogText(self):
+        mn = MailNotifier('from@example.org')
+        self.assertEqual(mn.getLogText(FakeLog(self.text)), self.text)
+
+    def test_getLogText_tail(self):
+        mn = MailNotifier('from@example.org', logTailLines=3)
+        self.assertEqual(mn.getLogText(FakeLog(self.text)),
+                "[7 earlier lines not included]\nline 8\nline 9\nline 10\n")
+
+    def test_getLogText_tail_partial_line(self):
+        mn = MailNotifier('from@example.org', logTailLines=2)
+        self.assertEqual(mn.getLogText(FakeLog(self.text + 'end')),
+                "[9 earlier lines not included]\nline 10\nend")
+
+    def test_getLogText_maxLogSize(self):
+        mn = MailNotifier('from@example.org', maxLogSize=16)
+        self.assertEqual(mn.getLogText(FakeLog(self.text)),
+                "[8 earlier lines not included]\nline 9\nline 10\n")
+        mn.maxLogSize = 4
+        self.assertEqual(mn.getLogText(FakeLog('x' * 50)), 'xxxx')
+
+    def test_createEmail_attaches_tail(self):
+        mn = MailNotifier('from@example.org', addLogs=True, logTailLines=1)
+        m = mn.createEmail(create_msgdict(), u'builder', u'pr', SUCCESS,
+                           [ FakeBuildStatus(name="build") ], [],
+                           [ FakeLog(self.text) ])
+        attachment = m.get_payload()[1].get_payload(decode=True)
+        self.assertEqual(attachment,
+                         "[9 earlier lines not included]\nline 10\n")
+
+class TestMailNotifierDigest(unittest.TestCase):
+
+    def setUp(self):
+        self.mn = MailNotifier('from@example.org', digestDelay=60,
+                               sendToInterestedUsers=False,
+                               extraRecipients=['a@example.org'])
+        self.mn._reactor = self.clock = task.Clock()
+        self.mn.master_status = Mock()
+        self.mn.master_status.getTitle.return_value = 'proj'
+        self.mn.sendMessage = Mock()
+        self.mn.sendMessage.return_value = defer.succeed(None)
+
+    def message(self, subject):
+        m = Message()
+        m['Subject'] = subject
+        m.set_payload('body of ' + subject)
+        return m
+
+    def test_single(self):
+        m = self.message('one')
+        self.mn._gotRecipients([], m)
+        self.assertFalse(self.mn.sendMessage.called)
+        self.clock.advance(60)
+        self.mn.sendMessage.assert_called_with(m, ['a@example.org'])
+
+    def test_digest(self):
+        self.mn._gotRecipients([], self.message('one'))
+        self.clock.advance(30)
+        self.mn._gotRecipients([], self.message('two'))
+        self.clock.advance(30)
+        self.assertEqual(self.mn.sendMessage.call_count, 1)
+        m, recipients = self.mn.sendMessage.call_args[0]
+        self.assertEqual(recipients, ['a@example.org'])
+        self.assertEqual(m['To'], 'a@example.org')
+        self.assertEqual(m['Subject'], 'buildbot: 2 notifications from proj')
+        parts = m.get_payload()
+        self.assertIn(' * one\n * two\n', parts[0].get_payload(decode=True))
+        self.assertEqual([ p.get_payload()[0]['Subject'] for p in parts[1:] ],
+                         ['one', 'two'])
+
+        # the next message starts a new digest
+        self.mn._gotRecipients([], self.message('three'))
+        self.assertEqual(self.mn.sendMessage.call_count, 1)
+        self.clock.advance(60)
+        self.assertEqual(self.mn.sendMessage.call_count, 2)
+
+    def test_stopService_sends_digests(self):
+        self.mn.startService()
+        self.mn._gotRecipients([], self.message('one'))
+        d = self.mn.stopService()
+        def check(_):
+            self.assertEqual(self.mn.sendMessage.call_count, 1)
+            self.assertEqual(self.clock.getDelayedCalls(), [])
+        d.addCallback(check)
+        return d
+
+class FakeMessageDelivery(object):
+    implements(mail.smtp.IMessageDelivery)
+
+    def __init__(self, mailbox):
+        self.mailbox = mailbox
+
+    def receivedHeader(self, helo, origin, recipients):
+        return "Received: from test"
+
+    def validateFrom(self, helo, origin):
+        return origin
+
+    def validateTo(self, user):
+        return lambda : FakeMessage(self.mailbox)
+
+class FakeMessage(object):
+    implements(mail.smtp.IMessage)
+
+    def __init__(self, mailbox):
+        self.mailbox = mailbox
+        self.lines = []
+
+    def lineReceived(self, line):
+        self.lines.append(line)
+
+    def eomReceived(self):
+        self.mailbox.append(self.lines[-1])
+        return defer.succeed(None)
+
+    def connectionLost(self):
+        pass
+
+class RelayProtocol(mail.smtp.ESMTP):
+
+    def connectionLost(self, reason):
+        mail.smtp.ESMTP.connectionLost(self, reason)
+        self.factory.lost.callback(None)
+
+class RelayFactory(protocol.ServerFactory):
+
+    def __init__(self):
+        self.mailbox = []
+        self.connections = 0
+
+    def buildProtocol(self, addr):
+        self.connections += 1
+        self.lost = defer.Deferred()
+        p = RelayProtocol()
+        p.delivery = FakeMessageDelivery(self.mailbox)
+        p.factory = self
+        return p
+
+class TestSMTPOutbox(unittest.TestCase):
+
+    if not mail.smtp:
+        skip = "twisted-mail is not installed"
+
+    def setUp(self):
+        self.relay = RelayFactory()
+        self.port = reactor.listenTCP(0, self.relay, interface='127.0.0.1')
+        self.outbox = mail.SMTPOutbox('127.0.0.1', self.port.getHost().port,
+                                      'from@example.org')
+
+    def tearDown(self):
+        return self.port.stopListening()
+
+    def test_one_connection(self):
+        dl = [ self.outbox.send('Subject: %d\n\nmessage %d\n' % (i, i),
+                                ['to@example.org'])
+               for i in range(3) ]
+        d = defer.gatherResults(dl)
+        d.addCallback(lambda _ : self.relay.lost)
+        def check(_):
+            self.assertEqual(self.relay.mailbox,
+                             ['message 0', 'message 1', 'message 2'])
+            self.assertEqual(self.relay.connections, 1)
+        d.addCallback(check)
+        return d
+
+    def test_maxMessagesPerConnection(self):
+        self.outbox.maxMessagesPerConnection = 2
+        dl = [ self.outbox.send('Subject: %d\n\nmessage %d\n' % (i, i),
+                                ['to@example.org'])
+               for i in range(3) ]
+        d = defer.gatherResults(dl)
+        d.addCallback(lambda _ : self.relay.lost)
+        def check(_):
+            self.assertEqual(len(self.relay.mailbox), 3)
+            self.assertEqual(self.relay.connections, 2)
+        d.addCallback(check)
+        return d
+
+    def test_connection_refused(self):
+        self.outbox.port = 1
+        self.outbox.retries = 1
+        d = self.outbox.send('Subject: x\n\nx\n', ['to@example.org'])
+        def check(f):
+            self.assertEqual(self.outbox.queue, [])
+            self.assertEqual(self.outbox.connector, None)
+        d.addCallbacks(lambda _ : self.fail("should have failed"), check)
+        return d
@@ -22,6 +22,22 @@ from buildbot.test.fake import fakedb
 class FakeStatusReceiver(base.StatusReceiver):
     pass
 
+class ComparableStatusReceiver(base.StatusReceiverMultiService):
+    compare_attrs = ['x']
+    keepOnReconfig = True
+    def __init__(self, x):
+        base.StatusReceiverMultiService.__init__(self)
+        self.x = x
+
+class PartlyComparableStatusReceiver(ComparableStatusReceiver):
+    keepOnReconfig = False
+
+class SubclassedStatusReceiver(ComparableStatusReceiver):
+    # does not compare y, and does not set keepOnReconfig itself
+    def __init__(self, x, y):
+        ComparableStatusReceiver.__init__(self, x)
+        self.y = y
+
 class TestStatus(unittest.TestCase):
 
     def makeStatus(self):
@@ -105,3 +121,84 @@ class TestStatus(unittest.TestCase):
         self.assertIdentical(sr0.master, None)
         self.assertIdentical(sr1.master, None)
         self.assertIdentical(sr2.master, None)
+
+    @defer.deferredGenerator
+    def test_reconfigService_keeps_unchanged(self):
+        m = mock.Mock(name='master')
+        status = master.Status(m)
+        status.startService()
+
+        config = mock.Mock()
+        sr1, sr2 = ComparableStatusReceiver(1), ComparableStatusReceiver(2)
+        config.status = [ sr1, sr2 ]
+        wfd = defer.waitForDeferred(
+                status.reconfigService(config))
+        yield wfd
+        wfd.getResult()
+
+        # an equal receiver is not restarted, while a changed one is
+        # replaced
+        new_sr1, new_sr2 = ComparableStatusReceiver(1), ComparableStatusReceiver(3)
+        config.status = [ new_sr1, new_sr2 ]
+        wfd = defer.waitForDeferred(
+                status.reconfigService(config))
+        yield wfd
+        wfd.getResult()
+
+        self.assertTrue(sr1.running)
+        self.assertIdentical(sr1.master, m)
+        self.assertFalse(new_sr1.running)
+        self.assertFalse(sr2.running)
+        self.assertTrue(new_sr2.running)
+        self.assertEqual(set(status), set([sr1, new_sr2]))
+
+    @defer.deferredGenerator
+    def test_reconfigService_replaces_without_keepOnReconfig(self):
+        m = mock.Mock(name='master')
+        status = master.Status(m)
+        status.startService()
+
+        config = mock.Mock()
+        sr1 = PartlyComparableStatusReceiver(1)
+        config.status = [ sr1 ]
+        wfd = defer.waitForDeferred(
+                status.reconfigService(config))
+        yield wfd
+        wfd.getResult()
+
+        # compare_attrs alone is not enough to keep a receiver running
+        new_sr1 = PartlyComparableStatusReceiver(1)
+        config.status = [ new_sr1 ]
+        wfd = defer.waitForDeferred(
+                status.reconfigService(config))
+        yield wfd
+        wfd.getResult()
+
+        self.assertFalse(sr1.running)
+        self.assertTrue(new_sr1.running)
+        self.assertEqual(list(status), [new_sr1])
+
+    @defer.deferredGenerator
+    def test_reconfigService_keepOnReconfig_not_inherited(self):
+        m = mock.Mock(name='master')
+        status = master.Status(m)
+        status.startService()
+
+        config = mock.Mock()
+        sr1 = SubclassedStatusReceiver(1, 'a')
+        config.status = [ sr1 ]
+        wfd = defer.waitForDeferred(
+                status.reconfigService(config))
+        yield wfd
+        wfd.getResult()
+
+        new_sr1 = SubclassedStatusReceiver(1, 'b')
+        config.status = [ new_sr1 ]
+        wfd = defer.waitForDeferred(
+                status.reconfigService(config))
+        yield wfd
+        wfd.getResult()
+
+        self.assertFalse(sr1.running)
+        self.assertTrue(new_sr1.running)
+        self.assertEqual(list(status), [new_sr1])
@@ -19,7 +19,7 @@ from twisted.trial import unittest
 from buildbot.test.util import dirs
 
 from buildbot.status.persistent_queue import MemoryQueue, DiskQueue, \
-    IQueue, PersistentQueue, WriteFile
+    IQueue, PersistentQueue, WriteFile, JournalQueue
 
 class test_Queues(dirs.DirsMixin, unittest.TestCase):
 
@@ -144,4 +144,142 @@ class test_Queues(dirs.DirsMixin, unittest.TestCase):
         self._test_helper(PersistentQueue(MemoryQueue(3),
                                           DiskQueue('fake_dir', 5)))
 
+    def testJournalQueue(self):
+        self._test_helper(JournalQueue('fake_dir', maxItems=8))
+
+    def testJournalQueueSmallSegments(self):
+        # every record gets a segment of its own
+        self._test_helper(JournalQueue('fake_dir', maxItems=8, segmentSize=1))
+
+    def testPersistentJournalQueue(self):
+        self._test_helper(PersistentQueue(MemoryQueue(3),
+                                          JournalQueue('fake_dir', 5)))
+
+    def testJournalQueueMigration(self):
+        WriteFile(os.path.join('fake_dir', '3'), 'foo3')
+        WriteFile(os.path.join('fake_dir', '5'), 'foo5')
+        WriteFile(os.path.join('fake_dir', '8'), 'foo8')
+        queue = PersistentQueue(MemoryQueue(3),
+            JournalQueue('fake_dir', 5, pickleFn=str, unpickleFn=str))
+        self.assertEqual(['foo3', 'foo5', 'foo8'], queue.items())
+        self.assertEqual(['foo3', 'foo5', 'foo8'], queue.popChunk())
+
+    def testJournalQueueReopen(self):
+        q = JournalQueue('fake_dir', segmentSize=20)
+        for i in range(10):
+            q.pushItem(i)
+        self.assertEqual([0, 1, 2], q.popChunk(3))
+        q.insertBackChunk(['a'])
+        q.save()
+        # segments that have been read are deleted
+        self.assertTrue(len(os.listdir('fake_dir')) < 10)
+
+        q = JournalQueue('fake_dir', segmentSize=20)
+        self.assertEqual(8, q.nbItems())
+        self.assertEqual(['a', 3, 4, 5, 6, 7, 8, 9], q.popChunk())
+        self.assertEqual([], os.listdir('fake_dir'))
+
+    def testJournalQueueReopenCursor(self):
+        q = JournalQueue('fake_dir', pickleFn=str, unpickleFn=str)
+        for i in range(5):
+            q.pushItem(i)
+        self.assertEqual(['0', '1'], q.popChunk(2))
+        q.save()
+
+        q = JournalQueue('fake_dir', pickleFn=str, unpickleFn=str)
+        self.assertEqual(['2', '3', '4'], q.items())
+        self.assertEqual(['2', '3', '4'], q.popChunk())
+
+    def testJournalQueueTornRecord(self):
+        q = JournalQueue('fake_dir', pickleFn=str, unpickleFn=str)
+        q.pushItem('foo')
+        q.pushItem('bar')
+        q.save()
+        path = os.path.join('fake_dir', 'segment-0')
+        data = open(path, 'rb').read()
+        WriteFile(path, data[:-1])
+
+        q = JournalQueue('fake_dir', pickleFn=str, unpickleFn=str)
+        self.assertEqual(1, q.nbItems())
+        q.pushItem('baz')
+        self.assertEqual(['foo', 'baz'], q.popChunk())
+
+    def assertReloads(self, q):
+        # a queue opened on the same directory has the same items
+        q.save()
+        self.assertEqual(q.items(),
+                JournalQueue('fake_dir', pickleFn=str, unpickleFn=str).items())
+
+    def testJournalQueueReloadEachStep(self):
+        q = JournalQueue('fake_dir', segmentSize=10, pickleFn=str,
+                         unpickleFn=str)
+        for i in range(6):
+            q.pushItem(i)
+            self.assertReloads(q)
+        self.assertEqual(['0', '1', '2'], q.popChunk(3))
+        self.assertReloads(q)
+        q.insertBackChunk(['a', 'b'])
+        self.assertReloads(q)
+        self.assertEqual(['a', 'b', '3'], q.popChunk(3))
+        self.assertReloads(q)
+        q.insertBackChunk(['c'])
+        self.assertReloads(q)
+        q.insertBackChunk(['d'])
+        self.assertReloads(q)
+        self.assertEqual(['d', 'c', '4', '5'], q.popChunk())
+        self.assertEqual([], os.listdir('fake_dir'))
+
+    def crashIn(self, obj, name):
+        # make the next call to obj.name fail, as if the master had stopped
+        # there
+        original = getattr(obj, name)
+        def crash(*args, **kwargs):
+            setattr(obj, name, original)
+            raise RuntimeError('crash')
+        self.patch(obj, name, crash)
+
+    def testJournalQueueCrashBeforeCursor(self):
+        q = JournalQueue('fake_dir', segmentSize=10, pickleFn=str,
+                         unpickleFn=str)
+        for i in range(4):
+            q.pushItem(i)
+        self.assertEqual(['0'], q.popChunk(1))
+        q.save()
+
+        # the inserted segment is on disk, but the cursor does not name it
+        self.crashIn(JournalQueue, '_saveCursor')
+        self.assertRaises(RuntimeError, lambda : q.insertBackChunk(['a']))
+
+        q = JournalQueue('fake_dir', pickleFn=str, unpickleFn=str)
+        self.assertEqual(['1', '2', '3'], q.popChunk())
+
+    def testJournalQueueCrashBeforeRename(self):
+        q = JournalQueue('fake_dir', pickleFn=str, unpickleFn=str)
+        for i in range(3):
+            q.pushItem(i)
+        self.assertEqual(['0'], q.popChunk(1))
+        q.save()
+
+        self.crashIn(os, 'rename')
+        self.assertRaises(RuntimeError, lambda : q.insertBackChunk(['a']))
+
+        q = JournalQueue('fake_dir', pickleFn=str, unpickleFn=str)
+        self.assertEqual(['1', '2'], q.popChunk())
+
+    def testJournalQueueCrashAfterDrop(self):
+        q = JournalQueue('fake_dir', segmentSize=10, pickleFn=str,
+                         unpickleFn=str)
+        for i in range(4):
+            q.pushItem(i)
+        self.assertEqual(['0'], q.popChunk(1))
+        q.insertBackChunk(['a'])
+
+        # the first segment is removed, but the cursor still names it; the
+        # item read from the next segment is read again
+        self.crashIn(JournalQueue, '_saveCursor')
+        self.assertRaises(RuntimeError, lambda : q.popChunk(2))
+
+        q = JournalQueue('fake_dir', pickleFn=str, unpickleFn=str)
+        self.assertEqual(['1', '2', '3'], q.popChunk())
+
 # vim: set ts=4 sts=4 sw=4 et:
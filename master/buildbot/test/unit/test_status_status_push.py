@@ -0,0 +1,273 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import gzip
+import urllib
+import mock
+from cStringIO import StringIO
+from twisted.trial import unittest
+from twisted.internet import defer, reactor
+from twisted.web import resource, server
+from buildbot.status import status_push
+from buildbot.util import json
+
+def items(n, size=10):
+    return [ dict(id=i, payload='x' * size) for i in range(n) ]
+
+class TestHttpStatusPush(unittest.TestCase):
+
+    def makePush(self, **kwargs):
+        kwargs.setdefault('maxDiskItems', 0)
+        push = status_push.HttpStatusPush('http://127.0.0.1:1/', **kwargs)
+        self.addCleanup(lambda : push.pool and
+                        push.pool.closeCachedConnections())
+        push.queueNextServerPush = mock.Mock()
+        return push
+
+    def test_compare(self):
+        push = self.makePush(compress=True)
+        self.assertEqual(push, self.makePush(compress=True))
+        for kwargs in [ dict(), dict(compress=True, maxMemoryItems=10),
+                        dict(compress=True, maxInFlight=2),
+                        dict(compress=True, projections={ 'buildStarted':
+                                { 'build': ['number'] } }) ]:
+            self.assertNotEqual(push, self.makePush(**kwargs))
+
+    def fill(self, push, packets):
+        for p in packets:
+            push.queue.pushItem(p)
+
+    def test_popChunk_form(self):
+        push = self.makePush()
+        self.fill(push, items(3))
+        data, sent = push.popChunk()
+        self.assertEqual(sent, items(3))
+        self.assertEqual(data, urllib.urlencode({'packets':
+                json.dumps(items(3), separators=(',',':'))}))
+
+    def test_popChunk_compressed(self):
+        push = self.makePush(compress=True)
+        self.fill(push, items(3))
+        data, sent = push.popChunk()
+        self.assertEqual(sent, items(3))
+        body = gzip.GzipFile(fileobj=StringIO(data)).read()
+        self.assertEqual(json.loads(body), items(3))
+
+    def test_popChunk_maxHttpRequestSize(self):
+        push = self.makePush(maxHttpRequestSize=200)
+        self.fill(push, items(10))
+        data, sent = push.popChunk()
+        self.assertTrue(0 < len(sent) < 10)
+        self.assertTrue(len(data) < 200)
+        self.assertEqual(data, urllib.urlencode({'packets':
+                json.dumps(sent, separators=(',',':'))}))
+        # the rest is still queued, in order
+        self.assertEqual(sent + push.queue.items(), items(10))
+
+    def test_popChunk_drops_large_items(self):
+        push = self.makePush(maxHttpRequestSize=200)
+        big = dict(id=0, payload='x' * 500)
+        self.fill(push, [big] + items(2)[1:])
+        data, sent = push.popChunk()
+        self.assertEqual(sent, items(2)[1:])
+        self.assertEqual(push.queue.items(), [])
+
+    def test_inFlight(self):
+        push = self.makePush(maxInFlight=2, chunkSize=2)
+        posts = []
+        def postData(data):
+            d = defer.Deferred()
+            posts.append(d)
+            return d
+        push.postData = postData
+        self.fill(push, items(6))
+
+        push.pushHttp()
+        self.assertEqual(len(posts), 2)
+        self.assertEqual(push.inFlight, [items(6)[0:2], items(6)[2:4]])
+
+        # the first push fails, the second succeeds: the failed items are
+        # queued back once nothing is in flight
+        posts[0].errback(RuntimeError('down'))
+        self.assertEqual(push.queue.items(), items(6)[4:])
+        self.assertFalse(push.queueNextServerPush.called)
+        posts[1].callback(None)
+        self.assertEqual(push.queue.items(), items(6)[0:2] + items(6)[4:])
+        self.assertEqual(push.inFlight, [])
+        push.queueNextServerPush.assert_called_with()
+
+        # while the server is down, a single item is sent
+        push.pushHttp()
+        self.assertEqual(len(posts), 3)
+        self.assertEqual(push.inFlight, [items(6)[0:1]])
+
+    def test_inFlight_backlog(self):
+        push = self.makePush(maxInFlight=2, chunkSize=2)
+        posts = []
+        def postData(data):
+            d = defer.Deferred()
+            posts.append(d)
+            return d
+        push.postData = postData
+        self.fill(push, items(7))
+        push.pushHttp()
+        # a full chunk is waiting, so it is sent as soon as there is room
+        posts[0].callback(None)
+        self.assertEqual(len(posts), 3)
+        # but a partial chunk waits for the usual delay
+        posts[1].callback(None)
+        posts[2].callback(None)
+        self.assertEqual(len(posts), 3)
+        self.assertEqual(push.queue.items(), items(7)[6:])
+        push.queueNextServerPush.assert_called_with()
+
+
+class Collector(resource.Resource):
+    isLeaf = True
+
+    def __init__(self):
+        resource.Resource.__init__(self)
+        self.bodies = []
+        self.connections = set()
+
+    def render_POST(self, request):
+        self.connections.add(request.channel)
+        body = request.content.read()
+        if request.getHeader('content-encoding') == 'gzip':
+            body = gzip.GzipFile(fileobj=StringIO(body)).read()
+        self.bodies.append(body)
+        return 'ok'
+
+class TestHttpStatusPushServer(unittest.TestCase):
+
+    if not status_push.HTTPConnectionPool:
+        skip = "Persistent connections need Twisted-12.1"
+
+    def setUp(self):
+        self.collector = Collector()
+        self.port = reactor.listenTCP(0, server.Site(self.collector),
+                                      interface='127.0.0.1')
+        self.push = status_push.HttpStatusPush(
+                'http://127.0.0.1:%d/' % self.port.getHost().port,
+                maxDiskItems=0, compress=True, chunkSize=2)
+        self.push.queueNextServerPush = mock.Mock()
+
+    def tearDown(self):
+        d = self.push.pool.closeCachedConnections()
+        d.addCallback(lambda _ : self.port.stopListening())
+        return d
+
+    @defer.deferredGenerator
+    def test_keepalive(self):
+        for i in range(2):
+            self.push.queue.pushItem(items(1)[0])
+            wfd = defer.waitForDeferred(self.push.pushHttp())
+            yield wfd
+            wfd.getResult()
+        self.assertEqual([ json.loads(b) for b in self.collector.bodies ],
+                         [ items(1), items(1) ])
+        self.assertEqual(len(self.collector.connections), 1)
+        self.assertTrue(self.push.wasLastPushSuccessful())
+
+
+class FakeBuild(object):
+    def __init__(self, number):
+        self.number = number
+        self.serialized = 0
+    def getNumber(self):
+        return self.number
+    def getResults(self):
+        return 0
+    def getTimes(self):
+        return (1, 2)
+    def getText(self):
+        return ['text']
+    def asDict(self):
+        self.serialized += 1
+        return dict(number=self.number, results=0, times=(1, 2),
+                    steps=['lots'])
+
+class TestStatusPush(unittest.TestCase):
+
+    def makePush(self, **kwargs):
+        push = status_push.StatusPush(serverPushCb=lambda push : None,
+                                      **kwargs)
+        push.status = mock.Mock()
+        push.status.getTitle.return_value = 'proj'
+        push.queueNextServerPush = mock.Mock()
+        return push
+
+    def events(self, push):
+        return [ (p['event'], p['payload']) for p in push.queue.items() ]
+
+    def test_lazy(self):
+        push = self.makePush()
+        build = FakeBuild(1)
+        push.push('buildStarted', build=build)
+        self.assertEqual(build.serialized, 0)
+        self.assertEqual(push.queue.items(), [])
+        build.number = 2
+        push.flushPending()
+        self.assertEqual(build.serialized, 1)
+        self.assertEqual(self.events(push),
+            [ ('buildStarted', {'build' : dict(number=2, times=[1, 2],
+                                               steps=['lots'])}) ])
+        self.assertEqual(push.queue.items()[0]['id'], 1)
+
+    def test_callable(self):
+        push = self.makePush()
+        push.push('stepStarted', properties=lambda : [('a', 1, 's')])
+        push.flushPending()
+        self.assertEqual(self.events(push),
+            [ ('stepStarted', {'properties' : [['a', 1, 's']]}) ])
+
+    def test_collapse(self):
+        push = self.makePush()
+        step1, step2 = FakeBuild(1), FakeBuild(2)
+        push.push('stepTextChanged', step=step1, text=['a'])
+        push.push('stepTextChanged', step=step2, text=['b'])
+        push.push('stepFinished', step=step2)
+        push.push('stepTextChanged', step=step1, text=['c'])
+        push.flushPending()
+        self.assertEqual([ (e, p.get('text'), p['step']['number'])
+                           for e, p in self.events(push) ],
+            [ ('stepTextChanged', ['b'], 2),
+              ('stepFinished', None, 2),
+              ('stepTextChanged', ['c'], 1) ])
+        self.assertEqual([ p['id'] for p in push.queue.items() ], [1, 2, 3])
+
+        # after a flush, updates are no longer collapsed with sent ones
+        push.push('stepTextChanged', step=step1, text=['d'])
+        push.flushPending()
+        self.assertEqual(len(push.queue.items()), 4)
+
+    def test_projection(self):
+        push = self.makePush(projections={
+            'buildFinished' : { 'build' : ['number', 'results', 'times'] },
+            'buildStarted' : { 'build' : ['number', 'steps'] }})
+        build = FakeBuild(3)
+        push.push('buildFinished', build=build)
+        push.flushPending()
+        self.assertEqual(self.events(push),
+            [ ('buildFinished', {'build' : dict(number=3, times=[1, 2])}) ])
+        # projected through the getters
+        self.assertEqual(build.serialized, 0)
+
+        push.queue.popChunk()
+        push.push('buildStarted', build=build)
+        push.flushPending()
+        self.assertEqual(self.events(push),
+            [ ('buildStarted', {'build' : dict(number=3, steps=['lots'])}) ])
+        self.assertEqual(build.serialized, 1)
@@ -0,0 +1,68 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import mock
+from twisted.trial import unittest
+from twisted.web import static
+from buildbot.status.web import baseweb
+from buildbot.status.web.auth import BasicAuth
+from buildbot.status.web.authz import Authz
+
+class TestWebStatus(unittest.TestCase):
+
+    def test_compare(self):
+        ws = baseweb.WebStatus(http_port=8010, allowForce=True)
+        self.assertEqual(ws, baseweb.WebStatus(http_port=8010,
+                                               allowForce=True))
+        self.assertNotEqual(ws, baseweb.WebStatus(http_port=8011,
+                                                  allowForce=True))
+        self.assertNotEqual(ws, baseweb.WebStatus(http_port=8010))
+        self.assertNotEqual(ws, baseweb.WebStatus(http_port=8010,
+                                            allowForce=True, numbuilds=5))
+
+    def test_compare_authz(self):
+        def make(userpass):
+            return baseweb.WebStatus(http_port=8010,
+                    authz=Authz(auth=BasicAuth(userpass),
+                                forceBuild='auth'))
+        self.assertEqual(make([('a', 'b')]), make([('a', 'b')]))
+        self.assertNotEqual(make([('a', 'b')]), make([('a', 'c')]))
+
+    def test_compare_extra_children(self):
+        ws1 = baseweb.WebStatus(http_port=8010)
+        ws2 = baseweb.WebStatus(http_port=8010)
+        # children added from the config file are compared by identity
+        ws1.putChild('x', static.Data('x', 'text/plain'))
+        ws2.putChild('x', static.Data('x', 'text/plain'))
+        self.assertNotEqual(ws1, ws2)
+
+    def test_reconfigService_revlink(self):
+        ws = baseweb.WebStatus(http_port=8010)
+        ws.setupTemplates('global1')
+        templates = ws.templates
+        new_config = mock.Mock()
+        new_config.revlink = 'global1'
+        ws.reconfigService(new_config)
+        self.assertIdentical(ws.templates, templates)
+        new_config.revlink = 'global2'
+        ws.reconfigService(new_config)
+        self.assertNotIdentical(ws.templates, templates)
+        self.assertEqual(ws.templatesRevlink, 'global2')
+
+        # a WebStatus with its own revlink ignores the global one
+        ws = baseweb.WebStatus(http_port=8010, revlink='own')
+        ws.setupTemplates('global1')
+        ws.reconfigService(new_config)
+        self.assertEqual(ws.templatesRevlink, 'own')
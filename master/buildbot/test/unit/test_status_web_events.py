@@ -0,0 +1,216 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import mock
+from twisted.trial import unittest
+from twisted.internet import defer, task
+from buildbot.status.web import events
+from buildbot.test.fake import web
+from buildbot.util import json
+
+class FakeRequest(web.FakeRequest):
+
+    def __init__(self, args={}, headers={}):
+        web.FakeRequest.__init__(self, args)
+        self.method = 'GET'
+        self.received_headers = headers
+        self.headers = {}
+        self.producer = None
+        self.finishNotification = defer.Deferred()
+
+    def getHeader(self, name):
+        return self.received_headers.get(name.lower())
+
+    def setHeader(self, name, value):
+        self.headers[name.lower()] = value
+
+    def registerProducer(self, producer, streaming):
+        self.producer = producer
+
+    def unregisterProducer(self):
+        self.producer = None
+
+    def notifyFinish(self):
+        return self.finishNotification
+
+    def frames(self):
+        # parse the Server-Sent Events written so far
+        frames = []
+        for block in self.written.split('\n\n'):
+            fields = {}
+            for line in block.split('\n'):
+                if ': ' in line and not line.startswith(':'):
+                    k, v = line.split(': ', 1)
+                    fields[k] = v
+            if 'event' in fields:
+                frames.append(fields)
+        return frames
+
+class FakeBuilderStatus(object):
+    def __init__(self, name, category=None):
+        self.name = name
+        self.category = category
+    def getName(self):
+        return self.name
+    def getCategory(self):
+        return self.category
+    def unsubscribe(self, receiver):
+        pass
+
+class TestEventHub(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.hub = events.EventHub(_reactor=self.clock)
+        self.status = mock.Mock()
+        self.hub.attach(self.status)
+        self.hub.builderAdded('b1', FakeBuilderStatus('b1', 'cat1'))
+        self.hub.builderAdded('b2', FakeBuilderStatus('b2', 'cat2'))
+
+    def stream(self, args={}, headers={}):
+        headers = dict(headers)
+        headers['accept'] = 'text/event-stream'
+        request = FakeRequest(args=args, headers=headers)
+        self.request_render(request)
+        return request
+
+    def request_render(self, request):
+        request.site.buildbot_service.getEventHub.return_value = self.hub
+        events.EventsResource().render(request)
+
+    def test_stream(self):
+        request = self.stream()
+        self.assertEqual(request.headers['content-type'], 'text/event-stream')
+        self.hub.builderChangedState('b1', 'idle')
+        frames = request.frames()
+        self.assertEqual([ f['event'] for f in frames ],
+                         ['builderChangedState'])
+        self.assertEqual(json.loads(frames[0]['data']),
+                         dict(builder='b1', state='idle'))
+        self.assertEqual(frames[0]['id'], self.hub.getCursor())
+
+    def test_stream_filters(self):
+        by_builder = self.stream(args={'builder' : ['b2']})
+        by_category = self.stream(args={'category' : ['cat1']})
+        by_branch = self.stream(args={'branch' : ['br']})
+        self.hub.builderChangedState('b1', 'idle')
+        self.hub.builderChangedState('b2', 'idle')
+        self.hub.publish('thing', {}, builderName='b2', branch='br')
+        self.hub.slaveConnected('sl')
+        self.assertEqual([ json.loads(f['data']).get('builder')
+                           for f in by_builder.frames() ],
+                         ['b2', None])
+        self.assertEqual([ json.loads(f['data']).get('builder')
+                           for f in by_category.frames() ],
+                         ['b1'])
+        self.assertEqual([ f['event'] for f in by_branch.frames() ],
+                         ['thing'])
+
+    def test_stream_resume(self):
+        self.hub.builderChangedState('b1', 'idle')
+        cursor = self.hub.getCursor()
+        self.hub.builderChangedState('b1', 'building')
+        self.hub.builderChangedState('b2', 'building')
+        request = self.stream(headers={'last-event-id' : cursor},
+                              args={'builder' : ['b1']})
+        self.assertEqual([ json.loads(f['data'])['state']
+                           for f in request.frames() ], ['building'])
+
+    def test_stream_resume_unknown_cursor(self):
+        self.hub.historySize = 1
+        self.hub.builderChangedState('b1', 'idle')
+        cursor = self.hub.getCursor()
+        for i in range(3):
+            self.hub.builderChangedState('b1', 'building')
+        request = self.stream(args={'since' : [cursor]})
+        self.assertEqual([ f['event'] for f in request.frames() ], ['reset'])
+
+        request = self.stream(args={'since' : ['123-4']})
+        self.assertEqual([ f['event'] for f in request.frames() ], ['reset'])
+
+    def test_stream_backpressure(self):
+        request = self.stream()
+        producer = request.producer
+        producer.pauseProducing()
+        self.hub.builderChangedState('b1', 'idle')
+        self.assertEqual(request.frames(), [])
+        producer.resumeProducing()
+        self.assertEqual(len(request.frames()), 1)
+
+    def test_stream_overflow(self):
+        request = self.stream()
+        request.producer.maxQueuedEvents = 2
+        request.producer.pauseProducing()
+        for i in range(3):
+            self.hub.builderChangedState('b1', 'idle')
+        self.assertTrue(request.finished)
+        self.assertEqual(self.hub.getClients(), set())
+
+    def test_stream_disconnect(self):
+        request = self.stream(args={'builder' : ['b1']})
+        self.assertEqual(len(self.hub.getClients()), 1)
+        request.finishNotification.callback(None)
+        self.assertEqual(self.hub.getClients(), set())
+        self.assertEqual(self.hub.clientsByBuilder, {})
+        self.assertEqual(self.hub.heartbeat, None)
+
+    def test_heartbeat(self):
+        request = self.stream()
+        self.clock.advance(self.hub.heartbeatInterval)
+        self.assertIn(': keepalive\n\n', request.written)
+
+    def test_poll_waits(self):
+        request = FakeRequest()
+        self.request_render(request)
+        self.assertFalse(request.finished)
+        self.hub.builderChangedState('b1', 'idle')
+        self.assertTrue(request.finished)
+        reply = json.loads(request.written)
+        self.assertEqual(reply['cursor'], self.hub.getCursor())
+        self.assertEqual(reply['reset'], False)
+        self.assertEqual([ e['event'] for e in reply['events'] ],
+                         ['builderChangedState'])
+        self.assertEqual(self.hub.getClients(), set())
+
+    def test_poll_backlog(self):
+        cursor = self.hub.getCursor()
+        self.hub.builderChangedState('b1', 'idle')
+        self.hub.builderChangedState('b2', 'idle')
+        request = FakeRequest(args={'since' : [cursor]})
+        self.request_render(request)
+        self.assertTrue(request.finished)
+        reply = json.loads(request.written)
+        self.assertEqual([ e['data']['builder'] for e in reply['events'] ],
+                         ['b1', 'b2'])
+
+    def test_poll_timeout(self):
+        request = FakeRequest()
+        self.request_render(request)
+        self.clock.advance(events.PollClient.timeout)
+        self.assertTrue(request.finished)
+        self.assertEqual(json.loads(request.written)['events'], [])
+        self.assertEqual(self.hub.getClients(), set())
+
+    def test_history_trimmed(self):
+        self.hub.historySize = 2
+        for i in range(10):
+            self.hub.builderChangedState('b1', 'idle')
+        self.assertTrue(len(self.hub.history) <= 4)
+
+    def test_detach(self):
+        request = self.stream()
+        self.hub.detach()
+        self.assertTrue(request.finished)
+        self.status.unsubscribe.assert_called_with(self.hub)
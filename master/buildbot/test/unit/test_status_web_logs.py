@@ -0,0 +1,175 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import os
+import mock
+from twisted.trial import unittest
+from twisted.web import http
+from buildbot.status import logfile
+from buildbot.status.web import logs, baseweb
+from buildbot.test.fake import web
+from buildbot.test.util import dirs
+from buildbot import config
+
+class FakeRequest(web.FakeRequest):
+
+    def __init__(self, args={}, headers={}):
+        web.FakeRequest.__init__(self, args)
+        self.method = 'GET'
+        self.prepath = [ 'builders', 'b', 'builds', '1', 'steps', 's',
+                         'logs', 'stdio' ]
+        self.received_headers = headers
+        self.headers = {}
+        self.code = http.OK
+
+    def getHeader(self, name):
+        return self.received_headers.get(name.lower())
+
+    def setHeader(self, name, value):
+        self.headers[name.lower()] = value
+
+    def setResponseCode(self, code):
+        self.code = code
+
+    def registerProducer(self, producer, streaming):
+        pass
+
+    def unregisterProducer(self):
+        pass
+
+class TestParsing(unittest.TestCase):
+
+    def test_parseByteRange(self):
+        p = logs.parseByteRange
+        self.assertEqual(p('bytes=0-9', 100), (0, 10))
+        self.assertEqual(p('bytes=90-', 100), (90, 100))
+        self.assertEqual(p('bytes=90-200', 100), (90, 100))
+        self.assertEqual(p('bytes=-10', 100), (90, 100))
+        self.assertEqual(p('bytes=-200', 100), (0, 100))
+        # ignored
+        self.assertEqual(p('bytes=0-1,5-6', 100), None)
+        self.assertEqual(p('lines=0-1', 100), None)
+        self.assertEqual(p('bytes=x-1', 100), None)
+        self.assertEqual(p('bytes=5-1', 100), None)
+        self.assertRaises(logs.UnsatisfiableRange, p, 'bytes=100-', 100)
+        self.assertRaises(logs.UnsatisfiableRange, p, 'bytes=-0', 100)
+
+    def test_parseLineRange(self):
+        p = logs.parseLineRange
+        self.assertEqual(p('1-10'), (0, 10))
+        self.assertEqual(p('5-'), (4, None))
+        self.assertEqual(p('-5'), (0, 5))
+        self.assertEqual(p('3'), (2, 3))
+        self.assertEqual(p('0-2'), (0, 2))
+        self.assertEqual(p('x'), None)
+        self.assertEqual(p('5-2'), None)
+
+class TestTextLog(unittest.TestCase, dirs.DirsMixin):
+
+    def setUp(self):
+        step = mock.Mock(name='build_step_status')
+        self.basedir = step.build.builder.basedir = os.path.abspath('basedir')
+        self.setUpDirs(self.basedir)
+        self.logfile = logfile.LogFile(step, 'stdio', '123-stdio')
+        self.logfile.master = mock.Mock()
+        self.logfile.master.config = config.MasterConfig()
+        # small chunks, so that ranges cross chunk boundaries
+        self.logfile.chunkSize = 16
+        self.logfile.addHeader('command\n')
+        for i in range(1, 11):
+            self.logfile.addStdout('line %d\n' % i)
+        self.logfile.finish()
+
+    def tearDown(self):
+        self.tearDownDirs()
+
+    def render(self, asText=True, **kwargs):
+        request = FakeRequest(**kwargs)
+        request.site.buildbot_service.templates = baseweb.createJinjaEnv()
+        resource = logs.TextLog(self.logfile)
+        resource.asText = asText
+        resource.pageLines = 4
+        d = request.test_render(resource)
+        d.addCallback(lambda _ : request)
+        return d
+
+    def assertText(self, request, lines):
+        self.assertEqual(request.written,
+                         ''.join([ 'line %d\n' % i for i in lines ]))
+
+    def test_whole(self):
+        d = self.render()
+        def check(request):
+            self.assertText(request, range(1, 11))
+            self.assertEqual(request.headers['accept-ranges'], 'bytes')
+        d.addCallback(check)
+        return d
+
+    def test_range(self):
+        d = self.render(headers={'range' : 'bytes=7-20'})
+        def check(request):
+            self.assertEqual(request.code, http.PARTIAL_CONTENT)
+            self.assertEqual(request.headers['content-range'],
+                             'bytes 7-20/71')
+            self.assertEqual(request.written, 'line 2\nline 3\n')
+        d.addCallback(check)
+        return d
+
+    def test_range_unsatisfiable(self):
+        d = self.render(headers={'range' : 'bytes=71-'})
+        def check(request):
+            self.assertEqual(request.code,
+                             http.REQUESTED_RANGE_NOT_SATISFIABLE)
+            self.assertEqual(request.headers['content-range'], 'bytes */71')
+            self.assertEqual(request.written, '')
+        d.addCallback(check)
+        return d
+
+    def test_lines(self):
+        d = self.render(args={'lines' : ['3-5']})
+        d.addCallback(self.assertText, [3, 4, 5])
+        return d
+
+    def test_tail(self):
+        d = self.render(args={'tail' : ['3']})
+        d.addCallback(self.assertText, [8, 9, 10])
+        return d
+
+    def test_tail_more_than_log(self):
+        d = self.render(args={'tail' : ['30']})
+        d.addCallback(self.assertText, range(1, 11))
+        return d
+
+    def test_html_last_page(self):
+        d = self.render(asText=False)
+        def check(request):
+            self.assertIn('lines 7-10 of 10', request.written)
+            self.assertIn('?lines=3-6', request.written)
+            self.assertNotIn('line 6\n', request.written)
+            self.assertIn('line 7\n', request.written)
+            self.assertNotIn('command', request.written)
+        d.addCallback(check)
+        return d
+
+    def test_html_first_page(self):
+        d = self.render(asText=False, args={'lines' : ['1-']})
+        def check(request):
+            self.assertIn('lines 1-4 of 10', request.written)
+            self.assertIn('?lines=5-8', request.written)
+            self.assertIn('command', request.written)
+            self.assertIn('line 4\n', request.written)
+            self.assertNotIn('line 5\n', request.written)
+        d.addCallback(check)
+        return d
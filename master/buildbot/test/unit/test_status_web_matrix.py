@@ -0,0 +1,250 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import mock
+from twisted.trial import unittest
+from twisted.internet import defer
+from buildbot.status.web import matrix, console
+from buildbot.status.results import SUCCESS, WARNINGS, FAILURE, EXCEPTION
+from buildbot.sourcestamp import SourceStamp
+
+class FakeBuild(object):
+    def __init__(self, builder, number, revision, branch=None,
+                 finished=True, results=SUCCESS):
+        self.builder = builder
+        self.number = number
+        self.ss = SourceStamp(branch=branch, revision=revision)
+        self.finished = finished
+        self.results = results
+        self.properties = {}
+    def getBuilder(self):
+        return self.builder
+    def getNumber(self):
+        return self.number
+    def getSourceStamp(self, absolute=False):
+        return self.ss
+    def getChanges(self):
+        return []
+    def getTimes(self):
+        return (self.number + 100, None)
+    def isFinished(self):
+        return self.finished
+    def getResults(self):
+        if self.finished:
+            return self.results
+    def getText(self):
+        return [ 'text', str(self.number) ]
+    def getETA(self):
+        return None
+    def getProperty(self, propname, default=None):
+        return self.properties.get(propname, default)
+
+class FakeBuilderStatus(object):
+    def __init__(self, name, revisions):
+        self.name = name
+        self.history = [ FakeBuild(self, n, rev)
+                         for n, rev in enumerate(revisions) ]
+        self.loads = 0
+    def getName(self):
+        return self.name
+    def _generateBuilds(self):
+        self.loads += 1
+        for b in reversed(self.history):
+            yield b
+    def newBuild(self, revision, **kwargs):
+        b = FakeBuild(self, len(self.history), revision, **kwargs)
+        self.history.append(b)
+        return b
+    def unsubscribe(self, receiver):
+        pass
+
+class TestBuildMatrix(unittest.TestCase):
+
+    def setUp(self):
+        self.status = mock.Mock()
+        self.matrix = matrix.BuildMatrix()
+        self.matrix.attach(self.status)
+        self.status.subscribe.assert_called_with(self.matrix)
+
+    def numbers(self, entries):
+        return [ e.getNumber() for e in entries ]
+
+    def addBuilder(self, name, revisions):
+        bs = FakeBuilderStatus(name, revisions)
+        self.assertIdentical(self.matrix.builderAdded(name, bs), self.matrix)
+        return bs
+
+    def test_getEntries_loads_once(self):
+        bs = self.addBuilder('b1', ['1', '2', '3'])
+        self.assertEqual(self.numbers(self.matrix.getEntries(bs)), [2, 1, 0])
+        self.assertEqual(self.numbers(self.matrix.getEntries(bs)), [2, 1, 0])
+        self.assertEqual(bs.loads, 1)
+
+    def test_getEntries_branch(self):
+        bs = self.addBuilder('b1', ['1'])
+        self.matrix.buildStarted('b1', bs.newBuild('2', branch='br'))
+        self.matrix.getEntries(bs)
+        self.matrix.buildStarted('b1', bs.newBuild('3', branch='br'))
+        self.assertEqual(
+            self.numbers(self.matrix.getEntries(bs, branch='br')), [2, 1])
+        self.assertEqual(
+            self.numbers(self.matrix.getEntries(bs, branch=None)), [0])
+
+    def test_getEntries_maxBuilds(self):
+        self.matrix.maxBuilds = 2
+        bs = self.addBuilder('b1', ['1', '2', '3'])
+        self.assertEqual(self.numbers(self.matrix.getEntries(bs)), [2, 1])
+        self.matrix.buildStarted('b1', bs.newBuild('4'))
+        self.assertEqual(self.numbers(self.matrix.getEntries(bs)), [3, 2])
+        # evicted builds are no longer in the index
+        self.assertEqual(self.matrix.lookup(SourceStamp(revision='2'), bs),
+                         None)
+
+    def test_getEntries_untracked_builder(self):
+        bs = FakeBuilderStatus('b1', ['1', '2'])
+        self.assertEqual(self.numbers(self.matrix.getEntries(bs)), [1, 0])
+        self.assertEqual(self.matrix.entries, {})
+        self.assertEqual(self.matrix.byStamp, {})
+
+    def test_lookup(self):
+        b1 = self.addBuilder('b1', ['1', '2', '2'])
+        b2 = self.addBuilder('b2', ['1'])
+        e = self.matrix.lookup(SourceStamp(revision='2'), b1)
+        self.assertEqual(e.getNumber(), 2)
+        self.assertIdentical(e.getBuilder(), b1)
+        self.assertEqual(self.matrix.lookup(SourceStamp(revision='2'), b2),
+                         None)
+        self.assertEqual(
+            self.matrix.lookup(SourceStamp(revision='1'), b2).getNumber(), 0)
+        self.assertEqual(b1.loads, 1)
+
+    def test_running_build(self):
+        bs = self.addBuilder('b1', [])
+        self.matrix.getEntries(bs)
+        build = bs.newBuild('5', finished=False)
+        self.matrix.buildStarted('b1', build)
+
+        e = self.matrix.lookup(SourceStamp(revision='5'), bs)
+        self.assertFalse(e.isFinished())
+        self.assertEqual(e.getResults(), None)
+
+        # the build learns its revision, and finishes
+        build.ss = SourceStamp(revision='6')
+        build.properties['got_revision'] = '6'
+        build.finished = True
+        build.results = FAILURE
+        self.matrix.buildFinished('b1', build, FAILURE)
+
+        self.assertEqual(self.matrix.lookup(SourceStamp(revision='5'), bs),
+                         None)
+        e = self.matrix.lookup(SourceStamp(revision='6'), bs)
+        self.assertTrue(e.isFinished())
+        self.assertEqual(e.getResults(), FAILURE)
+        self.assertEqual(e.getText(), ['text', '0'])
+        self.assertEqual(e.getProperty('got_revision'), '6')
+        # the entry no longer refers to the build
+        self.assertEqual(e.build, None)
+
+    def test_builderRemoved(self):
+        bs = self.addBuilder('b1', ['1'])
+        self.matrix.getEntries(bs)
+        self.matrix.builderRemoved('b1')
+        self.assertEqual(self.matrix.entries, {})
+        self.assertEqual(self.matrix.byStamp, {})
+        self.assertEqual(self.matrix.builderStatuses, {})
+
+    @defer.deferredGenerator
+    def test_getRecentChanges(self):
+        def mkchange(rev, branch=None):
+            ch = mock.Mock()
+            ch.revision = rev
+            ch.branch = branch
+            ch.repository = ch.project = ''
+            return ch
+        chdicts = [ 'c1', 'c2' ]
+        master = mock.Mock()
+        master.db.changes.getRecentChanges.return_value = \
+                defer.succeed(chdicts)
+        self.patch(matrix.changes.Change, 'fromChdict',
+                classmethod(lambda cls, master, chdict :
+                            defer.succeed(mkchange(chdict))))
+
+        wfd = defer.waitForDeferred(
+                self.matrix.getRecentChanges(master, 10))
+        yield wfd
+        self.assertEqual([ c.revision for c in wfd.getResult() ],
+                         ['c1', 'c2'])
+
+        self.matrix.changeAdded(mkchange('c3', branch='br'))
+        wfd = defer.waitForDeferred(
+                self.matrix.getRecentChanges(master, 2))
+        yield wfd
+        self.assertEqual([ c.revision for c in wfd.getResult() ],
+                         ['c2', 'c3'])
+
+        wfd = defer.waitForDeferred(
+                self.matrix.getRecentChanges(master, 10, branch='br'))
+        yield wfd
+        self.assertEqual([ c.revision for c in wfd.getResult() ], ['c3'])
+
+        # the database was only queried once
+        self.assertEqual(master.db.changes.getRecentChanges.call_count, 1)
+
+    def test_detach(self):
+        self.matrix.detach()
+        self.status.unsubscribe.assert_called_with(self.matrix)
+
+class TestConsoleBuildDetails(unittest.TestCase):
+
+    def setUp(self):
+        self.matrix = matrix.BuildMatrix()
+        self.matrix.attach(mock.Mock())
+        self.bs = FakeBuilderStatus('b1', [])
+        self.matrix.builderAdded('b1', self.bs)
+        self.matrix.getEntries(self.bs)
+        self.loaded = []
+        def getBuild(number):
+            self.loaded.append(number)
+            return self.bs.history[number]
+        self.bs.getBuild = getBuild
+
+        self.console = console.ConsoleStatusResource()
+        self.console.getBuildMatrix = lambda request : self.matrix
+        self.console.getBuildDetails = \
+                lambda request, builderName, build : dict(loaded=True)
+
+    def addBuild(self, revision, **kwargs):
+        b = self.bs.newBuild(revision, **kwargs)
+        b.properties['got_revision'] = revision
+        self.matrix.buildStarted('b1', b)
+        if b.finished:
+            self.matrix.buildFinished('b1', b, b.results)
+
+    def test_details_loaded_unless_successful(self):
+        self.addBuild('1', results=SUCCESS)
+        self.addBuild('2', results=WARNINGS)
+        self.addBuild('3', results=FAILURE)
+        self.addBuild('4', results=EXCEPTION)
+        self.addBuild('5', finished=False)
+        debugInfo = dict(builds_scanned=0)
+        builds = self.console.getBuildsForRevision(None, self.bs, 'b1', '0',
+                                                   10, debugInfo)
+        self.assertEqual(sorted(self.loaded), [2, 3, 4])
+        self.assertEqual([ (b.number, b.details) for b in builds ],
+                [ (4, dict(loaded=True)), (3, dict(loaded=True)),
+                  (2, dict(loaded=True)), (1, {}), (0, {}) ])
+
+    def test_ANYBRANCH_shared(self):
+        self.assertIdentical(console.ANYBRANCH, matrix.ANYBRANCH)
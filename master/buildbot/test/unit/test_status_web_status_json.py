@@ -0,0 +1,239 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import gzip
+import mock
+from cStringIO import StringIO
+from twisted.trial import unittest
+from twisted.web import http
+from buildbot.status.web import status_json
+from buildbot.test.fake import web
+from buildbot.util import json
+
+class FakeRequest(web.FakeRequest):
+
+    def __init__(self, args={}, headers={}):
+        web.FakeRequest.__init__(self, args)
+        self.method = 'GET'
+        self.path = '/json/thing'
+        self.prepath = [ 'json', 'thing' ]
+        self.postpath = []
+        self.received_headers = headers
+        self.headers = {}
+        self.etag = None
+        self.code = http.OK
+
+    def getHeader(self, name):
+        return self.received_headers.get(name.lower())
+
+    def setHeader(self, name, value):
+        self.headers[name.lower()] = value
+
+    def setResponseCode(self, code):
+        self.code = code
+
+    setETag = http.Request.setETag.im_func
+
+class ThingJsonResource(status_json.JsonResource):
+
+    generation = 0
+
+    def __init__(self):
+        status_json.JsonResource.__init__(self, None)
+        self.rendered = 0
+
+    def asDict(self, request):
+        self.rendered += 1
+        return { 'generation' : self.generation, 'padding' : 'x' * 1000 }
+
+    def getGeneration(self, request):
+        return self.generation
+
+class TestJsonResource(unittest.TestCase):
+
+    def setUp(self):
+        self.resource = ThingJsonResource()
+        self.resource.responseCache = status_json.ResponseCache()
+
+    def render(self, **kwargs):
+        request = FakeRequest(**kwargs)
+        d = request.test_render(self.resource)
+        d.addCallback(lambda _ : request)
+        return d
+
+    def test_cached_until_generation_changes(self):
+        d = self.render()
+        d.addCallback(lambda _ : self.render())
+        def check_cached(request):
+            self.assertEqual(self.resource.rendered, 1)
+            self.assertEqual(json.loads(request.written)['generation'], 0)
+            self.resource.generation = 1
+            return self.render()
+        d.addCallback(check_cached)
+        def check_rerendered(request):
+            self.assertEqual(self.resource.rendered, 2)
+            self.assertEqual(json.loads(request.written)['generation'], 1)
+        d.addCallback(check_rerendered)
+        return d
+
+    def test_args_in_key(self):
+        d = self.render()
+        d.addCallback(lambda _ : self.render(args={'compact' : ['0']}))
+        def check(request):
+            self.assertEqual(self.resource.rendered, 2)
+            self.assertIn('\n', request.written)
+        d.addCallback(check)
+        return d
+
+    def test_not_modified(self):
+        d = self.render()
+        def second(request):
+            etag = request.etag
+            self.assertTrue(etag)
+            return self.render(headers={'if-none-match' : etag})
+        d.addCallback(second)
+        def check(request):
+            self.assertEqual(request.code, http.NOT_MODIFIED)
+            self.assertEqual(request.written, '')
+        d.addCallback(check)
+        return d
+
+    def test_not_modified_after_change(self):
+        d = self.render()
+        def second(request):
+            self.resource.generation = 1
+            return self.render(headers={'if-none-match' : request.etag})
+        d.addCallback(second)
+        def check(request):
+            self.assertEqual(request.code, http.OK)
+            self.assertEqual(json.loads(request.written)['generation'], 1)
+        d.addCallback(check)
+        return d
+
+    def test_gzip(self):
+        d = self.render(headers={'accept-encoding' : 'deflate, gzip'})
+        def check(request):
+            self.assertEqual(request.headers['content-encoding'], 'gzip')
+            self.assertEqual(request.headers['vary'], 'Accept-Encoding')
+            data = gzip.GzipFile(fileobj=StringIO(request.written)).read()
+            self.assertEqual(json.loads(data)['generation'], 0)
+            # the compressed response has its own ETag
+            plain_etag = self.resource.responseCache.getETag(
+                    self.resource.responseCache.getKey(request, 0), False)
+            self.assertNotEqual(request.etag, plain_etag)
+        d.addCallback(check)
+        return d
+
+    def test_uncacheable(self):
+        self.resource.generation = None
+        d = self.render()
+        d.addCallback(lambda _ : self.render())
+        def check(request):
+            self.assertEqual(self.resource.rendered, 2)
+            self.assertEqual(request.etag, None)
+        d.addCallback(check)
+        return d
+
+    def test_select_generation(self):
+        root = status_json.JsonResource(None)
+        root.putChild('thing', self.resource)
+        request = FakeRequest(args={'select' : ['thing', 'missing']})
+        request.prepath = [ 'json' ]
+        self.assertEqual(root.getRequestGeneration(request), (0, 0))
+        self.assertEqual(request.prepath, [ 'json' ])
+        self.resource.generation = None
+        self.assertEqual(root.getRequestGeneration(request), None)
+
+class FakeBuildStatus(object):
+
+    def __init__(self, builder, number):
+        self.builder = builder
+        self.number = number
+        self.source_stamp = mock.Mock(name='source_stamp')
+        self.source_stamp.changes = []
+
+    def getBuilder(self):
+        return self.builder
+
+    def getNumber(self):
+        return self.number
+
+    def getGeneration(self):
+        # every build starts at the same generation
+        return 3
+
+    def isFinished(self):
+        return True
+
+    def getSourceStamp(self):
+        return self.source_stamp
+
+    def getSteps(self):
+        return []
+
+    def asDict(self):
+        return { 'number' : self.number }
+
+class TestBuildsJsonResource(unittest.TestCase):
+
+    def setUp(self):
+        self.builder_status = mock.Mock(name='builder_status')
+        self.builder_status.getName.return_value = 'bldr'
+        self.builds = [ FakeBuildStatus(self.builder_status, 0) ]
+        def getBuild(number):
+            if number < 0:
+                number += len(self.builds)
+            if 0 <= number < len(self.builds):
+                return self.builds[number]
+        self.builder_status.getBuild = getBuild
+        self.resource = status_json.AllBuildsJsonResource(None,
+                                                          self.builder_status)
+        self.resource.responseCache = status_json.ResponseCache()
+
+    def render(self, path, **kwargs):
+        request = FakeRequest(**kwargs)
+        request.path = '/json/builders/bldr/builds/' + path
+        child = self.resource.getChildWithDefault(path, request)
+        d = request.test_render(child)
+        d.addCallback(lambda _ : request)
+        return d
+
+    def test_relative_build_number(self):
+        d = self.render('-1')
+        def newBuild(request):
+            self.assertEqual(json.loads(request.written)['number'], 0)
+            self.builds.append(FakeBuildStatus(self.builder_status, 1))
+            return self.render('-1',
+                    headers={'if-none-match' : request.etag})
+        d.addCallback(newBuild)
+        def check(request):
+            self.assertEqual(request.code, http.OK)
+            self.assertEqual(json.loads(request.written)['number'], 1)
+        d.addCallback(check)
+        return d
+
+class TestAcceptsGzip(unittest.TestCase):
+
+    def accepts(self, header):
+        request = FakeRequest(headers={'accept-encoding' : header})
+        return status_json.AcceptsGzip(request)
+
+    def test_accepts(self):
+        self.assertTrue(self.accepts('gzip'))
+        self.assertTrue(self.accepts('deflate, gzip;q=0.5'))
+        self.assertFalse(self.accepts('deflate'))
+        self.assertFalse(self.accepts('gzip;q=0'))
+        self.assertFalse(FakeRequest().getHeader('accept-encoding'))
+        self.assertFalse(status_json.AcceptsGzip(FakeRequest()))
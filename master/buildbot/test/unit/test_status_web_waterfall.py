@@ -0,0 +1,202 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import mock
+from twisted.trial import unittest
+from twisted.internet import defer
+from buildbot import util
+from buildbot.status.web import waterfall
+from buildbot.test.fake import web
+
+class FakeBuild(object):
+    def __init__(self, number):
+        self.number = number
+    def getNumber(self):
+        return self.number
+
+class FakeBuilderStatus(object):
+    def __init__(self, name, nbuilds):
+        self.name = name
+        self.history = [ FakeBuild(n) for n in range(nbuilds) ]
+        self.loads = 0
+    def getName(self):
+        return self.name
+    def _generateBuilds(self):
+        self.loads += 1
+        for b in reversed(self.history):
+            yield b
+    def getBuild(self, number):
+        if 0 <= number < len(self.history):
+            return self.history[number]
+    def unsubscribe(self, receiver):
+        pass
+
+class TestWaterfallTimeline(unittest.TestCase):
+
+    def setUp(self):
+        self.status = mock.Mock()
+        self.timeline = waterfall.WaterfallTimeline()
+        self.timeline.attach(self.status)
+        self.status.subscribe.assert_called_with(self.timeline)
+
+    def numbers(self, builds):
+        return [ b.getNumber() for b in builds ]
+
+    def test_generation(self):
+        tl = self.timeline
+        gen = tl.generation
+        bs = FakeBuilderStatus('b1', 0)
+        self.assertIdentical(tl.builderAdded('b1', bs), tl)
+        self.assertIdentical(tl.buildStarted('b1', FakeBuild(0)), tl)
+        tl.stepStarted(None, None)
+        tl.stepFinished(None, None, None)
+        tl.buildFinished('b1', None, None)
+        tl.requestSubmitted(None)
+        tl.changeAdded(None)
+        self.assertEqual(tl.generation, gen + 7)
+
+    def test_getBuilds_loads_once(self):
+        tl = self.timeline
+        bs = FakeBuilderStatus('b1', 3)
+        tl.builderAdded('b1', bs)
+        self.assertEqual(self.numbers(tl.getBuilds(bs)), [2, 1, 0])
+        self.assertEqual(self.numbers(tl.getBuilds(bs)), [2, 1, 0])
+        self.assertEqual(bs.loads, 1)
+
+        # new builds are added from events, without reloading
+        new = FakeBuild(3)
+        bs.history.append(new)
+        tl.buildStarted('b1', new)
+        self.assertEqual(self.numbers(tl.getBuilds(bs)), [3, 2, 1, 0])
+        self.assertEqual(bs.loads, 1)
+
+    def test_getBuilds_maxBuilds(self):
+        tl = self.timeline
+        tl.maxBuilds = 2
+        bs = FakeBuilderStatus('b1', 4)
+        tl.builderAdded('b1', bs)
+        # older builds come from the builder itself
+        self.assertEqual(self.numbers(tl.getBuilds(bs)), [3, 2, 1, 0])
+        self.assertEqual(tl.builds['b1'], [3, 2])
+
+        new = FakeBuild(4)
+        bs.history.append(new)
+        tl.buildStarted('b1', new)
+        self.assertEqual(tl.builds['b1'], [4, 3])
+        self.assertEqual(self.numbers(tl.getBuilds(bs)), [4, 3, 2, 1, 0])
+
+    def test_getBuilds_no_references(self):
+        tl = self.timeline
+        bs = FakeBuilderStatus('b1', 2)
+        tl.builderAdded('b1', bs)
+        list(tl.getBuilds(bs))
+        # the index holds build numbers, not the builds themselves
+        self.assertEqual(tl.builds['b1'], [1, 0])
+
+        # builds which the builder no longer has are skipped
+        bs.history[1] = None
+        self.assertEqual(self.numbers(tl.getBuilds(bs)), [0])
+
+    def test_getBuilds_untracked_builder(self):
+        tl = self.timeline
+        bs = FakeBuilderStatus('b1', 2)
+        self.assertEqual(self.numbers(tl.getBuilds(bs)), [1, 0])
+        self.assertEqual(tl.builds, {})
+
+    def test_builderRemoved(self):
+        tl = self.timeline
+        bs = FakeBuilderStatus('b1', 2)
+        tl.builderAdded('b1', bs)
+        list(tl.getBuilds(bs))
+        tl.builderRemoved('b1')
+        self.assertEqual(tl.builds, {})
+        self.assertEqual(tl.builderStatuses, {})
+
+    def test_detach(self):
+        self.timeline.detach()
+        self.status.unsubscribe.assert_called_with(self.timeline)
+
+
+class TestWaterfallRenderCache(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+        self.patch(util, 'now', lambda *args : self.now)
+
+        self.timeline = waterfall.WaterfallTimeline()
+        self.resource = waterfall.WaterfallStatusResource()
+
+        self.rendered = []
+        def render(**ctx):
+            self.rendered.append(ctx)
+            return 'page'
+
+        def makeRequest(args={}):
+            req = web.FakeRequest(args=args)
+            req.prepath = ['waterfall']
+            svc = req.site.buildbot_service
+            svc.getWaterfallTimeline.return_value = self.timeline
+            svc.templates.get_template.return_value.render = render
+            status = svc.getStatus.return_value
+            status.getBuilderNames.return_value = []
+            db = svc.master.db
+            db.changes.getRecentChanges.return_value = defer.succeed([])
+            db.buildrequests.getBuildRequests.return_value = defer.succeed([])
+            return req
+        self.makeRequest = makeRequest
+
+    def render(self, args={}):
+        req = self.makeRequest(args)
+        d = defer.maybeDeferred(self.resource.content, req, {})
+        def check(data):
+            self.assertEqual(data, 'page')
+            return req.site.buildbot_service.master.db.changes.\
+                    getRecentChanges.call_count
+        d.addCallback(check)
+        return d
+
+    @defer.deferredGenerator
+    def test_cache(self):
+        queries = []
+        for args, advance, bump in [
+                ({}, 0, False),             # first render
+                ({}, 1, False),             # cached
+                ({'reload' : ['60']}, 0, False), # different arguments
+                ({}, 1, True),              # state changed
+                ({}, 1, False),             # cached again
+                ({}, 20, False),            # expired
+                ]:
+            self.now += advance
+            if bump:
+                self.timeline.changed()
+            wfd = defer.waitForDeferred(self.render(args))
+            yield wfd
+            queries.append(wfd.getResult())
+        self.assertEqual(queries, [1, 0, 1, 1, 0, 1])
+        # each render used the fragment, and the cached one matches
+        self.assertEqual(self.rendered[0]['gridlen'],
+                         self.rendered[1]['gridlen'])
+        self.assertEqual(self.rendered[2]['refresh'], 60)
+
+    @defer.deferredGenerator
+    def test_cache_bounded(self):
+        self.resource.maxCacheEntries = 2
+        for i in range(4):
+            wfd = defer.waitForDeferred(
+                    self.render({'num_events' : [str(10+i)]}))
+            yield wfd
+            wfd.getResult()
+            self.now += 1
+        self.assertEqual(len(self.resource.renderCache), 2)
@@ -443,3 +443,13 @@ class TestIRC(unittest.TestCase):
         # just put it through its paces
         irc.startService()
         return irc.stopService()
+
+    def test_compare(self):
+        irc = self.makeIRC(lostDelay=10)
+        self.assertEqual(irc, self.makeIRC(lostDelay=10))
+        for kwargs in [ dict(lostDelay=11), dict(lostDelay=10, useColors=False),
+                        dict(lostDelay=10, showBlameList=False),
+                        dict(lostDelay=10, noticeOnChannel=True),
+                        dict(lostDelay=10,
+                             notify_events={ 'successToFailure': 1 }) ]:
+            self.assertNotEqual(irc, self.makeIRC(**kwargs))
@@ -152,6 +152,16 @@ class TestRemoveDirectory(steps.BuildStepMixin, unittest.TestCase):
                 status_text=["Delete failed."])
         return self.runStep()
 
+    def test_trash(self):
+        self.setupStep(slave.RemoveDirectory(dir="d", trash=True))
+        self.expectCommands(
+            Expect('rmdir', { 'dir' : 'd', 'trash' : True })
+            + 0
+        )
+        self.expectOutcome(result=SUCCESS,
+                status_text=["RemoveDirectory"])
+        return self.runStep()
+
     def test_render(self):
         self.setupStep(slave.RemoveDirectory(dir=properties.Property("x")))
         self.properties.setProperty('x', 'XXX', 'here')
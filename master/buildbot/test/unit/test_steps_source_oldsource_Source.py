@@ -96,6 +96,28 @@ class TestSourceDescription(steps.BuildStepMixin, unittest.TestCase):
         self.assertEqual(step.description, ['svn', 'update', '(running)'])
         self.assertEqual(step.descriptionDone, ['svn', 'update'])
 
+class TestSourceArgs(unittest.TestCase):
+
+    def test_defaults(self):
+        step = Source(workdir='build', mode='copy')
+        self.assertFalse('trash' in step.args)
+        self.assertFalse('copy_method' in step.args)
+        self.assertFalse('copy_sync' in step.args)
+
+    def test_trash(self):
+        step = Source(workdir='build', mode='clobber', trash=True)
+        self.assertEqual(step.args['trash'], True)
+
+    def test_copy_args(self):
+        step = Source(workdir='build', mode='copy', copyMethod='auto',
+                      copySync=True)
+        self.assertEqual((step.args['copy_method'], step.args['copy_sync']),
+                         ('auto', True))
+
+    def test_bad_copyMethod(self):
+        self.assertRaises(AssertionError, lambda :
+                Source(workdir='build', mode='copy', copyMethod='teleport'))
+
 class TestSource(sourcesteps.SourceStepMixin, unittest.TestCase):
 
     def setUp(self):
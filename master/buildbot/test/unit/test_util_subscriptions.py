@@ -62,3 +62,45 @@ class subscriptions(unittest.TestCase):
         # log.err will cause Trial to complain about this error anyway, unless
         # we clean it up
         self.assertEqual(1, len(self.flushLoggedErrors(RuntimeError)))
+
+class keyedSubscriptions(unittest.TestCase):
+
+    def setUp(self):
+        self.subpt = subscription.KeyedSubscriptionPoint('test_sub')
+
+    def test_str(self):
+        self.assertIn('test_sub', str(self.subpt))
+
+    def test_subscribe_unsubscribe(self):
+        state = []
+        def cb(*args, **kwargs):
+            state.append((args, kwargs))
+
+        sub = self.subpt.subscribe(10, cb)
+        self.assertTrue(isinstance(sub, subscription.Subscription))
+
+        # only deliveries for the key are received
+        self.subpt.deliver(11, 2)
+        self.assertEqual(state, [])
+        self.subpt.deliver(10, 2, a=3)
+        self.assertEqual(state, [((10, 2), dict(a=3))])
+        state.pop()
+
+        # and the key is forgotten when its last subscription is cancelled
+        sub.unsubscribe()
+        self.subpt.deliver(10, 2)
+        self.assertEqual(state, [])
+        self.assertEqual(self.subpt.subscriptionsByKey, {})
+
+    def test_unsubscribe_during_delivery(self):
+        state = []
+        subs = []
+        def cb(key):
+            state.append(key)
+            for sub in subs:
+                sub.unsubscribe()
+            del subs[:]
+        subs.append(self.subpt.subscribe(10, cb))
+        subs.append(self.subpt.subscribe(10, cb))
+        self.subpt.deliver(10)
+        self.assertEqual(state, [10])
@@ -24,6 +24,8 @@ class ChangeSourceMixin(object):
      - starting and stopping a ChangeSource service
      - a fake C{self.master.addChange}, which adds its args
        to the list C{self.changes_added}
+     - a fake C{self.master.addChanges}, which adds each of its
+       changes to the same list
     """
 
     changesource = None
@@ -43,8 +45,13 @@ class ChangeSourceMixin(object):
                                 "non-ascii string for key '%s': %r" % (k,v))
             self.changes_added.append(kwargs)
             return defer.succeed(mock.Mock())
+        def addChanges(changes):
+            dl = [ addChange(**kwargs) for kwargs in changes ]
+            d = defer.gatherResults(dl)
+            return d
         self.master = mock.Mock()
         self.master.addChange = addChange
+        self.master.addChanges = addChanges
         return defer.succeed(None)
 
     def tearDownChangeSource(self):
@@ -15,6 +15,7 @@
 
 import os
 import mock
+from buildbot import config
 from buildbot.test.fake import fakedb
 
 class FakeMaster(object):
@@ -23,10 +24,13 @@ class FakeMaster(object):
         self.basedir = basedir
         self.db = db
         self.changes_subscr_cb = None
+        self.changes_subscr_filter = None
         self.bset_subscr_cb = None
         self.bset_completion_subscr_cb = None
+        self.bset_completion_by_bsid_cbs = {}
         self.caches = mock.Mock(name="caches")
         self.caches.get_cache = self.get_cache
+        self.config = config.MasterConfig()
 
     def addBuildset(self, **kwargs):
         return self.db.buildsets.addBuildset(**kwargs)
@@ -41,9 +45,10 @@ class FakeMaster(object):
         sub.unsubscribe = unsub
         return sub
 
-    def subscribeToChanges(self, callback):
+    def subscribeToChanges(self, callback, change_filter=None):
         assert not self.changes_subscr_cb
         self.changes_subscr_cb = callback
+        self.changes_subscr_filter = change_filter
         return self._makeSubscription('changes_subscr_cb')
 
     def subscribeToBuildsets(self, callback):
@@ -56,6 +61,15 @@ class FakeMaster(object):
         self.bset_completion_subscr_cb = callback
         return self._makeSubscription('bset_completion_subscr_cb')
 
+    def subscribeToBuildsetCompletion(self, bsid, callback):
+        assert bsid not in self.bset_completion_by_bsid_cbs
+        self.bset_completion_by_bsid_cbs[bsid] = callback
+        sub = mock.Mock()
+        def unsub():
+            del self.bset_completion_by_bsid_cbs[bsid]
+        sub.unsubscribe = unsub
+        return sub
+
     # caches
 
     def get_cache(self, cache_name, miss_fn):
@@ -67,9 +81,13 @@ class FakeMaster(object):
 
     def getSubscriptionCallbacks(self):
         """get the subscription callbacks set on the master, in a dictionary
-        with keys @{buildsets}, @{buildset_completion}, and C{changes}."""
+        with keys @{buildsets}, @{buildset_completion},
+        C{buildset_completion_by_bsid} (a dictionary keyed by bsid), and
+        C{changes}."""
         return dict(buildsets=self.bset_subscr_cb,
                     buildset_completion=self.bset_completion_subscr_cb,
+                    buildset_completion_by_bsid=
+                        self.bset_completion_by_bsid_cbs.copy(),
                     changes=self.changes_subscr_cb)
 
 
@@ -56,6 +56,49 @@ class SubscriptionPoint(object):
     def _unsubscribe(self, subscription):
         self.subscriptions.remove(subscription)
 
+class KeyedSubscriptionPoint(SubscriptionPoint):
+    """
+    Something that can be subscribed to for a particular key, such as the id
+    of a buildset.  Each delivery is for a key, and only reaches the
+    subscriptions for that key.
+    """
+    def __init__(self, name):
+        SubscriptionPoint.__init__(self, name)
+        self.subscriptionsByKey = {}
+
+    def __str__(self):
+        return "<KeyedSubscriptionPoint '%s'>" % self.name
+
+    def subscribe(self, key, callback):
+        """Add C{callback} to the subscriptions for C{key}; returns a
+        L{Subscription} instance."""
+        sub = SubscriptionPoint.subscribe(self, callback)
+        sub.key = key
+        self.subscriptionsByKey.setdefault(key, set()).add(sub)
+        return sub
+
+    def deliver(self, key, *args, **kwargs):
+        """
+        Deliver C{key} and the given args and keyword args to the current
+        subscribers for C{key}.
+        """
+        for sub in list(self.subscriptionsByKey.get(key, ())):
+            # an earlier callback may have cancelled this subscription
+            if sub not in self.subscriptions:
+                continue
+            try:
+                sub.callback(key, *args, **kwargs)
+            except:
+                log.err(failure.Failure(),
+                        'while invoking callback %s to %s' % (sub.callback, self))
+
+    def _unsubscribe(self, subscription):
+        SubscriptionPoint._unsubscribe(self, subscription)
+        subs = self.subscriptionsByKey[subscription.key]
+        subs.remove(subscription)
+        if not subs:
+            del self.subscriptionsByKey[subscription.key]
+
 class Subscription(object):
     """
     Represents a subscription to a L{SubscriptionPoint}; use
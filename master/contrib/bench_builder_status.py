@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+"""bench_builder_status.py [options]
+
+Measure how long the master takes to set up the status of its builders at
+startup, as the number of builders and of builds kept on disk for each of
+them grows.  Each builder directory is filled with empty build and log files
+and a builder pickle, then Status.builderAdded is timed three ways: on the
+first start, when the build number has to be found by scanning the directory;
+on a restart, when it is read from the index; and on a restart where the
+history of every builder is then used, which loads the pickles."""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from twisted.python import log
+from buildbot import config
+from buildbot.status import master
+
+class Master(object):
+    botmaster = None
+    def __init__(self, basedir):
+        self.basedir = basedir
+        self.config = config.MasterConfig()
+
+def populate(basedir, builders, builds, logs):
+    for b in xrange(builders):
+        builddir = os.path.join(basedir, 'builder%d' % b)
+        os.makedirs(builddir)
+        for n in xrange(builds):
+            open(os.path.join(builddir, '%d' % n), 'w').close()
+            for l in xrange(logs):
+                open(os.path.join(builddir, '%d-log-step%d-stdio' % (n, l)),
+                     'w').close()
+
+def start(basedir, builders, useHistory=False):
+    status = master.Status(Master(basedir))
+    started = time.time()
+    for b in xrange(builders):
+        name = 'builder%d' % b
+        bs = status.builderAdded(name, name)
+        if useHistory:
+            bs.getEvent(-1)
+    return time.time() - started
+
+def main():
+    from optparse import OptionParser
+    parser = OptionParser(__doc__)
+    parser.set_defaults(builders=50, builds=2000, logs=2)
+    parser.add_option("-b", "--builders", dest="builders", type="int",
+            help="number of builders")
+    parser.add_option("-n", "--builds", dest="builds", type="int",
+            help="number of builds on disk for each builder")
+    parser.add_option("-l", "--logs", dest="logs", type="int",
+            help="number of log files for each build")
+    parser.add_option("-d", "--dir", dest="dir",
+            help="directory to put the builders in (default: a temporary one)")
+    parser.add_option("-v", "--verbose", dest="verbose", action="store_true",
+            help="show the master's log messages")
+    options, args = parser.parse_args()
+    if args:
+        parser.error("no arguments expected")
+    if options.verbose:
+        log.startLogging(sys.stdout)
+
+    basedir = options.dir or tempfile.mkdtemp()
+    try:
+        populate(basedir, options.builders, options.builds, options.logs)
+        # write the builder pickles, as a master that ran before would have
+        status = master.Status(Master(basedir))
+        for b in xrange(options.builders):
+            name = 'builder%d' % b
+            status.builderAdded(name, name).saveYourself()
+        for b in xrange(options.builders):
+            os.unlink(os.path.join(basedir, 'builder%d' % b, 'builder.index'))
+
+        print "%d builders, %d builds each" % (options.builders,
+                                               options.builds)
+        print "first start      %7.2fs" % start(basedir, options.builders)
+        print "restart          %7.2fs" % start(basedir, options.builders)
+        print "restart + loads  %7.2fs" % start(basedir, options.builders,
+                                               useHistory=True)
+    finally:
+        if not options.dir:
+            shutil.rmtree(basedir)
+
+if __name__ == '__main__':
+    sys.exit(main())
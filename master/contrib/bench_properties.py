@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+"""bench_properties.py [options]
+
+Time the rendering of a step's command line and environment, as a build does
+before running a step: a long list of arguments, some of them WithProperties
+instances using the ':-', ':~' and ':+' operators, and an environment dict
+where most values are plain strings."""
+
+import sys
+import time
+
+from buildbot.process.properties import Properties, WithProperties
+
+def makeCommand(args):
+    command = [ 'make' ]
+    for i in xrange(args):
+        if i % 4 == 0:
+            command.append(WithProperties('--rev=%(got_revision:-unknown)s'))
+        elif i % 4 == 1:
+            command.append(WithProperties('%(branch:~trunk)s/%(buildnumber)s'))
+        elif i % 4 == 2:
+            command.append(WithProperties('%(clobber:+--clean)s'))
+        else:
+            command.append('--flag%d' % i)
+    return command
+
+def makeEnv(vars):
+    env = dict([ ('VAR%d' % i, 'value%d' % i) for i in xrange(vars) ])
+    env['BUILDNUMBER'] = WithProperties('%(buildnumber)s')
+    return env
+
+def main():
+    from optparse import OptionParser
+    parser = OptionParser(__doc__)
+    parser.set_defaults(renders=2000, args=100, vars=50)
+    parser.add_option("-n", "--renders", dest="renders", type="int",
+            help="number of times to render the command and environment")
+    parser.add_option("-a", "--args", dest="args", type="int",
+            help="number of arguments on the command line")
+    parser.add_option("-e", "--env", dest="vars", type="int",
+            help="number of variables in the environment")
+    options, args = parser.parse_args()
+    if args:
+        parser.error("no arguments expected")
+
+    props = Properties(branch='', buildnumber=42, got_revision='abc123')
+    command = makeCommand(options.args)
+    env = makeEnv(options.vars)
+
+    start = time.time()
+    for i in xrange(options.renders):
+        props.render(command)
+    rendered = time.time()
+    for i in xrange(options.renders):
+        props.render(env)
+    done = time.time()
+
+    print "command %7.2fs  env %7.2fs" % (rendered - start, done - rendered)
+
+if __name__ == '__main__':
+    sys.exit(main())
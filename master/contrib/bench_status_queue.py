@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+"""bench_status_queue.py [options]
+
+Compare the on-disk queues that StatusPush can use to hold events while the
+server they are pushed to is down: DiskQueue, which keeps a file per event,
+and JournalQueue, which appends events to segment files.  Each queue is
+filled with events the size of a typical status push packet, then drained
+in chunks, as HttpStatusPush does when the server comes back."""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from buildbot.status.persistent_queue import DiskQueue, JournalQueue
+
+def bench(queueClass, basedir, items, chunkSize, itemSize):
+    path = os.path.join(basedir, queueClass.__name__)
+    item = {'event': 'stepFinished', 'payload': 'x' * itemSize}
+
+    start = time.time()
+    queue = queueClass(path, maxItems=items)
+    for i in xrange(items):
+        queue.pushItem(item)
+    queue.save()
+    pushed = time.time()
+
+    # as if the master was restarted
+    queue = queueClass(path, maxItems=items)
+    loaded = time.time()
+    while queue.nbItems():
+        queue.popChunk(chunkSize)
+    popped = time.time()
+
+    shutil.rmtree(path)
+    print "%-12s push %7.2fs  load %7.2fs  pop %7.2fs" % (
+            queueClass.__name__, pushed - start, loaded - pushed,
+            popped - loaded)
+
+def main():
+    from optparse import OptionParser
+    parser = OptionParser(__doc__)
+    parser.set_defaults(items=20000, chunk=200, size=500)
+    parser.add_option("-n", "--items", dest="items", type="int",
+            help="number of events to queue")
+    parser.add_option("-c", "--chunk", dest="chunk", type="int",
+            help="number of events popped at a time")
+    parser.add_option("-s", "--size", dest="size", type="int",
+            help="approximate size of each event, in bytes")
+    parser.add_option("-d", "--dir", dest="dir",
+            help="directory to put the queues in (default: a temporary one)")
+    options, args = parser.parse_args()
+    if args:
+        parser.error("no arguments expected")
+
+    basedir = options.dir or tempfile.mkdtemp()
+    try:
+        for queueClass in (DiskQueue, JournalQueue):
+            bench(queueClass, basedir, options.items, options.chunk,
+                  options.size)
+    finally:
+        if not options.dir:
+            shutil.rmtree(basedir)
+
+if __name__ == '__main__':
+    sys.exit(main())
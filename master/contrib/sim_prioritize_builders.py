@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+"""sim_prioritize_builders.py [options] [TRACE]
+
+Compare prioritizeBuilders policies by replaying a trace of build requests
+against a simulated pool of slaves: the default, which runs the builder with
+the oldest request first, and DurationPrioritizer, which runs the shortest
+expected builds first.  The simulation is deterministic, and calls the
+sorting functions Buildbot uses.
+
+Each line of TRACE describes one build request, as
+
+    <submitted at, in seconds> <builder name> <duration, in seconds>
+
+and lines starting with '#' are ignored.  Without a trace, one is generated
+from the --seed option.  The builders share --slaves slaves, unless the
+slaves of a builder are given with --builder NAME=SLAVE,SLAVE..."""
+
+import random
+import sys
+
+from twisted.internet import defer, task
+from buildbot.process import botmaster, prioritizer
+from buildbot.util import epoch2datetime
+
+class Expectations(object):
+    decay = 0.5
+    def __init__(self, duration):
+        self.duration = duration
+    def update(self, duration):
+        self.duration = duration * self.decay + \
+                        self.duration * (1 - self.decay)
+    def expectedBuildTime(self):
+        return self.duration
+
+class Config(object):
+    def __init__(self, slavenames):
+        self.slavenames = slavenames
+
+class Builder(object):
+    def __init__(self, name, slavenames):
+        self.name = name
+        self.config = Config(slavenames)
+        self.expectations = None
+        self.pending = [] # (submitted at, duration)
+
+    def getOldestRequestTime(self):
+        if self.pending:
+            return defer.succeed(epoch2datetime(self.pending[0][0]))
+        return defer.succeed(None)
+
+    def buildFinished(self, duration):
+        if self.expectations:
+            self.expectations.update(duration)
+        else:
+            self.expectations = Expectations(duration)
+
+class Builds(object):
+    def getRecentBuildDurations(self, buildername, count=5):
+        return defer.succeed([])
+
+class DB(object):
+    builds = Builds()
+
+class Master(object):
+    db = DB()
+
+class BotMaster(object):
+    master = Master()
+
+def sortBuilders(sorter, builders):
+    result = []
+    d = sorter(Master(), builders)
+    d.addCallback(result.append)
+    # all of the fakes answer synchronously
+    assert result, "sorter did not answer synchronously"
+    return result[0]
+
+def simulate(sorter, trace, builderSlaves, clock):
+    builders = dict([ (name, Builder(name, slaves))
+                      for name, slaves in builderSlaves.iteritems() ])
+    allSlaves = set()
+    for slaves in builderSlaves.itervalues():
+        allSlaves.update(slaves)
+    idle = set(allSlaves)
+    running = [] # (finish time, slave, builder, duration)
+    arrivals = sorted(trace)
+    feedback = {} # builder name : [ time to feedback ]
+
+    while arrivals or running:
+        # advance to the next event
+        times = []
+        if arrivals:
+            times.append(arrivals[0][0])
+        if running:
+            times.append(min(running)[0])
+        now = min(times)
+        clock.advance(now - clock.seconds())
+
+        while arrivals and arrivals[0][0] <= now:
+            submitted, name, duration = arrivals.pop(0)
+            builders[name].pending.append((submitted, duration))
+        for build in [ b for b in running if b[0] <= now ]:
+            running.remove(build)
+            finish, slave, bldr, duration = build
+            idle.add(slave)
+            bldr.buildFinished(duration)
+
+        # distribute the requests, as BuildRequestDistributor does
+        waiting = [ b for b in builders.itervalues() if b.pending ]
+        for bldr in sortBuilders(sorter, waiting):
+            while bldr.pending:
+                free = sorted(idle.intersection(bldr.config.slavenames))
+                if not free:
+                    break
+                submitted, duration = bldr.pending.pop(0)
+                idle.remove(free[0])
+                running.append((now + duration, free[0], bldr, duration))
+                feedback.setdefault(bldr.name, []).append(
+                        now + duration - submitted)
+    return feedback
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+def report(policy, feedback, verbose):
+    def line(label, values):
+        print "%-24s %6d %10.0f %10.0f %10.0f" % (label, len(values),
+                float(sum(values)) / len(values),
+                percentile(values, 0.5), percentile(values, 0.95))
+    allValues = []
+    for values in feedback.itervalues():
+        allValues.extend(values)
+    line(policy, allValues)
+    if verbose:
+        for name in sorted(feedback):
+            line("  " + name, feedback[name])
+
+def readTrace(filename):
+    trace = []
+    for line in open(filename):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        submitted, name, duration = line.split()
+        trace.append((int(submitted), name, int(duration)))
+    return trace
+
+def generateTrace(seed, requests):
+    # a few quick builders, and a few long ones
+    rnd = random.Random(seed)
+    kinds = [ ('quick%d' % i, 300) for i in range(4) ] + \
+            [ ('long%d' % i, 3600) for i in range(2) ]
+    trace = []
+    now = 0
+    for i in xrange(requests):
+        now += int(rnd.expovariate(1.0 / 240))
+        name, mean = rnd.choice(kinds)
+        trace.append((now, name, int(rnd.uniform(0.5, 1.5) * mean)))
+    return trace
+
+def main():
+    from optparse import OptionParser
+    parser = OptionParser(__doc__)
+    parser.set_defaults(slaves=8, seed=0, requests=500, builders=[],
+                        aging=1.0, verbose=False)
+    parser.add_option("-s", "--slaves", dest="slaves", type="int",
+            help="number of slaves shared by all builders")
+    parser.add_option("-b", "--builder", dest="builders", action="append",
+            help="slaves of a builder, as NAME=SLAVE,SLAVE...")
+    parser.add_option("-a", "--aging", dest="aging", type="float",
+            help="agingFactor for DurationPrioritizer")
+    parser.add_option("--seed", dest="seed", type="int",
+            help="seed used to generate a trace")
+    parser.add_option("-n", "--requests", dest="requests", type="int",
+            help="number of requests in a generated trace")
+    parser.add_option("-v", "--verbose", dest="verbose", action="store_true",
+            help="report each builder")
+    options, args = parser.parse_args()
+    if len(args) > 1:
+        parser.error("at most one trace expected")
+
+    if args:
+        trace = readTrace(args[0])
+    else:
+        trace = generateTrace(options.seed, options.requests)
+
+    shared = [ 'slave%d' % i for i in range(options.slaves) ]
+    builderSlaves = dict([ (name, shared) for _, name, _ in trace ])
+    for spec in options.builders:
+        name, slaves = spec.split('=', 1)
+        builderSlaves[name] = slaves.split(',')
+
+    print "%-24s %6s %10s %10s %10s" % ("time to feedback (s)",
+            "builds", "mean", "median", "95%")
+
+    distributor = botmaster.BuildRequestDistributor(BotMaster())
+    clock = task.Clock()
+    report("oldest request first",
+           simulate(distributor._defaultSorter, trace, builderSlaves, clock),
+           options.verbose)
+
+    clock = task.Clock()
+    sorter = prioritizer.DurationPrioritizer(agingFactor=options.aging,
+                                             _reactor=clock)
+    report("DurationPrioritizer",
+           simulate(sorter, trace, builderSlaves, clock), options.verbose)
+
+if __name__ == '__main__':
+    sys.exit(main())
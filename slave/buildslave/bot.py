@@ -28,6 +28,7 @@ import buildslave
 from buildslave.pbutil import ReconnectingPBClientFactory
 from buildslave.commands import registry, base
 from buildslave import monkeypatches
+from buildslave import trash
 
 class UnknownCommand(pb.Error):
     pass
@@ -54,6 +55,10 @@ class SlaveBuilder(pb.Referenceable, service.Service):
     # when the step is started
     remoteStep = None
 
+    # .reaper is the slave's TrashReaper, used by commands to clobber
+    # directories in the background.  It is set by the Bot.
+    reaper = None
+
     def __init__(self, name):
         #service.Service.__init__(self) # Service has no __init__ method
         self.setName(name)
@@ -241,6 +246,8 @@ class Bot(pb.Referenceable, service.MultiService):
         self.usePTY = usePTY
         self.unicode_encoding = unicode_encoding or sys.getfilesystemencoding() or 'ascii'
         self.builders = {}
+        self.reaper = trash.TrashReaper(basedir)
+        self.reaper.setServiceParent(self)
 
     def startService(self):
         assert os.path.isdir(self.basedir)
@@ -255,7 +262,7 @@ class Bot(pb.Referenceable, service.MultiService):
 
     def remote_setBuilderList(self, wanted):
         retval = {}
-        wanted_dirs = ["info"]
+        wanted_dirs = ["info", self.reaper.trashdirName]
         for (name, builddir) in wanted:
             wanted_dirs.append(builddir)
             b = self.builders.get(name, None)
@@ -268,6 +275,7 @@ class Bot(pb.Referenceable, service.MultiService):
                 b = SlaveBuilder(name)
                 b.usePTY = self.usePTY
                 b.unicode_encoding = self.unicode_encoding
+                b.reaper = self.reaper
                 b.setServiceParent(self)
                 b.setBuilddir(builddir)
                 self.builders[name] = b
@@ -28,11 +28,12 @@ from buildslave import runprocess
 from buildslave.exceptions import AbandonChain
 from buildslave.commands import utils
 from buildslave import util
+from buildslave import copier
 
 # this used to be a CVS $-style "Revision" auto-updated keyword, but since I
 # moved to Darcs as the primary repository, this is updated manually each
 # time this file is changed. The last cvs_ver that was here was 1.51 .
-command_version = "2.15"
+command_version = "2.18"
 
 # version history:
 #  >=1.17: commands are interruptable
@@ -64,6 +65,10 @@ command_version = "2.15"
 #  >= 2.13: SlaveFileUploadCommand supports option 'keepstamp'
 #  >= 2.14: RemoveDirectory can delete multiple directories
 #  >= 2.15: 'interruptSignal' option is added to SlaveShellCommand
+#  >= 2.16: RemoveDirectory and source commands accept 'trash'
+#  >= 2.17: CopyDirectory accepts 'method', 'sync' and 'threads', and source
+#           commands accept 'copy_method' and 'copy_sync'
+#  >= 2.18: Git accepts 'mirror'
 
 class Command:
     implements(ISlaveCommand)
@@ -192,6 +197,38 @@ class Command:
     def _sendRC(self, res):
         self.sendStatus({'rc': 0})
 
+    def _trashDirectory(self, path):
+        """Try to move C{path} into the slave's trash directory, where it
+        will be deleted in the background.  Returns True if C{path} is gone,
+        or False if the caller must remove it the slow way."""
+        if not self.builder.reaper:
+            return False
+        try:
+            self.builder.reaper.trash(path)
+        except OSError, e:
+            log.msg("could not move %s to trash (%s); removing it instead"
+                    % (path, e))
+            return False
+        return True
+
+    def _copyTree(self, fromdir, todir, method, sync, threadCount=4):
+        """Copy C{fromdir} to C{todir} in a thread using a
+        L{buildslave.copier.TreeCopier}.  Returns a Deferred that fires with
+        an rc."""
+        tc = copier.TreeCopier(fromdir, todir, method=method, sync=sync,
+                               threads=threadCount)
+        d = threads.deferToThread(tc.run)
+        def cb(stats):
+            self.sendStatus({'header' : 'copied %s to %s: %s\n' % (fromdir,
+                todir, ', '.join([ '%d %s' % (stats[k], k)
+                                   for k in sorted(stats) ]))})
+            return 0 # rc=0
+        def eb(f):
+            self.sendStatus({'header' : 'exception from TreeCopier\n' + f.getTraceback()})
+            return -1 # rc=-1
+        d.addCallbacks(cb, eb)
+        return d
+
     def _checkAbandoned(self, why):
         log.msg("_checkAbandoned", why)
         why.trap(AbandonChain)
@@ -235,6 +272,19 @@ class SourceBaseCommand(Command):
                         reattempted, up to REPEATS times, after a delay of
                         DELAY seconds. This is intended to deal with slaves
                         that experience transient network failures.
+
+        - ['copy_method']: in 'copy' mode, how the source tree is copied
+                        into the workdir: one of copy/reflink/hardlink/auto;
+                        see L{buildslave.copier.TreeCopier}.  Defaults to
+                        'copy', which uses 'cp -R'.
+
+        - ['copy_sync']: in 'copy' mode, if true, the workdir is not clobbered
+                        before the copy; instead only changed files are
+                        copied and files not in the source tree are removed.
+
+        - ['trash']:    If true, directories are clobbered by moving them to
+                        the slave's trash directory, where they are deleted
+                        in the background, instead of with 'rm -rf'.
     """
 
     sourcedata = ""
@@ -254,6 +304,9 @@ class SourceBaseCommand(Command):
         self.maxTime = args.get('maxTime', None)
         self.retry = args.get('retry')
         self.logEnviron = args.get('logEnviron',True)
+        self.trash = args.get('trash', False)
+        self.copy_method = args.get('copy_method', 'copy')
+        self.copy_sync = args.get('copy_sync', False)
         self._commandPaths = {}
         # VC-specific subclasses should override this to extract more args.
         # Make sure to upcall!
@@ -314,6 +367,9 @@ class SourceBaseCommand(Command):
 
     def maybeClobber(self, d):
         # do we need to clobber anything?
+        if self.mode == "copy" and self.copy_sync:
+            # the copy will bring the existing workdir up to date
+            return
         if self.mode in ("copy", "clobber", "export"):
             d.addCallback(self.doClobber, self.workdir)
 
@@ -477,6 +533,8 @@ class SourceBaseCommand(Command):
 
     def doClobber(self, dummy, dirname, chmodDone=False):
         d = os.path.join(self.builder.basedir, dirname)
+        if self.trash and self._trashDirectory(d):
+            return defer.succeed(0)
         if runtime.platformType != "posix":
             d = threads.deferToThread(utils.rmdirRecursive, d)
             def cb(_):
@@ -532,6 +590,11 @@ class SourceBaseCommand(Command):
         # now copy tree to workdir
         fromdir = os.path.join(self.builder.basedir, self.srcdir)
         todir = os.path.join(self.builder.basedir, self.workdir)
+        if self.copy_method != 'copy' or self.copy_sync:
+            d = self._copyTree(fromdir, todir, self.copy_method,
+                               self.copy_sync)
+            d.addCallback(self._abandonOnFailure)
+            return d
         if runtime.platformType != "posix":
             d = threads.deferToThread(shutil.copytree, fromdir, todir)
             def cb(_):
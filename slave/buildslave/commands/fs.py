@@ -46,7 +46,7 @@ class RemoveDirectory(base.Command):
 
     def setup(self,args):
         self.logEnviron = args.get('logEnviron',True)
-
+        self.trash = args.get('trash', False)
 
     @defer.deferredGenerator
     def start(self):
@@ -78,7 +78,9 @@ class RemoveDirectory(base.Command):
 
     def removeSingleDir(self, dirname):
         self.dir = os.path.join(self.builder.basedir, dirname)
-        if runtime.platformType != "posix":
+        if self.trash and self._trashDirectory(self.dir):
+            d = defer.succeed(0)
+        elif runtime.platformType != "posix":
             d = threads.deferToThread(utils.rmdirRecursive, self.dir)
             def cb(_):
                 return 0 # rc=0
@@ -150,8 +152,16 @@ class CopyDirectory(base.Command):
 
         self.timeout = args.get('timeout', 120)
         self.maxTime = args.get('maxTime', None)
+        method = args.get('method', 'copy')
+        sync = args.get('sync', False)
 
-        if runtime.platformType != "posix":
+        if method != 'copy' or sync:
+            d = self._copyTree(fromdir, todir, method, sync,
+                               args.get('threads', 4))
+            @d.addCallback
+            def send_rc(rc):
+                self.sendStatus({'rc' : rc})
+        elif runtime.platformType != "posix":
             d = threads.deferToThread(shutil.copytree, fromdir, todir)
             def cb(_):
                 return 0 # rc=0
@@ -16,11 +16,19 @@
 import os
 
 from twisted.internet import defer
+from twisted.python import log
 
 from buildslave.commands.base import SourceBaseCommand
-from buildslave import runprocess
+from buildslave import runprocess, util
 from buildslave.commands.base import AbandonChain
 
+# Mirrors are shared by all of the builders on a slave, which all run in this
+# process.  Each mirror has a lock, so that only one builder fetches into it at
+# a time, and the time of its last successful refresh, so that builders which
+# were waiting for that refresh need not repeat it.
+_mirrorLocks = {}
+_mirrorRefreshed = {}
+
 
 class Git(SourceBaseCommand):
     """Git specific VC operation. In addition to the arguments
@@ -41,6 +49,12 @@ class Git(SourceBaseCommand):
                                    requires Git 1.7.2 or later.
     ['shallow'] (optional):        if true, use shallow clones that do not
                                    also fetch history
+    ['mirror'] (optional):         path (relative to the builder's basedir)
+                                   of a bare mirror of the repository, shared
+                                   by all builders on this slave.  The mirror
+                                   is created and refreshed as needed, and
+                                   checkouts fetch from it and borrow its
+                                   objects through alternates.
     """
 
     header = "git operation"
@@ -56,10 +70,28 @@ class Git(SourceBaseCommand):
         self.ignore_ignores = args.get('ignore_ignores', True)
         self.reference = args.get('reference', None)
         self.gerrit_branch = args.get('gerrit_branch', None)
+        self.mirror = args.get('mirror', None)
+        self.useMirror = bool(self.mirror)
 
     def _fullSrcdir(self):
         return os.path.join(self.builder.basedir, self.srcdir)
 
+    def _mirrorDir(self):
+        return os.path.normpath(os.path.join(self.builder.basedir,
+                                             self.mirror))
+
+    def _fetchUrl(self):
+        if self.useMirror:
+            return self._mirrorDir()
+        return self.repourl
+
+    def _getReference(self):
+        if self.reference:
+            return self.reference
+        if self.useMirror:
+            return self._mirrorDir()
+        return None
+
     def sourcedirIsUpdateable(self):
         return os.path.isdir(os.path.join(self._fullSrcdir(), ".git"))
 
@@ -77,6 +109,79 @@ class Git(SourceBaseCommand):
             d.addCallback(cb)
         return d
 
+    def _domirrorcmd(self, command, **kwargs):
+        git = self.getCommand("git")
+        c = runprocess.RunProcess(self.builder, [git] + command,
+                         self._mirrorDir(), sendRC=False, timeout=self.timeout,
+                         maxTime=self.maxTime, logEnviron=self.logEnviron,
+                         usePTY=False, **kwargs)
+        self.command = c
+        return c.start()
+
+    def doVC(self, res):
+        if not self.useMirror:
+            return SourceBaseCommand.doVC(self, res)
+        mirror = self._mirrorDir()
+        if mirror not in _mirrorLocks:
+            _mirrorLocks[mirror] = defer.DeferredLock()
+        d = _mirrorLocks[mirror].run(self._refreshMirror, mirror,
+                                     util.now(self._reactor))
+        d.addCallback(lambda _ : SourceBaseCommand.doVC(self, res))
+        return d
+
+    @defer.deferredGenerator
+    def _refreshMirror(self, mirror, requested):
+        if self.interrupted:
+            raise AbandonChain(1)
+
+        if not os.path.isdir(mirror):
+            os.makedirs(mirror)
+            wfd = defer.waitForDeferred(
+                self._domirrorcmd(['init', '--bare']))
+            yield wfd
+            if wfd.getResult() != 0:
+                self._abandonMirror("could not create mirror %s" % mirror)
+                return
+
+        # another builder may have refreshed the mirror while we waited for
+        # the lock; if so, there's no need to fetch again
+        if _mirrorRefreshed.get(mirror, 0) >= requested:
+            self.sendStatus({'header': "mirror %s is up to date\n" % mirror})
+            return
+
+        if self.revision:
+            wfd = defer.waitForDeferred(
+                self._domirrorcmd(['cat-file', '-e',
+                                   '%s^{commit}' % self.revision]))
+            yield wfd
+            if wfd.getResult() == 0:
+                self.sendStatus({'header': "mirror %s already has %s\n"
+                                            % (mirror, self.revision)})
+                return
+
+        branch = self.gerrit_branch or self.branch
+        command = ['fetch', '-t', self.repourl, '+refs/heads/*:refs/heads/*']
+        if branch.startswith('refs/'):
+            command.append('+%s:%s' % (branch, branch))
+        if self.args.get('progress'):
+            command.append('--progress')
+        self.sendStatus({"header": "refreshing mirror %s from %s\n"
+                                        % (mirror, self.repourl)})
+        wfd = defer.waitForDeferred(self._domirrorcmd(command))
+        yield wfd
+        if wfd.getResult() != 0:
+            self._abandonMirror("could not refresh mirror %s" % mirror)
+            return
+        _mirrorRefreshed[mirror] = util.now(self._reactor)
+
+    def _abandonMirror(self, msg):
+        # a broken mirror should not break the build; fall back to fetching
+        # from the repository directly
+        msg += "; fetching from %s instead" % self.repourl
+        self.sendStatus({'header': msg + "\n"})
+        log.msg(msg)
+        self.useMirror = False
+
     def sourcedataMatches(self):
         # If the repourl matches the sourcedata file, then we can say that the
         # sourcedata matches.  We can ignore branch changes, since Git can work
@@ -148,7 +253,7 @@ class Git(SourceBaseCommand):
     def _doFetch(self, dummy, branch):
         # The plus will make sure the repo is moved to the branch's
         # head even if it is not a simple "fast-forward"
-        command = ['fetch', '-t', self.repourl, '+%s' % branch]
+        command = ['fetch', '-t', self._fetchUrl(), '+%s' % branch]
         # If the 'progress' option is set, tell git fetch to output
         # progress information to the log. This can solve issues with
         # long fetches killed due to lack of output, but only works
@@ -156,7 +261,7 @@ class Git(SourceBaseCommand):
         if self.args.get('progress'):
             command.append('--progress')
         self.sendStatus({"header": "fetching branch %s from %s\n"
-                                        % (branch, self.repourl)})
+                                        % (branch, self._fetchUrl())})
         return self._dovccmd(command, self._didFetch, keepStderr=True)
 
     def _didClean(self, dummy):
@@ -178,9 +283,10 @@ class Git(SourceBaseCommand):
     def _didInit(self, res):
         # If we have a reference repository specified, we need to also set that
         # up after the 'git init'.
-        if self.reference:
+        reference = self._getReference()
+        if reference:
             git_alts_path = os.path.join(self._fullSrcdir(), '.git', 'objects', 'info', 'alternates')
-            git_alts_content = os.path.join(self.reference, 'objects')
+            git_alts_content = os.path.join(reference, 'objects')
             self.setFileContents(git_alts_path, git_alts_content)
         return self.doVCUpdate()
 
@@ -192,9 +298,10 @@ class Git(SourceBaseCommand):
         if not self.args.get('revision') and self.args.get('shallow'):
             cmd = [git, 'clone', '--depth', '1']
             # If we have a reference repository, pass it to the clone command
-            if self.reference:
-                cmd.extend(['--reference', self.reference])
-            cmd.extend([self.repourl, self._fullSrcdir()])
+            reference = self._getReference()
+            if reference:
+                cmd.extend(['--reference', reference])
+            cmd.extend([self._fetchUrl(), self._fullSrcdir()])
             c = runprocess.RunProcess(self.builder, cmd, self.builder.basedir,
                              sendRC=False, timeout=self.timeout,
                              maxTime=self.maxTime, logEnviron=self.logEnviron,
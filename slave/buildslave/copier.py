@@ -0,0 +1,235 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import os
+import sys
+import stat
+import errno
+import shutil
+import threading
+import Queue
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# the FICLONE ioctl, from linux/fs.h; this is supported by btrfs, xfs and
+# others, and makes the destination share extents with the source until one
+# of them is written to
+FICLONE = 0x40049409
+
+# copy methods, for the 'method' argument to TreeCopier
+METHODS = ('copy', 'reflink', 'hardlink', 'auto')
+
+# errors from the FICLONE ioctl that mean "not supported here"
+_reflink_unsupported = (errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV,
+                        errno.EINVAL, errno.ENOSYS, errno.EPERM)
+
+_writable = stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH
+
+class TreeCopier(object):
+    """
+    Copy a directory tree, like C{cp -R -P -p}, as cheaply as possible.
+
+    The C{method} determines how regular files are copied:
+
+     - C{copy}: copy the file contents
+     - C{reflink}: make a copy-on-write clone of each file, falling back to
+       copying if the filesystem does not support it
+     - C{hardlink}: hard-link files which are already read-only into the
+       destination, and copy the rest; a writable link would let a build
+       silently modify the source tree, and the source is never modified to
+       protect it
+     - C{auto}: reflink if possible; otherwise hard-link files which are
+       already read-only (so the link cannot be modified in place), and copy
+       everything else
+
+    Contents are copied by a pool of C{threads} worker threads, as copying
+    many small files is dominated by latency rather than bandwidth.
+
+    If C{sync} is true and the destination already exists, only files whose
+    size or modification time differ from the source are copied, and files
+    which are not present in the source are removed from the destination.
+
+    Call L{run} in a thread; it returns a dictionary of counts describing
+    what was done.
+    """
+
+    def __init__(self, fromdir, todir, method='copy', sync=False, threads=4):
+        assert method in METHODS, "unknown copy method %r" % (method,)
+        self.fromdir = fromdir
+        self.todir = todir
+        self.method = method
+        self.sync = sync
+        self.threads = max(1, threads)
+        self.can_reflink = method in ('reflink', 'auto') and fcntl is not None \
+                and sys.platform.startswith('linux')
+        self.stats = dict(copied=0, reflinked=0, hardlinked=0, skipped=0,
+                          removed=0)
+        self._lock = threading.Lock()
+
+    def run(self):
+        queue = Queue.Queue(maxsize=self.threads * 64)
+        errors = []
+        workers = []
+        for i in range(self.threads):
+            t = threading.Thread(target=self._worker, args=(queue, errors))
+            t.setDaemon(True)
+            t.start()
+            workers.append(t)
+
+        dirs = []
+        try:
+            try:
+                self._walk(queue, dirs)
+            finally:
+                for t in workers:
+                    queue.put(None)
+                for t in workers:
+                    t.join()
+        except:
+            errors.append(sys.exc_info())
+
+        if errors:
+            exc_type, exc_value, exc_tb = errors[0]
+            raise exc_type, exc_value, exc_tb
+
+        # directory times have to be set after their contents are written
+        for src, dst in reversed(dirs):
+            shutil.copystat(src, dst)
+        return self.stats
+
+    def _walk(self, queue, dirs):
+        for dirpath, dirnames, filenames in os.walk(self.fromdir):
+            rel = dirpath[len(self.fromdir):].lstrip(os.sep)
+            dstdir = os.path.join(self.todir, rel)
+            if not os.path.isdir(dstdir):
+                if os.path.lexists(dstdir):
+                    self._removePath(dstdir)
+                os.makedirs(dstdir)
+            dirs.append((dirpath, dstdir))
+
+            names = set(dirnames) | set(filenames)
+            if self.sync:
+                for name in os.listdir(dstdir):
+                    if name not in names:
+                        self._removePath(os.path.join(dstdir, name))
+
+            # os.walk does not follow symlinks to directories, but does
+            # list them in dirnames
+            linkdirs = [ n for n in dirnames
+                         if os.path.islink(os.path.join(dirpath, n)) ]
+            for name in linkdirs:
+                dirnames.remove(name)
+            for name in linkdirs + filenames:
+                src = os.path.join(dirpath, name)
+                dst = os.path.join(dstdir, name)
+                if os.path.islink(src):
+                    self._copyLink(src, dst)
+                else:
+                    queue.put((src, dst))
+
+    def _worker(self, queue, errors):
+        while 1:
+            item = queue.get()
+            if item is None:
+                return
+            if errors:
+                continue
+            try:
+                self._copyFile(*item)
+            except:
+                errors.append(sys.exc_info())
+
+    def _count(self, what):
+        self._lock.acquire()
+        try:
+            self.stats[what] += 1
+        finally:
+            self._lock.release()
+
+    def _copyLink(self, src, dst):
+        target = os.readlink(src)
+        if os.path.lexists(dst):
+            if self.sync and os.path.islink(dst) \
+                    and os.readlink(dst) == target:
+                self._count('skipped')
+                return
+            self._removePath(dst)
+        os.symlink(target, dst)
+        self._count('copied')
+
+    def _copyFile(self, src, dst):
+        st = os.stat(src)
+        if os.path.lexists(dst):
+            if self.sync and self._unchanged(st, dst):
+                self._count('skipped')
+                return
+            self._removePath(dst)
+
+        if not stat.S_ISREG(st.st_mode):
+            # fifos, sockets, devices; leave these to copyfile to complain
+            # about, as cp would
+            shutil.copy2(src, dst)
+            self._count('copied')
+        elif self.can_reflink and self._reflink(src, dst):
+            shutil.copystat(src, dst)
+            self._count('reflinked')
+        elif (self.method in ('hardlink', 'auto')
+                and not st.st_mode & _writable):
+            os.link(src, dst)
+            self._count('hardlinked')
+        else:
+            shutil.copy2(src, dst)
+            self._count('copied')
+
+    def _unchanged(self, st, dst):
+        try:
+            dst_st = os.lstat(dst)
+        except OSError:
+            return False
+        # os.utime cannot always set times with full precision, so only
+        # compare whole seconds, as rsync does
+        return (stat.S_ISREG(dst_st.st_mode)
+                and dst_st.st_size == st.st_size
+                and int(dst_st.st_mtime) == int(st.st_mtime))
+
+    def _reflink(self, src, dst):
+        srcf = open(src, 'rb')
+        try:
+            dstf = open(dst, 'wb')
+            try:
+                try:
+                    fcntl.ioctl(dstf.fileno(), FICLONE, srcf.fileno())
+                    return True
+                except (IOError, OSError), e:
+                    if e.errno not in _reflink_unsupported:
+                        raise
+            finally:
+                dstf.close()
+        finally:
+            srcf.close()
+        # don't bother trying again for the rest of this tree
+        self.can_reflink = False
+        os.unlink(dst)
+        return False
+
+    def _removePath(self, path):
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path)
+        else:
+            os.unlink(path)
+        self._count('removed')
@@ -21,6 +21,8 @@ from buildslave.test.util.command import CommandTestMixin
 from buildslave.commands import fs
 from twisted.python import runtime
 from buildslave.commands import utils
+from buildslave import trash
+from buildslave import copier
 
 class TestRemoveDirectory(CommandTestMixin, unittest.TestCase):
 
@@ -76,6 +78,38 @@ class TestRemoveDirectory(CommandTestMixin, unittest.TestCase):
         d.addCallback(check)
         return d
 
+    def test_trash(self):
+        self.make_command(fs.RemoveDirectory, dict(
+            dir='workdir',
+            trash=True,
+        ), True)
+        reaper = self.builder.reaper = trash.TrashReaper(self.basedir)
+        open(os.path.join(self.basedir_workdir, 'file'), "w")
+        d = self.run_command()
+
+        def check(_):
+            self.assertFalse(os.path.exists(self.basedir_workdir))
+            self.assertIn({'rc': 0}, self.get_updates(), self.builder.show())
+            return reaper.reap()
+        d.addCallback(check)
+        def check_reaped(_):
+            self.assertEqual(os.listdir(reaper.trashdir), [])
+        d.addCallback(check_reaped)
+        return d
+
+    def test_trash_no_reaper(self):
+        self.make_command(fs.RemoveDirectory, dict(
+            dir='workdir',
+            trash=True,
+        ), True)
+        d = self.run_command()
+
+        def check(_):
+            self.assertFalse(os.path.exists(self.basedir_workdir))
+            self.assertIn({'rc': 0}, self.get_updates(), self.builder.show())
+        d.addCallback(check)
+        return d
+
 class TestCopyDirectory(CommandTestMixin, unittest.TestCase):
 
     def setUp(self):
@@ -99,6 +133,42 @@ class TestCopyDirectory(CommandTestMixin, unittest.TestCase):
         d.addCallback(check)
         return d
 
+    def test_sync(self):
+        self.make_command(fs.CopyDirectory, dict(
+            fromdir='workdir',
+            todir='copy',
+            method='auto',
+            sync=True,
+        ), True)
+        open(os.path.join(self.basedir_workdir, 'file'), "w")
+        os.makedirs(os.path.join(self.basedir, 'copy'))
+        open(os.path.join(self.basedir, 'copy', 'stale'), "w")
+        d = self.run_command()
+
+        def check(_):
+            self.assertEqual(
+                os.listdir(os.path.abspath(os.path.join(self.basedir,'copy'))),
+                ['file'])
+            self.assertIn({'rc': 0}, self.get_updates(), self.builder.show())
+        d.addCallback(check)
+        return d
+
+    def test_sync_exception(self):
+        self.make_command(fs.CopyDirectory, dict(
+            fromdir='nosuchdir',
+            todir='copy',
+            method='hardlink',
+        ), True)
+        def fail(self):
+            raise RuntimeError("oh noes")
+        self.patch(copier.TreeCopier, 'run', fail)
+        d = self.run_command()
+
+        def check(_):
+            self.assertIn({'rc': -1}, self.get_updates(), self.builder.show())
+        d.addCallback(check)
+        return d
+
     def test_simple_exception(self):
         if runtime.platformType == "posix":
             return # we only use rmdirRecursive on windows
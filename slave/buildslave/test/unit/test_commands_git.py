@@ -27,6 +27,8 @@ class TestGit(SourceCommandTestMixin, unittest.TestCase):
 
     def setUp(self):
         self.setUpCommand()
+        self.patch(git, '_mirrorLocks', {})
+        self.patch(git, '_mirrorRefreshed', {})
 
     def tearDown(self):
         self.tearDownCommand()
@@ -685,6 +687,141 @@ class TestGit(SourceCommandTestMixin, unittest.TestCase):
         d.addCallback(check)
         return d
 
+    def make_mirror_command(self, **kwargs):
+        self.patch_getCommand('git', 'path/to/git')
+        self.clean_environ()
+        args = dict(
+            workdir='workdir',
+            mode='update',
+            revision=None,
+            mirror='mirror.git',
+            repourl='git://github.com/djmitche/buildbot.git',
+        )
+        args.update(kwargs)
+        self.make_command(git.Git, args,
+            initial_sourcedata = "git://github.com/djmitche/buildbot.git master\n",
+        )
+        self.patch_sourcedirIsUpdateable(False)
+        self.mirrordir = os.path.join(self.basedir, 'mirror.git')
+
+    def checkout_expects(self, url):
+        return [
+            Expect([ 'clobber', 'workdir' ],
+                self.basedir)
+                + 0,
+            Expect([ 'path/to/git', 'init'],
+                self.basedir_workdir,
+                sendRC=False, timeout=120, usePTY=False)
+                + 0,
+            Expect([ 'setFileContents',
+                     os.path.join(self.basedir_workdir,
+                                  *'.git/objects/info/alternates'.split('/')),
+                     os.path.join(self.mirrordir, 'objects'), ],
+                self.basedir)
+                + 0,
+            Expect([ 'path/to/git', 'fetch', '-t', url, '+master' ],
+                self.basedir_workdir,
+                sendRC=False, timeout=120, usePTY=False, keepStderr=True)
+                + { 'stderr' : '' }
+                + 0,
+            Expect(['path/to/git', 'reset', '--hard', 'FETCH_HEAD'],
+                self.basedir_workdir,
+                sendRC=False, timeout=120, usePTY=False)
+                + 0,
+            Expect(['path/to/git', 'branch', '-M', 'master'],
+                self.basedir_workdir,
+                sendRC=False, timeout=120, usePTY=False)
+                + 0,
+            Expect([ 'path/to/git', 'rev-parse', 'HEAD' ],
+                self.basedir_workdir,
+                sendRC=False, timeout=120, usePTY=False, keepStdout=True)
+                + { 'stdout' : '4026d33b0532b11f36b0875f63699adfa8ee8662\n' }
+                + 0,
+        ]
+
+    def test_run_with_mirror_new(self):
+        self.make_mirror_command()
+        checkout = self.checkout_expects(self.mirrordir)
+        expects = checkout[:1] + [
+            Expect([ 'path/to/git', 'init', '--bare' ],
+                self.mirrordir,
+                sendRC=False, timeout=120, usePTY=False)
+                + 0,
+            Expect([ 'path/to/git', 'fetch', '-t',
+                     'git://github.com/djmitche/buildbot.git',
+                     '+refs/heads/*:refs/heads/*' ],
+                self.mirrordir,
+                sendRC=False, timeout=120, usePTY=False)
+                + 0,
+        ] + checkout[1:]
+        self.patch_runprocess(*expects)
+
+        d = self.run_command()
+        def check(_):
+            self.assertTrue(self.mirrordir in git._mirrorRefreshed)
+        d.addCallback(check)
+        return d
+
+    def test_run_with_mirror_has_revision(self):
+        self.make_mirror_command(revision='abcdef')
+        os.makedirs(self.mirrordir)
+        expects = [
+            Expect([ 'clobber', 'workdir' ],
+                self.basedir)
+                + 0,
+            Expect([ 'path/to/git', 'cat-file', '-e', 'abcdef^{commit}' ],
+                self.mirrordir,
+                sendRC=False, timeout=120, usePTY=False)
+                + 0,
+            Expect([ 'path/to/git', 'init'],
+                self.basedir_workdir,
+                sendRC=False, timeout=120, usePTY=False)
+                + 0,
+            Expect([ 'setFileContents',
+                     os.path.join(self.basedir_workdir,
+                                  *'.git/objects/info/alternates'.split('/')),
+                     os.path.join(self.mirrordir, 'objects'), ],
+                self.basedir)
+                + 0,
+            Expect(['path/to/git', 'reset', '--hard', 'abcdef'],
+                self.basedir_workdir,
+                sendRC=False, timeout=120, usePTY=False)
+                + 0,
+            Expect([ 'path/to/git', 'rev-parse', 'HEAD' ],
+                self.basedir_workdir,
+                sendRC=False, timeout=120, usePTY=False, keepStdout=True)
+                + { 'stdout' : '4026d33b0532b11f36b0875f63699adfa8ee8662\n' }
+                + 0,
+        ]
+        self.patch_runprocess(*expects)
+        return self.run_command()
+
+    def test_run_with_mirror_recently_refreshed(self):
+        self.make_mirror_command()
+        os.makedirs(self.mirrordir)
+        # another builder refreshed the mirror while this one was waiting
+        git._mirrorRefreshed[self.mirrordir] = 1e20
+        self.patch_runprocess(*self.checkout_expects(self.mirrordir))
+        return self.run_command()
+
+    def test_run_with_mirror_fetch_fails(self):
+        self.make_mirror_command()
+        os.makedirs(self.mirrordir)
+        checkout = self.checkout_expects(
+                'git://github.com/djmitche/buildbot.git')
+        # without the mirror, there are no alternates
+        del checkout[2]
+        expects = checkout[:1] + [
+            Expect([ 'path/to/git', 'fetch', '-t',
+                     'git://github.com/djmitche/buildbot.git',
+                     '+refs/heads/*:refs/heads/*' ],
+                self.mirrordir,
+                sendRC=False, timeout=120, usePTY=False)
+                + 128,
+        ] + checkout[1:]
+        self.patch_runprocess(*expects)
+        return self.run_command()
+
     def test_parseGotRevision_bogus(self):
         return self.do_test_parseGotRevision("fatal: Couldn't find revision 1234\n", None)
 
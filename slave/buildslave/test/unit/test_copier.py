@@ -0,0 +1,156 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import os
+import stat
+import errno
+import shutil
+
+from twisted.trial import unittest
+
+from buildslave import copier
+
+class TestTreeCopier(unittest.TestCase):
+
+    def setUp(self):
+        self.basedir = os.path.abspath('basedir')
+        if os.path.exists(self.basedir):
+            shutil.rmtree(self.basedir)
+        self.src = os.path.join(self.basedir, 'source')
+        self.dst = os.path.join(self.basedir, 'build')
+        os.makedirs(os.path.join(self.src, 'sub'))
+        self.writeFile('top', 'top')
+        self.writeFile('sub/a', 'aaa')
+        self.writeFile('sub/b', 'bbbb')
+        os.symlink('sub', os.path.join(self.src, 'linkdir'))
+        os.symlink('top', os.path.join(self.src, 'linkfile'))
+
+    def tearDown(self):
+        if os.path.exists(self.basedir):
+            shutil.rmtree(self.basedir)
+
+    def writeFile(self, name, contents, base=None):
+        f = open(os.path.join(base or self.src, name), "w")
+        f.write(contents)
+        f.close()
+
+    def readFile(self, name):
+        return open(os.path.join(self.dst, name)).read()
+
+    def assertTreeCopied(self):
+        self.assertEqual(self.readFile('top'), 'top')
+        self.assertEqual(self.readFile('sub/a'), 'aaa')
+        self.assertEqual(self.readFile('sub/b'), 'bbbb')
+        self.assertEqual(os.readlink(os.path.join(self.dst, 'linkdir')), 'sub')
+        self.assertEqual(os.readlink(os.path.join(self.dst, 'linkfile')),
+                         'top')
+
+    def sameInode(self, name):
+        return (os.stat(os.path.join(self.src, name)).st_ino ==
+                os.stat(os.path.join(self.dst, name)).st_ino)
+
+    def test_bad_method(self):
+        self.assertRaises(AssertionError, lambda :
+                copier.TreeCopier(self.src, self.dst, method='teleport'))
+
+    def test_copy(self):
+        stats = copier.TreeCopier(self.src, self.dst).run()
+        self.assertTreeCopied()
+        self.assertFalse(self.sameInode('top'))
+        self.assertEqual(stats['copied'], 5)
+
+    def test_copy_preserves_times(self):
+        os.utime(os.path.join(self.src, 'sub', 'a'), (1000, 1000))
+        copier.TreeCopier(self.src, self.dst).run()
+        self.assertEqual(os.stat(os.path.join(self.dst, 'sub', 'a')).st_mtime,
+                         1000)
+
+    def test_hardlink(self):
+        for name in ('top', 'sub/a', 'sub/b'):
+            os.chmod(os.path.join(self.src, name), 0444)
+        stats = copier.TreeCopier(self.src, self.dst, method='hardlink').run()
+        self.assertTreeCopied()
+        self.assertTrue(self.sameInode('sub/a'))
+        self.assertEqual(stats['hardlinked'], 3)
+
+    def test_hardlink_writable(self):
+        stats = copier.TreeCopier(self.src, self.dst, method='hardlink').run()
+        self.assertTreeCopied()
+        # writable files are copied rather than linked, and the source is
+        # left writable
+        self.assertFalse(self.sameInode('sub/a'))
+        self.assertEqual((stats['hardlinked'], stats['copied']), (0, 5))
+        mode = os.stat(os.path.join(self.src, 'sub', 'a')).st_mode
+        self.assertTrue(mode & stat.S_IWUSR)
+
+    def test_auto_no_reflink(self):
+        self.patch(copier, 'fcntl', None)
+        os.chmod(os.path.join(self.src, 'sub', 'a'), 0444)
+        stats = copier.TreeCopier(self.src, self.dst, method='auto').run()
+        self.assertTreeCopied()
+        # read-only files are safe to link; the rest are copied
+        self.assertTrue(self.sameInode('sub/a'))
+        self.assertFalse(self.sameInode('sub/b'))
+        self.assertEqual((stats['hardlinked'], stats['copied']), (1, 4))
+
+    def test_reflink_unsupported(self):
+        calls = []
+        class FakeFcntl:
+            def ioctl(self, fd, op, arg):
+                calls.append(op)
+                raise IOError(errno.EOPNOTSUPP, "not supported")
+        self.patch(copier, 'fcntl', FakeFcntl())
+        tc = copier.TreeCopier(self.src, self.dst, method='reflink', threads=1)
+        tc.can_reflink = True
+        stats = tc.run()
+        self.assertTreeCopied()
+        # reflink is only attempted once per tree
+        self.assertEqual(calls, [ copier.FICLONE ])
+        self.assertEqual(stats['reflinked'], 0)
+        self.assertEqual(stats['copied'], 5)
+
+    def test_reflink_success(self):
+        class FakeFcntl:
+            def ioctl(self, fd, op, arg):
+                os.write(fd, os.read(arg, 1000))
+        self.patch(copier, 'fcntl', FakeFcntl())
+        tc = copier.TreeCopier(self.src, self.dst, method='reflink')
+        tc.can_reflink = True
+        stats = tc.run()
+        self.assertTreeCopied()
+        self.assertEqual(stats['reflinked'], 3)
+
+    def test_sync(self):
+        copier.TreeCopier(self.src, self.dst).run()
+        # simulate a build modifying the tree, and an update of the source
+        self.writeFile('build-output', 'junk', base=self.dst)
+        os.makedirs(os.path.join(self.dst, 'objdir'))
+        self.writeFile('sub/b', 'changed')
+        os.unlink(os.path.join(self.src, 'top'))
+        os.mkdir(os.path.join(self.src, 'top'))
+
+        stats = copier.TreeCopier(self.src, self.dst, sync=True).run()
+        self.assertEqual(sorted(os.listdir(self.dst)),
+                         ['linkdir', 'linkfile', 'sub', 'top'])
+        self.assertTrue(os.path.isdir(os.path.join(self.dst, 'top')))
+        self.assertEqual(self.readFile('sub/b'), 'changed')
+        self.assertEqual(stats['skipped'], 3) # sub/a and the symlinks
+        self.assertEqual(stats['copied'], 1)
+        self.assertEqual(stats['removed'], 4)
+
+    def test_error(self):
+        os.mkfifo(os.path.join(self.src, 'fifo'))
+        tc = copier.TreeCopier(self.src, self.dst)
+        self.assertRaises((shutil.Error, EnvironmentError), tc.run)
@@ -0,0 +1,109 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import os
+import shutil
+
+from twisted.trial import unittest
+
+from buildslave import trash
+
+class TestTrashReaper(unittest.TestCase):
+
+    def setUp(self):
+        self.basedir = os.path.abspath('basedir')
+        if os.path.exists(self.basedir):
+            shutil.rmtree(self.basedir)
+        os.makedirs(self.basedir)
+        self.reaper = trash.TrashReaper(self.basedir)
+
+    def tearDown(self):
+        if os.path.exists(self.basedir):
+            shutil.rmtree(self.basedir)
+
+    def makeTree(self, path, nfiles=3):
+        os.makedirs(os.path.join(path, 'sub', 'subsub'))
+        for i in range(nfiles):
+            open(os.path.join(path, 'sub', 'f%d' % i), "w").write("x")
+        os.symlink('sub', os.path.join(path, 'link'))
+
+    def test_trash_renames(self):
+        path = os.path.join(self.basedir, 'workdir')
+        self.makeTree(path)
+        self.reaper.maxDeletesPerSecond = None
+        self.assertTrue(self.reaper.trash(path))
+        self.assertFalse(os.path.exists(path))
+        d = self.reaper.reap()
+        def check(_):
+            self.assertEqual(os.listdir(self.reaper.trashdir), [])
+        d.addCallback(check)
+        return d
+
+    def test_trash_nonexistent(self):
+        path = os.path.join(self.basedir, 'nosuch')
+        self.assertFalse(self.reaper.trash(path))
+
+    def test_trash_same_name_twice(self):
+        self.reaper.maxDeletesPerSecond = None
+        for i in range(2):
+            path = os.path.join(self.basedir, 'workdir')
+            self.makeTree(path)
+            self.assertTrue(self.reaper.trash(path))
+        d = self.reaper.reap()
+        def check(_):
+            self.assertEqual(os.listdir(self.reaper.trashdir), [])
+        d.addCallback(check)
+        return d
+
+    def test_startService_resumes(self):
+        leftover = os.path.join(self.basedir, 'trash', '1.1.workdir')
+        self.makeTree(leftover)
+        self.reaper.startService()
+        d = self.reaper.reap()
+        def check(_):
+            self.assertEqual(os.listdir(self.reaper.trashdir), [])
+            return self.reaper.stopService()
+        d.addCallback(check)
+        return d
+
+    def test_unwritable_subdir(self):
+        path = os.path.join(self.basedir, 'workdir')
+        self.makeTree(path)
+        os.chmod(os.path.join(path, 'sub'), 0500)
+        self.reaper.trash(path)
+        d = self.reaper.reap()
+        def check(_):
+            self.assertEqual(os.listdir(self.reaper.trashdir), [])
+        d.addCallback(check)
+        return d
+
+    def test_throttle(self):
+        now = [ 0 ]
+        sleeps = []
+        self.reaper._time = lambda : now[0]
+        self.reaper._sleep = sleeps.append
+        self.reaper.batchSize = 2
+        self.reaper.maxDeletesPerSecond = 4
+        path = os.path.join(self.basedir, 'workdir')
+        self.makeTree(path, nfiles=3)
+        self.reaper.trash(path)
+        d = self.reaper.reap()
+        def check(_):
+            self.assertEqual(os.listdir(self.reaper.trashdir), [])
+            # 7 entries were removed (3 files, a link, two dirs, and the top),
+            # so three full batches of two, each taking half a second
+            self.assertEqual(sleeps, [0.5, 0.5, 0.5])
+        d.addCallback(check)
+        return d
@@ -0,0 +1,186 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import os
+import stat
+import time
+
+from twisted.application import service
+from twisted.internet import defer, threads
+from twisted.python import log
+
+class TrashReaper(service.Service):
+    """
+    I own the slave's trash directory.  Directories that are to be clobbered
+    are renamed into the trash directory by L{trash}, which is nearly
+    instantaneous as long as the trash directory is on the same filesystem.
+    The actual deletion happens later, in a thread, at a bounded rate so that
+    it does not starve running builds of I/O.
+
+    Anything left in the trash directory when the slave stops (or crashes) is
+    deleted when the service starts again.
+
+    @ivar trashdir: the directory holding items waiting to be deleted
+
+    @ivar maxDeletesPerSecond: upper bound on the number of filesystem
+    entries removed per second, or None for no limit
+    """
+
+    name = 'trash-reaper'
+
+    # name of the trash directory, relative to the slave basedir
+    trashdirName = 'trash'
+
+    # the reaper checks its deletion rate after this many entries
+    batchSize = 100
+
+    # for tests
+    _sleep = staticmethod(time.sleep)
+    _time = staticmethod(time.time)
+
+    def __init__(self, basedir, maxDeletesPerSecond=1000):
+        self.trashdir = os.path.join(basedir, self.trashdirName)
+        self.maxDeletesPerSecond = maxDeletesPerSecond
+        self._serial = 0
+        self._reaping = None
+        self._reapAgain = False
+        self._stopping = False
+
+    def startService(self):
+        service.Service.startService(self)
+        self._stopping = False
+        # resume any deletion interrupted by a slave restart
+        if os.path.isdir(self.trashdir) and os.listdir(self.trashdir):
+            log.msg("resuming deletion of leftover trash in %s"
+                    % self.trashdir)
+            self.reap()
+
+    def stopService(self):
+        self._stopping = True
+        service.Service.stopService(self)
+        if self._reaping:
+            d = defer.Deferred()
+            self._reaping.addBoth(lambda _ : d.callback(None))
+            return d
+
+    def trash(self, path):
+        """
+        Move C{path} into the trash directory and schedule it for deletion.
+        If C{path} does not exist, this does nothing.
+
+        @returns: True if something was moved into the trash
+        @raises OSError: if the rename fails, e.g., because C{path} is on a
+        different filesystem than the trash directory; the caller should
+        then delete C{path} itself
+        """
+        if not os.path.lexists(path):
+            return False
+        if not os.path.isdir(self.trashdir):
+            os.makedirs(self.trashdir)
+        self._serial += 1
+        target = os.path.join(self.trashdir, "%d.%d.%s" % (
+                    int(self._time()), self._serial,
+                    os.path.basename(os.path.normpath(path))))
+        os.rename(path, target)
+        self.reap()
+        return True
+
+    def reap(self):
+        """
+        Delete everything in the trash directory, in a thread.  If a reap is
+        already in progress, another pass is made once it completes, so that
+        newly-trashed items are not missed.
+
+        @returns: Deferred that fires when the trash directory has been
+        emptied, or the service is stopped
+        """
+        if self._reaping:
+            self._reapAgain = True
+            d = defer.Deferred()
+            self._reaping.addBoth(lambda _ : d.callback(None))
+            return d
+
+        self._reapAgain = False
+        d = self._reaping = threads.deferToThread(self._reapAll)
+        d.addErrback(log.err, "while reaping %s" % self.trashdir)
+        def done(_):
+            self._reaping = None
+            if self._reapAgain and not self._stopping:
+                return self.reap()
+        d.addCallback(done)
+        return d
+
+    # the rest of these methods run in a thread
+
+    def _reapAll(self):
+        try:
+            entries = sorted(os.listdir(self.trashdir))
+        except OSError:
+            return
+        self._batchStart = self._time()
+        self._batchCount = 0
+        for entry in entries:
+            if self._stopping:
+                return
+            self._removeTree(os.path.join(self.trashdir, entry))
+
+    def _removeTree(self, top):
+        if os.path.islink(top) or not os.path.isdir(top):
+            self._remove(os.unlink, top)
+            return
+        for dirpath, dirnames, filenames in os.walk(top, topdown=False):
+            for name in filenames:
+                if self._stopping:
+                    return
+                self._remove(os.unlink, os.path.join(dirpath, name))
+            for name in dirnames:
+                if self._stopping:
+                    return
+                path = os.path.join(dirpath, name)
+                # os.walk lists symlinks to directories in dirnames
+                if os.path.islink(path):
+                    self._remove(os.unlink, path)
+                else:
+                    self._remove(os.rmdir, path)
+        self._remove(os.rmdir, top)
+
+    def _remove(self, fn, path):
+        try:
+            fn(path)
+        except OSError:
+            # the parent directory may be missing write permission, as with
+            # 'rm -rf' in RemoveDirectory; fix that and try again
+            try:
+                parent = os.path.dirname(path)
+                os.chmod(parent, os.stat(parent).st_mode | stat.S_IRWXU)
+                if fn is os.rmdir:
+                    os.chmod(path, os.stat(path).st_mode | stat.S_IRWXU)
+                fn(path)
+            except OSError, e:
+                log.msg("could not delete %s from trash: %s" % (path, e))
+        self._throttle()
+
+    def _throttle(self):
+        if not self.maxDeletesPerSecond:
+            return
+        self._batchCount += 1
+        if self._batchCount < self.batchSize:
+            return
+        elapsed = self._time() - self._batchStart
+        wanted = float(self._batchCount) / self.maxDeletesPerSecond
+        if wanted > elapsed:
+            self._sleep(wanted - elapsed)
+        self._batchStart = self._time()
+        self._batchCount = 0